@@ -0,0 +1,3 @@
+"""
+Module with benchmarks of the robuser entry points
+"""
@@ -0,0 +1,94 @@
+"""
+Import-time benchmark of the robuser entry points. Every entry point is imported in a fresh interpreter, so that
+the cost of its dependencies is measured as a short evaluation job or a worker process would pay it.
+"""
+
+import argparse
+import subprocess
+import sys
+
+import tabulate
+
+# Budget in seconds of the import of every entry point, the heavy dependencies (e.g. librosa, audiomentations,
+# pyroomacoustics) must only be imported by the code paths that use them
+IMPORT_BUDGETS = {
+    "robuser.evaluation.calculate_ce": 0.5,
+    "robuser.evaluation.evaluate": 0.5,
+    "robuser.dataset_corruption.corrupt_dataset": 0.75,
+    "robuser.dataset_corruption.corrupt_dataset_per_file": 0.75,
+    "robuser.corruptions.get_corruption": 0.1,
+    "robuser.corruptions.gaussian": 0.5,
+}
+
+
+def time_statement(statement, repeats):
+    """
+    Times a statement run in fresh interpreters.
+
+    Args:
+        statement (str): Python statement to run
+        repeats (int): number of runs, the fastest one is kept to reduce the noise of the machine
+
+    Returns:
+        float: the fastest run time in seconds
+    """
+    # The interpreter times itself, so that the time of spawning the process is not counted
+    code = f"import time; _start = time.perf_counter(); {statement}; print(time.perf_counter() - _start)"
+    times = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise ValueError(f"Running '{statement}' failed:\n{result.stderr}")
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return min(times)
+
+
+def benchmark_imports(budgets=IMPORT_BUDGETS, repeats=5):
+    """
+    Measures the import time of every entry point and compares it with its budget.
+
+    Args:
+        budgets (dict): {module name: budget in seconds}
+        repeats (int): number of runs per entry point
+
+    Returns:
+        list of tuples: (module name, import time in seconds, budget in seconds)
+    """
+    return [(module, time_statement(f"import {module}", repeats), budget) for module, budget in budgets.items()]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Measure the import time of the robuser entry points")
+    parser.add_argument("-r", "--repeats", type=int, default=5,
+                        help="Number of runs per entry point, the fastest one is reported")
+    parser.add_argument("-m", "--modules", type=str, nargs="+", default=None,
+                        help="Entry points to benchmark (default: all the entry points with a budget)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    budgets = IMPORT_BUDGETS
+    if args.modules is not None:
+        unknown = [module for module in args.modules if module not in IMPORT_BUDGETS]
+        if unknown:
+            raise ValueError(f"No import budget for {unknown}, the entry points are: {list(IMPORT_BUDGETS)}")
+        budgets = {module: IMPORT_BUDGETS[module] for module in args.modules}
+
+    results = benchmark_imports(budgets, args.repeats)
+    print(
+        tabulate.tabulate(
+            [[module, f"{import_time:.3f}", f"{budget:.3f}", "OK" if import_time <= budget else "OVER BUDGET"]
+             for module, import_time, budget in results],
+            headers=["Entry point", "Import time (s)", "Budget (s)", "Status"],
+        )
+    )
+
+    over_budget = [module for module, import_time, budget in results if import_time > budget]
+    if over_budget:
+        print(f"{len(over_budget)} entry point(s) over their import budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
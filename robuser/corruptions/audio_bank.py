@@ -0,0 +1,100 @@
+import os
+import tempfile
+
+import numpy as np
+
+from robuser.corruptions.utils import AUDIO_DTYPE
+
+# Directory of the banks: a RAM-backed file system when there is one, so that the bank is never written to disk
+SHARED_MEMORY_DIR = "/dev/shm"
+
+
+class AudioBank:
+    """
+    Read-only bank of decoded audio clips (e.g. the noise clips or impulse responses of a corruption), created once
+    by the parent process in a memory-mapped file.
+
+    When the bank is pickled (e.g. with the corruption sent to the worker processes), only its path and index are;
+    the workers map the same file, so that the memory of the clips is shared by all of them instead of every worker
+    decoding and holding its own copy.
+    """
+
+    def __init__(self, path, index, owner=False):
+        """
+        Initialize the AudioBank class, mapping the file of an existing bank
+
+        :param path: path to the file with the samples of all the clips
+        :param index: dictionary mapping every file path to the (offset, length, sample rate) of its clip
+        :param owner: whether this instance created the bank and deletes its file on `close`
+        """
+        self.path = path
+        self.index = index
+        self.owner = owner
+        num_samples = sum(length for _, length, _ in index.values())
+        if num_samples > 0:
+            self.samples = np.memmap(path, dtype=AUDIO_DTYPE, mode="r", shape=(num_samples,))
+        else:
+            self.samples = np.empty(0, dtype=AUDIO_DTYPE)
+
+    @classmethod
+    def create(cls, file_paths):
+        """
+        Decode audio files at their own sample rate (as mono) into a new bank
+
+        :param file_paths: list of paths to the audio files
+        :return: the AudioBank, owning its file
+        """
+        import librosa
+
+        directory = SHARED_MEMORY_DIR if os.path.isdir(SHARED_MEMORY_DIR) else None
+        index = {}
+        offset = 0
+        with tempfile.NamedTemporaryFile(prefix="robuser_audio_bank_", suffix=".f32", dir=directory,
+                                         delete=False) as file:
+            try:
+                for file_path in dict.fromkeys(file_paths):
+                    audio, sample_rate = librosa.load(file_path, sr=None)
+                    np.asarray(audio, dtype=AUDIO_DTYPE).tofile(file)
+                    index[file_path] = (offset, len(audio), sample_rate)
+                    offset += len(audio)
+            except BaseException:
+                file.close()
+                os.remove(file.name)
+                raise
+
+        return cls(file.name, index, owner=True)
+
+    def __contains__(self, file_path):
+        return file_path in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def nbytes(self):
+        return self.samples.nbytes
+
+    def get(self, file_path):
+        """
+        Get the clip of an audio file of the bank
+
+        :param file_path: path to the audio file
+        :return: tuple of the clip (read-only float32 numpy array) and its sample rate
+        """
+        offset, length, sample_rate = self.index[file_path]
+        return self.samples[offset:offset + length], sample_rate
+
+    def __getstate__(self):
+        # The copies attach to the file of the bank, they do not own it
+        return {"path": self.path, "index": self.index}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["index"])
+
+    def close(self):
+        """
+        Unmap the bank, and delete its file if this instance created it
+        """
+        self.samples = np.empty(0, dtype=AUDIO_DTYPE)
+        if self.owner and os.path.exists(self.path):
+            os.remove(self.path)
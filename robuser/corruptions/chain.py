@@ -0,0 +1,183 @@
+import json
+
+from robuser.corruptions.get_corruption import get_corruption
+from robuser.corruptions.utils import derive_seed
+
+
+class ChainNode:
+    """
+    A single corruption step of a ChainExecutor, shared by all the chains that start with the same steps
+    """
+
+    def __init__(self, corruption, step_path):
+        """
+        Initialize the ChainNode class
+
+        :param corruption: the corruption instance applied at this step
+        :param step_path: list of the (corruption_type, normalized config) steps from the root up to this step
+        """
+        self.corruption = corruption
+        self.step_path = step_path
+        self.children = {}
+        # Indices of the chains that end at this step
+        self.chain_indices = []
+
+
+class ChainExecutor:
+    """
+    Apply several chains of corruptions (e.g. reverb, then background noise, then MP3 compression) in memory.
+
+    The chains are merged into a prefix tree, so that a prefix shared by several chains (e.g. the same reverb
+    followed by three different noise SNRs) is computed once per audio and its result is fed to every branch.
+    Each chain is a list of [corruption_type, corruption_config] steps.
+    """
+
+    # The draws of a step depend on the draws of the steps before it, so the chains do not draw their assignments up
+    # front (see `CorruptionType.locality_key`)
+    locality_key = None
+
+    def __init__(self, chains):
+        """
+        Initialize the ChainExecutor class
+
+        :param chains: list of chains, each one a list of [corruption_type, corruption_config] steps
+        """
+        if not chains:
+            raise ValueError("At least one corruption chain is required")
+
+        self.chains = chains
+        self.seed = None
+        self.last_details = None
+        self.root = {}
+        for chain_index, chain in enumerate(chains):
+            if not chain:
+                raise ValueError(f"Corruption chain {chain_index} has no steps")
+
+            children = self.root
+            node = None
+            step_path = []
+            for corruption_type, corruption_config in chain:
+                step_key = (corruption_type, json.dumps(corruption_config, sort_keys=True))
+                step_path = step_path + [step_key]
+                if step_key not in children:
+                    corruption_class = get_corruption(corruption_type)
+                    children[step_key] = ChainNode(corruption_class(corruption_config), step_path)
+                node = children[step_key]
+                children = node.children
+            node.chain_indices.append(chain_index)
+
+    @property
+    def corruption_classes(self):
+        """
+        The corruption classes of every step, each shared step counted once as it runs once per audio
+        """
+        classes = []
+        stack = list(self.root.values())
+        while stack:
+            node = stack.pop()
+            classes.append(type(node.corruption))
+            stack.extend(node.children.values())
+        return classes
+
+    def share_audio_data(self):
+        """
+        Share the external audio files of every step with the worker processes (see `CorruptionType.share_audio_data`)
+
+        :return: list of the created banks
+        """
+        banks = []
+        stack = list(self.root.values())
+        while stack:
+            node = stack.pop()
+            banks.extend(node.corruption.share_audio_data())
+            stack.extend(node.children.values())
+        return banks
+
+    def unshare_audio_data(self):
+        """
+        Delete the banks created by `share_audio_data`
+        """
+        stack = list(self.root.values())
+        while stack:
+            node = stack.pop()
+            node.corruption.unshare_audio_data()
+            stack.extend(node.children.values())
+
+    def reseed(self, seed):
+        """
+        Reseed the chains for the next audio. Each step is reseeded right before it runs, with a seed derived from
+        this seed and the steps leading to it.
+
+        :param seed: integer seed in [0, 2**32)
+        """
+        self.seed = seed
+
+    def run_all(self, audio_data, sample_rate):
+        """
+        Run every chain on the audio data
+
+        :param audio_data: numpy array with the audio data
+        :param sample_rate: the sample rate
+        :return: list with one tuple of the corrupted audio data and the applied noises (or None) per chain,
+                 in the order the chains were given
+        """
+        results = [None] * len(self.chains)
+        self.last_details = [None] * len(self.chains)
+
+        # Depth-first traversal, so that only the intermediate results of the current path are kept in memory
+        stack = [(node, audio_data, (), ()) for node in reversed(list(self.root.values()))]
+        while stack:
+            node, input_audio, applied, details = stack.pop()
+            if self.seed is not None:
+                node.corruption.reseed(derive_seed(self.seed, node.step_path))
+            output_audio, applied_noise = node.corruption.run(input_audio, sample_rate)
+            if applied_noise is not None:
+                applied = applied + (str(applied_noise),)
+            details = details + (node.corruption.get_details()[0],)
+
+            for chain_index in node.chain_indices:
+                results[chain_index] = (output_audio, ";".join(applied) if applied else None)
+                self.last_details[chain_index] = {"steps": list(details)}
+            for child in reversed(list(node.children.values())):
+                stack.append((child, output_audio, applied, details))
+
+        return results
+
+    def run_output(self, audio_data, sample_rate, output_index, details=None):
+        """
+        Run a single chain on the audio data, with the same draws as run_all (see `CorruptionType.run_output`).
+        get_details then returns the details of this chain only
+
+        :param audio_data: numpy array with the audio data
+        :param sample_rate: the sample rate
+        :param output_index: index of the chain
+        :param details: the details of the chain (see `get_details`), or None to draw them from the random state
+        :return: tuple of the corrupted audio data and the applied noises (or None)
+        """
+        applied = ()
+        steps = []
+        children = self.root
+        for step_index, (corruption_type, corruption_config) in enumerate(self.chains[output_index]):
+            node = children[(corruption_type, json.dumps(corruption_config, sort_keys=True))]
+            if self.seed is not None:
+                node.corruption.reseed(derive_seed(self.seed, node.step_path))
+            step_details = None if details is None else details["steps"][step_index]
+            audio_data, applied_noise = node.corruption.run_output(audio_data, sample_rate, 0, step_details)
+            if applied_noise is not None:
+                applied = applied + (str(applied_noise),)
+            steps.append(node.corruption.get_details()[0])
+            children = node.children
+
+        self.last_details = [{"steps": steps}]
+        return audio_data, ";".join(applied) if applied else None
+
+    def get_details(self):
+        """
+        Get the details of every chain of the last run, with the details of each of its steps
+        (see `CorruptionType.get_details`)
+
+        :return: list with one dictionary per chain
+        """
+        if self.last_details is None:
+            return [None] * len(self.chains)
+        return self.last_details
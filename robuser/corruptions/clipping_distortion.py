@@ -1,5 +1,4 @@
 from robuser.corruptions.corruption_type import CorruptionType
-from audiomentations import ClippingDistortion
 
 class AddClippingDistortion(CorruptionType):
     """
@@ -12,6 +11,13 @@ class AddClippingDistortion(CorruptionType):
     the two input parameters min_percentile_threshold and max_percentile_threshold. If for instance
     30% is drawn, the samples are clipped if they're below the 15th or above the 85th percentile.
     """
+
+    batchable = True
+    deterministic = True
+    cost_class = "light"
+    # Sorting the samples to find the percentiles
+    cost_model = (0.0, 2.0)
+
     def __init__(self, config):
         """
         Initialize the ClippingDistortion class
@@ -30,17 +36,23 @@ class AddClippingDistortion(CorruptionType):
 
         self.p_clipping = 1.0
 
-    def run(self, audio_data, sample_rate):
+    def run(self, audio_data, sample_rate, out=None):
         """
         Run the clipping distortion augmentation method
 
             :param audio_data: numpy array with the audio data
             :param sample_rate: the sample rate
+            :param out: optional preallocated float32 array with the shape of the audio data
 
             :return: the augmented audio data (numpy array)
         """
+        from audiomentations import ClippingDistortion
+
         transform = ClippingDistortion(
             max_percentile_threshold=self.max_percentile_threshold, 
             p=self.p_clipping
         )
-        return transform(audio_data, sample_rate), None
+        augmented_audio = transform(audio_data, sample_rate)
+        # The parameters drawn by audiomentations (the percentile threshold)
+        self.last_details = [dict(transform.parameters)]
+        return self.to_output(augmented_audio, out), None
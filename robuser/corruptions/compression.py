@@ -1,10 +1,153 @@
-from pathlib import Path
-import tempfile
-from subprocess import run, DEVNULL
+import errno
 import os
+import subprocess
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
 import soundfile as sf
 
 from robuser.corruptions.corruption_type import CorruptionType
+from robuser.corruptions.native_threads import get_available_cpus
+
+# Maximum time in seconds of an ffmpeg job, after which it is killed
+FFMPEG_TIMEOUT = 120.0
+# Number of attempts of an ffmpeg job that hangs or cannot be spawned (a job that exits with an error, e.g. on an
+# unsupported input, fails the same way every time and is not retried)
+FFMPEG_ATTEMPTS = 3
+# Delay in seconds before the first retry of a failed job, doubled at every retry
+FFMPEG_RETRY_DELAY = 0.5
+
+
+class FFmpegPool:
+    """ Bounded pool of concurrent ffmpeg jobs, shared by all the compression corruptions and threads of a process.
+    The encoding is done by the ffmpeg processes, so threads waiting on them keep as many jobs in flight as there
+    are cores without a process pool on the Python side. Jobs that hang are killed after a timeout, and the jobs
+    that time out or cannot be spawned are retried.
+    """
+
+    def __init__(self, max_jobs=None, timeout=FFMPEG_TIMEOUT, attempts=FFMPEG_ATTEMPTS):
+        """ Initialize the pool.
+        Args:
+            max_jobs: Maximum number of concurrent ffmpeg processes, defaults to the number of CPUs available
+            timeout: Maximum time in seconds of a job
+            attempts: Number of attempts of a job before giving up
+        """
+        self.max_jobs = max_jobs or get_available_cpus()
+        self.timeout = timeout
+        self.attempts = attempts
+        self.slots = threading.BoundedSemaphore(self.max_jobs)
+        self.stats_lock = threading.Lock()
+        self.stats = self.empty_stats()
+
+    @staticmethod
+    def empty_stats():
+        return {
+            "jobs": 0, "retries": 0, "timeouts": 0, "failures": 0, "spawns": 0, "spawn_time": 0.0,
+            "max_spawn_time": 0.0,
+        }
+
+    def record(self, **increments):
+        with self.stats_lock:
+            for name, increment in increments.items():
+                self.stats[name] += increment
+
+    def run(self, args):
+        """ Run an ffmpeg job, waiting for a free slot of the pool.
+        Args:
+            args: The command as a list of arguments, run without a shell
+        Raises:
+            ValueError: if ffmpeg is not installed, if the job exited with an error, or if it timed out or could not
+                be spawned on every attempt
+        """
+        error = None
+        for attempt in range(self.attempts):
+            if attempt > 0:
+                self.record(retries=1)
+                warnings.warn(f"Retrying ffmpeg ({error}): {' '.join(args)}")
+                time.sleep(FFMPEG_RETRY_DELAY * 2 ** (attempt - 1))
+
+            with self.slots:
+                start = time.perf_counter()
+                try:
+                    process = subprocess.Popen(
+                        args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+                    )
+                except OSError as e:
+                    if e.errno == errno.ENOENT:
+                        raise ValueError(f"{args[0]} is not installed or not in the PATH")
+                    # e.g. too many processes or not enough memory to fork, which may not last
+                    error = str(e)
+                    continue
+                spawn_time = time.perf_counter() - start
+                with self.stats_lock:
+                    self.stats["spawns"] += 1
+                    self.stats["spawn_time"] += spawn_time
+                    self.stats["max_spawn_time"] = max(self.stats["max_spawn_time"], spawn_time)
+
+                try:
+                    _, stderr = process.communicate(timeout=self.timeout)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.communicate()
+                    self.record(timeouts=1)
+                    error = f"killed after {self.timeout}s"
+                    continue
+
+            if process.returncode == 0:
+                self.record(jobs=1)
+                return
+            # e.g. an unsupported input or codec, which fails the same way on every attempt
+            self.record(failures=1)
+            error = stderr.decode(errors="replace").strip().splitlines()[-1:] or [f"exit code {process.returncode}"]
+            raise ValueError(f"ffmpeg failed ({error[0]}): {' '.join(args)}")
+
+        self.record(failures=1)
+        raise ValueError(f"ffmpeg failed after {self.attempts} attempts ({error}): {' '.join(args)}")
+
+    def get_summary(self, reset=False):
+        """ Summary of the jobs run by the pool, with the mean and max time to spawn an ffmpeg process
+        Args:
+            reset: Start the stats over after the summary, e.g. at the end of a run
+        Returns:
+            The summary, or None if the pool has not run any job
+        """
+        with self.stats_lock:
+            stats = dict(self.stats)
+            if reset:
+                self.stats = self.empty_stats()
+        if not stats["spawns"] and not stats["failures"]:
+            return None
+        mean_spawn_time = stats["spawn_time"] / stats["spawns"] if stats["spawns"] else 0.0
+        return (
+            f"ffmpeg: {stats['jobs']} jobs on up to {self.max_jobs} at once, {stats['retries']} retries, "
+            f"{stats['timeouts']} timeouts, {stats['failures']} failures, spawn time "
+            f"{mean_spawn_time * 1000:.1f}ms on average and {stats['max_spawn_time'] * 1000:.1f}ms at most"
+        )
+
+
+_ffmpeg_pool = None
+_ffmpeg_pool_lock = threading.Lock()
+
+
+def get_ffmpeg_pool():
+    """ The ffmpeg pool of the process, created on first use
+    """
+    global _ffmpeg_pool
+    with _ffmpeg_pool_lock:
+        if _ffmpeg_pool is None:
+            _ffmpeg_pool = FFmpegPool()
+        return _ffmpeg_pool
+
+
+def pop_ffmpeg_summary():
+    """ Summary of the jobs run by the ffmpeg pool of the process since the last call, or None if it ran none
+    """
+    with _ffmpeg_pool_lock:
+        ffmpeg_pool = _ffmpeg_pool
+    return None if ffmpeg_pool is None else ffmpeg_pool.get_summary(reset=True)
 
 
 class Compression(CorruptionType):
@@ -13,6 +156,13 @@ class Compression(CorruptionType):
     audio format at the original sample rate with 1 channel.
     """
 
+    sweep_parameter = "bit_rate"
+    stateless = True
+    deterministic = True
+    cost_class = "subprocess"
+    # Two ffmpeg processes per file
+    cost_model = (30.0, 3.0)
+
     def __init__(self, config):
         """ Initialize the perturbator.
         Args:
@@ -23,41 +173,83 @@ class Compression(CorruptionType):
         super().__init__(config)
         self.format = "mp3"
         self.bit_rate = config["bit_rate"]
+        self.check_bit_rate(self.bit_rate)
 
-        if not isinstance(self.bit_rate, int) or self.bit_rate < 8 or self.bit_rate > 192:
+    @staticmethod
+    def check_bit_rate(bit_rate):
+        if not isinstance(bit_rate, int) or bit_rate < 8 or bit_rate > 192:
             raise ValueError("`bit_rate` must be an integer between 8 and 192kHz.")
 
-    def run(self, audio_data, sample_rate):
-        # Create temporary files for input and output
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_input:
-            temp_input_path = temp_input.name
-        
-        with tempfile.NamedTemporaryFile(suffix=f'.{self.format}', delete=False) as temp_compressed:
-            temp_compressed_path = temp_compressed.name
-            
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_output:
-            temp_output_path = temp_output.name
-        
-        try:
-            # Write audio data to temporary input file
-            sf.write(temp_input_path, audio_data, sample_rate)
-            
-            # Compress the audio
-            # Overwrite the output file
-            compression_command = f"ffmpeg -y -i {temp_input_path} -b:a {self.bit_rate}k {temp_compressed_path}"
-            conversion_command = f"ffmpeg -y -i {temp_compressed_path} -ac 1 -ar {sample_rate} {temp_output_path}"
-            
-            run(f"{compression_command} && {conversion_command}", 
-                shell=True, check=False,
-                stdout=DEVNULL, stderr=DEVNULL)
-            
-            # Read the compressed audio back
-            compressed_audio, _ = sf.read(temp_output_path)
-            
-            return compressed_audio, None
-            
-        finally:
-            # Clean up temporary files
-            for temp_file in [temp_input_path, temp_compressed_path, temp_output_path]:
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
+    def transcode(self, input_path, temp_dir, bit_rate, sample_rate):
+        """ Compress an audio file and convert it back, through the ffmpeg pool.
+        Args:
+            input_path: path to the wav file to compress
+            temp_dir: directory of the intermediate files
+            bit_rate: the bit_rate to compress the audio to, in kbps
+            sample_rate: the sample rate of the output
+        Returns:
+            the compressed audio data (float32 numpy array)
+        """
+        compressed_path = os.path.join(temp_dir, f"compressed_{bit_rate}.{self.format}")
+        output_path = os.path.join(temp_dir, f"output_{bit_rate}.wav")
+        ffmpeg_pool = get_ffmpeg_pool()
+        ffmpeg_pool.run(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", input_path, "-b:a", f"{bit_rate}k",
+             compressed_path]
+        )
+        ffmpeg_pool.run(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", compressed_path, "-ac", "1", "-ar",
+             str(sample_rate), output_path]
+        )
+        compressed_audio, _ = sf.read(output_path, dtype="float32")
+        return compressed_audio
+
+    def run(self, audio_data, sample_rate, out=None):
+        """ Compress and decompress the audio.
+        Args:
+            audio_data: numpy array with the audio data
+            sample_rate: the sample rate
+            out: optional preallocated float32 array with the shape of the audio data. The decoded audio
+                is cut (or zero-padded) to its length, as the codec may add or drop a few samples.
+        Returns:
+            tuple of the compressed audio data (float32 numpy array) and None
+        """
+        with tempfile.TemporaryDirectory(prefix="robuser_compression_") as temp_dir:
+            input_path = os.path.join(temp_dir, "input.wav")
+            sf.write(input_path, audio_data, sample_rate)
+            compressed_audio = self.transcode(input_path, temp_dir, self.bit_rate, sample_rate)
+
+        if out is not None:
+            num_samples = min(len(out), len(compressed_audio))
+            out[:num_samples] = compressed_audio[:num_samples]
+            out[num_samples:] = 0
+            return out, None
+
+        return compressed_audio, None
+
+    def run_sweep(self, audio_data, sample_rate, severities):
+        """ Compress and decompress the audio at several bit rates. The input is written once and all the bit
+        rates are encoded concurrently, up to the size of the ffmpeg pool.
+        Args:
+            audio_data: numpy array with the audio data
+            sample_rate: the sample rate
+            severities: list of bit rates
+        Returns:
+            list with one tuple of the compressed audio data and None per bit rate
+        """
+        for bit_rate in severities:
+            self.check_bit_rate(bit_rate)
+
+        with tempfile.TemporaryDirectory(prefix="robuser_compression_") as temp_dir:
+            input_path = os.path.join(temp_dir, "input.wav")
+            sf.write(input_path, audio_data, sample_rate)
+            with ThreadPoolExecutor(max_workers=min(len(severities), get_ffmpeg_pool().max_jobs)) as executor:
+                compressed_audios = list(
+                    executor.map(
+                        lambda bit_rate: self.transcode(input_path, temp_dir, bit_rate, sample_rate),
+                        dict.fromkeys(severities),
+                    )
+                )
+
+        compressed_audios = dict(zip(dict.fromkeys(severities), compressed_audios))
+        return [(compressed_audios[bit_rate], None) for bit_rate in severities]
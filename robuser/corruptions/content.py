@@ -5,13 +5,25 @@
 import os
 import random
 import warnings
-from itertools import cycle
 
-import librosa
 import numpy as np
 
 from robuser.corruptions.corruption_type import CorruptionType
-from robuser.corruptions.utils import normalize_audio, get_supported_audio_extensions
+from robuser.corruptions.resampler import (
+    DEFAULT_QUALITY,
+    can_resample_segment,
+    check_quality,
+    get_audio_info,
+    get_resampled_length,
+    resample_segment,
+)
+from robuser.corruptions.utils import (
+    AUDIO_DTYPE,
+    get_supported_audio_extensions,
+    mean_std,
+    normalize_audio,
+    signal_power,
+)
 
 
 class ContentCorruption(CorruptionType):
@@ -20,8 +32,16 @@ class ContentCorruption(CorruptionType):
     config should contain:
         * content_dataset_path: the path to the dataset
         * snr: the signal-to-noise ratio
+        * resampling_quality: optional quality of the resampling of the noise (see `resampler.RESAMPLING_QUALITIES`)
     """
 
+    sweep_parameter = "snr"
+    deterministic = True
+    external_data = "content_dataset_path"
+    # Loading and resampling a whole noise clip dominates, whatever the length of the utterance
+    cost_model = (20.0, 2.0)
+    locality_key = "noise_file"
+
     def __init__(self, config):
         """
         Initialize the ContentAugmentation class
@@ -35,13 +55,23 @@ class ContentCorruption(CorruptionType):
             raise ValueError("SNR is not in the config")
 
         self.dataset_path = config["content_dataset_path"]
+        self.resampling_quality = check_quality(config.get("resampling_quality", DEFAULT_QUALITY))
         if not os.path.exists(self.dataset_path):
             raise ValueError(f"Dataset path {self.dataset_path} does not exist")
 
         self.audio_files = self.get_audio_files()
         random.seed(42)
         self.random_audio_files = random.choices(self.audio_files, k=len(self.audio_files) * 100)
-        self.random_audio_generator = cycle(self.random_audio_files)
+        # Position of the next noise in the (cyclic) sequence of random noises
+        self.noise_index = 0
+        # Noise file and position of the noise segment of the last loaded noise, for the details of the outputs
+        self.noise_draw = None
+        # SNR of the last noise mixed by apply_snr
+        self.applied_snr = None
+        # Sample rate and number of frames of the noise files, read from their headers when drawing the noises
+        self.noise_infos = {}
+        # Mean and std of the resampled noise files, computed the first time each one is loaded in full
+        self.noise_stats = {}
 
     def get_audio_files(self):
         """
@@ -61,6 +91,31 @@ class ContentCorruption(CorruptionType):
 
         return sorted(audio_files)
 
+    def get_external_audio_files(self):
+        """
+        Get the noise clips of the dataset, which can be shared with the worker processes (see `share_audio_data`)
+        """
+        return self.audio_files
+
+    def reseed(self, seed):
+        """
+        Reseed the random state of the corruption, including the position in the sequence of random noises
+
+        :param seed: integer seed in [0, 2**32)
+        """
+        super().reseed(seed)
+        self.noise_index = random.randrange(len(self.random_audio_files))
+
+    def next_noise_file(self):
+        """
+        Get the next noise file of the sequence of random noises
+        Returns:
+            the path to the noise file
+        """
+        noise_filename = self.random_audio_files[self.noise_index % len(self.random_audio_files)]
+        self.noise_index += 1
+        return noise_filename
+
     def calculate_snr(self, signal, noise):
         """Calculates the snr from signal and noise
 
@@ -71,84 +126,271 @@ class ContentCorruption(CorruptionType):
         Returns:
             float: snr
         """
-        # Calculate the power of the signal
-        signal_power = np.sum(signal ** 2) / len(signal)
-
-        # Calculate the power of the noise
-        noise_power = np.sum(noise ** 2) / len(noise)
-
-        # Calculate the Signal-to-Noise Ratio (SNR) in decibels (dB)
-        snr = 10 * np.log10(signal_power / noise_power)
+        # Calculate the Signal-to-Noise Ratio (SNR) in decibels (dB) from the powers of the signal and the noise
+        snr = 10 * np.log10(signal_power(signal) / signal_power(noise))
         return snr
 
-    def apply_snr(self, signal, noise):
-        """Apply snr and augment signal
+    @staticmethod
+    def get_applied_snr(power_signal, power_noise, scaling):
+        """Calculates the SNR of the signal mixed with the scaled noise
 
         Args:
-            signal (np.array): original signal
-            noise (np.array): noise signal
+            power_signal (float): power of the signal
+            power_noise (float): power of the noise
+            scaling (float): scaling factor of the noise
 
         Returns:
-            np.array: augmented signal
+            float: the applied SNR
         """
-        snr = self.config["snr"]
-        # Calculate the power of the normalized original signal
-        power_signal = np.sum(signal ** 2) / len(signal)
+        return float(10 * np.log10(power_signal / (power_noise * scaling ** 2)))
 
-        # Calculate the power of the normalized noise
-        power_noise = np.sum(noise ** 2) / len(noise)
+    @staticmethod
+    def get_noise_scaling(power_signal, power_noise, snr):
+        """Calculates the scaling factor of the noise that achieves the snr
 
+        Args:
+            power_signal (float): power of the signal
+            power_noise (float): power of the noise
+            snr (float): the desired signal-to-noise ratio
+
+        Returns:
+            float: scaling factor of the noise
+        """
         # Calculate the ratio of powers for the random SNR
         snr_ratio = 10 ** (snr / 10.0)
 
         # Calculate the required scaling factor for the noise to achieve the random SNR
-        required_scaling_factor = np.sqrt(power_signal / (power_noise * snr_ratio))
+        return np.sqrt(power_signal / (power_noise * snr_ratio))
 
-        # Scale noise by the calculated factor to achieve the random SNR
-        scaled_noise = noise * required_scaling_factor
+    def apply_snr(self, signal, noise, snr=None, out=None):
+        """Apply snr and augment signal
+
+        Args:
+            signal (np.array): original signal
+            noise (np.array): noise signal
+            snr (float): the signal-to-noise ratio, defaults to the one of the config
+            out (np.array): optional float32 array to write the augmented signal to, it can be the noise itself
+                            (which is then scaled in place) but not the signal
 
-        # Augment original signal with the scaled normalized noise at the random SNR
-        augmented_signal = signal + scaled_noise
-        applied_snr = self.calculate_snr(signal, scaled_noise)
+        Returns:
+            np.array: augmented signal
+        """
+        if snr is None:
+            snr = self.config["snr"]
+        # Calculate the power of the normalized original signal and of the normalized noise
+        power_signal = signal_power(signal)
+        power_noise = signal_power(noise)
+
+        required_scaling_factor = self.get_noise_scaling(power_signal, power_noise, snr)
+
+        # Scale noise by the calculated factor and augment the original signal with it, without temporary arrays
+        if out is None:
+            out = np.empty(signal.shape, dtype=AUDIO_DTYPE)
+        np.multiply(noise, required_scaling_factor, out=out, casting="same_kind")
+        out += signal
+
+        # The power of the scaled noise follows from the scaling factor, so the noise is not traversed again
+        applied_snr = self.get_applied_snr(power_signal, power_noise, required_scaling_factor)
+        self.applied_snr = applied_snr
         if abs(applied_snr - snr) > 0.5:
             warnings.warn(f"Desired SNR and applied SNR differ more than 0.5")
 
-        return augmented_signal
+        return out
+
+    def get_noise_length(self, noise_filename, sample_rate):
+        """
+        Get the number of samples of a noise file resampled to a sample rate, from its header (or its clip in the
+        shared bank), without decoding it
+
+        :param noise_filename: path to the noise file
+        :param sample_rate: the sample rate of the signal
+        :return: the number of samples of the resampled noise
+        """
+        if noise_filename not in self.noise_infos:
+            if self.audio_bank is not None and noise_filename in self.audio_bank:
+                _, frames, noise_sample_rate = self.audio_bank.index[noise_filename]
+            else:
+                noise_sample_rate, frames = get_audio_info(noise_filename)
+            self.noise_infos[noise_filename] = (noise_sample_rate, frames)
+        noise_sample_rate, frames = self.noise_infos[noise_filename]
+        return get_resampled_length(frames, noise_sample_rate, sample_rate)
+
+    def draw_assignment(self, num_samples, sample_rate):
+        """
+        Draw the next noise of the dataset and the position of the noise segment (or the padding of the noise)
+
+        :param num_samples: the number of samples of the signal
+        :param sample_rate: the sample rate of the signal
+        :return: dictionary with the noise_file, the noise_offset in samples of the resampled noise and the pad_front
+        """
+        noise_filename = self.next_noise_file()
+        ts = num_samples  # Duration of the initial audio signal
+        tn = self.get_noise_length(noise_filename, sample_rate)  # Duration of the selected noise signal
+        if ts <= tn:
+            tn1 = random.randint(0, tn - ts)
+            pad_front = 0
+        else:
+            tn1 = 0
+            pad_front = random.randint(0, ts - tn)
+        return {"noise_file": noise_filename, "noise_offset": tn1, "pad_front": pad_front}
+
+    def assignment_from_details(self, details):
+        """
+        Rebuild the noise of an output from its details (see `get_details`)
+
+        :param details: the details of the output, with the noise_file relative to the dataset
+        :return: dictionary with the noise_file, the noise_offset and the pad_front (see `draw_assignment`)
+        """
+        noise_filename = os.path.join(self.dataset_path, details["noise_file"])
+        if not os.path.exists(noise_filename):
+            raise ValueError(f"The noise file {noise_filename} does not exist")
+        return {
+            "noise_file": noise_filename, "noise_offset": details["noise_offset"], "pad_front": details["pad_front"]
+        }
+
+    def load_noise_segment(self, noise_filename, sample_rate, start, num_samples):
+        """
+        Load a segment of a noise file resampled to the sample rate of the signal, with the mean and std of the whole
+        resampled noise. The first time a noise file is loaded, it is decoded and resampled in full for its
+        statistics. Afterwards, unless it is still in memory (in the cache of resampled files or the shared bank), only
+        the segment is read, seeking to it, and resampled with the margin of the resampling filter, which gives the
+        same samples (see `resampler.can_resample_segment`; with libsoxr, the whole noise is resampled every time).
+
+        :param noise_filename: path to the noise file
+        :param sample_rate: the sample rate of the signal
+        :param start: first sample of the segment, in samples of the resampled noise
+        :param num_samples: the number of samples of the segment
+        :return: tuple of the segment (float32 numpy array) and the (mean, std) of the resampled noise
+        """
+        import soundfile as sf
+
+        cache_key = (noise_filename, sample_rate, self.resampling_quality)
+        noise_sample_rate, frames = self.noise_infos[noise_filename]
+        in_memory = cache_key in self.external_audio_cache or (
+            self.audio_bank is not None and noise_filename in self.audio_bank
+        )
+        if (
+            cache_key in self.noise_stats
+            and not in_memory
+            and can_resample_segment(noise_sample_rate, sample_rate, self.resampling_quality)
+        ):
+            try:
+                noise_segment = resample_segment(
+                    noise_filename, frames, noise_sample_rate, sample_rate, start, num_samples,
+                    self.resampling_quality,
+                )
+                return noise_segment, self.noise_stats[cache_key]
+            except sf.LibsndfileError:
+                # Formats that soundfile cannot read (e.g. m4a) are decoded in full
+                pass
+
+        noise_signal = self.load_resampled_external_audio(noise_filename, sample_rate, self.resampling_quality)
+        if len(noise_signal) != self.get_noise_length(noise_filename, sample_rate):
+            raise ValueError(f"The noise file {noise_filename} does not have the length given by its header")
+        if cache_key not in self.noise_stats:
+            self.noise_stats[cache_key] = mean_std(noise_signal)
+        return noise_signal[start:start + num_samples], self.noise_stats[cache_key]
+
+    def load_noise(self, num_samples, sample_rate, assignment, out=None):
+        """
+        Load the noise of an assignment, resampled, normalized and cut (or padded) to the length of the signal
+
+        :param num_samples: the number of samples of the signal
+        :param sample_rate: the sample rate of the signal
+        :param assignment: the noise drawn by `draw_assignment`
+        :param out: optional float32 array of num_samples samples to write the noise to
+        :return: tuple of the noise (float32 numpy array) and the noise filename
+        """
+        noise_filename = assignment["noise_file"]
+        noise_basename = os.path.basename(noise_filename)
+        ts = num_samples  # Duration of the initial audio signal
+        tn = self.get_noise_length(noise_filename, sample_rate)  # Duration of the selected noise signal
+        tn1 = assignment["noise_offset"]
+        pad_front = assignment["pad_front"]
+
+        # Normalize the noise with the statistics of the whole noise, writing only the part that is used
+        noise_segment, noise_stats = self.load_noise_segment(noise_filename, sample_rate, tn1, min(ts, tn))
+        if out is None:
+            out = np.empty(num_samples, dtype=AUDIO_DTYPE)
+        if ts <= tn:
+            normalize_audio(noise_segment, out=out, stats=noise_stats)
+        else:
+            out[:pad_front] = 0
+            normalize_audio(noise_segment, out=out[pad_front:pad_front + tn], stats=noise_stats)
+            out[pad_front + tn:] = 0
+
+        # The offset of the segment is in samples of the resampled noise
+        self.noise_draw = {
+            "noise_file": os.path.relpath(noise_filename, self.dataset_path),
+            "noise_offset": tn1,
+            "pad_front": pad_front,
+            "pad_back": max(ts - tn - pad_front, 0),
+        }
 
-    def run(self, audio_data, sample_rate):
+        return out, noise_basename
+
+    def run(self, audio_data, sample_rate, out=None):
         """
         Run the augmentation method
 
         :param audio_data: numpy array with the audio data
         :param sample_rate: the sample rate
-        :return: tuple of the augmented audio data (numpy array) and the applied noise filename
+        :param out: optional preallocated float32 array with the shape of the audio data
+        :return: tuple of the augmented audio data (float32 numpy array) and the applied noise filename
         """
+        return self.apply_assignment(audio_data, sample_rate, self.draw_assignment(len(audio_data), sample_rate), out)
 
-        # Load a random noise from the dataset
-        noise_filename = next(self.random_audio_generator)
-        noise_basename = os.path.basename(noise_filename)
-        noise_signal, noise_sample_rate = librosa.load(noise_filename, sr=None)
+    def apply_assignment(self, audio_data, sample_rate, assignment, out=None):
+        """
+        Mix the noise of an assignment drawn by `draw_assignment` with the audio
 
-        # Resample the noise to match the sample rate of the audio data
-        if noise_sample_rate != sample_rate:
-            noise_signal = librosa.resample(noise_signal, orig_sr=noise_sample_rate, target_sr=sample_rate)
+        :param audio_data: numpy array with the audio data
+        :param sample_rate: the sample rate
+        :param assignment: the noise drawn for the audio
+        :param out: optional preallocated float32 array with the shape of the audio data
+        :return: tuple of the augmented audio data (float32 numpy array) and the applied noise filename
+        """
+        # The noise is written to the output array, where it is then mixed with the signal in place
+        noise, noise_basename = self.load_noise(len(audio_data), sample_rate, assignment, out=out)
 
-        # Normalize the audio data and the noise
+        # Normalize the audio data
         signal = normalize_audio(audio_data)
-        noise = normalize_audio(noise_signal)
-        ts = len(signal)  # Duration of the initial audio signal
-        tn = len(noise)  # Duration of the selected noise signal
-        if ts <= tn:
-            tn1 = random.randint(0, tn - ts)
-            tn2 = tn1 + ts
-            noise = noise[tn1:tn2]
-        else:
-            pad_front = random.randint(0, ts - tn)
-            pad_end = ts - tn - pad_front
-            noise = np.pad(noise, (pad_front, pad_end), mode='constant')
 
         # Apply the SNR and normalize the augmented signal
-        s_aug = self.apply_snr(signal, noise)
-        s_aug = s_aug / np.abs(s_aug.max())
+        s_aug = self.apply_snr(signal, noise, out=noise)
+        s_aug /= np.abs(s_aug.max())
 
+        self.last_details = [dict(self.noise_draw, snr=self.applied_snr)]
         return s_aug, noise_basename
+
+    def run_sweep(self, audio_data, sample_rate, severities, assignment=None):
+        """
+        Run the augmentation method for several SNRs, drawing and loading the noise only once
+
+        :param audio_data: numpy array with the audio data
+        :param sample_rate: the sample rate
+        :param severities: list of SNRs
+        :param assignment: the noise of the audio (see `draw_assignment`), drawn if not given
+        :return: list with one tuple of the augmented audio data and the applied noise filename per SNR
+        """
+        if assignment is None:
+            assignment = self.draw_assignment(len(audio_data), sample_rate)
+        noise, noise_basename = self.load_noise(len(audio_data), sample_rate, assignment)
+        signal = normalize_audio(audio_data)
+
+        power_signal = signal_power(signal)
+        power_noise = signal_power(noise)
+
+        outputs = []
+        self.last_details = []
+        for snr in severities:
+            scaling = self.get_noise_scaling(power_signal, power_noise, snr)
+            s_aug = np.multiply(noise, scaling, dtype=AUDIO_DTYPE)
+            s_aug += signal
+            s_aug /= np.abs(s_aug.max())
+            outputs.append((s_aug, noise_basename))
+            self.last_details.append(
+                dict(self.noise_draw, snr=self.get_applied_snr(power_signal, power_noise, scaling))
+            )
+
+        return outputs
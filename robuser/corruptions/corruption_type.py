@@ -1,9 +1,54 @@
+import random
+from collections import OrderedDict
+
+import numpy as np
+
+from robuser.corruptions.utils import AUDIO_DTYPE
+
+# Number of resampled external audio files kept by a corruption, so that the files that read the same one in a row
+# (see `CorruptionType.locality_key`) load and resample it once
+EXTERNAL_AUDIO_CACHE_SIZE = 4
+
+
 class CorruptionType:
     """
     CorruptionType base class
 
     """
 
+    # Name of the config parameter that run_sweep can vary with a single draw of the corruption (or None)
+    sweep_parameter = None
+
+    # Capabilities of the corruption, which the dataset runners use to pick how to run it. The defaults are the safe
+    # ones for a corruption that declares nothing.
+    # The output of run only depends on the input, the config and the state set by reseed: no global random state
+    # and nothing carried over from one file to the next, so that copies of the corruption can run in threads
+    stateless = False
+    # Cheap to run and without per-file set up, so that the files are dispatched to the workers in batches
+    batchable = False
+    # Consecutive chunks of the audio can be corrupted independently, without statistics of the whole signal
+    chunkable = False
+    # The output is reproducible from the seed given to reseed
+    deterministic = False
+    # Name of the config parameter with the path of the external data the corruption reads (e.g. a noise dataset)
+    external_data = None
+    # Expected cost class: "light" (a few vectorized passes over the audio), "heavy" (e.g. loading external audio,
+    # long convolutions) or "subprocess" (the work is done by another program, e.g. ffmpeg)
+    cost_class = "heavy"
+    # Expected cost relative to decoding and writing one second of audio: (fixed cost per file, cost per second)
+    cost_model = (0.0, 1.0)
+    # Field of the assignments drawn by draw_assignment with the external file an output reads (e.g. its noise clip),
+    # or None if the corruption does not draw its assignments up front. The runners plan the assignments of all the
+    # files and process the files that read the same external file together (see `scheduling.plan_assignments`)
+    locality_key = None
+
+    # Details of the outputs of the last run (or run_sweep), e.g. the noise file and the position of the noise
+    # segment, saved in the provenance of the corrupted files: a list with one dictionary (or None) per output
+    last_details = None
+
+    # Bank of the external audio files shared with the worker processes (see `share_audio_data`)
+    audio_bank = None
+
     def __init__(self, config):
         """
         Initialize the CorruptionType class
@@ -11,13 +56,203 @@ class CorruptionType:
         :param config: dictionary with the configuration parameters
         """
         self.config = config
+        # Resampled external audio files recently loaded, see `load_resampled_external_audio`
+        self.external_audio_cache = OrderedDict()
 
-    def run(self, audio_data, sample_rate):
+    def run(self, audio_data, sample_rate, out=None):
         """
         Run the corruption method
 
         :param audio_data: numpy array with the audio data or the path to the audio file
         :param sample_rate: the sample rate of the audio data
-        :return: tuple with the corrupted audio data (numpy array) and the applied noise (or None)
+        :param out: optional preallocated float32 array with the shape of the audio data, where the corrupted
+                    audio is written; it must not be the audio data itself
+        :return: tuple with the corrupted audio data (float32 numpy array) and the applied noise (or None)
+        """
+        raise NotImplementedError
+
+    def reseed(self, seed):
+        """
+        Reseed the random state of the corruption, so that its next output only depends on the seed and the input.
+        This is used to corrupt each file with its own seed, independently of the order of the files.
+
+        :param seed: integer seed in [0, 2**32)
+        """
+        random.seed(seed)
+        np.random.seed(seed)
+
+    def get_external_audio_files(self):
+        """
+        Get the external audio files the corruption reads (e.g. its noise clips or impulse responses)
+
+        :return: list of paths to the audio files, or None if the corruption reads none
+        """
+        return None
+
+    def share_audio_data(self):
+        """
+        Decode the external audio files of the corruption once into a read-only AudioBank in shared memory, which the
+        copies of the corruption sent to the worker processes read instead of decoding and holding their own copies
+
+        :return: list of the created banks (empty if the corruption reads no external audio)
+        """
+        file_paths = self.get_external_audio_files()
+        if not file_paths:
+            return []
+
+        from robuser.corruptions.audio_bank import AudioBank
+
+        self.audio_bank = AudioBank.create(file_paths)
+        return [self.audio_bank]
+
+    def unshare_audio_data(self):
+        """
+        Delete the bank created by `share_audio_data`, the corruption decodes its external audio files again
+        """
+        if self.audio_bank is not None:
+            self.audio_bank.close()
+            self.audio_bank = None
+
+    def load_external_audio(self, file_path):
+        """
+        Load an external audio file at its own sample rate, from the shared bank if there is one
+
+        :param file_path: path to the audio file
+        :return: tuple of the audio (float32 numpy array, read-only if it comes from the bank) and its sample rate
+        """
+        if self.audio_bank is not None and file_path in self.audio_bank:
+            return self.audio_bank.get(file_path)
+
+        import librosa
+
+        return librosa.load(file_path, sr=None)
+
+    def load_resampled_external_audio(self, file_path, sample_rate, quality):
+        """
+        Load an external audio file resampled to a sample rate, keeping the last few ones so that consecutive outputs
+        that read the same file (e.g. ordered by `locality_key`) load and resample it once
+
+        :param file_path: path to the audio file
+        :param sample_rate: the sample rate to resample to
+        :param quality: the resampling quality (see `resampler.RESAMPLING_QUALITIES`)
+        :return: the resampled audio (read-only float32 numpy array)
+        """
+        from robuser.corruptions.resampler import resample
+
+        cache_key = (file_path, sample_rate, quality)
+        if cache_key in self.external_audio_cache:
+            self.external_audio_cache.move_to_end(cache_key)
+            return self.external_audio_cache[cache_key]
+
+        audio, orig_sample_rate = self.load_external_audio(file_path)
+        audio = resample(audio, orig_sample_rate, sample_rate, quality)
+        audio.flags.writeable = False
+        self.external_audio_cache[cache_key] = audio
+        if len(self.external_audio_cache) > EXTERNAL_AUDIO_CACHE_SIZE:
+            self.external_audio_cache.popitem(last=False)
+        return audio
+
+    def draw_assignment(self, num_samples, sample_rate):
+        """
+        Draw from the random state what the corruption applies to an audio (e.g. its noise clip and the position of
+        the noise segment), without loading anything; run draws the same assignment and applies it. Only the
+        corruptions with a `locality_key` draw their assignments up front
+
+        :param num_samples: the number of samples of the audio
+        :param sample_rate: the sample rate of the audio
+        :return: dictionary with the assignment, whose `locality_key` field is the external file it reads
+        """
+        raise NotImplementedError
+
+    def apply_assignment(self, audio_data, sample_rate, assignment, out=None):
+        """
+        Apply an assignment drawn by `draw_assignment` to an audio
+
+        :param audio_data: numpy array with the audio data
+        :param sample_rate: the sample rate of the audio data
+        :param assignment: the assignment drawn for the audio
+        :param out: optional preallocated float32 array with the shape of the audio data
+        :return: tuple with the corrupted audio data (float32 numpy array) and the applied noise (or None)
+        """
+        raise NotImplementedError
+
+    def assignment_from_details(self, details):
+        """
+        Rebuild the assignment of an output from its details (see `get_details`), e.g. to regenerate the output from
+        its provenance whatever the external files listed now
+
+        :param details: the details of the output, as saved in the provenance
+        :return: dictionary with the assignment (see `draw_assignment`)
+        """
+        raise NotImplementedError
+
+    def get_details(self, num_outputs=1):
+        """
+        Get the details of the outputs of the last run (or run_sweep), e.g. what was drawn from the random state
+
+        :param num_outputs: number of outputs of the last run, if the corruption reports no details
+        :return: list with one dictionary (or None) per output
+        """
+        if self.last_details is None:
+            return [None] * num_outputs
+        return self.last_details
+
+    @staticmethod
+    def to_output(corrupted_audio, out=None):
+        """
+        Convert the corrupted audio to float32, writing it to the preallocated output array if one is given
+
+        :param corrupted_audio: numpy array with the corrupted audio data
+        :param out: optional preallocated float32 array with the same shape as the corrupted audio
+        :return: the corrupted audio as a float32 numpy array
+        """
+        if out is None:
+            return np.asarray(corrupted_audio, dtype=AUDIO_DTYPE)
+        np.copyto(out, corrupted_audio, casting="same_kind")
+        return out
+
+    @property
+    def corruption_classes(self):
+        """
+        The corruption classes that run on every audio, whose capabilities the dataset runners check
+        """
+        return [type(self)]
+
+    def run_all(self, audio_data, sample_rate):
+        """
+        Run the corruption method for every output that is produced from a single input
+
+        :param audio_data: numpy array with the audio data
+        :param sample_rate: the sample rate of the audio data
+        :return: list with one tuple of the corrupted audio data and the applied noise (or None) per output
+        """
+        return [self.run(audio_data, sample_rate)]
+
+    def run_output(self, audio_data, sample_rate, output_index, details=None):
+        """
+        Run the corruption method for a single output of run_all, e.g. to regenerate a corrupted file. Given the
+        details of the output, the corruptions with a `locality_key` apply the assignment they record instead of
+        drawing a new one. get_details then returns the details of this output only
+
+        :param audio_data: numpy array with the audio data
+        :param sample_rate: the sample rate of the audio data
+        :param output_index: index of the output among the outputs of run_all
+        :param details: the details of the output (see `get_details`), or None to draw it from the random state
+        :return: tuple of the corrupted audio data and the applied noise (or None)
+        """
+        if output_index != 0:
+            raise IndexError(f"The corruption has a single output, not {output_index + 1}")
+        if details is not None and self.locality_key is not None:
+            return self.apply_assignment(audio_data, sample_rate, self.assignment_from_details(details))
+        return self.run(audio_data, sample_rate)
+
+    def run_sweep(self, audio_data, sample_rate, severities):
+        """
+        Run the corruption method for several values of the sweep parameter, sharing a single random draw
+
+        :param audio_data: numpy array with the audio data
+        :param sample_rate: the sample rate of the audio data
+        :param severities: list of values of the sweep parameter
+        :return: list with one tuple of the corrupted audio data and the applied noise (or None) per value
         """
         raise NotImplementedError
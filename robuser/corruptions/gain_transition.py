@@ -1,5 +1,4 @@
 from robuser.corruptions.corruption_type import CorruptionType
-from audiomentations import GainTransition
 import random
 
 class AddGainTransition(CorruptionType):
@@ -16,6 +15,11 @@ class AddGainTransition(CorruptionType):
                 "fraction": Fraction of the total sound length
         `p_gain` (float): the probability of applying gain transition
     """
+
+    batchable = True
+    deterministic = True
+    cost_class = "light"
+
     def __init__(self, config):
         """
         Initialize the GainTransition class
@@ -37,15 +41,18 @@ class AddGainTransition(CorruptionType):
         self.duration_unit = "fraction"
         self.p_gain = 1.0
 
-    def run(self, audio_data, sample_rate):
+    def run(self, audio_data, sample_rate, out=None):
         """
         Run the gain transition augmentation method
 
             :param audio_data: numpy array with the audio data
             :param sample_rate: the sample rate
+            :param out: optional preallocated float32 array with the shape of the audio data
 
             :return: the augmented audio data (numpy array)
         """
+        from audiomentations import GainTransition
+
         transform = GainTransition(
             min_gain_db=self.min_gain_db,
             max_gain_db=self.max_gain_db,
@@ -55,4 +62,7 @@ class AddGainTransition(CorruptionType):
             p=self.p_gain
         )
 
-        return transform(audio_data, sample_rate), None
+        augmented_audio = transform(audio_data, sample_rate)
+        # The parameters drawn by audiomentations (e.g. the gains and the position of the transition)
+        self.last_details = [dict(transform.parameters)]
+        return self.to_output(augmented_audio, out), None
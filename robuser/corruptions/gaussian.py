@@ -1,5 +1,6 @@
-from audiomentations import AddGaussianSNR
+import numpy as np
 from robuser.corruptions.corruption_type import CorruptionType
+from robuser.corruptions.utils import AUDIO_DTYPE, calculate_desired_noise_rms, signal_power
 
 
 class AWGNAugmentation(CorruptionType):
@@ -10,6 +11,12 @@ class AWGNAugmentation(CorruptionType):
         * snr: the signal-to-noise ratio
     """
 
+    sweep_parameter = "snr"
+    stateless = True
+    batchable = True
+    deterministic = True
+    cost_class = "light"
+
     def __init__(self, config):
         super().__init__(config)
 
@@ -20,14 +27,69 @@ class AWGNAugmentation(CorruptionType):
 
         self.snr = config["snr"]
 
-        self.transform = AddGaussianSNR(min_snr_db=self.snr, max_snr_db=self.snr, p=1.0)
+        # The noise is drawn directly as float32, so that it can be written to the output array
+        self.rng = np.random.default_rng()
+
+    def reseed(self, seed):
+        """
+        Reseed the random state of the corruption
+
+        :param seed: integer seed in [0, 2**32)
+        """
+        super().reseed(seed)
+        self.rng = np.random.default_rng(seed)
 
-    def run(self, audio_data, sample_rate):
+    def run(self, audio_data, sample_rate, out=None):
         """
         Run the augmentation method
 
         :param audio_data: numpy array with the audio data
         :param sample_rate: the sample rate
-        :return: the augmented audio data (numpy array)
+        :param out: optional preallocated float32 array with the shape of the audio data
+        :return: the augmented audio data (float32 numpy array)
+        """
+        # In gaussian noise, the RMS gets roughly equal to the std
+        power_signal = signal_power(audio_data)
+        noise_std = calculate_desired_noise_rms(clean_rms=np.sqrt(power_signal), snr=self.snr)
+
+        out = self.rng.standard_normal(size=audio_data.shape, dtype=AUDIO_DTYPE, out=out)
+        out *= noise_std
+        self.last_details = [{"snr": self.get_applied_snr(power_signal, signal_power(out))}]
+        out += audio_data
+        return out, None
+
+    def run_sweep(self, audio_data, sample_rate, severities):
+        """
+        Run the augmentation method for several SNRs, drawing the Gaussian noise only once
+
+        :param audio_data: numpy array with the audio data
+        :param sample_rate: the sample rate
+        :param severities: list of SNRs
+        :return: list with one tuple of the augmented audio data and None per SNR
+        """
+        power_signal = signal_power(audio_data)
+        clean_rms = np.sqrt(power_signal)
+        unit_noise = self.rng.standard_normal(size=audio_data.shape, dtype=AUDIO_DTYPE)
+        power_unit_noise = signal_power(unit_noise)
+
+        outputs = []
+        self.last_details = []
+        for snr in severities:
+            noise_rms = calculate_desired_noise_rms(clean_rms=clean_rms, snr=snr)
+            augmented_audio = np.multiply(unit_noise, noise_rms, dtype=AUDIO_DTYPE)
+            augmented_audio += audio_data
+            outputs.append((augmented_audio, None))
+            self.last_details.append({"snr": self.get_applied_snr(power_signal, power_unit_noise * noise_rms ** 2)})
+
+        return outputs
+
+    @staticmethod
+    def get_applied_snr(power_signal, power_noise):
+        """
+        Calculate the SNR of the drawn noise, which differs slightly from the configured one
+
+        :param power_signal: power of the signal
+        :param power_noise: power of the scaled noise
+        :return: the applied SNR in dB
         """
-        return self.transform(audio_data, sample_rate), None
+        return float(10 * np.log10(power_signal / power_noise))
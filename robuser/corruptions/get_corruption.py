@@ -1,23 +1,51 @@
-from robuser.corruptions.content import ContentCorruption
-from robuser.corruptions.gaussian import AWGNAugmentation
-from robuser.corruptions.gain_transition import AddGainTransition
-from robuser.corruptions.clipping_distortion import AddClippingDistortion
-from robuser.corruptions.impulse_response import AddImpulseResponse
-from robuser.corruptions.compression import Compression
+import importlib
+
+# Module and class of every corruption. The modules are imported on first use, so that importing this module does not
+# pull in the dependencies of all the corruptions (e.g. audiomentations, pyroomacoustics).
+CORRUPTIONS = {
+    "content": ("robuser.corruptions.content", "ContentCorruption"),
+    "gaussian": ("robuser.corruptions.gaussian", "AWGNAugmentation"),
+    "gain_transition": ("robuser.corruptions.gain_transition", "AddGainTransition"),
+    "clipping_distortion": ("robuser.corruptions.clipping_distortion", "AddClippingDistortion"),
+    "impulse_response": ("robuser.corruptions.impulse_response", "AddImpulseResponse"),
+    "compression": ("robuser.corruptions.compression", "Compression"),
+}
+
+# Entry point group where other packages register their corruptions, e.g. in their pyproject.toml:
+# [project.entry-points."robuser.corruptions"]
+# my_corruption = "my_package.corruptions:MyCorruption"
+ENTRY_POINT_GROUP = "robuser.corruptions"
+
+
+def get_plugin_entry_points():
+    """
+    Returns the corruptions registered by other packages, by name
+    """
+    from importlib.metadata import entry_points
+
+    return {entry_point.name: entry_point for entry_point in entry_points(group=ENTRY_POINT_GROUP)}
+
+
+def get_corruption_names():
+    """
+    Returns the names of the built-in and the registered corruptions
+    """
+    return list(CORRUPTIONS) + [name for name in get_plugin_entry_points() if name not in CORRUPTIONS]
 
 
 def get_corruption(corruption_name):
-    if corruption_name == "content":
-        return ContentCorruption
-    elif corruption_name == "gaussian":
-        return AWGNAugmentation
-    elif corruption_name == "gain_transition":
-        return AddGainTransition
-    elif corruption_name == "clipping_distortion":
-        return AddClippingDistortion
-    elif corruption_name == "impulse_response":
-        return AddImpulseResponse   
-    elif corruption_name == "compression":
-        return Compression
-    else:
+    if corruption_name in CORRUPTIONS:
+        module_name, class_name = CORRUPTIONS[corruption_name]
+        return getattr(importlib.import_module(module_name), class_name)
+
+    # The built-in corruptions take precedence over the registered ones
+    plugin_entry_points = get_plugin_entry_points()
+    if corruption_name not in plugin_entry_points:
         raise ValueError(f"Unknown corruption: {corruption_name}")
+
+    from robuser.corruptions.corruption_type import CorruptionType
+
+    corruption_class = plugin_entry_points[corruption_name].load()
+    if not isinstance(corruption_class, type) or not issubclass(corruption_class, CorruptionType):
+        raise ValueError(f"The corruption '{corruption_name}' registered as a plugin is not a CorruptionType subclass")
+    return corruption_class
@@ -1,11 +1,13 @@
+import multiprocessing
 import os
 import random
+from concurrent.futures import ProcessPoolExecutor
 
-import librosa
-import pyroomacoustics as pra
-from audiomentations import ApplyImpulseResponse
+import numpy as np
 
 from robuser.corruptions.corruption_type import CorruptionType
+from robuser.corruptions.native_threads import get_available_cpus, limit_native_threads
+from robuser.corruptions.resampler import DEFAULT_QUALITY, check_quality
 from robuser.corruptions.utils import get_supported_audio_extensions
 
 
@@ -15,6 +17,9 @@ def calculate_rt60(impulse_response_path):
         :param impulse_response_path: the path to the impulse response
         :return: the RT60 in seconds
     """
+    import librosa
+    import pyroomacoustics as pra
+
     impulse_response, sample_rate = librosa.load(impulse_response_path, sr=None)
     # Normalize the impulse response
     norm_impulse_response = impulse_response / max(abs(impulse_response))
@@ -22,6 +27,128 @@ def calculate_rt60(impulse_response_path):
     return rt60
 
 
+def estimate_rt60_batch(impulse_responses, sample_rates, decay_db=60):
+    """
+    Estimate the RT60 of a batch of impulse responses at once, padding them to a common length.
+
+    This is a vectorized version of `pyroomacoustics.experimental.measure_rt60` (with the default energy threshold
+    and log-domain fit): Schroeder backward integration of the energy, then a least-squares fit of the decay from
+    -5 dB down to `decay_db` below it, extrapolated to -60 dB. The energy is integrated in float64, so the estimates
+    match `calculate_rt60` within 0.1% (relative), pyroomacoustics integrating the float32 samples in float32.
+
+        :param impulse_responses: list of 1D numpy arrays with the impulse responses
+        :param sample_rates: the sample rate of every impulse response
+        :param decay_db: the decay in dB that is measured and extrapolated to 60 dB
+        :return: numpy array with the RT60 in seconds of every impulse response (0 if it decays less than 5 dB)
+    """
+    num_irs = len(impulse_responses)
+    length = max(len(impulse_response) for impulse_response in impulse_responses)
+    power = np.zeros((num_irs, length))
+    for i, impulse_response in enumerate(impulse_responses):
+        impulse_response = np.asarray(impulse_response, dtype=np.float64)
+        peak = np.max(np.abs(impulse_response)) if len(impulse_response) else 0.0
+        if peak > 0:
+            power[i, :len(impulse_response)] = (impulse_response / peak) ** 2
+    sample_rates = np.asarray(sample_rates, dtype=np.float64)
+
+    # Backward energy integration according to Schroeder
+    energy = np.cumsum(power[:, ::-1], axis=1)[:, ::-1]
+
+    # The energy is cut before the last non-zero sample, which also removes the zero padding
+    samples = np.arange(length)
+    nonzero = power > 0
+    num_valid = np.where(nonzero.any(axis=1), length - 1 - np.argmax(nonzero[:, ::-1], axis=1), 0)
+    valid = samples < num_valid[:, None]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        energy_db = 10 * np.log10(energy)
+        energy_db -= energy_db[:, :1]
+    energy_db = np.where(valid, energy_db, np.inf)
+
+    # Measure a shorter decay if the energy does not decay enough
+    min_energy_db = -np.min(energy_db, axis=1)
+    decay = np.where(min_energy_db - 5 < decay_db, min_energy_db, decay_db)
+
+    # -5 dB headroom
+    below_5db = energy_db < -5.0
+    has_5db = below_5db.any(axis=1)
+    i_5db = np.argmax(below_5db, axis=1)
+    e_5db = energy_db[np.arange(num_irs), i_5db]
+
+    # after decay
+    below_decay = energy_db < (e_5db - decay)[:, None]
+    i_decay = np.where(below_decay.any(axis=1), np.argmax(below_decay, axis=1), num_valid)
+
+    # Least-squares fit of a line to the decay in dB
+    segment = (samples >= i_5db[:, None]) & (samples < i_decay[:, None])
+    t = np.where(segment, (samples - i_5db[:, None]) / sample_rates[:, None], 0.0)
+    decay_db_values = np.where(segment, energy_db - e_5db[:, None], 0.0)
+    n = segment.sum(axis=1)
+    sum_t, sum_d = t.sum(axis=1), decay_db_values.sum(axis=1)
+    sum_tt, sum_td = (t * t).sum(axis=1), (t * decay_db_values).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (n * sum_td - sum_t * sum_d) / (n * sum_tt - sum_t ** 2)
+        rt60 = -60.0 / slope
+
+    return np.where(has_5db, rt60, 0.0)
+
+
+def estimate_rt60_files(impulse_response_paths):
+    """
+    Load a batch of impulse responses and estimate their RT60 with `estimate_rt60_batch`
+
+        :param impulse_response_paths: list of paths to the impulse responses
+        :return: numpy array with the RT60 in seconds of every impulse response
+    """
+    import librosa
+
+    impulse_responses, sample_rates = [], []
+    for impulse_response_path in impulse_response_paths:
+        impulse_response, sample_rate = librosa.load(impulse_response_path, sr=None)
+        impulse_responses.append(impulse_response)
+        sample_rates.append(sample_rate)
+    return estimate_rt60_batch(impulse_responses, sample_rates)
+
+
+def calculate_rt60s(impulse_response_paths, workers=None, batch_size=32):
+    """
+    Calculate the RT60 of many impulse responses, in batches of similar length spread over a process pool
+
+        :param impulse_response_paths: list of paths to the impulse responses
+        :param workers: number of worker processes (default: the number of CPUs)
+        :param batch_size: number of impulse responses estimated at once
+        :return: numpy array with the RT60 in seconds of every impulse response, in the given order
+    """
+    impulse_response_paths = list(impulse_response_paths)
+    if workers is None:
+        workers = get_available_cpus()
+    # Worker processes (e.g. of a corruption run) cannot start a pool of their own
+    if multiprocessing.current_process().daemon:
+        workers = 1
+
+    # Batch the impulse responses of similar size, so that little padding is needed
+    order = sorted(
+        range(len(impulse_response_paths)), key=lambda i: os.path.getsize(impulse_response_paths[i])
+    )
+    batches = [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+    batch_paths = [[impulse_response_paths[i] for i in batch] for batch in batches]
+
+    if workers > 1 and len(batches) > 1:
+        workers = min(workers, len(batches))
+        # Every worker limits the native thread pools of its FFTs and convolutions to its share of the CPUs
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=limit_native_threads, initargs=(max(get_available_cpus() // workers, 1),)
+        ) as executor:
+            batch_rt60s = list(executor.map(estimate_rt60_files, batch_paths))
+    else:
+        batch_rt60s = [estimate_rt60_files(paths) for paths in batch_paths]
+
+    rt60s = np.zeros(len(impulse_response_paths))
+    for batch, rt60 in zip(batches, batch_rt60s):
+        rt60s[batch] = rt60
+    return rt60s
+
+
 class AddImpulseResponse(CorruptionType):
     """
     Convolve the audio with a randomly selected impulse response.
@@ -29,10 +156,18 @@ class AddImpulseResponse(CorruptionType):
     config: 
         `ir_path`  (str/Path): A path or list of paths to audio file(s) and/or folder(s) with audio files. 
         `rt60_range` (float, float): The range of the RT60 in seconds of the impulse responses to be used.
+        `resampling_quality` (str): optional quality of the resampling of the impulse responses
+            (see `resampler.RESAMPLING_QUALITIES`)
 
     *download the echo thief impulse response dataset: http://www.echothief.com/downloads/
     """
 
+    deterministic = True
+    external_data = "ir_path"
+    # FFT convolution with the impulse response
+    cost_model = (5.0, 8.0)
+    locality_key = "ir_file"
+
     def __init__(self, config):
         """
         Initialize the ImpulseResponse class
@@ -58,6 +193,7 @@ class AddImpulseResponse(CorruptionType):
             raise ValueError("rt60_range must be a list or tuple of [min_rt60, max_rt60]")
         
         self.rt60_min, self.rt60_max = config["rt60_range"]
+        self.resampling_quality = check_quality(config.get("resampling_quality", DEFAULT_QUALITY))
 
         random.seed(42)
         self.selected_irs = list(self.load_dataset(self.ir_path, rt60_min=self.rt60_min, rt60_max=self.rt60_max))
@@ -66,25 +202,89 @@ class AddImpulseResponse(CorruptionType):
 
     def load_dataset(self, path, rt60_min, rt60_max):
         audio_extensions = get_supported_audio_extensions()
+        ir_paths = []
         for root, dirs, files in os.walk(path):
             for file in files:
                 if file.lower().endswith(audio_extensions):
-                    rt60 = calculate_rt60(os.path.join(root, file))
-                    if rt60_min <= rt60 <= rt60_max:
-                        yield os.path.join(root, file)
+                    ir_paths.append(os.path.join(root, file))
+
+        rt60s = calculate_rt60s(ir_paths)
+        for ir_wav_path, rt60 in zip(ir_paths, rt60s):
+            if rt60_min <= rt60 <= rt60_max:
+                yield ir_wav_path
+
+    def get_external_audio_files(self):
+        """
+        Get the selected impulse responses, which can be shared with the worker processes (see `share_audio_data`)
+        """
+        return self.selected_irs
+
+    def draw_assignment(self, num_samples, sample_rate):
+        """
+        Draw the impulse response applied to an audio
+
+            :param num_samples: the number of samples of the audio
+            :param sample_rate: the sample rate of the audio
+            :return: dictionary with the ir_file
+        """
+        ir_wav_path = random.choice(self.selected_irs)
+        # ApplyImpulseResponse(ir_path=ir_wav_path, p=1.0) drew whether to apply itself and which of its single
+        # impulse response to use; the draws are kept so that the outputs for a given seed do not change
+        random.random()
+        random.choice([ir_wav_path])
+        return {"ir_file": ir_wav_path}
+
+    def assignment_from_details(self, details):
+        """
+        Rebuild the impulse response of an output from its details (see `get_details`)
+
+            :param details: the details of the output, with the ir_file relative to the impulse responses
+            :return: dictionary with the ir_file
+        """
+        ir_wav_path = os.path.join(self.ir_path, details["ir_file"])
+        if not os.path.exists(ir_wav_path):
+            raise ValueError(f"The impulse response {ir_wav_path} does not exist")
+        return {"ir_file": ir_wav_path}
 
-    def run(self, audio_data, sample_rate):
+    def run(self, audio_data, sample_rate, out=None):
         """
-        Run the impulse response method
+        Run the impulse response method, as audiomentations' ApplyImpulseResponse: convolve the audio with the
+        impulse response (resampled to the sample rate of the audio), scale the peak to 0.5 and cut the reverb tail
 
             :param audio_data: numpy array with the audio data
             :param sample_rate: the sample rate
+            :param out: optional preallocated float32 array with the shape of the audio data
 
             :return: the augmented audio data (numpy array) and the applied impulse response
         """
-        ir_wav_path = random.choice(self.selected_irs)
-        transform = ApplyImpulseResponse(
-            ir_path=ir_wav_path,
-            p=1.0
-        )
-        return transform(audio_data, sample_rate), ir_wav_path
+        return self.apply_assignment(audio_data, sample_rate, self.draw_assignment(len(audio_data), sample_rate), out)
+
+    def apply_assignment(self, audio_data, sample_rate, assignment, out=None):
+        """
+        Convolve the audio with the impulse response of an assignment drawn by `draw_assignment`
+
+            :param audio_data: numpy array with the audio data
+            :param sample_rate: the sample rate
+            :param assignment: the impulse response drawn for the audio
+            :param out: optional preallocated float32 array with the shape of the audio data
+
+            :return: the augmented audio data (numpy array) and the applied impulse response
+        """
+        from scipy.signal import convolve
+
+        ir_wav_path = assignment["ir_file"]
+        self.last_details = [{"ir_file": os.path.relpath(ir_wav_path, self.ir_path)}]
+
+        audio_data = np.asarray(audio_data, dtype=np.float32)
+        if len(audio_data) == 0:
+            return self.to_output(audio_data, out), ir_wav_path
+
+        impulse_response = self.load_resampled_external_audio(ir_wav_path, sample_rate, self.resampling_quality)
+
+        reverberant_audio = np.asarray(convolve(audio_data, impulse_response), dtype=np.float32)
+        # The peak of the whole convolution, including the reverb tail that is cut, is scaled to 0.5
+        max_value = max(np.amax(reverberant_audio), -np.amin(reverberant_audio))
+        reverberant_audio = reverberant_audio[:len(audio_data)]
+        if max_value > 0.0:
+            reverberant_audio *= 0.5 / max_value
+        return self.to_output(reverberant_audio, out), ir_wav_path
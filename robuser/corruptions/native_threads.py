@@ -0,0 +1,124 @@
+"""
+Thread budget of the native libraries (BLAS, OpenMP, ...) behind numpy, scipy, librosa and pyroomacoustics, shared by
+the corruptions and the dataset tools: every worker process limits its native thread pools to its share of the CPUs,
+so that the workers do not spawn one thread pool per CPU each (and the processes do not oversubscribe the CPUs).
+"""
+
+import contextlib
+import os
+
+# Environment variables read by the native libraries when they are loaded, e.g. by a lazy import in a worker, after
+# the limits of the libraries already loaded are set
+NATIVE_THREAD_VARIABLES = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+
+def get_available_cpus():
+    """
+    Returns the number of CPUs the process may run on (e.g. restricted by taskset or the cpuset of a container).
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_thread_budget(thread_budget=None):
+    """
+    Returns the number of threads a run may use in total.
+
+    Args:
+        thread_budget (int): the number of threads, e.g. the share of the CPUs of one of several runs on the same
+                             machine, or None for all the CPUs available
+
+    Returns:
+        int: the thread budget
+    """
+    if thread_budget is None:
+        return get_available_cpus()
+    if thread_budget < 1:
+        raise ValueError(f"The thread budget must be at least 1, got {thread_budget}")
+    return int(thread_budget)
+
+
+def get_native_thread_pools():
+    """
+    Returns the native thread pools loaded in the process.
+
+    Returns:
+        dict: the libraries (e.g. openblas, openmp) mapped to their number of threads, empty without threadpoolctl
+    """
+    try:
+        from threadpoolctl import threadpool_info
+    except ImportError:
+        return {}
+    pools = {}
+    for info in threadpool_info():
+        pools[info["internal_api"]] = max(pools.get(info["internal_api"], 0), info["num_threads"])
+    return pools
+
+
+def limit_native_threads(num_threads):
+    """
+    Limits the native thread pools of the process for the rest of its life, e.g. in a worker process: the ones of the
+    libraries already loaded with threadpoolctl, and the ones of the libraries loaded afterwards through their
+    environment variables.
+
+    Args:
+        num_threads (int): maximum number of threads of every native thread pool
+    """
+    for variable in NATIVE_THREAD_VARIABLES:
+        os.environ[variable] = str(num_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits=num_threads)
+
+
+@contextlib.contextmanager
+def native_thread_limits(num_threads):
+    """
+    Limits the native thread pools of the process within a context, e.g. a run in the main process, and restores
+    them (and their environment variables) afterwards.
+
+    Args:
+        num_threads (int): maximum number of threads of every native thread pool
+    """
+    previous_values = {variable: os.environ.get(variable) for variable in NATIVE_THREAD_VARIABLES}
+    for variable in NATIVE_THREAD_VARIABLES:
+        os.environ[variable] = str(num_threads)
+    try:
+        try:
+            from threadpoolctl import threadpool_limits
+        except ImportError:
+            yield
+        else:
+            with threadpool_limits(limits=num_threads):
+                yield
+    finally:
+        for variable, value in previous_values.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+
+
+def init_worker_threads(num_threads, initializer=None, initargs=()):
+    """
+    Initializes a worker process of a pool: limits its native thread pools, then runs the initializer of the pool.
+
+    Args:
+        num_threads (int): maximum number of threads of every native thread pool of the worker
+        initializer (callable): optional initializer of the pool
+        initargs (tuple): arguments of the initializer
+    """
+    limit_native_threads(num_threads)
+    if initializer is not None:
+        initializer(*initargs)
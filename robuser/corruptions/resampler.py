@@ -0,0 +1,331 @@
+"""
+Resampling of the audio, shared by the corruptions (e.g. the noise clips and impulse responses resampled to the sample
+rate of the utterance) and the dataset tools (e.g. resampling a dataset to a common sample rate).
+"""
+
+import functools
+import math
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from robuser.corruptions.native_threads import get_available_cpus, limit_native_threads
+
+# Qualities of the resampling:
+# - "soxr_vhq", "soxr_hq", "soxr_mq", "soxr_lq": libsoxr, as librosa.resample, which designs its filters internally
+# - "poly_hq", "poly": polyphase FIR filtering (scipy.signal.resample_poly) with Kaiser-windowed sinc filters, designed
+#   once per pair of sample rates; "poly" is the design of scipy, "poly_hq" a longer filter with a sharper cutoff
+RESAMPLING_QUALITIES = ("soxr_vhq", "soxr_hq", "soxr_mq", "soxr_lq", "poly_hq", "poly")
+# Quality of the corruptions and the dataset tools, the default of librosa.resample, so that their outputs are the
+# same as when they called it
+DEFAULT_QUALITY = "soxr_hq"
+# Half length of the polyphase filters, in periods of the highest of the up and down sampling factors, and beta of
+# their Kaiser window
+POLYPHASE_DESIGNS = {"poly_hq": (32, 8.6), "poly": (10, 5.0)}
+
+
+def check_quality(quality):
+    """
+    Checks that a resampling quality is supported.
+
+    Args:
+        quality (str): the resampling quality
+
+    Returns:
+        str: the resampling quality
+    """
+    if quality not in RESAMPLING_QUALITIES:
+        raise ValueError(f"Unknown resampling quality '{quality}', use one of {', '.join(RESAMPLING_QUALITIES)}")
+    return quality
+
+
+@functools.lru_cache(maxsize=None)
+def design_polyphase_filter(orig_sr, target_sr, quality="poly", dtype="float64"):
+    """
+    Designs the polyphase filter of a pair of sample rates, once per pair (the design is cached).
+
+    Args:
+        orig_sr (int): the sample rate of the input
+        target_sr (int): the sample rate of the output
+        quality (str): "poly" or "poly_hq"
+        dtype (str): data type of the coefficients, the one of the signals to filter (as scipy does)
+
+    Returns:
+        tuple: (up sampling factor, down sampling factor, read-only array with the FIR filter coefficients)
+    """
+    from scipy.signal import firwin
+
+    gcd = math.gcd(orig_sr, target_sr)
+    up, down = target_sr // gcd, orig_sr // gcd
+    max_rate = max(up, down)
+    half_length, beta = POLYPHASE_DESIGNS[quality]
+    taps = firwin(2 * half_length * max_rate + 1, 1.0 / max_rate, window=("kaiser", beta)).astype(dtype)
+    taps.flags.writeable = False
+    return up, down, taps
+
+
+def resample(signal, orig_sr, target_sr, quality=DEFAULT_QUALITY):
+    """
+    Resamples a signal.
+
+    Args:
+        signal (np.array): 1-D signal
+        orig_sr (int): the sample rate of the signal
+        target_sr (int): the sample rate to resample to
+        quality (str): the resampling quality (see `RESAMPLING_QUALITIES`)
+
+    Returns:
+        np.array: the resampled signal, with ceil(len(signal) * target_sr / orig_sr) samples and the data type of the
+                  signal (the signal itself if the sample rates are the same)
+    """
+    check_quality(quality)
+    if orig_sr == target_sr:
+        return signal
+
+    num_samples = get_resampled_length(len(signal), orig_sr, target_sr)
+    if quality.startswith("soxr"):
+        import soxr
+
+        resampled = soxr.resample(signal, orig_sr, target_sr, quality=quality)
+    else:
+        from scipy.signal import resample_poly
+
+        up, down, taps = design_polyphase_filter(int(orig_sr), int(target_sr), quality, np.dtype(signal.dtype).name)
+        resampled = resample_poly(signal, up, down, window=taps)
+
+    # soxr may give a sample more or less than the exact ratio, which librosa fixes the same way
+    if len(resampled) > num_samples:
+        resampled = resampled[:num_samples]
+    elif len(resampled) < num_samples:
+        resampled = np.pad(resampled, (0, num_samples - len(resampled)))
+    return np.asarray(resampled, dtype=signal.dtype)
+
+
+def can_resample_segment(orig_sr, target_sr, quality=DEFAULT_QUALITY):
+    """
+    Checks whether `resample_segment` gives exactly the segment of the whole resampled signal: without resampling, or
+    with polyphase filtering, whose outputs only depend on the input samples within the length of the filter. libsoxr
+    filters in blocks, so a segment resampled on its own differs slightly from the one of the whole signal.
+
+    Args:
+        orig_sr (int): the sample rate of the signal
+        target_sr (int): the sample rate to resample to
+        quality (str): the resampling quality (see `RESAMPLING_QUALITIES`)
+
+    Returns:
+        bool: whether a segment can be resampled on its own
+    """
+    return orig_sr == target_sr or quality in POLYPHASE_DESIGNS
+
+
+def read_audio_frames(file_path, start, stop):
+    """
+    Reads frames of an audio file (as mono), seeking to the first one, as `librosa.load(file_path, sr=None)` decodes
+    them.
+
+    Args:
+        file_path (str): path to the audio file
+        start (int): first frame
+        stop (int): frame after the last one
+
+    Returns:
+        np.array: the float32 samples
+    """
+    import librosa
+    import soundfile as sf
+
+    audio = sf.read(file_path, start=start, stop=stop, dtype="float32", always_2d=False)[0].T
+    return librosa.to_mono(audio)
+
+
+def resample_segment(file_path, num_frames, orig_sr, target_sr, start, num_samples, quality=DEFAULT_QUALITY):
+    """
+    Resamples a segment of an audio file, reading only the frames of the segment and a margin of the length of the
+    filter around it. The result is the segment [start, start + num_samples) of the whole file resampled by `resample`
+    (see `can_resample_segment`).
+
+    Args:
+        file_path (str): path to the audio file
+        num_frames (int): number of frames of the file
+        orig_sr (int): the sample rate of the file
+        target_sr (int): the sample rate to resample to
+        start (int): first sample of the segment, in samples of the resampled signal
+        num_samples (int): number of samples of the segment
+        quality (str): the resampling quality, a polyphase one if the sample rates differ
+
+    Returns:
+        np.array: the float32 samples of the resampled segment
+    """
+    if orig_sr == target_sr:
+        return read_audio_frames(file_path, start, start + num_samples)
+    if not can_resample_segment(orig_sr, target_sr, quality):
+        raise ValueError(f"A segment cannot be resampled on its own with the '{quality}' quality")
+
+    from scipy.signal import resample_poly
+
+    up, down, taps = design_polyphase_filter(int(orig_sr), int(target_sr), quality, "float32")
+    # Output sample n is filtered from the upsampled samples n * down +/- the half length of the filter, so the input
+    # window starts at a multiple of down (its outputs are then aligned with the ones of the whole signal) before the
+    # first input sample the segment depends on
+    margin = (len(taps) - 1) // 2 // up + 2
+    window_start = max((start * down // up - margin) // down * down, 0)
+    window_stop = min(-(-(start + num_samples) * down // up) + margin, num_frames)
+    window = read_audio_frames(file_path, window_start, window_stop)
+    resampled = resample_poly(window, up, down, window=taps)
+    offset = start - window_start * up // down
+    return np.asarray(resampled[offset:offset + num_samples], dtype=np.float32)
+
+
+def resample_batch(signals, orig_srs, target_sr, quality=DEFAULT_QUALITY):
+    """
+    Resamples a batch of signals to the same sample rate. With polyphase filtering, the signals of the same length and
+    sample rate are stacked and filtered at once.
+
+    Args:
+        signals (list): 1-D signals
+        orig_srs (list): the sample rate of every signal
+        target_sr (int): the sample rate to resample to
+        quality (str): the resampling quality (see `RESAMPLING_QUALITIES`)
+
+    Returns:
+        list: the resampled signals, in the order of the given signals
+    """
+    check_quality(quality)
+    if quality.startswith("soxr"):
+        return [resample(signal, orig_sr, target_sr, quality) for signal, orig_sr in zip(signals, orig_srs)]
+
+    from scipy.signal import resample_poly
+
+    groups = {}
+    for index, (signal, orig_sr) in enumerate(zip(signals, orig_srs)):
+        groups.setdefault((orig_sr, len(signal), np.dtype(signal.dtype)), []).append(index)
+
+    resampled = [None] * len(signals)
+    for (orig_sr, _, dtype), indices in groups.items():
+        if orig_sr == target_sr or len(indices) == 1:
+            for index in indices:
+                resampled[index] = resample(signals[index], orig_sr, target_sr, quality)
+            continue
+        up, down, taps = design_polyphase_filter(int(orig_sr), int(target_sr), quality, dtype.name)
+        stacked = resample_poly(np.stack([signals[index] for index in indices]), up, down, window=taps, axis=1)
+        for row, index in enumerate(indices):
+            resampled[index] = np.asarray(stacked[row], dtype=dtype)
+    return resampled
+
+
+def get_audio_info(file_path):
+    """
+    Reads the sample rate and number of frames of an audio file from its header, decoding the file only if soundfile
+    cannot read it.
+
+    Args:
+        file_path (str): path to the audio file
+
+    Returns:
+        tuple: (sample rate, number of frames)
+    """
+    import soundfile as sf
+
+    try:
+        info = sf.info(file_path)
+        return info.samplerate, info.frames
+    except sf.LibsndfileError:
+        import librosa
+
+        audio, sample_rate = librosa.load(file_path, sr=None)
+        return sample_rate, len(audio)
+
+
+def get_sample_rate(file_path):
+    """
+    Reads the sample rate of an audio file from its header (see `get_audio_info`).
+
+    Args:
+        file_path (str): path to the audio file
+
+    Returns:
+        int: the sample rate
+    """
+    return get_audio_info(file_path)[0]
+
+
+def get_resampled_length(num_samples, orig_sr, target_sr):
+    """
+    Returns the number of samples of a signal resampled by `resample`.
+    """
+    if orig_sr == target_sr:
+        return num_samples
+    return math.ceil(num_samples * target_sr / orig_sr)
+
+
+def resample_file(file_path, target_sr, quality=DEFAULT_QUALITY):
+    """
+    Resamples an audio file in place (as mono), if its sample rate is not the target one. The sample rate is read from
+    the header, so the files that are already at the target sample rate are not decoded.
+
+    Args:
+        file_path (str): path to the audio file
+        target_sr (int): the sample rate to resample to
+        quality (str): the resampling quality (see `RESAMPLING_QUALITIES`)
+
+    Returns:
+        int: the original sample rate of the file
+    """
+    import soundfile as sf
+
+    orig_sr = get_sample_rate(file_path)
+    if orig_sr != target_sr:
+        import librosa
+
+        signal, _ = librosa.load(file_path, sr=None)
+        sf.write(file_path, resample(signal, orig_sr, target_sr, quality), target_sr)
+    return orig_sr
+
+
+def resample_file_task(task):
+    """
+    Resamples an audio file in a worker process of `resample_files`.
+    """
+    return resample_file(*task)
+
+
+def resample_files(file_paths, target_sr, quality=DEFAULT_QUALITY, workers=None, desc=None):
+    """
+    Resamples audio files in place (see `resample_file`), spread over a pool of worker processes.
+
+    Args:
+        file_paths (list): paths to the audio files
+        target_sr (int): the sample rate to resample to
+        quality (str): the resampling quality (see `RESAMPLING_QUALITIES`)
+        workers (int): number of worker processes (default: the number of CPUs)
+        desc (str): description of the progress bar, or None for no progress bar
+
+    Returns:
+        list: the original sample rate of every file
+    """
+    from tqdm import tqdm
+
+    check_quality(quality)
+    tasks = [(file_path, target_sr, quality) for file_path in file_paths]
+    if workers is None:
+        workers = get_available_cpus()
+
+    if workers > 1 and len(tasks) > 1:
+        workers = min(workers, len(tasks))
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=limit_native_threads, initargs=(max(get_available_cpus() // workers, 1),)
+        ) as executor:
+            chunksize = max(1, len(tasks) // (workers * 8))
+            orig_srs = list(
+                tqdm(executor.map(resample_file_task, tasks, chunksize=chunksize), total=len(tasks), desc=desc,
+                     disable=desc is None)
+            )
+    else:
+        orig_srs = [resample_file_task(task) for task in tqdm(tasks, desc=desc, disable=desc is None)]
+
+    resampled_srs = sorted(set(orig_sr for orig_sr in orig_srs if orig_sr != target_sr))
+    if resampled_srs:
+        warnings.warn(f"Resampled files from {', '.join(map(str, resampled_srs))} Hz to {target_sr} Hz")
+    return orig_srs
@@ -0,0 +1,116 @@
+from robuser.corruptions.get_corruption import get_corruption
+
+
+class SeveritySweep:
+    """
+    Apply a corruption at several severities (e.g. SNRs) with a single random draw per audio.
+
+    The configurations must only differ in the sweep parameter of the corruption class, e.g. `snr` for the
+    content and gaussian corruptions. The expensive parts of the corruption (e.g. loading the noise) are paid once
+    and all the severities share the same noise realization, which makes them directly comparable.
+    """
+
+    def __init__(self, corruption_type, corruption_configs):
+        """
+        Initialize the SeveritySweep class
+
+        :param corruption_type: the type of the corruption (e.g. content)
+        :param corruption_configs: list of configurations, one per severity
+        """
+        corruption_class = get_corruption(corruption_type)
+        if corruption_class.sweep_parameter is None:
+            raise ValueError(f"The '{corruption_type}' corruption does not support severity sweeps")
+        if not corruption_configs:
+            raise ValueError("At least one corruption configuration is required")
+
+        sweep_parameter = corruption_class.sweep_parameter
+        shared_configs = [
+            {key: value for key, value in config.items() if key != sweep_parameter} for config in corruption_configs
+        ]
+        if any(config != shared_configs[0] for config in shared_configs):
+            raise ValueError(f"The configurations of a sweep may only differ in '{sweep_parameter}'")
+
+        self.corruption = corruption_class(corruption_configs[0])
+        self.severities = [config[sweep_parameter] for config in corruption_configs]
+
+    @property
+    def corruption_classes(self):
+        """
+        The corruption class of the sweep, which runs once per audio for all the severities
+        """
+        return [type(self.corruption)]
+
+    @property
+    def locality_key(self):
+        """
+        The field of the assignments with the external file they read (see `CorruptionType.locality_key`)
+        """
+        return self.corruption.locality_key
+
+    def draw_assignment(self, num_samples, sample_rate):
+        """
+        Draw the assignment shared by all the severities of an audio (see `CorruptionType.draw_assignment`)
+
+        :param num_samples: the number of samples of the audio
+        :param sample_rate: the sample rate of the audio
+        :return: dictionary with the assignment
+        """
+        return self.corruption.draw_assignment(num_samples, sample_rate)
+
+    def share_audio_data(self):
+        """
+        Share the external audio files of the corruption with the worker processes (see
+        `CorruptionType.share_audio_data`)
+
+        :return: list of the created banks
+        """
+        return self.corruption.share_audio_data()
+
+    def unshare_audio_data(self):
+        """
+        Delete the banks created by `share_audio_data`
+        """
+        self.corruption.unshare_audio_data()
+
+    def reseed(self, seed):
+        """
+        Reseed the random state of the corruption
+
+        :param seed: integer seed in [0, 2**32)
+        """
+        self.corruption.reseed(seed)
+
+    def run_all(self, audio_data, sample_rate):
+        """
+        Run the corruption for every severity
+
+        :param audio_data: numpy array with the audio data
+        :param sample_rate: the sample rate
+        :return: list with one tuple of the corrupted audio data and the applied noise (or None) per severity
+        """
+        return self.corruption.run_sweep(audio_data, sample_rate, self.severities)
+
+    def run_output(self, audio_data, sample_rate, output_index, details=None):
+        """
+        Run the corruption for a single severity, with the same draw as run_all (see `CorruptionType.run_output`).
+        get_details then returns the details of this severity first
+
+        :param audio_data: numpy array with the audio data
+        :param sample_rate: the sample rate
+        :param output_index: index of the severity
+        :param details: the details of the output (see `get_details`), or None to draw it from the random state
+        :return: tuple of the corrupted audio data and the applied noise (or None)
+        """
+        severities = [self.severities[output_index]]
+        if details is not None and self.locality_key is not None:
+            assignment = self.corruption.assignment_from_details(details)
+            return self.corruption.run_sweep(audio_data, sample_rate, severities, assignment)[0]
+        return self.corruption.run_sweep(audio_data, sample_rate, severities)[0]
+
+    def get_details(self):
+        """
+        Get the details of every severity of the last run (see `CorruptionType.get_details`)
+
+        :return: list with one dictionary (or None) per severity
+        """
+        return self.corruption.get_details(len(self.severities))
@@ -1,8 +1,10 @@
+import hashlib
+import json
 import os
 import numpy as np
-import librosa
-import soundfile as sf
-import warnings
+
+# Data type of the audio that flows through the corruptions
+AUDIO_DTYPE = np.float32
 
 
 def get_supported_audio_extensions():
@@ -15,53 +17,134 @@ def get_supported_audio_extensions():
     return (".wav", ".mp3", ".flac", ".m4a", ".ogg", ".aac", ".wma")
 
 
-def normalize_audio(signal):
+def derive_seed(seed, *keys):
+    """A function to derive a reproducible seed from a base seed and some keys (e.g. a file path).
+
+    Args:
+        seed (int): base seed
+        *keys: JSON serializable values that identify what the seed is used for
+
+    Returns:
+        int: a seed in [0, 2**32)
+    """
+    digest = hashlib.sha256(json.dumps([seed, *keys], sort_keys=True).encode()).digest()
+    return int.from_bytes(digest[:4], "little")
+
+
+def to_json_value(value):
+    """A function to convert the values that json does not serialize (e.g. numpy scalars in the details of a
+    corruption), to be used as the `default` of `json.dump`.
+
+    Args:
+        value: value that json does not serialize
+
+    Returns:
+        the value as a Python number or list, or its string representation
+    """
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    return str(value)
+
+
+def to_audio_dtype(signal):
+    """A function to convert a signal to the audio data type, without copying it if it already has it.
+
+    Args:
+        signal (np.array): signal
+
+    Returns:
+        np.array: signal as float32
+    """
+    return np.asarray(signal, dtype=AUDIO_DTYPE)
+
+
+def signal_power(signal):
+    """A function to calculate the power (mean square) of a signal in a single pass.
+
+    Args:
+        signal (np.array): 1-D signal
+
+    Returns:
+        float: power of the signal
+    """
+    return float(np.dot(signal, signal)) / len(signal)
+
+
+def calculate_desired_noise_rms(clean_rms, snr):
+    """A function to calculate the RMS of the noise to add to a signal to reach a given SNR.
+
+    Args:
+        clean_rms (float): RMS of the clean signal
+        snr (float): desired signal-to-noise ratio in dB
+
+    Returns:
+        float: RMS of the noise
+    """
+    return clean_rms / (10 ** (float(snr) / 20))
+
+
+def mean_std(signal):
+    """A function to calculate the mean and std of a signal without allocating temporary arrays.
+
+    Args:
+        signal (np.array): 1-D signal
+
+    Returns:
+        tuple: mean and std of the signal
+    """
+    mean = float(np.sum(signal, dtype=np.float64)) / len(signal)
+    variance = max(signal_power(signal) - mean ** 2, 0.0)
+    return mean, np.sqrt(variance)
+
+
+def normalize_audio(signal, out=None, stats=None):
     """A function to normalize a signal according to its mean and std.
 
     Args:
         signal (np.array): signal
+        out (np.array): optional float32 array to write the normalized signal to, it can be the signal itself
+        stats (tuple): optional (mean, std) to normalize with, instead of the ones of the signal
 
     Returns:
         np.array: normalized signal
     """
-    mean = np.mean(signal)
-    std = np.std(signal)
-    return (signal - mean) / std
+    mean, std = mean_std(signal) if stats is None else stats
+    if out is None:
+        out = np.empty(signal.shape, dtype=AUDIO_DTYPE)
+    np.subtract(signal, mean, out=out, casting="same_kind")
+    out /= std
+    return out
 
 
-def resample_dataset(folder_path, resampled_folder_path):
+def resample_dataset(folder_path, resampled_folder_path, quality=None, workers=None):
     """A function to get the target sample rate from a folder of audio files 
        and resample all the files to the target sample rate.
 
     Args:
         folder_path (str): path to the folder with target audio files 
         resampled_folder_path (str): path to the folder with the files to be resampled
+        quality (str): the resampling quality (default: `resampler.DEFAULT_QUALITY`)
+        workers (int): number of worker processes (default: the number of CPUs)
     """
+    from robuser.corruptions.resampler import DEFAULT_QUALITY, get_sample_rate, resample_files
 
     target_sr = None
-    need_resampling = False
     audio_extensions = get_supported_audio_extensions()
 
-    # Iterate through the original folder to find the target sample rate
+    # Iterate through the original folder to find the target sample rate, from the header of the first audio file
     for root, _, files in os.walk(folder_path):
         for file in files:
             if file.lower().endswith(audio_extensions):
-                _, target_sr = librosa.load(os.path.join(root, file), sr=None)
+                target_sr = get_sample_rate(os.path.join(root, file))
                 break
         if target_sr:
             break
 
     # Iterate through the resampled folder to resample files
+    file_paths = []
     for root, dirs, files in os.walk(resampled_folder_path):
         for file in files:
             if file.lower().endswith(audio_extensions):
-                file_path = os.path.join(root, file)
-                y, sr = librosa.load(file_path, sr=None)
-
-                if target_sr != sr:
-                    if not need_resampling:
-                        need_resampling = True
-                        warnings.warn(f"Resampling from {sr} to {target_sr}...")
+                file_paths.append(os.path.join(root, file))
 
-                    y = librosa.resample(y, orig_sr=sr, target_sr=target_sr)
-                    sf.write(file_path, y, target_sr)
+    resample_files(file_paths, target_sr, DEFAULT_QUALITY if quality is None else quality, workers)
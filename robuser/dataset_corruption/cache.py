@@ -0,0 +1,184 @@
+"""
+Local content-addressed cache of corrupted audio files, shared across runs of the corruption scripts.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import robuser
+from robuser.corruptions.utils import to_json_value
+
+
+def hash_audio_file(file_path):
+    """
+    Hashes the content of an audio file.
+
+    Args:
+        file_path (str): path to the audio file
+
+    Returns:
+        str: hex digest of the file content
+    """
+    with open(file_path, "rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+
+def normalize_corruption_config(corruption_config):
+    """
+    Normalizes a corruption configuration (sorted keys, lists and tuples alike), the same way as
+    `parse_corruption_metadata` does for the per-file corruption CSV.
+
+    Args:
+        corruption_config (dict): configuration for the corruption
+
+    Returns:
+        str: canonical JSON string of the configuration
+    """
+    return json.dumps(dict(corruption_config), sort_keys=True)
+
+
+class CorruptionCache:
+    """
+    Content-addressed cache of corrupted audio, with a size-capped least-recently-used eviction.
+
+    Each entry is keyed by the hash of the source audio, the corruption type, the normalized corruption
+    configuration, the seed of the file and the robuser version, and stores the corrupted audio (as float32 .npy),
+    its sample rate, the applied noise (e.g. the noise file or the impulse response path) and the details reported by
+    the corruption (see `CorruptionType.get_details`).
+    Caching is only meaningful when every file is corrupted with its own seed, so that its output does not depend
+    on the other files of the run.
+    """
+
+    def __init__(self, cache_dir, max_size_gb=10.0):
+        """
+        Initialize the CorruptionCache class
+
+        Args:
+            cache_dir (str): directory of the cache, created if it does not exist
+            max_size_gb (float): maximum size of the cache in GB, the least recently used entries are evicted above it
+        """
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_gb * 1024 ** 3)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.size = sum(size for _, _, size in self.list_entries())
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(source_hash, corruption_type, corruption_config, seed):
+        """
+        Computes the key of a corrupted file.
+
+        Args:
+            source_hash (str): hash of the source audio file (see `hash_audio_file`)
+            corruption_type (str): type of corruption (e.g. content)
+            corruption_config (dict): configuration for the corruption
+            seed (int): the seed the file is corrupted with
+
+        Returns:
+            str: the key of the entry
+        """
+        key = json.dumps(
+            [source_hash, corruption_type, normalize_corruption_config(corruption_config), seed, robuser.__version__]
+        )
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get_entry_paths(self, key):
+        """
+        Returns the paths of the audio and metadata files of an entry.
+        """
+        entry_dir = os.path.join(self.cache_dir, key[:2])
+        return os.path.join(entry_dir, f"{key}.npy"), os.path.join(entry_dir, f"{key}.json")
+
+    def list_entries(self):
+        """
+        Lists the entries of the cache.
+
+        Returns:
+            list of tuples: (last access time, audio path, size in bytes) of every entry
+        """
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if file.endswith(".npy"):
+                    audio_path = os.path.join(root, file)
+                    stat = os.stat(audio_path)
+                    entries.append((stat.st_mtime, audio_path, stat.st_size))
+        return entries
+
+    def get(self, key):
+        """
+        Gets a corrupted file from the cache.
+
+        Args:
+            key (str): the key of the entry
+
+        Returns:
+            tuple: (corrupted audio, sample rate, applied noise, details), or None if the entry is not cached
+        """
+        audio_path, metadata_path = self.get_entry_paths(key)
+        try:
+            with open(metadata_path, "r") as file:
+                metadata = json.load(file)
+            audio = np.load(audio_path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        # Mark the entry as recently used
+        os.utime(audio_path)
+        self.hits += 1
+        return audio, metadata["sample_rate"], metadata["applied_noise"], metadata.get("details")
+
+    def put(self, key, audio, sample_rate, applied_noise, details=None):
+        """
+        Adds a corrupted file to the cache, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key (str): the key of the entry
+            audio (np.array): the corrupted audio
+            sample_rate (int): the sample rate of the corrupted audio
+            applied_noise: the applied noise (or None)
+            details (dict): the details of the output reported by the corruption (or None)
+        """
+        audio_path, metadata_path = self.get_entry_paths(key)
+        os.makedirs(os.path.dirname(audio_path), exist_ok=True)
+
+        # Write to temporary files first, so that concurrent readers never see partial entries
+        metadata = {"sample_rate": sample_rate, "applied_noise": applied_noise, "details": details}
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(metadata_path), delete=False) as file:
+            json.dump(metadata, file, default=to_json_value)
+        os.replace(file.name, metadata_path)
+        with tempfile.NamedTemporaryFile(suffix=".npy", dir=os.path.dirname(audio_path), delete=False) as file:
+            np.save(file, np.asarray(audio, dtype=np.float32))
+        os.replace(file.name, audio_path)
+
+        self.size += os.path.getsize(audio_path)
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """
+        Evicts the least recently used entries, until the cache is below 90% of its maximum size.
+        """
+        entries = sorted(self.list_entries())
+        self.size = sum(size for _, _, size in entries)
+        target_size = 0.9 * self.max_size
+        for _, audio_path, size in entries:
+            if self.size <= target_size:
+                break
+            metadata_path = os.path.splitext(audio_path)[0] + ".json"
+            for path in (audio_path, metadata_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.size -= size
+
+    def get_summary(self):
+        """
+        Returns a string with the hits and misses of the cache.
+        """
+        return f"Cache {self.cache_dir}: {self.hits} hits, {self.misses} misses, {self.size / 1024 ** 2:.1f} MB"
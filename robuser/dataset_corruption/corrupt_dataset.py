@@ -4,18 +4,47 @@ Applies corruptions to an audio dataset based on a yaml configuration file, maki
 
 
 import argparse
+import copy
 import itertools
 import os
 import shutil
+import threading
 
-import librosa
 import yaml
 import soundfile as sf
 from tqdm import tqdm
 
-from robuser.corruptions.utils import get_supported_audio_extensions
+from robuser.corruptions.chain import ChainExecutor
+from robuser.corruptions.compression import pop_ffmpeg_summary
+from robuser.corruptions.native_threads import native_thread_limits
+from robuser.corruptions.utils import derive_seed, get_supported_audio_extensions
 from robuser.corruptions.get_corruption import get_corruption
+from robuser.corruptions.sweep import SeveritySweep
+from robuser.dataset_corruption.cache import CorruptionCache, hash_audio_file
+from robuser.dataset_corruption.provenance import (
+    ProvenanceWriter,
+    make_chains_recipe,
+    make_corruption_recipe,
+    make_header,
+    make_sweep_recipe,
+)
+from robuser.dataset_corruption.scheduling import (
+    choose_strategy,
+    describe_strategy,
+    estimate_costs,
+    make_locality_batches,
+    order_by_locality,
+    parse_workers,
+    plan_assignments,
+    resolve_workers,
+    run_longest_first,
+)
 from robuser.parsing.get_parser import get_parser_for_dataset
+from robuser.parsing.manifest import MANIFEST_FILENAME, build_manifest, probe_audio_file
+from robuser.parsing.subsample import DEFAULT_SUBSAMPLE_SEED, SUBSAMPLE_FILENAME, save_subsample
+
+# Seed used when every file has to be corrupted with its own seed and none is given
+DEFAULT_SEED = 42
 
 
 def copy_dataset(original_dataset_path, corrupted_dataset_path, ignore_extensions=None):
@@ -33,6 +62,8 @@ def copy_dataset(original_dataset_path, corrupted_dataset_path, ignore_extension
     print(f"Copying the original dataset to: {corrupted_dataset_path}")
     for root, _, files in os.walk(original_dataset_path):
         for file in files:
+            if file == MANIFEST_FILENAME:
+                continue
             if not any([file.endswith(extension) for extension in ignore_extensions]):
                 file_path = os.path.join(root, file)
                 relative_path = os.path.relpath(file_path, original_dataset_path)
@@ -41,29 +72,17 @@ def copy_dataset(original_dataset_path, corrupted_dataset_path, ignore_extension
                 shutil.copy2(file_path, output_file_path)
 
 
-def corrupt_dataset(
-    original_dataset_path,
-    corrupted_dataset_path,
-    dataset_name,
-    corruption_type,
-    corruption_config,
-    force=False,
-    skip_copy=False,
-):
+def get_dataset_files(original_dataset_path, dataset_name):
     """
-    Corrupts the original dataset with the specified corruption type and configuration.
+    Finds the audio files of the original dataset.
 
     Args:
         original_dataset_path (str): path to the original dataset
-        corrupted_dataset_path (str): path to the corrupted dataset
-        dataset_name (str): name of the dataset (e.g. iemocap)
-        corruption_type (str): type of corruption (e.g. content)
-        corruption_config (dict): configuration for the corruption
-        force (bool): force overwrite the corrupted dataset if it already exists
-        skip_copy (bool): skip copying the original dataset to the corrupted dataset path
-    """
+        dataset_name (str): name of the dataset (e.g. iemocap), or None for a directory without labels
 
-    # Parse the original dataset
+    Returns:
+        dict: the audio file paths mapped to their annotations (None if no dataset is provided)
+    """
     if dataset_name is not None:
         parser_class = get_parser_for_dataset(dataset_name)
         parser = parser_class(original_dataset_path)
@@ -78,6 +97,19 @@ def corrupt_dataset(
                     file_path = os.path.join(root, file)
                     files_dict[file_path] = None
 
+    return files_dict
+
+
+def prepare_corrupted_dataset(original_dataset_path, corrupted_dataset_path, force=False, skip_copy=False):
+    """
+    Creates the corrupted dataset path, copying the non-audio files of the original dataset.
+
+    Args:
+        original_dataset_path (str): path to the original dataset
+        corrupted_dataset_path (str): path to the corrupted dataset
+        force (bool): force overwrite the corrupted dataset if it already exists
+        skip_copy (bool): skip copying the original dataset to the corrupted dataset path
+    """
     # Check if the corrupted dataset already exists
     if os.path.exists(corrupted_dataset_path):
         if force:
@@ -92,42 +124,605 @@ def corrupt_dataset(
     if not skip_copy:
         copy_dataset(original_dataset_path, corrupted_dataset_path, ignore_extensions=list(get_supported_audio_extensions()))
 
-    # Initialize the corruption class
-    corruption_class = get_corruption(corruption_type)
-    corruption = corruption_class(corruption_config)
 
-    # Metadata for the corrupted dataset
-    robuser_metadata = {}
+def write_robuser_metadata(corrupted_dataset_path, robuser_metadata):
+    """
+    Saves the applied noise of every corrupted file, if the corruption reports any.
+
+    Args:
+        corrupted_dataset_path (str): path to the corrupted dataset
+        robuser_metadata (dict): the corrupted file paths mapped to the applied noise (or None)
+    """
+    if all(value is None for value in robuser_metadata.values()):
+        return
+
+    metadata_path = os.path.join(corrupted_dataset_path, "robuser_metadata.csv")
+
+    # Save as CSV
+    with open(metadata_path, "w") as file:
+        file.write("file_path,corruption_type\n")
+        for key, value in robuser_metadata.items():
+            file.write(f"{key},{value}\n")
+
+    print(f"Metadata saved to {metadata_path}")
+
+
+def corrupt_file(
+    file_path,
+    original_dataset_path,
+    corrupted_dataset_paths,
+    corruption,
+    output_configs=None,
+    seed=None,
+    cache=None,
+):
+    """
+    Corrupts an audio file once per output dataset and saves the corrupted files.
+
+    Args:
+        file_path (str): path to the audio file in the original dataset
+        original_dataset_path (str): path to the original dataset
+        corrupted_dataset_paths (list): paths to the corrupted datasets, one per output of the corruption
+        corruption: object whose `run_all` method returns one (audio, applied noise) tuple per output dataset
+        output_configs (list): [corruption_type, corruption_config] identifying each output in the cache
+        seed (int): seed of the run, the file is corrupted with its own seed derived from this one (see `corrupt_files`)
+        cache (CorruptionCache): optional cache of corrupted files
+
+    Returns:
+        tuple: (list with the applied noise of every output, list with the details of every output (see
+               `CorruptionType.get_details`), whether the outputs were found in the cache)
+    """
+    # file_path is an absolute path, find the relative path to the original_dataset_path
+    relative_path = os.path.relpath(file_path, original_dataset_path)
+    file_seed = None if seed is None else derive_seed(seed, relative_path)
+
+    outputs = None
+    if cache is not None:
+        source_hash = hash_audio_file(file_path)
+        cache_keys = [
+            cache.make_key(source_hash, corruption_type, corruption_config, file_seed)
+            for corruption_type, corruption_config in output_configs
+        ]
+        cached_outputs = [cache.get(cache_key) for cache_key in cache_keys]
+        if all(cached_output is not None for cached_output in cached_outputs):
+            outputs = [(augmented_audio, applied_noise) for augmented_audio, _, applied_noise, _ in cached_outputs]
+            details = [cached_details for _, _, _, cached_details in cached_outputs]
+            sr = cached_outputs[0][1]
+    cache_hit = outputs is not None
+
+    if outputs is None:
+        import librosa
 
-    # Corrupt the dataset
-    for file_path in tqdm(
-        files_dict, desc=f"Corrupting dataset with '{corruption_type}' corruption"
-    ):
         # Load the audio file
         audio, sr = librosa.load(file_path, sr=None)
-        augmented_audio, corruption_type = corruption.run(audio, sr)
+        if file_seed is not None:
+            corruption.reseed(file_seed)
+        outputs = corruption.run_all(audio, sr)
+        details = corruption.get_details()
 
-        # file_path is an absolute path, find the relative path to the original_dataset_path
-        relative_path = os.path.relpath(file_path, original_dataset_path)
-        output_file_path = os.path.join(corrupted_dataset_path, relative_path)
+        if cache is not None:
+            for cache_key, cached_output, (augmented_audio, applied_noise), output_details in zip(
+                cache_keys, cached_outputs, outputs, details
+            ):
+                if cached_output is None:
+                    cache.put(cache_key, augmented_audio, sr, applied_noise, output_details)
 
+    for corrupted_dataset_path, (augmented_audio, _) in zip(corrupted_dataset_paths, outputs):
         # Save the corrupted audio file
-        robuser_metadata[output_file_path] = corruption_type
+        output_file_path = os.path.join(corrupted_dataset_path, relative_path)
         os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
-
         sf.write(output_file_path, augmented_audio, sr)
 
-    # Save the metadata
-    if not all(value is None for value in robuser_metadata.values()):
-        metadata_path = os.path.join(corrupted_dataset_path, "robuser_metadata.csv")
+    return [applied_noise for _, applied_noise in outputs], details, cache_hit
+
+
+# Arguments of `corrupt_file` shared by all the files, set once in every worker by `init_worker`
+_worker_state = threading.local()
+
+
+def init_worker(original_dataset_path, corrupted_dataset_paths, corruption, output_configs, seed, cache):
+    """
+    Initializes a worker process or thread with the arguments of `corrupt_file` shared by all the files.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        # The worker threads of a process would share the random state of the corruption
+        corruption = copy.deepcopy(corruption)
+    _worker_state.args = (original_dataset_path, corrupted_dataset_paths, corruption, output_configs, seed, cache)
+
+
+def corrupt_file_in_worker(file_path):
+    """
+    Corrupts an audio file in a worker initialized by `init_worker`.
+    """
+    return file_path, corrupt_file(file_path, *_worker_state.args)
+
 
-        # Save as CSV
-        with open(metadata_path, "w") as file:
-            file.write("file_path,corruption_type\n")
-            for key, value in robuser_metadata.items():
-                file.write(f"{key},{value}\n")
+def corrupt_files_serially(file_paths, file_args, num_threads):
+    """
+    Corrupts audio files one after the other in the main process, with its native thread pools limited to the thread
+    budget of the run.
+
+    Yields:
+        tuple: (file path, output of `corrupt_file`) of every file
+    """
+    with native_thread_limits(num_threads):
+        for file_path in file_paths:
+            yield file_path, corrupt_file(file_path, *file_args)
+
+
+def get_file_durations(file_paths):
+    """
+    Reads the durations of audio files (in seconds) from their headers.
+    """
+    durations = {}
+    for file_path in file_paths:
+        sample_rate, frames, _ = probe_audio_file(file_path)
+        durations[file_path] = frames / sample_rate
+    return durations
+
+
+def corrupt_files(
+    files_dict,
+    original_dataset_path,
+    corrupted_dataset_paths,
+    corruption,
+    desc,
+    output_configs=None,
+    seed=None,
+    cache=None,
+    workers=1,
+    durations=None,
+    share_audio=False,
+    thread_budget=None,
+    recipe=None,
+):
+    """
+    Corrupts every audio file once per output dataset, decoding each file only once.
+
+    With several workers, the files are corrupted in parallel and dispatched longest-first according to their
+    estimated cost (their duration times the cost models declared by the corruptions), so that the long files do not
+    end up at the tail of the run. The executor and the number of files per task are picked from the capabilities
+    declared by the corruptions (see `scheduling.choose_strategy`).
+
+    With a seed, the corruptions that read external files (e.g. noise clips, impulse responses) draw the assignment
+    of every file up front, and the files that read the same external file are corrupted one after the other (by the
+    same worker), which then loads and resamples it once (see `scheduling.plan_assignments`).
+
+    Args:
+        files_dict (dict): the audio file paths of the original dataset
+        original_dataset_path (str): path to the original dataset
+        corrupted_dataset_paths (list): paths to the corrupted datasets, one per output of the corruption
+        corruption: object whose `run_all` method returns one (audio, applied noise) tuple per output dataset
+        desc (str): description of the progress bar
+        output_configs (list): [corruption_type, corruption_config] identifying each output in the cache
+        seed (int): if given, every file is corrupted with its own seed derived from this one and its relative path,
+                    otherwise the corruption keeps a single random state through the whole dataset
+        cache (CorruptionCache): optional cache of corrupted files, which requires a seed
+        workers (int): number of workers, more than one requires a seed
+        durations (dict): the audio file paths mapped to their durations in seconds, read from the headers if not given
+        share_audio (bool): with worker processes, decode the external audio of the corruption (e.g. noise clips,
+                            impulse responses) once into a bank in shared memory, instead of in every worker
+        thread_budget (int): number of threads of the run, shared by the workers and their native thread pools
+                             (see `scheduling.choose_strategy`), all the CPUs available if None
+        recipe (dict): recipe of the corruption (see `provenance.build_corruption`), saved in the provenance of the
+                       corrupted datasets so that their files can be regenerated
+    """
+    if cache is not None and seed is None:
+        raise ValueError("Caching corrupted files requires a seed")
+    if workers > 1 and seed is None:
+        raise ValueError("Corrupting files in parallel requires a seed")
+
+    corruption_classes = corruption.corruption_classes
+    if cache is not None and not all(corruption_class.deterministic for corruption_class in corruption_classes):
+        print("The corruption is not reproducible from a seed, its outputs are not cached")
+        cache = None
+
+    file_args = (original_dataset_path, corrupted_dataset_paths, corruption, output_configs, seed, cache)
+    strategy = choose_strategy(corruption_classes, workers, len(files_dict), thread_budget)
+    print(f"Corrupting the files on {describe_strategy(strategy)}")
+
+    banks = []
+    if share_audio and strategy.executor == "process":
+        banks = corruption.share_audio_data()
+        if banks:
+            print(f"Sharing {sum(bank.nbytes for bank in banks) / 1024 ** 2:.1f} MB of external audio with the workers")
+
+    # The provenance of every file is appended as soon as the file is written
+    deterministic = all(corruption_class.deterministic for corruption_class in corruption_classes)
+    if output_configs is None:
+        output_configs = [[None, None]] * len(corrupted_dataset_paths)
+    provenance_writers = [
+        ProvenanceWriter(
+            corrupted_dataset_path,
+            make_header(original_dataset_path, recipe, index, output_config, seed, deterministic),
+        )
+        for index, (corrupted_dataset_path, output_config) in enumerate(zip(corrupted_dataset_paths, output_configs))
+    ]
+
+    try:
+        file_paths = list(files_dict)
+        locality_batches = None
+        if seed is not None and corruption.locality_key is not None and len(file_paths) > 1:
+            file_seeds = [
+                derive_seed(seed, os.path.relpath(file_path, original_dataset_path)) for file_path in file_paths
+            ]
+            plan = plan_assignments(corruption, file_paths, file_seeds)
+            locality_batches = make_locality_batches(plan, corruption.locality_key, strategy.workers)
+            print(
+                f"Grouped the files by their '{corruption.locality_key}': "
+                f"{len(set(plan[corruption.locality_key]))} files read, {len(locality_batches)} batches"
+            )
+
+        if strategy.executor != "serial":
+            if durations is None:
+                durations = get_file_durations(file_paths)
+            costs = estimate_costs(
+                [durations[file_path] for file_path in file_paths],
+                [corruption_class.cost_model for corruption_class in corruption_classes],
+                len(corrupted_dataset_paths),
+            )
+            results = run_longest_first(
+                corrupt_file_in_worker,
+                file_paths,
+                costs,
+                strategy.workers,
+                initializer=init_worker,
+                initargs=file_args,
+                executor=strategy.executor,
+                batch_size=strategy.batch_size,
+                batches=locality_batches,
+                threads_per_worker=strategy.threads_per_worker,
+            )
+        else:
+            if locality_batches is not None:
+                file_paths = [file_paths[index] for batch in locality_batches for index in batch]
+            results = corrupt_files_serially(file_paths, file_args, strategy.threads_per_worker)
+
+        applied_noises = {}
+        cache_hits = 0
+        for file_path, (file_applied_noises, file_details, cache_hit) in tqdm(
+            results, total=len(files_dict), desc=desc
+        ):
+            applied_noises[file_path] = file_applied_noises
+            cache_hits += cache_hit
+
+            relative_path = os.path.relpath(file_path, original_dataset_path)
+            file_seed = None if seed is None else derive_seed(seed, relative_path)
+            for provenance_writer, output_details in zip(provenance_writers, file_details):
+                provenance_writer.write(
+                    {"file": relative_path, "seed": file_seed, "cached": cache_hit, "details": output_details}
+                )
+    finally:
+        for provenance_writer in provenance_writers:
+            provenance_writer.close()
+        if banks:
+            corruption.unshare_audio_data()
+
+    if cache is not None:
+        print(f"Cache {cache.cache_dir}: {cache_hits} of {len(files_dict)} files found in the cache")
+    # The ffmpeg jobs of worker processes are counted by the workers
+    ffmpeg_summary = pop_ffmpeg_summary() if strategy.executor != "process" else None
+    if ffmpeg_summary is not None:
+        print(ffmpeg_summary)
+
+    # Save the metadata, in the order of the files of the dataset
+    for index, corrupted_dataset_path in enumerate(corrupted_dataset_paths):
+        metadata = {}
+        for file_path in files_dict:
+            relative_path = os.path.relpath(file_path, original_dataset_path)
+            metadata[os.path.join(corrupted_dataset_path, relative_path)] = applied_noises[file_path][index]
+        write_robuser_metadata(corrupted_dataset_path, metadata)
+
+
+def corrupt_dataset(
+    original_dataset_path,
+    corrupted_dataset_path,
+    dataset_name,
+    corruption_type,
+    corruption_config,
+    force=False,
+    skip_copy=False,
+    seed=None,
+    cache=None,
+    files_dict=None,
+    workers=1,
+    durations=None,
+    share_audio=False,
+    thread_budget=None,
+):
+    """
+    Corrupts the original dataset with the specified corruption type and configuration.
 
-        print(f"Metadata saved to {metadata_path}")
+    Args:
+        original_dataset_path (str): path to the original dataset
+        corrupted_dataset_path (str): path to the corrupted dataset
+        dataset_name (str): name of the dataset (e.g. iemocap)
+        corruption_type (str): type of corruption (e.g. content)
+        corruption_config (dict): configuration for the corruption
+        force (bool): force overwrite the corrupted dataset if it already exists
+        skip_copy (bool): skip copying the original dataset to the corrupted dataset path
+        seed (int): seed to corrupt every file with its own random state (see `corrupt_files`)
+        cache (CorruptionCache): optional cache of corrupted files
+        files_dict (dict): the audio files of the original dataset (e.g. from its manifest), parsed if not given
+        workers (int): number of workers (see `corrupt_files`)
+        durations (dict): the audio file paths mapped to their durations in seconds (e.g. from the manifest)
+        share_audio (bool): share the external audio of the corruption with the workers (see `corrupt_files`)
+        thread_budget (int): number of threads of the run (see `corrupt_files`)
+    """
+
+    # Parse the original dataset
+    if files_dict is None:
+        files_dict = get_dataset_files(original_dataset_path, dataset_name)
+
+    prepare_corrupted_dataset(original_dataset_path, corrupted_dataset_path, force, skip_copy)
+
+    # Initialize the corruption class
+    corruption_class = get_corruption(corruption_type)
+    corruption = corruption_class(corruption_config)
+
+    # Corrupt the dataset
+    corrupt_files(
+        files_dict,
+        original_dataset_path,
+        [corrupted_dataset_path],
+        corruption,
+        desc=f"Corrupting dataset with '{corruption_type}' corruption",
+        output_configs=[[corruption_type, corruption_config]],
+        seed=seed,
+        cache=cache,
+        workers=workers,
+        durations=durations,
+        share_audio=share_audio,
+        thread_budget=thread_budget,
+        recipe=make_corruption_recipe(corruption_type, corruption_config),
+    )
+
+
+def corrupt_dataset_outputs(
+    original_dataset_path,
+    corrupted_dataset_paths,
+    dataset_name,
+    corruption,
+    desc,
+    force=False,
+    skip_copy=False,
+    output_configs=None,
+    seed=None,
+    cache=None,
+    files_dict=None,
+    workers=1,
+    durations=None,
+    share_audio=False,
+    thread_budget=None,
+    recipe=None,
+):
+    """
+    Corrupts the original dataset with a corruption that produces several outputs per file (e.g. a severity sweep
+    or a set of corruption chains), creating one corrupted dataset per output.
+    Every file is decoded once and all its outputs are computed in memory.
+
+    Args:
+        original_dataset_path (str): path to the original dataset
+        corrupted_dataset_paths (list): paths to the corrupted datasets, one per output
+        dataset_name (str): name of the dataset (e.g. iemocap)
+        corruption: object whose `run_all` method returns one (audio, applied noise) tuple per output
+        desc (str): description of the progress bar
+        force (bool): force overwrite the corrupted datasets if they already exist
+        skip_copy (bool): skip copying the original dataset to the corrupted dataset paths
+        output_configs (list): [corruption_type, corruption_config] identifying each output in the cache
+        seed (int): seed to corrupt every file with its own random state (see `corrupt_files`)
+        cache (CorruptionCache): optional cache of corrupted files
+        files_dict (dict): the audio files of the original dataset (e.g. from its manifest), parsed if not given
+        workers (int): number of workers (see `corrupt_files`)
+        durations (dict): the audio file paths mapped to their durations in seconds (e.g. from the manifest)
+        share_audio (bool): share the external audio of the corruption with the workers (see `corrupt_files`)
+        thread_budget (int): number of threads of the run (see `corrupt_files`)
+        recipe (dict): recipe of the corruption, saved in the provenance of the corrupted datasets
+    """
+
+    # Parse the original dataset
+    if files_dict is None:
+        files_dict = get_dataset_files(original_dataset_path, dataset_name)
+
+    for corrupted_dataset_path in corrupted_dataset_paths:
+        prepare_corrupted_dataset(original_dataset_path, corrupted_dataset_path, force, skip_copy)
+
+    corrupt_files(
+        files_dict,
+        original_dataset_path,
+        corrupted_dataset_paths,
+        corruption,
+        desc=desc,
+        output_configs=output_configs,
+        seed=seed,
+        cache=cache,
+        workers=workers,
+        durations=durations,
+        share_audio=share_audio,
+        thread_budget=thread_budget,
+        recipe=recipe,
+    )
+
+
+def corrupt_dataset_chains(
+    original_dataset_path,
+    corrupted_dataset_paths,
+    dataset_name,
+    chains,
+    force=False,
+    skip_copy=False,
+    seed=None,
+    cache=None,
+    files_dict=None,
+    workers=1,
+    durations=None,
+    share_audio=False,
+    thread_budget=None,
+):
+    """
+    Corrupts the original dataset with chains of corruptions, creating one corrupted dataset per chain.
+    The chains are applied in memory, computing the prefixes they share only once per file.
+
+    Args:
+        original_dataset_path (str): path to the original dataset
+        corrupted_dataset_paths (list): paths to the corrupted datasets, one per chain
+        dataset_name (str): name of the dataset (e.g. iemocap)
+        chains (list): list of chains, each one a list of [corruption_type, corruption_config] steps
+        force (bool): force overwrite the corrupted datasets if they already exist
+        skip_copy (bool): skip copying the original dataset to the corrupted dataset paths
+        seed (int): seed to corrupt every file with its own random state (see `corrupt_files`)
+        cache (CorruptionCache): optional cache of corrupted files
+        files_dict (dict): the audio files of the original dataset (e.g. from its manifest), parsed if not given
+        workers (int): number of workers (see `corrupt_files`)
+        durations (dict): the audio file paths mapped to their durations in seconds (e.g. from the manifest)
+        share_audio (bool): share the external audio of the corruption with the workers (see `corrupt_files`)
+        thread_budget (int): number of threads of the run (see `corrupt_files`)
+    """
+    corrupt_dataset_outputs(
+        original_dataset_path,
+        corrupted_dataset_paths,
+        dataset_name,
+        ChainExecutor(chains),
+        desc=f"Corrupting dataset with {len(chains)} corruption chains",
+        force=force,
+        skip_copy=skip_copy,
+        output_configs=[["chain", {"steps": steps}] for steps in chains],
+        seed=seed,
+        cache=cache,
+        files_dict=files_dict,
+        workers=workers,
+        durations=durations,
+        share_audio=share_audio,
+        thread_budget=thread_budget,
+        recipe=make_chains_recipe(chains),
+    )
+
+
+def corrupt_dataset_sweep(
+    original_dataset_path,
+    corrupted_dataset_paths,
+    dataset_name,
+    corruption_type,
+    corruption_configs,
+    force=False,
+    skip_copy=False,
+    seed=None,
+    cache=None,
+    files_dict=None,
+    workers=1,
+    durations=None,
+    share_audio=False,
+    thread_budget=None,
+):
+    """
+    Corrupts the original dataset at several severities of the same corruption, creating one corrupted dataset per
+    severity. The corruption is drawn once per file (e.g. the same noise segment) and scaled to every severity.
+
+    Args:
+        original_dataset_path (str): path to the original dataset
+        corrupted_dataset_paths (list): paths to the corrupted datasets, one per severity
+        dataset_name (str): name of the dataset (e.g. iemocap)
+        corruption_type (str): type of corruption (e.g. content)
+        corruption_configs (list): configurations for the corruption, one per severity
+        force (bool): force overwrite the corrupted datasets if they already exist
+        skip_copy (bool): skip copying the original dataset to the corrupted dataset paths
+        seed (int): seed to corrupt every file with its own random state (see `corrupt_files`)
+        cache (CorruptionCache): optional cache of corrupted files
+        files_dict (dict): the audio files of the original dataset (e.g. from its manifest), parsed if not given
+        workers (int): number of workers (see `corrupt_files`)
+        durations (dict): the audio file paths mapped to their durations in seconds (e.g. from the manifest)
+        share_audio (bool): share the external audio of the corruption with the workers (see `corrupt_files`)
+        thread_budget (int): number of threads of the run (see `corrupt_files`)
+    """
+    corrupt_dataset_outputs(
+        original_dataset_path,
+        corrupted_dataset_paths,
+        dataset_name,
+        SeveritySweep(corruption_type, corruption_configs),
+        desc=f"Corrupting dataset with '{corruption_type}' corruption at {len(corruption_configs)} severities",
+        force=force,
+        skip_copy=skip_copy,
+        # A sweep shares the noise between its severities, so its outputs differ from the ones of single runs
+        output_configs=[[f"{corruption_type}_sweep", corruption_config] for corruption_config in corruption_configs],
+        seed=seed,
+        cache=cache,
+        files_dict=files_dict,
+        workers=workers,
+        durations=durations,
+        share_audio=share_audio,
+        thread_budget=thread_budget,
+        recipe=make_sweep_recipe(corruption_type, corruption_configs),
+    )
+
+
+def expand_config(corruption_config):
+    """
+    Expands a corruption configuration with lists of values into all their combinations.
+
+    Args:
+        corruption_config (dict): configuration for the corruption, with a list of values per parameter
+
+    Returns:
+        list of dicts: one configuration per combination of the values
+    """
+    return [dict(zip(corruption_config, values)) for values in itertools.product(*corruption_config.values())]
+
+
+def parse_chains_config(chains_config):
+    """
+    Parses the configuration for the corruption chains.
+    Every chain is a list of steps, each step mapping a corruption type to its configuration,
+    which is expanded like any other corruption configuration.
+
+    Args:
+        chains_config (dict): the chain names mapped to their steps
+
+    Returns:
+        list of tuples: list of tuples with the "chain" type and the chain configuration
+    """
+    chains = []
+
+    for chain_name, steps in chains_config.items():
+        steps_options = []
+        for step in steps:
+            if not isinstance(step, dict) or len(step) != 1:
+                raise ValueError(
+                    f"Each step of the chain '{chain_name}' must map a single corruption type to its configuration"
+                )
+            (step_type, step_config), = step.items()
+            steps_options.append([[step_type, config] for config in expand_config(step_config)])
+
+        for chain_steps in itertools.product(*steps_options):
+            chains.append(["chain", {"name": chain_name, "steps": list(chain_steps)}])
+
+    return chains
+
+
+def parse_sweep_config(corruption_type, corruption_config):
+    """
+    Parses the configuration of a corruption applied as a severity sweep.
+    The configurations that only differ in the sweep parameter (e.g. snr) are grouped in a single sweep.
+
+    Args:
+        corruption_type (str): type of corruption (e.g. content)
+        corruption_config (dict): configuration for the corruption, with a list of values per parameter
+
+    Returns:
+        list of tuples: list of tuples with the "sweep" type and the sweep configuration
+    """
+    sweep_parameter = get_corruption(corruption_type).sweep_parameter
+    if sweep_parameter is None:
+        raise ValueError(f"The '{corruption_type}' corruption does not support severity sweeps")
+
+    sweeps = {}
+    for values_config in expand_config(corruption_config):
+        shared_config = {key: value for key, value in values_config.items() if key != sweep_parameter}
+        sweep_key = yaml.dump(shared_config)
+        if sweep_key not in sweeps:
+            sweeps[sweep_key] = {"corruption_type": corruption_type, "configs": []}
+        sweeps[sweep_key]["configs"].append(values_config)
+
+    return [["sweep", sweep_config] for sweep_config in sweeps.values()]
 
 
 def parse_config(config):
@@ -146,8 +741,16 @@ def parse_config(config):
         if not corruption_config.pop("enabled", False):
             continue
 
-        for values in itertools.product(*corruption_config.values()):
-            corruptions.append([corruption_type, dict(zip(corruption_config, values))])
+        if corruption_type == "chains":
+            corruptions.extend(parse_chains_config(corruption_config))
+            continue
+
+        if corruption_config.pop("sweep", False):
+            corruptions.extend(parse_sweep_config(corruption_type, corruption_config))
+            continue
+
+        for values_config in expand_config(corruption_config):
+            corruptions.append([corruption_type, values_config])
 
     print(f"Will apply the following {len(corruptions)} corruptions:")
     for corruption in corruptions:
@@ -160,6 +763,10 @@ def get_corruption_str(corruption_type, corruption_config):
     """
     Returns a string representation of the corruption type and configuration.
     """
+    if corruption_type == "chain":
+        steps_str = "_then_".join(get_corruption_str(*step) for step in corruption_config["steps"])
+        return f"chain_{corruption_config['name']}_{steps_str}"
+
     config_str = ""
     for key, value in corruption_config.items():
         if key == "enabled":
@@ -174,6 +781,18 @@ def get_corruption_str(corruption_type, corruption_config):
     return corruption_type + config_str
 
 
+def get_corrupted_dataset_path(corrupted_datasets_path, dataset_name, corruption_type, corruption_config):
+    """
+    Returns the path of the corrupted dataset for the corruption type and configuration.
+    """
+    if dataset_name is None:
+        return os.path.join(corrupted_datasets_path, f"{get_corruption_str(corruption_type, corruption_config)}")
+    return os.path.join(
+        corrupted_datasets_path,
+        f"{dataset_name}_{get_corruption_str(corruption_type, corruption_config)}",
+    )
+
+
 def corrupt(
     dataset_name,
     original_dataset_path,
@@ -181,6 +800,15 @@ def corrupt(
     corruptions_config,
     force=False,
     skip_copy=False,
+    seed=None,
+    cache_dir=None,
+    cache_size_gb=10.0,
+    manifest_path=None,
+    workers=1,
+    share_audio=False,
+    thread_budget=None,
+    subsample=None,
+    subsample_seed=DEFAULT_SUBSAMPLE_SEED,
 ):
     """
     Corrupts the original dataset with the specified corruption type and configuration.
@@ -192,19 +820,57 @@ def corrupt(
         corruptions_config (dict): configuration for the corruption
         force (bool): force overwrite the corrupted dataset if it already exists
         skip_copy (bool): skip copying the original dataset to the corrupted dataset path
+        seed (int): if given, every file is corrupted with its own seed derived from this one
+        cache_dir (str): optional directory of a cache of corrupted files, shared across runs
+        cache_size_gb (float): maximum size of the cache in GB
+        manifest_path (str): path of the manifest of the original dataset, which is built (or updated) once and
+                             shared by all the corruptions (default: robuser_manifest.npz in the corrupted datasets
+                             path, the original dataset is only read)
+        workers (int): number of workers corrupting the files of each dataset in parallel, or "auto" for one per
+                       thread of the budget
+        share_audio (bool): share the external audio of the corruptions with the worker processes
+        thread_budget (int): number of threads of the run, shared by the workers and their native thread pools (e.g.
+                             a share of the CPUs when several runs share the machine), all the CPUs available if None
+        subsample (float): if given, only corrupt a stratified subsample (by speaker and emotion) of this number of
+                           files, or this fraction of the files if below 1, listed in robuser_subsample.txt in the
+                           corrupted datasets path
+        subsample_seed (int): seed of the subsample, the larger subsamples of the same seed contain the smaller ones
     """
 
+    workers = resolve_workers(workers, thread_budget)
+    if (cache_dir is not None or workers > 1) and seed is None:
+        seed = DEFAULT_SEED
+        print(f"Caching and parallel corruption require every file to be corrupted with its own seed, using seed {seed}")
+
+    cache = None
+    if cache_dir is not None:
+        cache = CorruptionCache(cache_dir, cache_size_gb)
+
     corruptions_list = parse_config(corruptions_config)
+
+    # Parse the original dataset once for all the corruptions
+    if manifest_path is None:
+        os.makedirs(corrupted_datasets_path, exist_ok=True)
+        manifest_path = os.path.join(corrupted_datasets_path, MANIFEST_FILENAME)
+    manifest = build_manifest(original_dataset_path, dataset_name, manifest_path)
+    if subsample is not None:
+        num_files = len(manifest)
+        manifest = manifest.subsample(subsample, subsample_seed)
+        os.makedirs(corrupted_datasets_path, exist_ok=True)
+        subsample_path = os.path.join(corrupted_datasets_path, SUBSAMPLE_FILENAME)
+        save_subsample(subsample_path, manifest.file_paths, original_dataset_path)
+        print(f"Corrupting a stratified subsample of {len(manifest)} out of {num_files} files (see {subsample_path})")
+    files_dict = manifest.get_files_dict()
+    durations = dict(zip(manifest.file_paths, manifest.durations.tolist()))
+
+    chains_list = [corruption for corruption in corruptions_list if corruption[0] == "chain"]
+    sweeps_list = [corruption for corruption in corruptions_list if corruption[0] == "sweep"]
+    corruptions_list = [corruption for corruption in corruptions_list if corruption[0] not in ("chain", "sweep")]
+
     for corruption_type, corruption_config in tqdm(corruptions_list, desc="Corrupting datasets"):
-        if dataset_name is None:
-            corrupted_dataset_path = os.path.join(
-                corrupted_datasets_path, f"{get_corruption_str(corruption_type, corruption_config)}"
-            )
-        else:
-            corrupted_dataset_path = os.path.join(
-                corrupted_datasets_path,
-                f"{dataset_name}_{get_corruption_str(corruption_type, corruption_config)}",
-            )
+        corrupted_dataset_path = get_corrupted_dataset_path(
+            corrupted_datasets_path, dataset_name, corruption_type, corruption_config
+        )
         try:
             corrupt_dataset(
                 original_dataset_path,
@@ -214,6 +880,13 @@ def corrupt(
                 corruption_config,
                 force,
                 skip_copy,
+                seed=seed,
+                cache=cache,
+                files_dict=files_dict,
+                workers=workers,
+                durations=durations,
+                share_audio=share_audio,
+                thread_budget=thread_budget,
             )
             with open(os.path.join(corrupted_dataset_path, "robuser_config.yaml"), "w") as file_:
                 yaml.dump(corruption_config, file_)
@@ -221,6 +894,82 @@ def corrupt(
             print(f"Error while corrupting the dataset with '{corruption_type}' corruption: {e}")
             shutil.rmtree(corrupted_dataset_path, ignore_errors=True)
 
+    for _, sweep_config in tqdm(sweeps_list, desc="Corrupting datasets with severity sweeps"):
+        corruption_type = sweep_config["corruption_type"]
+        corrupt_multiple_outputs(
+            corrupted_datasets_path,
+            dataset_name,
+            [(corruption_type, corruption_config) for corruption_config in sweep_config["configs"]],
+            lambda corrupted_dataset_paths: corrupt_dataset_sweep(
+                original_dataset_path,
+                corrupted_dataset_paths,
+                dataset_name,
+                corruption_type,
+                sweep_config["configs"],
+                force,
+                skip_copy,
+                seed=seed,
+                cache=cache,
+                files_dict=files_dict,
+                workers=workers,
+                durations=durations,
+                share_audio=share_audio,
+                thread_budget=thread_budget,
+            ),
+            desc=f"'{corruption_type}' severity sweep",
+        )
+
+    if chains_list:
+        # All the chains are applied in a single pass over the dataset, sharing their common prefixes
+        corrupt_multiple_outputs(
+            corrupted_datasets_path,
+            dataset_name,
+            chains_list,
+            lambda corrupted_dataset_paths: corrupt_dataset_chains(
+                original_dataset_path,
+                corrupted_dataset_paths,
+                dataset_name,
+                [chain_config["steps"] for _, chain_config in chains_list],
+                force,
+                skip_copy,
+                seed=seed,
+                cache=cache,
+                files_dict=files_dict,
+                workers=workers,
+                durations=durations,
+                share_audio=share_audio,
+                thread_budget=thread_budget,
+            ),
+            desc="corruption chains",
+        )
+
+
+def corrupt_multiple_outputs(corrupted_datasets_path, dataset_name, outputs, corrupt_fn, desc):
+    """
+    Runs a corruption that creates several corrupted datasets at once and saves their configurations.
+    If the corruption fails, all of its corrupted datasets are removed.
+
+    Args:
+        corrupted_datasets_path (str): path to the corrupted datasets
+        dataset_name (str): name of the dataset (e.g. iemocap)
+        outputs (list): list of [corruption_type, corruption_config] pairs, one per corrupted dataset
+        corrupt_fn (callable): function that corrupts the dataset, given the list of corrupted dataset paths
+        desc (str): description of the corruption for the error messages
+    """
+    corrupted_dataset_paths = [
+        get_corrupted_dataset_path(corrupted_datasets_path, dataset_name, corruption_type, corruption_config)
+        for corruption_type, corruption_config in outputs
+    ]
+    try:
+        corrupt_fn(corrupted_dataset_paths)
+        for corrupted_dataset_path, (_, corruption_config) in zip(corrupted_dataset_paths, outputs):
+            with open(os.path.join(corrupted_dataset_path, "robuser_config.yaml"), "w") as file_:
+                yaml.dump(corruption_config, file_)
+    except Exception as e:
+        print(f"Error while corrupting the dataset with the {desc}: {e}")
+        for corrupted_dataset_path in corrupted_dataset_paths:
+            shutil.rmtree(corrupted_dataset_path, ignore_errors=True)
+
 
 def parse_arguments():
     """!
@@ -256,6 +1005,73 @@ def parse_arguments():
         default="config.yml",
         help="Path to the YAML configuration for the corruptions",
     )
+    args_parser.add_argument(
+        "-m",
+        "--manifest",
+        type=str,
+        default=None,
+        help="Path of the manifest of the original dataset (default: robuser_manifest.npz in the output path, "
+        "built in memory with --plan)",
+    )
+    args_parser.add_argument(
+        "-w",
+        "--workers",
+        type=parse_workers,
+        default=1,
+        help="Number of worker processes (or threads, see README), the longest files are corrupted first "
+        "(implies --seed 42 if no seed is given), or 'auto' for one per thread of the budget",
+    )
+    args_parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Number of threads of the run, shared by the workers and the native thread pools (BLAS, OpenMP) of "
+        "every worker, e.g. a share of the CPUs when several runs share the machine (default: all the CPUs)",
+    )
+    args_parser.add_argument(
+        "--share_audio",
+        action="store_true",
+        help="With several workers, decode the noise clips and impulse responses of the corruptions once into "
+        "shared memory, instead of in every worker process",
+    )
+    args_parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Only estimate the wall time, output size and peak memory of the corruptions, "
+        "by timing them on a few files, without writing any corrupted file",
+    )
+    args_parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Corrupt every file with its own seed, derived from this seed and the file path, "
+        "so that its output does not depend on the other files",
+    )
+    args_parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="Directory of a cache of corrupted files, reused across runs (implies --seed 42 if no seed is given)",
+    )
+    args_parser.add_argument(
+        "--cache_size",
+        type=float,
+        default=10.0,
+        help="Maximum size of the cache in GB, the least recently used files are evicted above it",
+    )
+    args_parser.add_argument(
+        "--subsample",
+        type=float,
+        default=None,
+        help="Only corrupt a stratified subsample (by speaker and emotion) of this number of files, or this fraction "
+        f"of the files if below 1, for a fast approximate evaluation (the files are listed in {SUBSAMPLE_FILENAME})",
+    )
+    args_parser.add_argument(
+        "--subsample_seed",
+        type=int,
+        default=DEFAULT_SUBSAMPLE_SEED,
+        help="Seed of the subsample, the larger subsamples of the same seed contain the smaller ones",
+    )
     return args_parser.parse_args()
 
 
@@ -266,7 +1082,41 @@ def main():
     with open(args.config, "r") as file:
         config = yaml.safe_load(file)
 
-    corrupt(args.dataset, args.input, args.output, config, args.force, args.skip_copy)
+    if args.plan:
+        from robuser.dataset_corruption.plan import plan_corruptions
+
+        manifest = build_manifest(args.input, args.dataset, args.manifest)
+        if args.subsample is not None:
+            manifest = manifest.subsample(args.subsample, args.subsample_seed)
+        plan_corruptions(
+            manifest,
+            args.input,
+            args.output,
+            parse_config(config),
+            workers=resolve_workers(args.workers, args.threads),
+            thread_budget=args.threads,
+            skip_copy=args.skip_copy,
+            seed=DEFAULT_SEED if args.seed is None else args.seed,
+        )
+        return
+
+    corrupt(
+        args.dataset,
+        args.input,
+        args.output,
+        config,
+        args.force,
+        args.skip_copy,
+        seed=args.seed,
+        cache_dir=args.cache_dir,
+        cache_size_gb=args.cache_size,
+        manifest_path=args.manifest,
+        workers=args.workers,
+        share_audio=args.share_audio,
+        thread_budget=args.threads,
+        subsample=args.subsample,
+        subsample_seed=args.subsample_seed,
+    )
 
 
 if __name__ == "__main__":
@@ -4,16 +4,47 @@ Applies corruptions to an audio dataset based on a CSV file, which specifies the
 
 import argparse
 import csv
+import heapq
+import itertools
 import json
 import os
+import tempfile
+import threading
+from collections import OrderedDict
+from operator import itemgetter
 
-import librosa
 import soundfile as sf
 from tqdm import tqdm
 from frozendict import frozendict
 
 
+from robuser.corruptions.compression import pop_ffmpeg_summary
 from robuser.corruptions.get_corruption import get_corruption
+from robuser.corruptions.native_threads import native_thread_limits
+from robuser.corruptions.utils import derive_seed
+from robuser.dataset_corruption.cache import CorruptionCache, hash_audio_file, normalize_corruption_config
+from robuser.dataset_corruption.corrupt_dataset import DEFAULT_SEED
+from robuser.dataset_corruption.scheduling import (
+    choose_strategy,
+    describe_strategy,
+    estimate_costs,
+    get_corruption_cost_model,
+    parse_workers,
+    resolve_workers,
+    run_longest_first,
+    run_streaming,
+)
+from robuser.parsing.manifest import probe_audio_file
+
+# Columns of the CSV specifications
+REQUIRED_HEADERS = ["audio_file_path", "corruption_type", "corruption_metadata", "output_file_path"]
+# Estimated memory taken by a row of the CSV held in memory, on top of its strings
+ROW_OVERHEAD_BYTES = 300
+# Memory budget in MB of the rows held in memory when streaming the CSV
+DEFAULT_MEMORY_BUDGET_MB = 512
+# Unique corruption configurations counted per corruption type, so that a CSV with a configuration per row (e.g. a
+# random SNR per file) does not fill the memory with them
+MAX_COUNTED_CONFIGS = 100000
 
 
 def parse_corruption_metadata(metadata_str):
@@ -39,89 +70,439 @@ def parse_corruption_metadata(metadata_str):
         raise ValueError(f"Invalid JSON in corruption metadata: {metadata_str}. Error: {e}")
 
 
-def apply_corruption_from_csv(csv_file_path, force=False):
+class CorruptionPool:
     """
-    Apply corruptions to audio files based on specifications in a CSV file.
+    Bounded pool of corruption instances keyed by corruption type and normalized metadata, so that a corruption
+    is initialized once (e.g. listing a noise dataset, estimating the RT60 of impulse responses) and reused across
+    the input files. The least recently used instance is dropped when the pool is full.
+    """
+
+    def __init__(self, max_size=16):
+        """
+        Args:
+            max_size (int): maximum number of corruption instances kept
+        """
+        self.max_size = max_size
+        self.corruptions = OrderedDict()
+
+    def get(self, corruption_type, corruption_metadata):
+        """
+        Returns the corruption instance for the corruption type and metadata, initializing it if needed.
+
+        Args:
+            corruption_type (str): type of corruption (e.g. content)
+            corruption_metadata (frozendict): normalized corruption metadata (see `parse_corruption_metadata`)
+        """
+        corruption_key = (corruption_type, corruption_metadata)
+        if corruption_key in self.corruptions:
+            self.corruptions.move_to_end(corruption_key)
+            return self.corruptions[corruption_key]
+
+        corruption_class = get_corruption(corruption_type)
+        corruption = corruption_class(corruption_metadata)
+        self.put(corruption_type, corruption_metadata, corruption)
+        return corruption
+
+    def put(self, corruption_type, corruption_metadata, corruption):
+        """
+        Adds an initialized corruption instance to the pool (e.g. one created in advance and sent to the workers).
+
+        Args:
+            corruption_type (str): type of corruption (e.g. content)
+            corruption_metadata (frozendict): normalized corruption metadata (see `parse_corruption_metadata`)
+            corruption (CorruptionType): the corruption instance
+        """
+        self.corruptions[(corruption_type, corruption_metadata)] = corruption
+        self.corruptions.move_to_end((corruption_type, corruption_metadata))
+        if len(self.corruptions) > self.max_size:
+            self.corruptions.popitem(last=False)
+
+
+def derive_row_seed(seed, audio_file_path, corruption_type, corruption_metadata, occurrence):
+    """
+    Derives the seed of a row of the CSV specification.
 
     Args:
-        csv_file_path (str): Path to the CSV file containing corruption specifications
+        seed (int): Seed of the run
+        audio_file_path (str): Path to the input audio file of the row
+        corruption_type (str): Type of corruption of the row
+        corruption_metadata (dict): Configuration of the corruption of the row
+        occurrence (int): Number of previous rows of the same input file with the same corruption and configuration,
+            so that repeated rows are corrupted with different seeds
+    Returns:
+        int: Seed of the row
+    """
+    return derive_seed(
+        seed, audio_file_path, corruption_type, normalize_corruption_config(corruption_metadata), occurrence
+    )
+
+
+def corrupt_input_file(audio_file_path, rows, corruption_pool, force=False, seed=None, cache=None):
+    """
+    Apply all the corruptions requested for an audio file, decoding it only once.
+
+    Args:
+        audio_file_path (str): Path to the input audio file
+        rows (list): List of (corruption_type, corruption_metadata, output_file_path) requested for the file
+        corruption_pool (CorruptionPool): Pool of the corruption instances
         force (bool): Force overwrite output files if they already exist
+        seed (int): If given, every row is corrupted with its own seed (see `derive_row_seed`)
+        cache (CorruptionCache): Optional cache of corrupted files
     Returns:
-        dict: Dictionary mapping input audio file paths to the paths of applied noise files (for applicable corruptions)
+        list: List of (output_file_path, applied_noise_path) of the corrupted files
+    """
+    source_hash = None
+    audio, sr = None, None
+    applied_noise_paths = []
+    occurrences = {}
+
+    for corruption_type, corruption_metadata, output_file_path in rows:
+        # The rows are counted before any is skipped, so that the seed of a row does not depend on the existing outputs
+        occurrence = occurrences.get((corruption_type, corruption_metadata), 0)
+        occurrences[(corruption_type, corruption_metadata)] = occurrence + 1
+        row_seed = None
+        if seed is not None:
+            row_seed = derive_row_seed(seed, audio_file_path, corruption_type, corruption_metadata, occurrence)
+
+        # Check if output file already exists
+        if os.path.exists(output_file_path) and not force:
+            print(
+                f"Warning: Output file already exists: {output_file_path}. Use --force to overwrite. Skipping."
+            )
+            continue
+        # Create output directory if it doesn't exist
+        os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+
+        # Apply the corruption
+        try:
+            cached_output = None
+            # The outputs of corruptions that are not reproducible from a seed are not cached
+            use_cache = cache is not None and get_corruption(corruption_type).deterministic
+            if use_cache:
+                if source_hash is None:
+                    source_hash = hash_audio_file(audio_file_path)
+                cache_key = cache.make_key(source_hash, corruption_type, corruption_metadata, row_seed)
+                cached_output = cache.get(cache_key)
+
+            if cached_output is not None:
+                augmented_audio, output_sr, applied_noise_path, _ = cached_output
+            else:
+                corruption = corruption_pool.get(corruption_type, corruption_metadata)
+
+                # Load the audio file, once for all its corruptions
+                if audio is None:
+                    import librosa
+
+                    audio, sr = librosa.load(audio_file_path, sr=None)
+                if row_seed is not None:
+                    corruption.reseed(row_seed)
+                augmented_audio, applied_noise_path = corruption.run(audio, sr)
+                output_sr = sr
+                if use_cache:
+                    cache.put(cache_key, augmented_audio, sr, applied_noise_path, corruption.get_details()[0])
+
+            sf.write(output_file_path, augmented_audio, output_sr)
+            applied_noise_paths.append((output_file_path, applied_noise_path))
+        except Exception as e:
+            print(
+                f"Error applying corruption to {audio_file_path}: {e}. Skipping this file."
+            )
+            continue
+
+    return applied_noise_paths
+
+
+# State of the workers, set once by `init_worker`
+_worker_state = threading.local()
+
+
+def init_worker(max_corruptions, force, seed, cache):
+    """
+    Initializes a worker process or thread with its own pool of corruption instances.
     """
+    _worker_state.state = (CorruptionPool(max_corruptions), force, seed, cache)
 
-    corruptions_to_apply = {}
-    corruption_types = set()
 
-    # Read the CSV file containing per-file corruption specifications
+def corrupt_input_file_in_worker(task):
+    """
+    Apply the corruptions of an audio file in a worker initialized by `init_worker`.
+    """
+    audio_file_path, rows = task
+    corruption_pool, force, seed, cache = _worker_state.state
+    return corrupt_input_file(audio_file_path, rows, corruption_pool, force, seed, cache)
+
+
+def corrupt_input_files_serially(tasks, max_corruptions, force, seed, cache, num_threads):
+    """
+    Apply the corruptions of the audio files one after the other in the main process, with its native thread pools
+    limited to the thread budget of the run.
+    """
+    corruption_pool = CorruptionPool(max_corruptions)
+    with native_thread_limits(num_threads):
+        for audio_file_path, rows in tasks:
+            yield corrupt_input_file(audio_file_path, rows, corruption_pool, force, seed, cache)
+
+
+def read_csv_rows(csv_file_path, corruptions_per_type):
+    """
+    Read the rows of a CSV file with per-file corruption specifications, one at a time.
+
+    Args:
+        csv_file_path (str): Path to the CSV file containing corruption specifications
+        corruptions_per_type (dict): Updated with the number of rows and the set of unique corruption metadata (up to
+            MAX_COUNTED_CONFIGS) of every corruption type
+    Yields:
+        tuple: (audio_file_path, corruption_type, corruption_metadata, output_file_path) of every row, with the
+            corruption metadata as in the CSV (JSON string)
+    """
     with open(csv_file_path, "r") as csvfile:
         reader = csv.DictReader(csvfile)
 
         # Validate CSV headers
-        required_headers = [
-            "audio_file_path",
-            "corruption_type",
-            "corruption_metadata",
-            "output_file_path",
-        ]
-        if not all(header in reader.fieldnames for header in required_headers):
+        if not all(header in reader.fieldnames for header in REQUIRED_HEADERS):
             raise ValueError(
-                f"CSV file must contain headers: {required_headers}. Found: {reader.fieldnames}"
+                f"CSV file must contain headers: {REQUIRED_HEADERS}. Found: {reader.fieldnames}"
             )
 
         for row in reader:
             corr_metadata = parse_corruption_metadata(row["corruption_metadata"])
-            corruption_key = (row["corruption_type"], corr_metadata)
-            if corruption_key not in corruptions_to_apply:
-                corruptions_to_apply[corruption_key] = []
-            corruptions_to_apply[corruption_key].append(
-                (row["audio_file_path"], row["output_file_path"])
+            if row["corruption_type"] not in corruptions_per_type:
+                corruptions_per_type[row["corruption_type"]] = [0, set()]
+            corruptions_per_type[row["corruption_type"]][0] += 1
+            if len(corruptions_per_type[row["corruption_type"]][1]) < MAX_COUNTED_CONFIGS:
+                corruptions_per_type[row["corruption_type"]][1].add(corr_metadata)
+            yield tuple(row[header] for header in REQUIRED_HEADERS)
+
+
+def write_sorted_run(rows, run_file_path):
+    """
+    Sort rows by input audio file (keeping the order of the rows of every file) and write them to a temporary run.
+
+    Args:
+        rows (list): List of rows, as yielded by `read_csv_rows`
+        run_file_path (str): Path of the run file
+    """
+    with open(run_file_path, "w", newline="") as run_file:
+        csv.writer(run_file).writerows(sorted(rows, key=itemgetter(0)))
+
+
+def read_sorted_run(run_file_path):
+    """
+    Read the rows of a temporary run written by `write_sorted_run`.
+    """
+    with open(run_file_path, "r", newline="") as run_file:
+        for row in csv.reader(run_file):
+            yield tuple(row)
+
+
+def sort_csv_rows(csv_file_path, memory_budget_mb, temp_dir, corruptions_per_type):
+    """
+    Read the CSV in chunks that fit in the memory budget, and sort every chunk by input audio file. Every chunk but the
+    last one is spilled to a sorted run in a temporary directory, so that only one chunk is held in memory.
+
+    Args:
+        csv_file_path (str): Path to the CSV file containing corruption specifications
+        memory_budget_mb (float): Memory budget of the rows held in memory, in MB
+        temp_dir (str): Directory of the temporary runs
+        corruptions_per_type (dict): Updated with the statistics of every corruption type (see `read_csv_rows`)
+    Returns:
+        list: The sorted runs, iterables of rows (see `read_csv_rows`) to merge
+    """
+    memory_budget = memory_budget_mb * 1024 ** 2
+    runs = []
+    chunk, chunk_size = [], 0
+    for row in read_csv_rows(csv_file_path, corruptions_per_type):
+        chunk.append(row)
+        chunk_size += ROW_OVERHEAD_BYTES + sum(len(value) for value in row)
+        if chunk_size > memory_budget:
+            run_file_path = os.path.join(temp_dir, f"run_{len(runs)}.csv")
+            write_sorted_run(chunk, run_file_path)
+            runs.append(read_sorted_run(run_file_path))
+            chunk, chunk_size = [], 0
+
+    if runs:
+        print(f"Spilled the rows of the CSV to {len(runs)} sorted runs in {temp_dir}")
+    runs.append(sorted(chunk, key=itemgetter(0)))
+    return runs
+
+
+def group_sorted_rows(rows):
+    """
+    Group the rows sorted by input audio file.
+
+    Args:
+        rows (iterable): Rows sorted by input audio file (see `read_csv_rows`)
+    Yields:
+        tuple: (audio_file_path, list of (corruption_type, corruption_metadata, output_file_path)), with the corruption
+            metadata parsed (see `parse_corruption_metadata`)
+    """
+    for audio_file_path, file_rows in itertools.groupby(rows, key=itemgetter(0)):
+        yield audio_file_path, [
+            (corruption_type, parse_corruption_metadata(corruption_metadata), output_file_path)
+            for _, corruption_type, corruption_metadata, output_file_path in file_rows
+        ]
+
+
+def apply_corruption_from_csv(
+    csv_file_path,
+    force=False,
+    seed=None,
+    cache_dir=None,
+    cache_size_gb=10.0,
+    workers=1,
+    max_corruptions=16,
+    memory_budget_mb=None,
+    applied_noise_file_path=None,
+    thread_budget=None,
+):
+    """
+    Apply corruptions to audio files based on specifications in a CSV file.
+
+    The rows are grouped by input audio file, so that every input file is decoded once and all of its corruptions
+    are applied from the decoded audio.
+
+    With a memory budget, the CSV is streamed: it is read in chunks that fit in the budget, sorted by input audio file
+    and spilled to temporary runs, which are then merged, so that the rows of every input file are grouped without
+    holding the whole CSV in memory. The input files are then corrupted in the order of their paths, as the merge
+    yields them.
+
+    Args:
+        csv_file_path (str): Path to the CSV file containing corruption specifications
+        force (bool): Force overwrite output files if they already exist
+        seed (int): If given, every row is corrupted with its own seed derived from this one, its input file, its
+            corruption and the number of identical rows before it (see `derive_row_seed`)
+        cache_dir (str): Optional directory of a cache of corrupted files, shared across runs
+        cache_size_gb (float): Maximum size of the cache in GB
+        workers (int): Number of workers, the longest input files with the most corruptions go first (unless the CSV
+            is streamed). The executor is picked from the capabilities declared by the corruptions (see
+            `scheduling.choose_strategy`), or "auto" for one per thread of the budget
+        max_corruptions (int): Maximum number of corruption instances kept by every worker
+        memory_budget_mb (float): If given, stream the CSV with this memory budget in MB for the rows held in memory
+        applied_noise_file_path (str): If given, the applied noise of every corrupted file is appended to this CSV
+            file as soon as the file is written, instead of being returned
+        thread_budget (int): Number of threads of the run, shared by the workers and their native thread pools, all
+            the CPUs available if None
+    Returns:
+        dict: Dictionary mapping the corrupted audio file paths to the paths of applied noise files (for applicable
+            corruptions), empty if they are written to applied_noise_file_path
+    """
+
+    workers = resolve_workers(workers, thread_budget)
+    if (cache_dir is not None or workers > 1) and seed is None:
+        seed = DEFAULT_SEED
+        print(f"Caching and parallel corruption require every row to be corrupted with its own seed, using seed {seed}")
+
+    cache = None
+    if cache_dir is not None:
+        cache = CorruptionCache(cache_dir, cache_size_gb)
+
+    corruptions_per_type = {}
+    temp_dir = None
+    if memory_budget_mb is None:
+        # Read the CSV file containing per-file corruption specifications
+        rows_per_input = {}
+        for audio_file_path, corruption_type, corruption_metadata, output_file_path in read_csv_rows(
+            csv_file_path, corruptions_per_type
+        ):
+            if audio_file_path not in rows_per_input:
+                rows_per_input[audio_file_path] = []
+            rows_per_input[audio_file_path].append(
+                (corruption_type, parse_corruption_metadata(corruption_metadata), output_file_path)
             )
-            corruption_types.add(row["corruption_type"])
+        tasks = list(rows_per_input.items())
+        num_tasks = len(tasks)
+    else:
+        temp_dir = tempfile.TemporaryDirectory(prefix="robuser_csv_runs_")
+        runs = sort_csv_rows(csv_file_path, memory_budget_mb, temp_dir.name, corruptions_per_type)
+        tasks = group_sorted_rows(heapq.merge(*runs, key=itemgetter(0)))
+        # The number of input files is only known once the runs are merged, the number of rows bounds it
+        num_tasks = None
 
-    applied_noise_paths = {}
     # Print the number of audio files for each corruption type
-    for corruption_type in corruption_types:
-        len_audio_files = 0
-        len_corruptions = 0
-        for corruption_key, audio_files in corruptions_to_apply.items():
-            if corruption_key[0] == corruption_type:
-                len_audio_files += len(audio_files)
-                len_corruptions += 1
-        print(f"Number of audio files for {corruption_type}: {len_audio_files}, {len_corruptions} unique corruption configurations")
+    for corruption_type, (len_audio_files, corruption_configs) in corruptions_per_type.items():
+        print(f"Number of audio files for {corruption_type}: {len_audio_files}, {len(corruption_configs)} unique corruption configurations")
+    if num_tasks is not None:
+        print(f"Number of input audio files: {num_tasks}")
+    num_rows = sum(len_audio_files for len_audio_files, _ in corruptions_per_type.values())
 
     # Apply the corruptions
-    for (corruption_type, corruption_metadata), audio_files in tqdm(
-        corruptions_to_apply.items(), desc="Applying corruptions"
-    ):
-        corruption_class = get_corruption(corruption_type)
-        corruption = corruption_class(corruption_metadata)
+    strategy = choose_strategy(
+        [get_corruption(corruption_type) for corruption_type in corruptions_per_type],
+        workers,
+        num_rows if num_tasks is None else num_tasks,
+        thread_budget,
+    )
+    print(f"Corrupting the files on {describe_strategy(strategy)}")
+    if strategy.executor != "serial" and num_tasks is None:
+        results = run_streaming(
+            corrupt_input_file_in_worker,
+            tasks,
+            strategy.workers,
+            initializer=init_worker,
+            initargs=(max_corruptions, force, seed, cache),
+            executor=strategy.executor,
+            batch_size=strategy.batch_size,
+            threads_per_worker=strategy.threads_per_worker,
+        )
+    elif strategy.executor != "serial":
+        costs = []
+        for audio_file_path, rows in tasks:
+            sample_rate, frames, _ = probe_audio_file(audio_file_path)
+            cost_models = [get_corruption_cost_model(corruption_type) for corruption_type, _, _ in rows]
+            costs.append(estimate_costs([frames / sample_rate], cost_models, len(rows))[0])
+        results = run_longest_first(
+            corrupt_input_file_in_worker,
+            tasks,
+            costs,
+            strategy.workers,
+            initializer=init_worker,
+            initargs=(max_corruptions, force, seed, cache),
+            executor=strategy.executor,
+            batch_size=strategy.batch_size,
+            threads_per_worker=strategy.threads_per_worker,
+        )
+    else:
+        results = corrupt_input_files_serially(
+            tasks, max_corruptions, force, seed, cache, strategy.threads_per_worker
+        )
 
-        for audio_file_path, output_file_path in tqdm(audio_files, desc=f"Applying {corruption_type}"):
-            # Check if output file already exists
-            if os.path.exists(output_file_path) and not force:
-                print(
-                    f"Warning: Output file already exists: {output_file_path}. Use --force to overwrite. Skipping."
-                )
-                continue
-            # Create output directory if it doesn't exist
-            os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
-
-            # Apply the corruption
-            try:
-                # Load the audio file
-                audio, sr = librosa.load(audio_file_path, sr=None)
-                augmented_audio, applied_noise_path = corruption.run(audio, sr)
-                sf.write(output_file_path, augmented_audio, sr)
-                applied_noise_paths[output_file_path] = applied_noise_path
-            except Exception as e:
-                print(
-                    f"Error applying corruption to {audio_file_path}: {e}. Skipping this file."
-                )
-                continue
+    applied_noise_paths = {}
+    applied_noise_file = None
+    try:
+        if applied_noise_file_path is not None:
+            # Line buffered, so that the results of an interrupted run are kept
+            applied_noise_file = open(applied_noise_file_path, "w", newline="", buffering=1)
+            applied_noise_writer = csv.writer(applied_noise_file)
+            applied_noise_writer.writerow(["audio_file_path", "applied_noise_path"])
+
+        for file_applied_noise_paths in tqdm(results, total=num_tasks, desc="Applying corruptions"):
+            if applied_noise_file is not None:
+                applied_noise_writer.writerows(file_applied_noise_paths)
+            else:
+                applied_noise_paths.update(file_applied_noise_paths)
+    finally:
+        if applied_noise_file is not None:
+            applied_noise_file.close()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    if strategy.executor != "process":
+        if cache is not None:
+            print(cache.get_summary())
+        ffmpeg_summary = pop_ffmpeg_summary()
+        if ffmpeg_summary is not None:
+            print(ffmpeg_summary)
 
     return applied_noise_paths
 
+
+def get_applied_noise_file_path(csv_file_path):
+    """
+    Returns the path of the CSV with the applied noise of a streamed CSV specification, next to it.
+    """
+    return os.path.splitext(csv_file_path)[0] + "_applied_noise_paths.csv"
+
+
 def parse_arguments():
     """
     Parse command line arguments.
@@ -160,6 +541,67 @@ Example corruption_metadata for different types:
         action="store_true",
         help="Force overwrite output files if they already exist",
     )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=parse_workers,
+        default=1,
+        help="Number of worker processes or threads (implies --seed 42 if no seed is given), or 'auto' for one per "
+        "thread of the budget",
+    )
+
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Number of threads of the run, shared by the workers and the native thread pools (BLAS, OpenMP) of "
+        "every worker (default: all the CPUs)",
+    )
+
+    parser.add_argument(
+        "--max_corruptions",
+        type=int,
+        default=16,
+        help="Maximum number of corruption instances (e.g. loaded noise or impulse response datasets) kept per worker",
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Corrupt every row with its own seed, derived from this seed, the input file, the corruption and the number "
+        "of identical rows before it",
+    )
+
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="Directory of a cache of corrupted files, reused across runs (implies --seed 42 if no seed is given)",
+    )
+
+    parser.add_argument(
+        "--cache_size",
+        type=float,
+        default=10.0,
+        help="Maximum size of the cache in GB, the least recently used files are evicted above it",
+    )
+
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Stream the CSV in chunks sorted by input file, spilled to temporary runs above the memory budget, and "
+        "append the applied noise of every file to <input>_applied_noise_paths.csv, next to the CSV, as soon as it is "
+        "written",
+    )
+
+    parser.add_argument(
+        "--memory_budget",
+        type=float,
+        default=DEFAULT_MEMORY_BUDGET_MB,
+        help="Memory budget in MB of the rows of the CSV held in memory with --streaming",
+    )
     return parser.parse_args()
 
 
@@ -170,13 +612,27 @@ def main():
     if not os.path.exists(args.input):
         raise FileNotFoundError(f"CSV file not found: {args.input}")
 
-    applied_noise_paths = apply_corruption_from_csv(args.input, args.force)
-    output_file = "applied_noise_paths.csv"
-    with open(output_file, "w") as f:
-        writer = csv.writer(f)
-        writer.writerow(["audio_file_path", "applied_noise_path"])
-        for audio_file_path, applied_noise_path in applied_noise_paths.items():
-            writer.writerow([audio_file_path, applied_noise_path])
+    # When streaming, the applied noise of every file is written next to the CSV as soon as the file is corrupted
+    output_file = get_applied_noise_file_path(args.input) if args.streaming else None
+    applied_noise_paths = apply_corruption_from_csv(
+        args.input,
+        args.force,
+        seed=args.seed,
+        cache_dir=args.cache_dir,
+        cache_size_gb=args.cache_size,
+        workers=args.workers,
+        max_corruptions=args.max_corruptions,
+        memory_budget_mb=args.memory_budget if args.streaming else None,
+        applied_noise_file_path=output_file,
+        thread_budget=args.threads,
+    )
+    if output_file is None:
+        output_file = "applied_noise_paths.csv"
+        with open(output_file, "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(["audio_file_path", "applied_noise_path"])
+            for audio_file_path, applied_noise_path in applied_noise_paths.items():
+                writer.writerow([audio_file_path, applied_noise_path])
     print(f"CSV with the applied noise paths saved to {output_file}")
     print("Corruption application completed!")
 
@@ -0,0 +1,306 @@
+"""
+Dry run of the corruptions of a dataset, estimating the runtime, disk space and memory they need without writing any
+corrupted file.
+"""
+
+import io
+import os
+import shutil
+import time
+import tracemalloc
+
+import numpy as np
+import soundfile as sf
+import tabulate
+
+from robuser.corruptions.chain import ChainExecutor
+from robuser.corruptions.get_corruption import get_corruption
+from robuser.corruptions.sweep import SeveritySweep
+from robuser.corruptions.utils import derive_seed, get_supported_audio_extensions
+from robuser.dataset_corruption.scheduling import choose_strategy, describe_strategy
+from robuser.parsing.manifest import MANIFEST_FILENAME
+
+# Size of the header of the corrupted wav files
+WAV_HEADER_BYTES = 44
+# The corrupted files are written as mono 16-bit PCM (the default subtype of soundfile for wav)
+BYTES_PER_SAMPLE = 2
+
+
+def get_copy_payload(original_dataset_path):
+    """
+    Computes the size of the files that `copy_dataset` copies to every corrupted dataset.
+
+    Args:
+        original_dataset_path (str): path to the original dataset
+
+    Returns:
+        int: size in bytes of the non-audio files of the dataset
+    """
+    ignore_extensions = list(get_supported_audio_extensions())
+    payload = 0
+    for root, _, files in os.walk(original_dataset_path):
+        for file in files:
+            if file == MANIFEST_FILENAME:
+                continue
+            if not any([file.endswith(extension) for extension in ignore_extensions]):
+                payload += os.path.getsize(os.path.join(root, file))
+    return payload
+
+
+def select_sample_files(file_paths, durations, num_samples):
+    """
+    Selects files spread over the range of durations of the dataset, from the shortest to the longest one.
+
+    Args:
+        file_paths (list): paths to the audio files
+        durations (np.array): durations of the files in seconds
+        num_samples (int): number of files to select
+
+    Returns:
+        list: indices of the selected files
+    """
+    order = np.argsort(durations, kind="stable")
+    positions = np.linspace(0, len(order) - 1, min(num_samples, len(order)))
+    return sorted(set(order[np.round(positions).astype(int)].tolist()))
+
+
+def fit_linear(durations, values):
+    """
+    Fits values = fixed + per_second * duration, e.g. the time or memory needed to corrupt a file.
+
+    Args:
+        durations (list): durations of the files in seconds
+        values (list): measured values
+
+    Returns:
+        tuple: (fixed, per_second), both non-negative
+    """
+    durations, values = np.asarray(durations, dtype=np.float64), np.asarray(values, dtype=np.float64)
+    if len(durations) < 2 or np.ptp(durations) == 0:
+        return 0.0, float(values.sum() / max(durations.sum(), 1e-9))
+
+    per_second, fixed = np.polyfit(durations, values, 1)
+    if fixed < 0:
+        return 0.0, float(values.sum() / durations.sum())
+    if per_second < 0:
+        return float(values.mean()), 0.0
+    return float(fixed), float(per_second)
+
+
+def benchmark_corruption(corruption, sample_files, original_dataset_path, seed):
+    """
+    Times the corruption of the sample files, including decoding and encoding them in memory,
+    and measures the peak memory allocated while corrupting each file.
+
+    Args:
+        corruption: object whose `run_all` method returns one (audio, applied noise) tuple per output dataset
+        sample_files (list): paths to the sample files
+        original_dataset_path (str): path to the original dataset
+        seed (int): seed of the run, every file is corrupted with its own seed derived from it
+
+    Returns:
+        tuple: lists of the durations (s), run times (s) and peak memory (bytes) of the sample files
+    """
+    import librosa
+
+    durations, run_times, peak_memories = [], [], []
+    # Warm up (e.g. lazy imports and caches), so that it does not count in the timings
+    audio, sr = librosa.load(sample_files[0], sr=None)
+    corruption.run_all(audio, sr)
+
+    for file_path in sample_files:
+        relative_path = os.path.relpath(file_path, original_dataset_path)
+        tracemalloc.start()
+        start = time.perf_counter()
+
+        audio, sr = librosa.load(file_path, sr=None)
+        corruption.reseed(derive_seed(seed, relative_path))
+        for augmented_audio, _ in corruption.run_all(audio, sr):
+            sf.write(io.BytesIO(), augmented_audio, sr, format="WAV")
+
+        run_times.append(time.perf_counter() - start)
+        peak_memories.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        durations.append(len(audio) / sr)
+
+    return durations, run_times, peak_memories
+
+
+def estimate_output_bytes(manifest, num_outputs):
+    """
+    Estimates the size of the corrupted audio files of one output dataset, written as mono 16-bit PCM wav files.
+
+    Args:
+        manifest (DatasetManifest): the manifest of the original dataset
+        num_outputs (int): number of corrupted datasets
+
+    Returns:
+        int: size in bytes of the corrupted audio files of all the outputs
+    """
+    frames = manifest.columns["frames"].astype(np.int64)
+    return num_outputs * int((WAV_HEADER_BYTES + frames * BYTES_PER_SAMPLE).sum())
+
+
+def format_bytes(num_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+
+def format_duration(seconds):
+    hours, remainder = divmod(int(round(seconds)), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s"
+
+
+def get_runners(corruptions_list):
+    """
+    Builds the runner of every corruption run, as `corrupt` runs them: one per single corruption, one per severity
+    sweep and one for all the chains.
+
+    Args:
+        corruptions_list (list): output of `parse_config`
+
+    Returns:
+        list of tuples: (description, function building the runner, list of [corruption_type, corruption_config]
+                        outputs)
+    """
+    runners = []
+    chains_list = []
+    for corruption_type, corruption_config in corruptions_list:
+        if corruption_type == "chain":
+            chains_list.append([corruption_type, corruption_config])
+        elif corruption_type == "sweep":
+            sweep_type, sweep_configs = corruption_config["corruption_type"], corruption_config["configs"]
+            runners.append(
+                (
+                    f"{sweep_type} sweep ({len(sweep_configs)} severities)",
+                    lambda sweep_type=sweep_type, sweep_configs=sweep_configs: SeveritySweep(sweep_type, sweep_configs),
+                    [[sweep_type, config] for config in sweep_configs],
+                )
+            )
+        else:
+            runners.append(
+                (
+                    f"{corruption_type} {corruption_config}",
+                    lambda corruption_type=corruption_type, corruption_config=corruption_config: get_corruption(
+                        corruption_type
+                    )(corruption_config),
+                    [[corruption_type, corruption_config]],
+                )
+            )
+
+    if chains_list:
+        runners.append(
+            (
+                f"{len(chains_list)} corruption chains",
+                lambda: ChainExecutor([chain_config["steps"] for _, chain_config in chains_list]),
+                chains_list,
+            )
+        )
+    return runners
+
+
+def plan_corruptions(
+    manifest,
+    original_dataset_path,
+    corrupted_datasets_path,
+    corruptions_list,
+    workers=1,
+    skip_copy=False,
+    seed=None,
+    num_samples=5,
+    thread_budget=None,
+):
+    """
+    Estimates the wall time, output size and peak memory per worker of every corruption run, by timing the
+    corruption of a few sample files spread over the durations of the dataset. Nothing is written to the output path.
+
+    Args:
+        manifest (DatasetManifest): the manifest of the original dataset
+        original_dataset_path (str): path to the original dataset
+        corrupted_datasets_path (str): path where the corrupted datasets would be saved
+        corruptions_list (list): output of `parse_config`
+        workers (int): number of worker processes of the run
+        skip_copy (bool): whether the original dataset would not be copied to the corrupted datasets
+        seed (int): seed of the run
+        num_samples (int): number of sample files to benchmark every corruption on
+        thread_budget (int): number of threads of the run (see `scheduling.choose_strategy`)
+
+    Returns:
+        list of dicts: the estimates of every corruption run
+    """
+    if len(manifest) == 0:
+        raise ValueError(f"No audio files found in {original_dataset_path}")
+
+    file_paths = manifest.file_paths
+    durations = manifest.durations
+    sample_indices = select_sample_files(file_paths, durations, num_samples)
+    sample_files = [file_paths[i] for i in sample_indices]
+    copy_payload = 0 if skip_copy else get_copy_payload(original_dataset_path)
+    print(
+        f"Dataset: {len(file_paths)} files, {format_duration(durations.sum())} of audio, "
+        f"benchmarking on {len(sample_files)} files from {durations.min():.1f}s to {durations.max():.1f}s"
+    )
+
+    plans = []
+    for description, build_runner, outputs in get_runners(corruptions_list):
+        start = time.perf_counter()
+        corruption = build_runner()
+        setup_time = time.perf_counter() - start
+        strategy = choose_strategy(corruption.corruption_classes, workers, len(file_paths), thread_budget)
+
+        sample_durations, run_times, peak_memories = benchmark_corruption(
+            corruption, sample_files, original_dataset_path, seed
+        )
+        fixed_time, time_per_second = fit_linear(sample_durations, run_times)
+        fixed_memory, memory_per_second = fit_linear(sample_durations, peak_memories)
+
+        file_times = fixed_time + time_per_second * durations
+        # The longest file bounds the makespan, however many workers there are
+        wall_time = setup_time + max(file_times.sum() / strategy.workers, file_times.max())
+        plans.append(
+            {
+                "corruption": description,
+                "outputs": len(outputs),
+                "strategy": describe_strategy(strategy),
+                "wall_time": wall_time,
+                "output_bytes": estimate_output_bytes(manifest, len(outputs)) + len(outputs) * copy_payload,
+                "peak_memory": fixed_memory + memory_per_second * durations.max(),
+            }
+        )
+
+    print(
+        tabulate.tabulate(
+            [
+                [
+                    plan["corruption"],
+                    plan["outputs"],
+                    plan["strategy"],
+                    format_duration(plan["wall_time"]),
+                    format_bytes(plan["output_bytes"]),
+                    format_bytes(plan["peak_memory"]),
+                ]
+                for plan in plans
+            ],
+            headers=["Corruption", "Datasets", "Strategy", "Wall time", "Output size", "Peak memory/worker"],
+        )
+    )
+
+    total_bytes = sum(plan["output_bytes"] for plan in plans)
+    print("---")
+    print(f"Total wall time: {format_duration(sum(plan['wall_time'] for plan in plans))}")
+    print(f"Total output size: {format_bytes(total_bytes)} (of which {format_bytes(copy_payload)} copied per dataset)")
+
+    # The output path may not exist yet, check the disk of its closest existing parent
+    disk_path = os.path.abspath(corrupted_datasets_path)
+    while not os.path.exists(disk_path):
+        disk_path = os.path.dirname(disk_path)
+    free_bytes = shutil.disk_usage(disk_path).free
+    print(f"Free disk space at {disk_path}: {format_bytes(free_bytes)}")
+    if total_bytes > free_bytes:
+        print("Warning: the corrupted datasets do not fit in the free disk space")
+
+    return plans
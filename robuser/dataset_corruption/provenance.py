@@ -0,0 +1,320 @@
+"""
+Provenance of the corrupted datasets: the recipe of every corrupted file, from which it can be regenerated.
+
+Every corrupted dataset gets a robuser_provenance.jsonl file. Its first line is the recipe shared by all the files
+(the original dataset, the corruption and its configuration, the seed of the run), and each following line is the
+recipe of one file (its path, its seed and the details reported by the corruption, e.g. the noise file, the position
+of the noise segment and the applied SNR). The lines are appended while the dataset is corrupted, so that an
+interrupted run keeps the provenance of the files written so far.
+
+The recipes take a few hundred bytes per file, so they can be archived instead of the corrupted audio and the files
+regenerated on demand from the original dataset:
+python3 -m robuser.dataset_corruption.provenance -p robuser_provenance.jsonl -o <corrupted dataset>
+"""
+
+import argparse
+import json
+import os
+import warnings
+
+import yaml
+
+import robuser
+from robuser.corruptions.utils import to_json_value
+
+PROVENANCE_FILENAME = "robuser_provenance.jsonl"
+# Version of the format of the provenance files
+PROVENANCE_VERSION = 1
+
+
+def make_corruption_recipe(corruption_type, corruption_config):
+    """
+    Returns the recipe of a single corruption, with one output per file.
+    """
+    return {"type": "corruption", "corruption_type": corruption_type, "corruption_config": corruption_config}
+
+
+def make_sweep_recipe(corruption_type, corruption_configs):
+    """
+    Returns the recipe of a severity sweep, with one output per severity.
+    """
+    return {"type": "sweep", "corruption_type": corruption_type, "corruption_configs": corruption_configs}
+
+
+def make_chains_recipe(chains):
+    """
+    Returns the recipe of a set of corruption chains, with one output per chain.
+    """
+    return {"type": "chains", "chains": chains}
+
+
+def build_corruption(recipe):
+    """
+    Creates the corruption of a recipe.
+
+    Args:
+        recipe (dict): recipe of the corruption (see `make_corruption_recipe`, `make_sweep_recipe` and
+                       `make_chains_recipe`)
+
+    Returns:
+        object whose `run_all` method returns one (audio, applied noise) tuple per output, and whose `run_output`
+        method returns the tuple of a single output
+    """
+    if recipe["type"] == "corruption":
+        from robuser.corruptions.get_corruption import get_corruption
+
+        return get_corruption(recipe["corruption_type"])(recipe["corruption_config"])
+    if recipe["type"] == "sweep":
+        from robuser.corruptions.sweep import SeveritySweep
+
+        return SeveritySweep(recipe["corruption_type"], recipe["corruption_configs"])
+    if recipe["type"] == "chains":
+        from robuser.corruptions.chain import ChainExecutor
+
+        return ChainExecutor(recipe["chains"])
+    raise ValueError(f"Unknown corruption recipe type: {recipe['type']}")
+
+
+class ProvenanceWriter:
+    """
+    Appends the recipes of the corrupted files of a dataset to its provenance file, one line per file, flushing every
+    line so that the provenance survives an interrupted run.
+    """
+
+    def __init__(self, corrupted_dataset_path, header):
+        """
+        Initialize the ProvenanceWriter class, writing the header of the provenance file
+
+        Args:
+            corrupted_dataset_path (str): path to the corrupted dataset
+            header (dict): recipe shared by all the files (see `make_header`)
+        """
+        self.path = os.path.join(corrupted_dataset_path, PROVENANCE_FILENAME)
+        os.makedirs(corrupted_dataset_path, exist_ok=True)
+        self.file = open(self.path, "w", buffering=1)
+        self.write(header)
+
+    def write(self, record):
+        self.file.write(json.dumps(record, default=to_json_value) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+def make_header(original_dataset_path, recipe, output_index, output_config, seed, deterministic):
+    """
+    Returns the header of the provenance file of a corrupted dataset.
+
+    Args:
+        original_dataset_path (str): path to the original dataset
+        recipe (dict): recipe of the corruption that produced the dataset, among its other outputs
+        output_index (int): index of the dataset among the outputs of the corruption
+        output_config (list): [corruption_type, corruption_config] of the dataset
+        seed (int): seed of the run (None if the files were not corrupted with their own seeds)
+        deterministic (bool): whether the outputs of the corruption are reproducible from their seeds
+
+    Returns:
+        dict: the header
+    """
+    return {
+        "provenance_version": PROVENANCE_VERSION,
+        "robuser_version": robuser.__version__,
+        "original_dataset_path": os.path.abspath(original_dataset_path),
+        "corruption_type": output_config[0],
+        "corruption_config": output_config[1],
+        "recipe": recipe,
+        "output_index": output_index,
+        "seed": seed,
+        "deterministic": deterministic,
+    }
+
+
+def read_provenance(provenance_path):
+    """
+    Reads a provenance file.
+
+    Args:
+        provenance_path (str): path to the provenance file (or to the corrupted dataset that contains it)
+
+    Returns:
+        tuple: (header, dict mapping the relative path of every corrupted file to its record)
+    """
+    if os.path.isdir(provenance_path):
+        provenance_path = os.path.join(provenance_path, PROVENANCE_FILENAME)
+
+    with open(provenance_path, "r") as file:
+        header = json.loads(file.readline())
+        if header.get("provenance_version") != PROVENANCE_VERSION:
+            raise ValueError(f"Unsupported provenance file: {provenance_path}")
+
+        records = {}
+        for line in file:
+            # The last line of an interrupted run may be incomplete
+            if not line.endswith("\n"):
+                break
+            record = json.loads(line)
+            records[record["file"]] = record
+
+    return header, records
+
+
+def check_regenerable(header):
+    """
+    Checks that the files of a provenance file can be regenerated from their recipes.
+    """
+    if header["recipe"] is None:
+        raise ValueError("The provenance has no recipe of the corruption, its files cannot be regenerated")
+    if header["seed"] is None:
+        raise ValueError(
+            "The dataset was corrupted without a seed, so its files depend on the files corrupted before them and "
+            "cannot be regenerated one by one. Corrupt it with --seed to regenerate it."
+        )
+    if not header["deterministic"]:
+        raise ValueError(f"The '{header['corruption_type']}' corruption is not reproducible from a seed")
+    if header["robuser_version"] != robuser.__version__:
+        warnings.warn(
+            f"The dataset was corrupted with robuser {header['robuser_version']}, the regenerated files may differ"
+        )
+
+
+def regenerate_file(header, record, corruption=None, original_dataset_path=None):
+    """
+    Regenerates a corrupted file from its recipe. Only the output of the dataset is computed, and the assignment
+    recorded in the details of the file (e.g. its noise file and the position of the noise segment) is applied again,
+    whatever the external files listed now. The details of the regenerated file must match the recorded ones.
+
+    Args:
+        header (dict): header of the provenance file
+        record (dict): record of the file in the provenance file
+        corruption: the corruption built from the recipe of the header, created if not given (e.g. to reuse it for
+                    several files)
+        original_dataset_path (str): path to the original dataset, if it moved since the dataset was corrupted
+
+    Returns:
+        tuple: (corrupted audio, sample rate)
+    """
+    import librosa
+
+    check_regenerable(header)
+    if corruption is None:
+        corruption = build_corruption(header["recipe"])
+    if original_dataset_path is None:
+        original_dataset_path = header["original_dataset_path"]
+
+    audio, sr = librosa.load(os.path.join(original_dataset_path, record["file"]), sr=None)
+    corruption.reseed(record["seed"])
+    augmented_audio, _ = corruption.run_output(audio, sr, header["output_index"], record["details"])
+    # The details went through JSON in the provenance
+    details = json.loads(json.dumps(corruption.get_details()[0], default=to_json_value))
+    if details != record["details"]:
+        raise ValueError(
+            f"The regenerated {record['file']} does not match its provenance: its details are {details} instead of "
+            f"{record['details']}"
+        )
+    return augmented_audio, sr
+
+
+def regenerate(provenance_path, corrupted_dataset_path, files=None, original_dataset_path=None, force=False,
+               skip_copy=False):
+    """
+    Regenerates a corrupted dataset (or some of its files) from its provenance file.
+
+    Args:
+        provenance_path (str): path to the provenance file (or to the corrupted dataset that contains it)
+        corrupted_dataset_path (str): path where the corrupted files are written
+        files (list): relative paths of the files to regenerate, all the files of the provenance if not given
+        original_dataset_path (str): path to the original dataset, if it moved since the dataset was corrupted
+        force (bool): overwrite the corrupted files that already exist
+        skip_copy (bool): skip copying the non-audio files of the original dataset, when regenerating all the files
+
+    Returns:
+        list: paths of the regenerated files
+    """
+    import soundfile as sf
+    from tqdm import tqdm
+
+    header, records = read_provenance(provenance_path)
+    check_regenerable(header)
+    if original_dataset_path is None:
+        original_dataset_path = header["original_dataset_path"]
+
+    if files is None:
+        files = list(records)
+        if not skip_copy:
+            from robuser.dataset_corruption.corrupt_dataset import copy_dataset
+
+            copy_dataset(original_dataset_path, corrupted_dataset_path)
+        # The configuration of the dataset, as written by the corruption scripts
+        os.makedirs(corrupted_dataset_path, exist_ok=True)
+        with open(os.path.join(corrupted_dataset_path, "robuser_config.yaml"), "w") as file_:
+            yaml.dump(header["corruption_config"], file_)
+    missing_files = [file for file in files if file not in records]
+    if missing_files:
+        raise ValueError(f"{len(missing_files)} files are not in the provenance, e.g. {missing_files[0]}")
+
+    corruption = build_corruption(header["recipe"])
+    output_file_paths = []
+    for file in tqdm(files, desc=f"Regenerating the '{header['corruption_type']}' corruption"):
+        output_file_path = os.path.join(corrupted_dataset_path, file)
+        if os.path.exists(output_file_path) and not force:
+            raise FileExistsError(f"{output_file_path} already exists. Use --force to overwrite it.")
+
+        augmented_audio, sr = regenerate_file(header, records[file], corruption, original_dataset_path)
+        os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+        sf.write(output_file_path, augmented_audio, sr)
+        output_file_paths.append(output_file_path)
+
+    return output_file_paths
+
+
+def parse_arguments():
+    """!
+    @brief Parse Arguments for regenerating a corrupted dataset from its provenance.
+    """
+    args_parser = argparse.ArgumentParser(description="Regenerate a corrupted dataset from its provenance")
+    args_parser.add_argument(
+        "-p", "--provenance", required=True, help=f"Path to the provenance file ({PROVENANCE_FILENAME})"
+    )
+    args_parser.add_argument(
+        "-o", "--output", required=True, help="Path where the corrupted dataset is regenerated"
+    )
+    args_parser.add_argument(
+        "-i",
+        "--input",
+        default=None,
+        help="Path of the original dataset (default: the path recorded in the provenance)",
+    )
+    args_parser.add_argument(
+        "--files",
+        nargs="+",
+        default=None,
+        help="Relative paths of the files to regenerate (default: all the files of the provenance)",
+    )
+    args_parser.add_argument(
+        "-f", "--force", action="store_true", help="Overwrite the corrupted files that already exist"
+    )
+    args_parser.add_argument(
+        "-s",
+        "--skip_copy",
+        action="store_true",
+        help="Skip copying the non-audio files of the original dataset",
+    )
+    return args_parser.parse_args()
+
+
+def main():
+    """Main entry point for the console script"""
+    args = parse_arguments()
+    output_file_paths = regenerate(
+        args.provenance,
+        args.output,
+        files=args.files,
+        original_dataset_path=args.input,
+        force=args.force,
+        skip_copy=args.skip_copy,
+    )
+    print(f"Regenerated {len(output_file_paths)} files in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+"""
+Quality checks of corrupted datasets against their original dataset. For every corrupted file it measures the
+achieved SNR, the ratio of clipped samples, the peak and RMS, whether it has NaN (or infinite) samples, whether it is
+silent and whether its duration matches the original file. The files are read once per batch, the clean file being
+shared by all the corrupted datasets, and the measures are computed on whole batches at once.
+
+Example usage:
+    python -m robuser.dataset_corruption.qa -i /path/to/IEMOCAP/ -c /path/to/corrupted_datasets/ -o qa_report.npz
+"""
+
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+import soundfile as sf
+import tabulate
+import yaml
+
+from robuser.corruptions.native_threads import get_thread_budget
+from robuser.dataset_corruption.scheduling import run_longest_first
+from robuser.parsing.manifest import build_manifest
+
+# Absolute value from which a sample is at full scale: the full scale of the PCM files written by the corruptions. Only
+# the runs of at least CLIP_RUN consecutive samples at full scale count as clipped, as the corruptions that normalize
+# their output (e.g. content) put its peak at full scale
+CLIP_THRESHOLD = 0.999
+CLIP_RUN = 2
+# RMS (in dBFS) under which a file counts as silent
+SILENCE_DB = -60.0
+# Tolerance (in dB) between the achieved SNR and the SNR of the configuration
+SNR_TOLERANCE_DB = 1.0
+# Number of clean samples read per batch
+BATCH_FRAMES = 16000 * 600
+
+# Columns of the report, one entry per (corrupted dataset, file) pair
+REPORT_COLUMNS = (
+    "dataset",
+    "relative_path",
+    "missing",
+    "snr_db",
+    "clipped_ratio",
+    "peak",
+    "rms_db",
+    "nonfinite",
+    "silent",
+    "duration_match",
+    "expected_snr_db",
+)
+
+
+def find_corrupted_datasets(corrupted_datasets_path):
+    """
+    Finds the corrupted datasets, i.e. the directories with a `robuser_config.yaml` file.
+
+    Args:
+        corrupted_datasets_path (str): path to a corrupted dataset, or to a directory of corrupted datasets
+
+    Returns:
+        list: the paths to the corrupted datasets, sorted by name
+    """
+    if os.path.isfile(os.path.join(corrupted_datasets_path, "robuser_config.yaml")):
+        return [corrupted_datasets_path]
+
+    corrupted_dataset_paths = sorted(
+        os.path.join(corrupted_datasets_path, name)
+        for name in os.listdir(corrupted_datasets_path)
+        if os.path.isfile(os.path.join(corrupted_datasets_path, name, "robuser_config.yaml"))
+    )
+    if not corrupted_dataset_paths:
+        raise ValueError(f"No corrupted dataset (with a robuser_config.yaml file) found in {corrupted_datasets_path}")
+    return corrupted_dataset_paths
+
+
+def get_expected_snr(corrupted_dataset_path):
+    """
+    Reads the SNR of the configuration of a corrupted dataset.
+
+    Returns:
+        float: the SNR in dB, or NaN if the corruption has none (e.g. clipping) or is a chain
+    """
+    with open(os.path.join(corrupted_dataset_path, "robuser_config.yaml"), "r") as file:
+        corruption_config = yaml.safe_load(file)
+    if isinstance(corruption_config, dict) and isinstance(corruption_config.get("snr"), (int, float)):
+        return float(corruption_config["snr"])
+    return np.nan
+
+
+def read_mono(file_path):
+    """
+    Reads an audio file as a mono float32 signal.
+
+    Returns:
+        tuple: (signal, sample rate), or (None, None) if the file is missing or cannot be read
+    """
+    try:
+        audio, sample_rate = sf.read(file_path, dtype="float32", always_2d=True)
+    except (RuntimeError, sf.LibsndfileError):
+        return None, None
+    return audio.mean(axis=1, dtype=np.float32) if audio.shape[1] > 1 else audio[:, 0], sample_rate
+
+
+def find_clipped_samples(full_scale, starts, min_run=CLIP_RUN):
+    """
+    Finds the samples of the runs of at least `min_run` consecutive samples at full scale, within every file.
+
+    Args:
+        full_scale (np.array): whether every sample of the concatenated files is at full scale
+        starts (np.array): index of the first sample of every file
+        min_run (int): minimum length of a run of clipped samples
+
+    Returns:
+        np.array: whether every sample is clipped
+    """
+    # Runs are cut at the start of every file
+    boundaries = np.zeros(len(full_scale), dtype=bool)
+    boundaries[starts] = True
+    changes = np.flatnonzero(boundaries | (full_scale != np.concatenate([[False], full_scale[:-1]])))
+    run_lengths = np.diff(np.append(changes, len(full_scale)))
+    return np.repeat(full_scale[changes] & (run_lengths >= min_run), run_lengths)
+
+
+def measure_batch(task):
+    """
+    Measures the corrupted versions of a batch of clean files.
+
+    The corrupted files are concatenated, each clean file being cut or zero-padded to the length of its corrupted
+    version, and every measure is reduced per file with `np.add.reduceat` (and `np.maximum.reduceat`). The achieved
+    SNR is scale-invariant: the corrupted signal (without its mean) is projected on the clean signal (without its
+    mean), the projection being the signal and the rest the noise, so that it does not depend on the normalization
+    of the corruption.
+
+    Args:
+        task (list): (index of the clean file, path to the clean file, paths to its corrupted versions) per file
+
+    Returns:
+        tuple: the indices of the clean files, and the measures as a dict of arrays
+               (number of clean files x number of corrupted datasets)
+    """
+    num_files, num_datasets = len(task), len(task[0][2])
+    shape = (num_files, num_datasets)
+    measures = {
+        "missing": np.ones(shape, dtype=bool),
+        "snr_db": np.full(shape, np.nan),
+        "clipped_ratio": np.full(shape, np.nan),
+        "peak": np.full(shape, np.nan),
+        "rms_db": np.full(shape, np.nan),
+        "nonfinite": np.zeros(shape, dtype=bool),
+        "silent": np.zeros(shape, dtype=bool),
+        "duration_match": np.zeros(shape, dtype=bool),
+    }
+
+    clean_segments, corrupted_segments, positions = [], [], []
+    for i, (_, clean_path, corrupted_paths) in enumerate(task):
+        clean, clean_sample_rate = read_mono(clean_path)
+        for j, corrupted_path in enumerate(corrupted_paths):
+            corrupted, sample_rate = read_mono(corrupted_path)
+            if corrupted is None or clean is None or len(corrupted) == 0:
+                continue
+            measures["missing"][i, j] = False
+            measures["duration_match"][i, j] = len(corrupted) == len(clean) and sample_rate == clean_sample_rate
+            aligned_clean = clean[:len(corrupted)]
+            if len(aligned_clean) < len(corrupted):
+                aligned_clean = np.pad(aligned_clean, (0, len(corrupted) - len(aligned_clean)))
+            clean_segments.append(aligned_clean)
+            corrupted_segments.append(corrupted)
+            positions.append((i, j))
+
+    if not positions:
+        return [index for index, _, _ in task], measures
+
+    lengths = np.array([len(segment) for segment in corrupted_segments])
+    starts = np.concatenate([[0], np.cumsum(lengths[:-1])])
+    clean = np.concatenate(clean_segments).astype(np.float64)
+    corrupted = np.concatenate(corrupted_segments).astype(np.float64)
+
+    finite = np.isfinite(corrupted)
+    nonfinite = np.add.reduceat(~finite, starts) > 0
+    corrupted[~finite] = 0.0
+    magnitude = np.abs(corrupted)
+    peak = np.maximum.reduceat(magnitude, starts)
+    clipped_ratio = np.add.reduceat(find_clipped_samples(magnitude >= CLIP_THRESHOLD, starts), starts) / lengths
+
+    # Sums of the signals and of their products, for the power and the SNR without the mean of the signals
+    clean_sum, corrupted_sum = np.add.reduceat(clean, starts), np.add.reduceat(corrupted, starts)
+    corrupted_power = np.add.reduceat(corrupted * corrupted, starts) / lengths
+    clean_energy = np.add.reduceat(clean * clean, starts) - clean_sum ** 2 / lengths
+    corrupted_energy = corrupted_power * lengths - corrupted_sum ** 2 / lengths
+    cross_energy = np.add.reduceat(clean * corrupted, starts) - clean_sum * corrupted_sum / lengths
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        signal_energy = np.where(clean_energy > 0, cross_energy ** 2 / clean_energy, np.nan)
+        noise_energy = np.maximum(corrupted_energy - signal_energy, 0.0)
+        snr_db = 10 * np.log10(signal_energy / noise_energy)
+        rms_db = 10 * np.log10(corrupted_power)
+
+    rows, columns = np.array(positions).T
+    measures["snr_db"][rows, columns] = snr_db
+    measures["clipped_ratio"][rows, columns] = clipped_ratio
+    measures["peak"][rows, columns] = peak
+    measures["rms_db"][rows, columns] = rms_db
+    measures["nonfinite"][rows, columns] = nonfinite
+    measures["silent"][rows, columns] = rms_db < SILENCE_DB
+    return [index for index, _, _ in task], measures
+
+
+def make_batches(frames, batch_frames=BATCH_FRAMES):
+    """
+    Splits the files in batches of about `batch_frames` samples.
+
+    Returns:
+        list of lists: the indices of the files of every batch
+    """
+    batches, batch, batch_size = [], [], 0
+    for index, file_frames in enumerate(frames):
+        batch.append(index)
+        batch_size += file_frames
+        if batch_size >= batch_frames:
+            batches.append(batch)
+            batch, batch_size = [], 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def run_qa(original_dataset_path, corrupted_datasets_path, workers=1, manifest_path=None, batch_frames=BATCH_FRAMES):
+    """
+    Measures every corrupted file of the corrupted datasets against its original file.
+
+    Args:
+        original_dataset_path (str): path to the original dataset
+        corrupted_datasets_path (str): path to a corrupted dataset, or to a directory of corrupted datasets
+        workers (int): number of worker processes
+        manifest_path (str): path of the manifest of the original dataset
+        batch_frames (int): number of clean samples read per batch
+
+    Returns:
+        dict: the columns of the report (see `REPORT_COLUMNS`), one entry per corrupted dataset and file
+    """
+    corrupted_dataset_paths = find_corrupted_datasets(corrupted_datasets_path)
+    manifest = build_manifest(original_dataset_path, manifest_path=manifest_path)
+    relative_paths = list(manifest.columns["relative_path"])
+    if not relative_paths:
+        raise ValueError(f"No audio files found in {original_dataset_path}")
+
+    tasks = [
+        [
+            (
+                index,
+                os.path.join(original_dataset_path, relative_paths[index]),
+                [os.path.join(path, relative_paths[index]) for path in corrupted_dataset_paths],
+            )
+            for index in batch
+        ]
+        for batch in make_batches(manifest.columns["frames"], batch_frames)
+    ]
+    if workers > 1:
+        costs = [manifest.columns["frames"][[index for index, _, _ in task]].sum() for task in tasks]
+        results = run_longest_first(
+            measure_batch, tasks, costs, workers, threads_per_worker=max(get_thread_budget() // workers, 1)
+        )
+    else:
+        results = map(measure_batch, tasks)
+
+    shape = (len(corrupted_dataset_paths), len(relative_paths))
+    report = {
+        "dataset": np.repeat([os.path.basename(os.path.normpath(path)) for path in corrupted_dataset_paths],
+                             len(relative_paths)),
+        "relative_path": np.tile(np.array(relative_paths), len(corrupted_dataset_paths)),
+    }
+    columns = {}
+    for indices, measures in results:
+        for name, values in measures.items():
+            if name not in columns:
+                columns[name] = np.empty(shape, dtype=values.dtype)
+            columns[name][:, indices] = values.T
+    report.update({name: column.reshape(-1) for name, column in columns.items()})
+    report["expected_snr_db"] = np.repeat([get_expected_snr(path) for path in corrupted_dataset_paths],
+                                          len(relative_paths))
+    return report
+
+
+def summarize_report(report):
+    """
+    Summarizes the report per corrupted dataset (i.e. per corruption configuration).
+
+    Args:
+        report (dict): the output of `run_qa`
+
+    Returns:
+        list of dicts: the summary of every corrupted dataset, with the number of files of every issue
+    """
+    summaries = []
+    for dataset in dict.fromkeys(report["dataset"].tolist()):
+        rows = report["dataset"] == dataset
+        measured = rows & ~report["missing"]
+        snr_db = report["snr_db"][measured]
+        snr_db = snr_db[np.isfinite(snr_db)]
+        expected_snr_db = report["expected_snr_db"][rows][0]
+        snr_error = np.abs(snr_db - expected_snr_db) if not np.isnan(expected_snr_db) else np.array([])
+        summaries.append(
+            {
+                "dataset": dataset,
+                "files": int(rows.sum()),
+                "missing": int((rows & report["missing"]).sum()),
+                "nonfinite": int(report["nonfinite"][measured].sum()),
+                "silent": int(report["silent"][measured].sum()),
+                "duration_mismatch": int((~report["duration_match"][measured]).sum()),
+                "clipped_files": int((report["clipped_ratio"][measured] > 0).sum()),
+                "clipped_ratio_mean": float(np.mean(report["clipped_ratio"][measured])) if measured.any() else np.nan,
+                "peak_max": float(np.max(report["peak"][measured])) if measured.any() else np.nan,
+                "expected_snr_db": float(expected_snr_db),
+                "snr_db_mean": float(np.mean(snr_db)) if len(snr_db) else np.nan,
+                "snr_db_std": float(np.std(snr_db)) if len(snr_db) else np.nan,
+                "snr_db_min": float(np.min(snr_db)) if len(snr_db) else np.nan,
+                "snr_db_max": float(np.max(snr_db)) if len(snr_db) else np.nan,
+                "snr_off_target": int((snr_error > SNR_TOLERANCE_DB).sum()),
+            }
+        )
+    return summaries
+
+
+def count_issues(summary):
+    """
+    Counts the files of a corrupted dataset with an issue that makes them unusable or off their configuration.
+    """
+    return (
+        summary["missing"]
+        + summary["nonfinite"]
+        + summary["silent"]
+        + summary["duration_mismatch"]
+        + summary["snr_off_target"]
+    )
+
+
+def save_report(report, output_path):
+    """
+    Saves the report as a compressed npz file of columns, or as a CSV file, depending on the extension of the path.
+    """
+    if output_path.endswith(".csv"):
+        with open(output_path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(list(report))
+            writer.writerows(zip(*[column.tolist() for column in report.values()]))
+    else:
+        np.savez_compressed(output_path, **report)
+    print(f"QA report saved to {output_path}")
+
+
+def parse_arguments():
+    """!
+    @brief Parse Arguments for checking the corrupted datasets.
+    """
+    args_parser = argparse.ArgumentParser(description="Check the corrupted datasets against the original dataset")
+    args_parser.add_argument("-i", "--input", required=True, help="Path of the original dataset")
+    args_parser.add_argument(
+        "-c",
+        "--corrupted",
+        required=True,
+        help="Path of a corrupted dataset, or of the directory with the corrupted datasets",
+    )
+    args_parser.add_argument(
+        "-o", "--output", required=False, help="Path to save the report of every file (.npz or .csv)"
+    )
+    args_parser.add_argument(
+        "-m", "--manifest", required=False, help="Path of the manifest of the original dataset"
+    )
+    args_parser.add_argument("-w", "--workers", type=int, default=1, help="Number of worker processes")
+    args_parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="Exit with an error if any file is missing, has NaN samples, is silent, has a different duration "
+        "or an SNR off its configuration",
+    )
+    return args_parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    report = run_qa(args.input, args.corrupted, workers=args.workers, manifest_path=args.manifest)
+    summaries = summarize_report(report)
+
+    print(
+        tabulate.tabulate(
+            [
+                [
+                    summary["dataset"],
+                    summary["files"],
+                    summary["missing"],
+                    summary["nonfinite"],
+                    summary["silent"],
+                    summary["duration_mismatch"],
+                    summary["clipped_files"],
+                    summary["expected_snr_db"],
+                    summary["snr_db_mean"],
+                    summary["snr_db_min"],
+                    summary["snr_db_max"],
+                    summary["snr_off_target"],
+                ]
+                for summary in summaries
+            ],
+            headers=[
+                "Corrupted dataset",
+                "Files",
+                "Missing",
+                "NaN",
+                "Silent",
+                "Duration mismatch",
+                "Clipped",
+                "Expected SNR",
+                "Mean SNR",
+                "Min SNR",
+                "Max SNR",
+                "SNR off target",
+            ],
+            floatfmt=".2f",
+        )
+    )
+    if args.output is not None:
+        save_report(report, args.output)
+
+    num_issues = sum(count_issues(summary) for summary in summaries)
+    if num_issues:
+        print(f"Warning: {num_issues} corrupted files have issues")
+        if args.strict:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+Cost-aware scheduling of the corruption work across worker processes or threads.
+"""
+
+import contextlib
+import itertools
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
+
+import numpy as np
+
+from robuser.corruptions.get_corruption import get_corruption
+from robuser.corruptions.native_threads import get_thread_budget, init_worker_threads, native_thread_limits
+from robuser.parsing.manifest import probe_audio_file
+
+# Cost of opening, decoding and writing a file, on top of the cost of the corruption
+FILE_COST_MODEL = (2.0, 1.0)
+
+# Batchable files are split in about this many batches per worker: enough for the longest-first dispatch to balance
+# the workers, few enough to amortize sending the tasks and their results between processes
+BATCHES_PER_WORKER = 8
+MAX_BATCH_SIZE = 64
+
+# How the corruptions are run: "serial", "thread" or "process" executor, number of files per task, number of workers
+# and number of threads of the native thread pools (BLAS, OpenMP) of every worker
+Strategy = namedtuple("Strategy", ["executor", "batch_size", "workers", "threads_per_worker"])
+
+
+def get_corruption_cost_model(corruption_type, corruption_config=None):
+    """
+    Returns the cost model declared by a corruption class, adding up the steps of corruption chains.
+
+    Args:
+        corruption_type (str): type of corruption (e.g. content), or "chain"
+        corruption_config (dict): configuration of the corruption, with the "steps" of a chain
+
+    Returns:
+        tuple: (fixed cost per file, cost per second of audio)
+    """
+    if corruption_type == "chain":
+        step_costs = [get_corruption_cost_model(*step) for step in corruption_config["steps"]]
+        return sum(fixed for fixed, _ in step_costs), sum(per_second for _, per_second in step_costs)
+    return get_corruption(corruption_type).cost_model
+
+
+def resolve_workers(workers, thread_budget=None):
+    """
+    Returns the number of workers of a run, "auto" being one per thread of the budget (see `choose_strategy`).
+    """
+    if workers == "auto":
+        return get_thread_budget(thread_budget)
+    return workers
+
+
+def parse_workers(value):
+    """
+    Parses the number of workers of a command line, a number or "auto".
+    """
+    return value if value == "auto" else int(value)
+
+
+def choose_strategy(corruption_classes, workers, num_tasks, thread_budget=None):
+    """
+    Picks the fastest valid way to run corruptions from the capabilities declared by their classes:
+    - serially, with a single worker
+    - on a thread pool, if all the corruptions are stateless and spend their time in other programs (e.g. ffmpeg):
+      the threads wait for them without holding the GIL, and no worker process has to be spawned and set up
+    - on a process pool otherwise, dispatching the files in batches if all the corruptions are batchable
+
+    The workers share a budget of threads (by default, one per CPU available): there are at most as many workers as
+    threads of the budget and as tasks, and the threads of the budget left to every worker process go to its native
+    thread pools (the BLAS and OpenMP threads behind numpy, scipy and librosa), which otherwise start one thread per
+    CPU in every worker. Running several files at once scales better than the native thread pools on a single file,
+    so the threads go to the workers first, and to the native thread pools when there are fewer files than threads
+    (or a single worker).
+
+    Chunked streaming of the files is not used yet: none of the built-in corruptions is chunkable, all of them
+    depend on statistics of the whole signal (e.g. its RMS or its percentiles).
+
+    Args:
+        corruption_classes (list): the corruption classes that run on every file
+        workers (int): number of workers requested
+        num_tasks (int): number of files (or input files with their corruptions) to corrupt
+        thread_budget (int): number of threads of the run, all the CPUs available if None
+
+    Returns:
+        Strategy: the executor, the number of files per task, the number of workers and their native threads
+    """
+    thread_budget = get_thread_budget(thread_budget)
+    workers = min(workers, thread_budget, num_tasks)
+    if workers <= 1:
+        return Strategy("serial", 1, 1, thread_budget)
+    if all(corruption_class.stateless and corruption_class.cost_class == "subprocess"
+           for corruption_class in corruption_classes):
+        # The work is done by the other programs, the threads only wait for them
+        return Strategy("thread", 1, workers, 1)
+    threads_per_worker = max(thread_budget // workers, 1)
+    if all(corruption_class.batchable for corruption_class in corruption_classes):
+        batch_size = int(np.clip(num_tasks // (workers * BATCHES_PER_WORKER), 1, MAX_BATCH_SIZE))
+        return Strategy("process", batch_size, workers, threads_per_worker)
+    return Strategy("process", 1, workers, threads_per_worker)
+
+
+def describe_strategy(strategy):
+    """
+    Describes a strategy for the logs, e.g. "4 worker processes, 8 files per task, 2 native threads per worker"
+    """
+    native_threads = f"{strategy.threads_per_worker} native thread{'s' if strategy.threads_per_worker > 1 else ''}"
+    if strategy.executor == "serial":
+        return f"a single worker, {native_threads}"
+    description = f"{strategy.workers} worker {'threads' if strategy.executor == 'thread' else 'processes'}"
+    if strategy.batch_size > 1:
+        description += f", {strategy.batch_size} files per task"
+    return f"{description}, {native_threads} per worker"
+
+
+def get_worker_pool(executor, workers, initializer=None, initargs=(), threads_per_worker=None):
+    """
+    Creates the pool of workers of a strategy, limiting the native thread pools of every worker.
+
+    Args:
+        executor (str): "process" or "thread" pool (see `choose_strategy`)
+        workers (int): number of workers
+        initializer (callable): optional function run once by every worker (e.g. to set up the corruption)
+        initargs (tuple): arguments of the initializer
+        threads_per_worker (int): number of threads of the native thread pools of every worker, not limited if None
+
+    Returns:
+        tuple: the pool and the context that limits the native thread pools of the worker threads, which share the
+               ones of the process
+    """
+    if threads_per_worker is None:
+        limits = contextlib.nullcontext()
+    elif executor == "thread":
+        limits = native_thread_limits(threads_per_worker)
+    else:
+        limits = contextlib.nullcontext()
+        initializer, initargs = init_worker_threads, (threads_per_worker, initializer, initargs)
+    executor_class = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+    return executor_class(max_workers=workers, initializer=initializer, initargs=initargs), limits
+
+
+def estimate_costs(durations, cost_models, num_outputs=1):
+    """
+    Estimates the cost of corrupting every file.
+
+    Args:
+        durations (np.array): durations of the files in seconds
+        cost_models (list): cost models of the corruptions applied to every file
+        num_outputs (int): number of corrupted files written per input file
+
+    Returns:
+        np.array: the estimated cost of every file
+    """
+    fixed_cost = FILE_COST_MODEL[0] + sum(fixed for fixed, _ in cost_models)
+    cost_per_second = FILE_COST_MODEL[1] * num_outputs + sum(per_second for _, per_second in cost_models)
+    return fixed_cost + np.asarray(durations, dtype=np.float64) * cost_per_second
+
+
+def order_longest_first(costs):
+    """
+    Returns the indices of the tasks in decreasing order of cost (stable for equal costs).
+    """
+    return np.argsort(-np.asarray(costs), kind="stable")
+
+
+def plan_assignments(corruption, file_paths, file_seeds):
+    """
+    Draws up front what a corruption applies to every file (e.g. its noise clip and the position of the noise
+    segment, or its impulse response), from the seed of the file and the length of the audio read from its header.
+    The corruption draws the same assignment again when it runs on the file with the same seed, so the plan only
+    decides the order of the files and does not change the outputs.
+
+    Args:
+        corruption: the corruption, with a `locality_key` (see `CorruptionType.draw_assignment`)
+        file_paths (list): paths to the audio files
+        file_seeds (list): the seed of every file
+
+    Returns:
+        dict: every field of the assignments mapped to a numpy array with its value for every file
+    """
+    assignments = []
+    for file_path, file_seed in zip(file_paths, file_seeds):
+        sample_rate, frames, _ = probe_audio_file(file_path)
+        corruption.reseed(file_seed)
+        assignments.append(corruption.draw_assignment(frames, sample_rate))
+    if not assignments:
+        return {}
+    return {key: np.array([assignment[key] for assignment in assignments]) for key in assignments[0]}
+
+
+def order_by_locality(plan, locality_key):
+    """
+    Returns the indices of the files ordered by the external file they read (e.g. their noise clip), then by the
+    rest of their assignment (e.g. the position of the noise segment), so that every external file is read by a run
+    of consecutive files, front to back.
+
+    Args:
+        plan (dict): the assignments of the files (see `plan_assignments`)
+        locality_key (str): the field of the assignments with the external file
+
+    Returns:
+        np.array: the indices of the files
+    """
+    sort_keys = [plan[locality_key]] + [values for key, values in plan.items() if key != locality_key]
+    # lexsort sorts by the last key first
+    return np.lexsort(sort_keys[::-1])
+
+
+def make_locality_batches(plan, locality_key, workers):
+    """
+    Splits the files into batches of files that read the same external file (e.g. the same noise clip), in the order
+    of `order_by_locality`, so that a worker loads the external file once for the whole batch. The batches are small
+    enough for the longest-first dispatch to balance the workers.
+
+    Args:
+        plan (dict): the assignments of the files (see `plan_assignments`)
+        locality_key (str): the field of the assignments with the external file
+        workers (int): number of workers
+
+    Returns:
+        list: the batches, each one an array with the indices of its files
+    """
+    order = order_by_locality(plan, locality_key)
+    num_tasks = len(order)
+    max_batch_size = int(np.clip(-(-num_tasks // (workers * BATCHES_PER_WORKER)), 1, MAX_BATCH_SIZE))
+
+    keys = plan[locality_key][order]
+    run_starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if num_tasks else np.array([], dtype=int)
+    run_ends = np.r_[run_starts[1:], num_tasks]
+    batches = []
+    for run_start, run_end in zip(run_starts, run_ends):
+        for start in range(run_start, run_end, max_batch_size):
+            batches.append(order[start:min(start + max_batch_size, run_end)])
+    return batches
+
+
+def run_batch(task_fn, tasks):
+    """
+    Applies a task function to a batch of tasks, in a single call of a worker.
+    """
+    return [task_fn(task) for task in tasks]
+
+
+def run_longest_first(
+    task_fn,
+    tasks,
+    costs,
+    workers,
+    initializer=None,
+    initargs=(),
+    executor="process",
+    batch_size=1,
+    batches=None,
+    threads_per_worker=None,
+):
+    """
+    Runs the tasks on a pool of workers, dispatching them longest-first. Every idle worker takes the
+    next most expensive task, so that no worker is left with the long tail of the work while the others are idle.
+
+    Args:
+        task_fn (callable): picklable function applied to every task
+        tasks (list): the tasks
+        costs (np.array): the estimated cost of every task
+        workers (int): number of workers
+        initializer (callable): optional function run once by every worker (e.g. to set up the corruption)
+        initargs (tuple): arguments of the initializer
+        executor (str): "process" or "thread" pool (see `choose_strategy`)
+        batch_size (int): number of tasks sent to a worker at once, consecutive in the longest-first order
+        batches (list): the indices of the tasks sent to a worker at once (e.g. from `make_locality_batches`), instead
+                        of batches of batch_size tasks; the batches are dispatched longest-first
+        threads_per_worker (int): number of threads of the native thread pools of every worker (see `choose_strategy`)
+
+    Yields:
+        the results of the tasks, in order of completion
+    """
+    order = order_longest_first(costs)
+    if batches is None and batch_size > 1:
+        batches = [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+    if batches is not None:
+        costs = np.asarray(costs, dtype=np.float64)
+        tasks = [[tasks[i] for i in batch] for batch in batches]
+        costs = [costs[batch].sum() for batch in batches]
+        task_fn = partial(run_batch, task_fn)
+        order = order_longest_first(costs)
+
+    pool, limits = get_worker_pool(executor, workers, initializer, initargs, threads_per_worker)
+    with limits, pool:
+        # Only a few tasks per worker are queued at a time, so that the order of dispatch is kept
+        pending = set()
+        next_task = 0
+        while next_task < len(order) or pending:
+            while next_task < len(order) and len(pending) < 2 * workers:
+                pending.add(pool.submit(task_fn, tasks[order[next_task]]))
+                next_task += 1
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if batches is not None:
+                    yield from future.result()
+                else:
+                    yield future.result()
+
+
+def run_streaming(
+    task_fn, tasks, workers, initializer=None, initargs=(), executor="process", batch_size=1, threads_per_worker=None
+):
+    """
+    Runs the tasks of an iterable on a pool of workers, in their order, without holding them all in memory: only a
+    few tasks per worker are taken from the iterable at a time. Unlike `run_longest_first`, the tasks are not
+    dispatched by cost, which is not known before the iterable is consumed.
+
+    Args:
+        task_fn (callable): picklable function applied to every task
+        tasks (iterable): the tasks
+        workers (int): number of workers
+        initializer (callable): optional function run once by every worker (e.g. to set up the corruption)
+        initargs (tuple): arguments of the initializer
+        executor (str): "process" or "thread" pool (see `choose_strategy`)
+        batch_size (int): number of consecutive tasks sent to a worker at once
+        threads_per_worker (int): number of threads of the native thread pools of every worker (see `choose_strategy`)
+
+    Yields:
+        the results of the tasks, in order of completion
+    """
+    task_iterator = iter(tasks)
+    if batch_size > 1:
+        single_tasks = task_iterator
+        task_iterator = iter(lambda: list(itertools.islice(single_tasks, batch_size)), [])
+        task_fn = partial(run_batch, task_fn)
+
+    pool, limits = get_worker_pool(executor, workers, initializer, initargs, threads_per_worker)
+    with limits, pool:
+        pending = set()
+        exhausted = False
+        while not exhausted or pending:
+            while not exhausted and len(pending) < 2 * workers:
+                try:
+                    pending.add(pool.submit(task_fn, next(task_iterator)))
+                except StopIteration:
+                    exhausted = True
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if batch_size > 1:
+                    yield from future.result()
+                else:
+                    yield future.result()
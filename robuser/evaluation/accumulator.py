@@ -0,0 +1,356 @@
+"""
+Streaming, mergeable accumulator of the evaluation metrics, so that the predictions can be scored in chunks and
+sharded inference can be scored locally and reduced afterwards.
+"""
+
+import csv
+import json
+import struct
+import warnings
+
+import numpy as np
+
+# Classes that are evaluated, the predictions and targets of the other classes are ignored
+EXPECTED_CLASSES = ("angry", "happy", "neutral", "sad")
+
+# Header of the serialized accumulators: magic, format version and length of the JSON metadata
+HEADER = struct.Struct("<4sHI")
+MAGIC = b"RBEA"
+FORMAT_VERSION = 2
+# Number of file names listed in the errors about missing and duplicate predictions
+MAX_LISTED_FILES = 10
+
+
+def read_predictions(preds_csv, chunk_size=10000):
+    """
+    Read the predictions CSV file in chunks
+    Args:
+        preds_csv: Path to the predictions CSV file with the following columns:
+                   file_name (e.g. Ses05F_impro02_M007.wav), emotion
+        chunk_size: Number of rows per chunk
+    Yields:
+        Tuple of lists (file_names, emotions) with up to chunk_size rows
+    """
+    file_names, emotions = [], []
+    with open(preds_csv, "r", newline="") as file:
+        for row in csv.reader(file):
+            if not row:
+                continue
+            file_name, emotion = row
+            file_names.append(file_name.strip())
+            emotions.append(emotion.strip())
+            if len(file_names) == chunk_size:
+                yield file_names, emotions
+                file_names, emotions = [], []
+    if file_names:
+        yield file_names, emotions
+
+
+def calc_metrics_from_cm(confusion_matrix):
+    """
+    Calculate the metrics from a confusion matrix (rows: true classes, columns: predicted classes)
+    Args:
+        confusion_matrix: Square matrix of counts
+    Returns:
+        Dictionary with the per-class recall and F1 score, the weighted and unweighted accuracy and the macro F1 score
+    """
+    confusion_matrix = np.asarray(confusion_matrix, dtype=np.float64)
+    TPs = np.diag(confusion_matrix)
+    instances_per_class = confusion_matrix.sum(axis=1)
+    predictions_per_class = confusion_matrix.sum(axis=0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predictions_per_class != 0, TPs / predictions_per_class, 0.0)
+        recall = np.where(instances_per_class != 0, TPs / instances_per_class, 0.0)
+        f1 = np.where(precision + recall != 0, 2 * precision * recall / (precision + recall), 0.0)
+
+    return {
+        "recall": recall.tolist(),
+        "f1_score": f1.tolist(),
+        "weighted_accuracy": TPs.sum() / instances_per_class.sum(),
+        "unweighted_accuracy": recall.mean(),
+        "macro_f1_score": f1.mean(),
+    }
+
+
+def accuracies_from_cms(confusion_matrices):
+    """
+    Calculate the weighted and unweighted accuracy of a stack of confusion matrices at once, over the classes found in
+    the targets or the predictions of every matrix (as `EvaluationAccumulator.get_results`)
+    Args:
+        confusion_matrices: Array of counts (... x true classes x predicted classes)
+    Returns:
+        Array of [weighted_accuracy, unweighted_accuracy] in % (... x 2)
+    """
+    confusion_matrices = np.asarray(confusion_matrices, dtype=np.float64)
+    TPs = np.diagonal(confusion_matrices, axis1=-2, axis2=-1)
+    instances_per_class = confusion_matrices.sum(axis=-1)
+    present = (instances_per_class + confusion_matrices.sum(axis=-2)) > 0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        recall = np.where(instances_per_class != 0, TPs / instances_per_class, 0.0)
+        weighted_accuracy = TPs.sum(axis=-1) / instances_per_class.sum(axis=-1)
+        unweighted_accuracy = (recall * present).sum(axis=-1) / present.sum(axis=-1)
+    return np.stack([weighted_accuracy, unweighted_accuracy], axis=-1) * 100
+
+
+def percentile_interval(samples, confidence=0.95):
+    """
+    Percentile interval of bootstrap samples
+    Args:
+        samples: Array of bootstrap samples (samples x ...)
+        confidence: Confidence level of the interval
+    Returns:
+        Tuple of arrays (lower bound, upper bound)
+    """
+    alpha = (1 - confidence) / 2 * 100
+    with warnings.catch_warnings():
+        # The bounds of undefined metrics (e.g. the CE of a corruption missing from the baseline) are NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanpercentile(samples, alpha, axis=0), np.nanpercentile(samples, 100 - alpha, axis=0)
+
+
+class EvaluationAccumulator:
+    """
+    Accumulates one confusion matrix of counts per fold from a stream of predictions, and which targets got a
+    prediction, so that the missing and duplicate predictions are reported.
+
+    Accumulators built for the same targets can be serialized to about a kilobyte (`to_bytes`) and merged in any
+    order (`merge`), e.g. one per inference shard. The metrics of the merged accumulator are the same as the ones of
+    all the predictions scored at once.
+    """
+
+    def __init__(self, classes, folds, num_targets, confusion_matrices=None, seen=None, duplicates=None,
+                 target_names=None):
+        """
+        Args:
+            classes: Names of the evaluated classes
+            folds: Names of the folds (e.g. the speaker IDs)
+            num_targets: Number of targets of the evaluated classes, which should all get a prediction
+            confusion_matrices: Optional array of counts (folds x true classes x predicted classes)
+            seen: Optional boolean array of the targets with a prediction (num_targets,)
+            duplicates: Optional boolean array of the targets with several predictions (num_targets,)
+            target_names: Optional file names of the targets, in the order of `get_target_names`, to name the
+                          missing and duplicate predictions
+        """
+        self.classes = list(classes)
+        self.folds = list(folds)
+        self.num_targets = num_targets
+        if confusion_matrices is None:
+            confusion_matrices = np.zeros((len(self.folds), len(self.classes), len(self.classes)), dtype=np.int64)
+        self.confusion_matrices = confusion_matrices
+        self.seen = np.zeros(num_targets, dtype=bool) if seen is None else seen
+        self.duplicates = np.zeros(num_targets, dtype=bool) if duplicates is None else duplicates
+        self.target_names = target_names
+
+    @staticmethod
+    def get_target_names(targets, classes=EXPECTED_CLASSES):
+        """
+        Sort the file names of the targets of the evaluated classes, which indexes them the same way in every
+        accumulator of the same targets (e.g. of every inference shard)
+        Args:
+            targets: Dictionary of {file_name: {"emotion": emotion, "speaker_id": speaker_id, ...}}
+            classes: Names of the evaluated classes
+        Returns:
+            List of file names
+        """
+        return sorted(key for key, value in targets.items() if value["emotion"] in classes)
+
+    @classmethod
+    def for_targets(cls, targets, classes=EXPECTED_CLASSES):
+        """
+        Create an empty accumulator for the targets of a dataset
+        Args:
+            targets: Dictionary of {file_name: {"emotion": emotion, "speaker_id": speaker_id, ...}}
+            classes: Names of the evaluated classes
+        Returns:
+            Tuple of the accumulator and the target indices to pass to `update`
+        """
+        target_names = cls.get_target_names(targets, classes)
+        folds = sorted(set(targets[key]["speaker_id"] for key in target_names))
+        accumulator = cls(classes, folds, len(target_names), target_names=target_names)
+        return accumulator, accumulator.index_targets(targets)
+
+    def index_targets(self, targets):
+        """
+        Map every target file name to its index and the indices of its fold and class
+        Args:
+            targets: Dictionary of {file_name: {"emotion": emotion, "speaker_id": speaker_id, ...}}
+        Returns:
+            Dictionary of {file_name: (target_index, fold_index, class_index)} for the targets of the evaluated
+            classes
+        """
+        fold_indices = {fold: index for index, fold in enumerate(self.folds)}
+        class_indices = {class_name: index for index, class_name in enumerate(self.classes)}
+        return {
+            key: (index, fold_indices[targets[key]["speaker_id"]], class_indices[targets[key]["emotion"]])
+            for index, key in enumerate(self.get_target_names(targets, self.classes))
+        }
+
+    def update(self, file_names, emotions, target_indices):
+        """
+        Count a chunk of predictions. The predictions of other classes than the evaluated ones, or of files that
+        are not in the targets, are ignored. Only the first prediction of a target is counted, the others are
+        recorded as duplicates.
+        Args:
+            file_names: List of file names (e.g. Ses05F_impro02_M007.wav)
+            emotions: List of the predicted emotions
+            target_indices: The output of `index_targets`
+        """
+        class_indices = {class_name: index for index, class_name in enumerate(self.classes)}
+        rows = [
+            target_indices[file_name] + (class_indices[emotion],)
+            for file_name, emotion in zip(file_names, emotions)
+            if emotion in class_indices and file_name in target_indices
+        ]
+        if not rows:
+            return
+        target, fold, true_class, predicted_class = np.array(rows, dtype=np.int64).T
+        _, first = np.unique(target, return_index=True)
+        is_first = np.zeros(len(target), dtype=bool)
+        is_first[first] = True
+        counted = is_first & ~self.seen[target]
+        self.duplicates[target[~counted]] = True
+        self.seen[target] = True
+        np.add.at(self.confusion_matrices, (fold[counted], true_class[counted], predicted_class[counted]), 1)
+
+    def merge(self, other):
+        """
+        Merge with the accumulator of other predictions of the same targets
+        Returns:
+            A new accumulator with the counts of both
+        """
+        if self.classes != other.classes or self.folds != other.folds or self.num_targets != other.num_targets:
+            raise ValueError("Only accumulators of the same classes, folds and targets can be merged")
+        return EvaluationAccumulator(
+            self.classes,
+            self.folds,
+            self.num_targets,
+            self.confusion_matrices + other.confusion_matrices,
+            self.seen | other.seen,
+            self.duplicates | other.duplicates | (self.seen & other.seen),
+            self.target_names if self.target_names is not None else other.target_names,
+        )
+
+    @property
+    def num_predictions(self):
+        return int(self.confusion_matrices.sum())
+
+    def to_bytes(self):
+        """
+        Serialize the accumulator: a small header, the JSON metadata, the counts as int32 and the bits of the targets
+        with a prediction and with several predictions
+        """
+        metadata = json.dumps({"classes": self.classes, "folds": self.folds, "num_targets": self.num_targets}).encode()
+        counts = self.confusion_matrices.astype("<i4").tobytes()
+        coverage = np.packbits(self.seen).tobytes() + np.packbits(self.duplicates).tobytes()
+        return HEADER.pack(MAGIC, FORMAT_VERSION, len(metadata)) + metadata + counts + coverage
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Deserialize an accumulator serialized with `to_bytes`
+        """
+        magic, version, metadata_length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Not a serialized evaluation accumulator")
+        metadata = json.loads(data[HEADER.size:HEADER.size + metadata_length])
+        num_classes, num_targets = len(metadata["classes"]), metadata["num_targets"]
+        shape = (len(metadata["folds"]), num_classes, num_classes)
+        offset = HEADER.size + metadata_length
+        counts = np.frombuffer(data, dtype="<i4", count=int(np.prod(shape)), offset=offset).astype(np.int64)
+        offset += counts.size * 4
+        coverage = np.unpackbits(np.frombuffer(data, dtype=np.uint8, offset=offset)).astype(bool)
+        packed_length = (num_targets + 7) // 8 * 8
+        return cls(
+            metadata["classes"],
+            metadata["folds"],
+            num_targets,
+            counts.reshape(shape),
+            coverage[:num_targets],
+            coverage[packed_length:packed_length + num_targets],
+        )
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            return cls.from_bytes(file.read())
+
+    def get_results(self):
+        """
+        Calculate the per-fold and overall metrics. As with macro averaged metrics over the labels found in the
+        targets and predictions, the classes that are neither in the targets nor in the predictions are ignored.
+        Returns:
+            Dictionary of {fold: [weighted_accuracy, unweighted_accuracy]}
+            List of [overal_wa, overall_ua, overall_macro_f1]
+        """
+        self.check_coverage()
+
+        results = {}
+        for fold, confusion_matrix in zip(self.folds, self.confusion_matrices):
+            metrics = calc_metrics_from_cm(self.get_present_classes_cm(confusion_matrix))
+            results[fold] = [float(metrics["weighted_accuracy"]) * 100, float(metrics["unweighted_accuracy"]) * 100]
+
+        overall_metrics = calc_metrics_from_cm(self.get_present_classes_cm(self.confusion_matrices.sum(axis=0)))
+        overall_results = [
+            float(overall_metrics["weighted_accuracy"]) * 100,
+            float(overall_metrics["unweighted_accuracy"]) * 100,
+            float(overall_metrics["macro_f1_score"]) * 100,
+        ]
+        return results, overall_results
+
+    def check_coverage(self):
+        """
+        Check that every target got exactly one prediction of the evaluated classes
+        """
+        errors = []
+        for mask, description in ((~self.seen, "no prediction of the evaluated classes"),
+                                  (self.duplicates, "several predictions")):
+            indices = np.flatnonzero(mask)
+            if len(indices):
+                errors.append(f"{len(indices)} targets have {description}{self.format_targets(indices)}")
+        if errors:
+            raise ValueError("; ".join(errors))
+
+    def format_targets(self, indices):
+        """
+        List the file names of the first targets of the indices, if they are known
+        """
+        if self.target_names is None:
+            return " (their file names are only known with the targets)"
+        names = [self.target_names[index] for index in indices[:MAX_LISTED_FILES]]
+        return ": " + ", ".join(names) + (", ..." if len(indices) > MAX_LISTED_FILES else "")
+
+    def bootstrap(self, num_samples=1000, seed=0):
+        """
+        Resample the predictions with replacement within every fold and true class (the strata of
+        `robuser.parsing.subsample`), which only needs the counts of the confusion matrices. The spread of the metrics
+        of the resamples estimates the error bars of the metrics of a subsample of the dataset.
+        Args:
+            num_samples: Number of bootstrap resamples
+            seed: Seed of the resampling
+        Returns:
+            Array of the overall [weighted_accuracy, unweighted_accuracy] of every resample in % (num_samples x 2)
+        """
+        rng = np.random.default_rng(seed)
+        num_classes = len(self.classes)
+        rows = self.confusion_matrices.reshape(-1, num_classes)
+        resampled_rows = np.zeros((num_samples, len(rows), num_classes), dtype=np.int64)
+        for index, row in enumerate(rows):
+            total = row.sum()
+            if total:
+                resampled_rows[:, index] = rng.multinomial(total, row / total, size=num_samples)
+        resampled = resampled_rows.reshape(num_samples, len(self.folds), num_classes, num_classes)
+        return accuracies_from_cms(resampled.sum(axis=1))
+
+    @staticmethod
+    def get_present_classes_cm(confusion_matrix):
+        """
+        Keep the rows and columns of the classes found in the targets or the predictions
+        """
+        present = (confusion_matrix.sum(axis=0) + confusion_matrix.sum(axis=1)) > 0
+        return confusion_matrix[np.ix_(present, present)]
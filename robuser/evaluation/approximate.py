@@ -0,0 +1,346 @@
+"""
+Fast approximate robustness evaluation on a stratified subsample of the dataset (see `robuser.parsing.subsample`).
+
+The predictions of the model on the clean and corrupted subsamples are scored together, and the utterances are
+resampled with replacement within every speaker and emotion. The resamples are paired (every resample weighs an
+utterance the same in every condition), so the error bars of the CEs and the mCE account for the correlation of the
+errors of the same utterances. As the width of the intervals shrinks with the square root of the number of
+utterances, the subsample size that would reach a target width of the mCE interval is estimated from the current one.
+
+Example usage:
+    python -m robuser.evaluation.approximate -i predictions.json -b results/iemocap_baseline_metrics.json \
+        -p <dataset_path> -d iemocap --subsample <corrupted_datasets_path>/robuser_subsample.txt --target_width 2
+"""
+
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+import tabulate
+
+from robuser.evaluation.accumulator import EXPECTED_CLASSES, accuracies_from_cms, percentile_interval, read_predictions
+from robuser.evaluation.calculate_ce import (
+    corruption_error_matrix, load_metrics, mean_corruption_error, relative_corruption_error_matrix
+)
+from robuser.parsing.subsample import load_subsample
+
+METRICS = ("weighted_accuracy", "unweighted_accuracy")
+# Minimum growth of the subsample between two rounds of `adaptive_robustness`, so that it takes a few rounds at most
+MIN_GROWTH = 1.5
+
+
+def load_predictions_index(index_path, chunk_size=10000):
+    """
+    Load the predictions of every condition listed in a predictions index, a JSON file in the format of the model
+    metrics file with the path of a predictions CSV file instead of every error rate, e.g.
+    {"clean": "clean.csv", "gaussian": {"level_1": "gaussian_1.csv", ...}, ...}
+    Args:
+        index_path: Path to the predictions index, the relative paths of the CSV files are relative to its directory
+        chunk_size: Number of predictions read at a time
+    Returns:
+        Dictionary of {"clean": {file_name: emotion}, corruption_type: {level: {file_name: emotion}}}
+    """
+    with open(index_path, "r") as f:
+        index = json.load(f)
+    if "clean" not in index:
+        raise ValueError(f"The predictions index {index_path} has no 'clean' predictions")
+
+    def load(preds_csv):
+        preds = {}
+        for file_names, emotions in read_predictions(os.path.join(os.path.dirname(index_path), preds_csv), chunk_size):
+            preds.update(zip(file_names, emotions))
+        return preds
+
+    return {
+        condition: load(value) if condition == "clean" else {level: load(csv) for level, csv in value.items()}
+        for condition, value in index.items()
+    }
+
+
+def stratified_bootstrap_weights(strata, num_samples, rng):
+    """
+    Draw the weights of the utterances in bootstrap resamples within every stratum
+    Args:
+        strata: Array of the stratum index of every utterance
+        num_samples: Number of resamples
+        rng: np.random.Generator
+    Returns:
+        Array of the number of times every utterance is drawn in every resample (num_samples x utterances)
+    """
+    weights = np.zeros((num_samples, len(strata)))
+    for stratum in np.unique(strata):
+        indices = np.flatnonzero(strata == stratum)
+        weights[:, indices] = rng.multinomial(len(indices), np.full(len(indices), 1 / len(indices)), size=num_samples)
+    return weights
+
+
+def bootstrap_error_rates(targets, predictions, weights, classes=EXPECTED_CLASSES, metric="unweighted_accuracy"):
+    """
+    Calculate the error rate of the predictions of a condition, for the whole subsample and every bootstrap resample
+    Args:
+        targets: Dictionary of {file_name: {"emotion": emotion, ...}} of the evaluated classes
+        predictions: Dictionary of {file_name: emotion}
+        weights: Weights of the utterances (in the order of the targets) in every resample (resamples x utterances)
+        classes: Names of the evaluated classes
+        metric: Accuracy the error rate is the complement of, "weighted_accuracy" or "unweighted_accuracy"
+    Returns:
+        Array of error rates in % (resamples,)
+    """
+    class_indices = {class_name: index for index, class_name in enumerate(classes)}
+    missing = [file_name for file_name in targets if predictions.get(file_name) not in class_indices]
+    if missing:
+        raise ValueError(f"{len(missing)} of the {len(targets)} targets have no prediction of the evaluated classes, "
+                         f"e.g. {missing[0]}")
+
+    true_classes = np.array([class_indices[target["emotion"]] for target in targets.values()])
+    predicted_classes = np.array([class_indices[predictions[file_name]] for file_name in targets])
+    one_hot = np.zeros((len(targets), len(classes) ** 2))
+    one_hot[np.arange(len(targets)), true_classes * len(classes) + predicted_classes] = 1
+    confusion_matrices = (weights @ one_hot).reshape(len(weights), len(classes), len(classes))
+    return 100 - accuracies_from_cms(confusion_matrices)[:, METRICS.index(metric)]
+
+
+def summarize(samples, confidence):
+    """
+    Summarize the estimate (the first sample) and the bootstrap samples of a metric
+    """
+    lower, upper = percentile_interval(samples[1:], confidence)
+    return {"estimate": float(samples[0]), "lower": float(lower), "upper": float(upper)}
+
+
+def bootstrap_robustness(targets, predictions, baseline_metrics_path, num_samples=1000, confidence=0.95,
+                         metric="unweighted_accuracy", seed=0, classes=EXPECTED_CLASSES):
+    """
+    Estimate the error rates, CEs and mCE of the model on a subsample of the dataset, with their confidence intervals
+    from a stratified, paired bootstrap of the utterances
+    Args:
+        targets: Dictionary of {file_name: {"emotion": emotion, "speaker_id": speaker_id, ...}} of the subsample
+        predictions: Predictions of every condition, as returned by `load_predictions_index`
+        baseline_metrics_path: Path to the baseline metrics json file with the error rates
+        num_samples: Number of bootstrap resamples
+        confidence: Confidence level of the intervals
+        metric: Accuracy the error rates are the complement of, "weighted_accuracy" or "unweighted_accuracy"
+        seed: Seed of the resampling
+        classes: Names of the evaluated classes
+    Returns:
+        Tuple of the model metrics (in the format of the metrics json files) and the report with the estimate and the
+        interval of every metric
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}', use one of {', '.join(METRICS)}")
+    targets = {key: value for key, value in sorted(targets.items()) if value["emotion"] in classes}
+    if not targets:
+        raise ValueError("None of the targets is of the evaluated classes")
+    strata = {}
+    stratum_indices = np.array([
+        strata.setdefault((target.get("speaker_id"), target["emotion"]), len(strata)) for target in targets.values()
+    ])
+    # The first row weighs every utterance once, for the estimates on the whole subsample
+    weights = np.vstack([
+        np.ones((1, len(targets))),
+        stratified_bootstrap_weights(stratum_indices, num_samples, np.random.default_rng(seed)),
+    ])
+
+    baseline_clean_errors, baseline_errors, corruption_types, levels = load_metrics([baseline_metrics_path])
+    for corruption_type, corruption_predictions in predictions.items():
+        if corruption_type == "clean":
+            continue
+        # The corruptions and levels missing from the baseline have no CE, as in the leaderboard
+        if corruption_type not in corruption_types:
+            corruption_types.append(corruption_type)
+        for level in corruption_predictions:
+            if level not in levels:
+                levels.append(level)
+    baseline_errors = np.pad(
+        baseline_errors,
+        ((0, 0), (0, len(corruption_types) - baseline_errors.shape[1]), (0, len(levels) - baseline_errors.shape[2])),
+        constant_values=np.nan,
+    )
+
+    clean_errors = bootstrap_error_rates(targets, predictions["clean"], weights, classes, metric)
+    errors = np.full((len(weights), len(corruption_types), len(levels)), np.nan)
+    for corruption_type, corruption_predictions in predictions.items():
+        if corruption_type == "clean":
+            continue
+        for level, level_predictions in corruption_predictions.items():
+            errors[:, corruption_types.index(corruption_type), levels.index(level)] = bootstrap_error_rates(
+                targets, level_predictions, weights, classes, metric
+            )
+
+    ces = corruption_error_matrix(baseline_errors, errors)[:, 0]
+    rces = relative_corruption_error_matrix(baseline_errors, baseline_clean_errors, errors, clean_errors)[:, 0]
+
+    model_metrics = {"clean": round(float(clean_errors[0]), 2)}
+    report = {
+        "num_utterances": len(targets),
+        "num_resamples": num_samples,
+        "confidence": confidence,
+        "metric": metric,
+        "clean_error": summarize(clean_errors, confidence),
+        "errors": {},
+        "CE": {},
+        "RCE": {},
+        # Averaged over the evaluated corruptions, the ones of the baseline without predictions have no CE
+        "mCE": summarize(mean_corruption_error(ces), confidence),
+        "relative_mCE": summarize(mean_corruption_error(rces), confidence),
+    }
+    for c, corruption_type in enumerate(corruption_types):
+        if corruption_type not in predictions:
+            continue
+        model_metrics[corruption_type] = {}
+        report["errors"][corruption_type] = {}
+        for level in predictions[corruption_type]:
+            level_errors = errors[:, c, levels.index(level)]
+            model_metrics[corruption_type][level] = round(float(level_errors[0]), 2)
+            report["errors"][corruption_type][level] = summarize(level_errors, confidence)
+        report["CE"][corruption_type] = summarize(ces[:, c], confidence)
+        report["RCE"][corruption_type] = summarize(rces[:, c], confidence)
+    return model_metrics, report
+
+
+def get_interval_width(summary):
+    return summary["upper"] - summary["lower"]
+
+
+def is_within_target(interval_width, target_width):
+    """
+    Check whether a confidence interval is at most the target width, an undefined width (e.g. no corruption of the
+    predictions has a CE against the baseline) never is
+    """
+    return bool(np.isfinite(interval_width) and interval_width <= target_width)
+
+
+def next_subsample_size(size, interval_width, target_width, max_size):
+    """
+    Estimate the subsample size at which the width of a confidence interval reaches the target width, as the width
+    shrinks with the square root of the number of utterances
+    Args:
+        size: Current number of files of the subsample
+        interval_width: Current width of the interval
+        target_width: Target width of the interval
+        max_size: Number of files of the dataset
+    Returns:
+        The next subsample size, at most the number of files of the dataset
+    """
+    if not np.isfinite(interval_width):
+        return min(math.ceil(size * MIN_GROWTH), max_size)
+    estimated_size = math.ceil(size * (interval_width / target_width) ** 2)
+    return min(max(estimated_size, math.ceil(size * MIN_GROWTH)), max_size)
+
+
+def adaptive_robustness(evaluate_subsample, baseline_metrics_path, target_width, initial_size, max_size, **kwargs):
+    """
+    Grow the subsample until the confidence interval of the mCE is at most the target width (or the subsample is the
+    whole dataset). With the same subsample seed, every subsample contains the previous ones, so with a cache of the
+    corrupted files (see `corrupt(..., subsample=size, cache_dir=...)`) only the new files are corrupted.
+    Args:
+        evaluate_subsample: Function of a subsample size, that corrupts the subsample, runs the model and returns the
+                            targets of the subsample and the predictions of every condition (see `bootstrap_robustness`)
+        baseline_metrics_path: Path to the baseline metrics json file with the error rates
+        target_width: Target width of the confidence interval of the mCE, in points of mCE
+        initial_size: Number of files of the first subsample
+        max_size: Number of files of the dataset
+        **kwargs: The other arguments of `bootstrap_robustness`
+    Returns:
+        Tuple of the final subsample size, the model metrics and the report
+    """
+    size = min(initial_size, max_size)
+    while True:
+        targets, predictions = evaluate_subsample(size)
+        model_metrics, report = bootstrap_robustness(targets, predictions, baseline_metrics_path, **kwargs)
+        if np.isnan(report["mCE"]["estimate"]):
+            raise ValueError("No corruption of the predictions has a CE against the baseline, the mCE is undefined")
+        width = get_interval_width(report["mCE"])
+        print(f"Subsample of {size} files: mCE {report['mCE']['estimate']:.2f}%, interval width {width:.2f}")
+        if is_within_target(width, target_width) or size >= max_size:
+            return size, model_metrics, report
+        size = next_subsample_size(size, width, target_width, max_size)
+
+
+def format_summary(summary):
+    return f"{summary['estimate']:.2f} [{summary['lower']:.2f}, {summary['upper']:.2f}]"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Estimate the robustness metrics of the model on a subsample, "
+                                                 "with their confidence intervals")
+    parser.add_argument("-i", "--predictions", type=str, required=True,
+                        help="Path to the predictions index json file, with the path of the predictions CSV file of "
+                             "every condition in the format of the model metrics file")
+    parser.add_argument("-b", "--baseline_metrics", type=str, required=True,
+                        help="Path to the baseline metrics json file with the error rates")
+    parser.add_argument("-p", "--data_path", type=str, required=True, help="Path to the dataset")
+    parser.add_argument("-d", "--dataset", type=str, choices=["iemocap"], required=True, help="Name of the dataset")
+    parser.add_argument("-m", "--manifest", type=str, required=False,
+                        help="Path of a manifest of the dataset to read the labels from, "
+                             "instead of parsing the annotations")
+    parser.add_argument("--subsample", type=str, required=False,
+                        help="List of the files of the subsample (robuser_subsample.txt, written by corrupt_dataset "
+                             "--subsample), by default every file of the dataset")
+    parser.add_argument("--metric", type=str, choices=METRICS, default="unweighted_accuracy",
+                        help="Accuracy the error rates are the complement of")
+    parser.add_argument("--num_samples", type=int, default=1000, help="Number of bootstrap resamples")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the intervals")
+    parser.add_argument("--target_width", type=float, default=None,
+                        help="Target width of the confidence interval of the mCE, to estimate the subsample size "
+                             "that reaches it")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the resampling")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="Path to save the estimated error rates, in the format of the model metrics file")
+    parser.add_argument("--report", type=str, default=None,
+                        help="Path to save the estimates and the confidence intervals of every metric (.json)")
+    return parser.parse_args()
+
+
+def main():
+    from robuser.evaluation.evaluate import get_targets
+
+    args = parse_args()
+    all_targets = get_targets(args.data_path, args.dataset, args.manifest)
+    targets = get_targets(args.data_path, args.dataset, args.manifest, args.subsample)
+    predictions = load_predictions_index(args.predictions)
+    model_metrics, report = bootstrap_robustness(
+        targets, predictions, args.baseline_metrics, args.num_samples, args.confidence, args.metric, args.seed
+    )
+
+    table = [
+        [corruption_type, format_summary(report["CE"][corruption_type]), format_summary(report["RCE"][corruption_type])]
+        for corruption_type in report["CE"]
+    ]
+    print(tabulate.tabulate(table, headers=["Corruption Type", "CE %", "RCE %"]))
+    print("---")
+    print(f"Estimates and {args.confidence:.0%} confidence intervals on {report['num_utterances']} utterances")
+    print(f"Clean error %: {format_summary(report['clean_error'])}")
+    print(f"Mean Corruption Error (mCE) %: {format_summary(report['mCE'])}")
+    print(f"Relative mCE %: {format_summary(report['relative_mCE'])}")
+
+    if args.target_width is not None:
+        width = get_interval_width(report["mCE"])
+        # The subsample size counts all its files, as --subsample of corrupt_dataset, not only the evaluated ones
+        size = len(all_targets) if args.subsample is None else len(load_subsample(args.subsample))
+        if is_within_target(width, args.target_width):
+            print(f"The mCE interval is {width:.2f} points wide, within the target of {args.target_width}")
+        elif np.isnan(report["mCE"]["estimate"]):
+            print("No corruption of the predictions has a CE against the baseline, the mCE is undefined")
+        elif size < len(all_targets):
+            report["next_subsample_size"] = next_subsample_size(size, width, args.target_width, len(all_targets))
+            print(f"The mCE interval is {width:.2f} points wide, grow the subsample to about "
+                  f"{report['next_subsample_size']} files (--subsample of corrupt_dataset, with the same seed)")
+        else:
+            print(f"The mCE interval is {width:.2f} points wide, above the target of {args.target_width} on the "
+                  f"whole dataset")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(model_metrics, f, indent=2)
+        print(f"Estimated error rates saved to {args.output}")
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
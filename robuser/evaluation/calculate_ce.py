@@ -1,5 +1,7 @@
 import argparse
+import csv
 import json
+import os
 import tabulate
 
 import numpy as np
@@ -36,49 +38,213 @@ def relative_corruption_error(baseline_errors, baseline_clean_error, model_error
     return rce
 
 
-def parse_args():
-    parser = argparse.ArgumentParser(description="Evaluate the model on the test set")
-    parser.add_argument("-i", "--model_metrics", type=str, required=True,
-                        help="Path to the model metrics json file with the error rates")
-    parser.add_argument("-b", "--baseline_metrics", type=str, required=True,
-                        help="Path to the baseline metrics json file with the error rates")
-    args = parser.parse_args()
-    return args
+def load_metrics(metrics_paths):
+    """
+    Load several metrics json files into a single tensor of error rates, reading every file once.
+    The corruption types and severity levels are aligned by name; the ones missing from a file are NaN.
+    Args:
+        metrics_paths: list of paths to the metrics json files
 
+    Returns:
+        Tuple of the clean error rates (n_files,), the error rates (n_files x n_corruptions x n_levels),
+        the corruption types and the severity levels
+    """
+    all_metrics = []
+    corruption_types, levels = {}, {}
+    for metrics_path in metrics_paths:
+        with open(metrics_path, "r") as f:
+            metrics = json.load(f)
+        if "clean" not in metrics:
+            raise ValueError(f"The metrics file {metrics_path} has no 'clean' error rate")
+        for corruption_type, corruption_errors in metrics.items():
+            if corruption_type == "clean":
+                continue
+            corruption_types.setdefault(corruption_type, len(corruption_types))
+            for level in corruption_errors:
+                levels.setdefault(level, len(levels))
+        all_metrics.append(metrics)
+
+    clean_errors = np.array([metrics["clean"] for metrics in all_metrics], dtype=np.float64)
+    errors = np.full((len(all_metrics), len(corruption_types), len(levels)), np.nan)
+    for i, metrics in enumerate(all_metrics):
+        for corruption_type, corruption_errors in metrics.items():
+            if corruption_type == "clean":
+                continue
+            for level, error in corruption_errors.items():
+                errors[i, corruption_types[corruption_type], levels[level]] = error
+
+    return clean_errors, errors, list(corruption_types), list(levels)
+
+
+def corruption_error_matrix(baseline_errors, model_errors):
+    """
+    Calculate the Corruption Error (CE) of every model against every baseline, for every corruption type.
+    Only the severity levels reported by both the model and the baseline are summed.
+    Args:
+        baseline_errors: np.array of baseline error rates (n_baselines x n_corruptions x n_levels)
+        model_errors: np.array of model error rates (n_models x n_corruptions x n_levels)
+
+    Returns:
+        np.array of corruption errors (n_models x n_baselines x n_corruptions)
+    """
+    model_mask, baseline_mask = ~np.isnan(model_errors), ~np.isnan(baseline_errors)
+    model_sums = np.einsum("mcl,bcl->mbc", np.where(model_mask, model_errors, 0), baseline_mask)
+    baseline_sums = np.einsum("mcl,bcl->mbc", model_mask, np.where(baseline_mask, baseline_errors, 0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ce = model_sums / baseline_sums * 100
+    # Corruptions without any common level are undefined
+    ce[np.einsum("mcl,bcl->mbc", model_mask, baseline_mask) == 0] = np.nan
+    return ce
+
+
+def relative_corruption_error_matrix(baseline_errors, baseline_clean_errors, model_errors, model_clean_errors):
+    """
+    Calculate the Relative Corruption Error of every model against every baseline, for every corruption type.
+    Args:
+        baseline_errors: np.array of baseline error rates (n_baselines x n_corruptions x n_levels)
+        baseline_clean_errors: np.array of baseline error rates on clean data (n_baselines,)
+        model_errors: np.array of model error rates (n_models x n_corruptions x n_levels)
+        model_clean_errors: np.array of model error rates on clean data (n_models,)
+    Returns:
+        np.array of relative corruption errors (n_models x n_baselines x n_corruptions)
+    """
+    return corruption_error_matrix(
+        baseline_errors - baseline_clean_errors[:, None, None], model_errors - model_clean_errors[:, None, None]
+    )
 
-def main():
-    args = parse_args()
-    with open(args.model_metrics, "r") as f:
-        model_metrics = json.load(f)
 
-    with open(args.baseline_metrics, "r") as f:
-        baseline_metrics = json.load(f)
+def mean_corruption_error(ces):
+    """
+    Average the CEs (or RCEs) over the corruption types, skipping the undefined ones (e.g. the corruptions missing from
+    the model or the baseline), as the mCE is the mean over the corruptions the model reports.
+    Args:
+        ces: np.array of corruption errors, with the corruption types on the last axis
+
+    Returns:
+        np.array of mean corruption errors, NaN where no corruption error is defined
+    """
+    defined = ~np.isnan(ces)
+    counts = defined.sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(defined, ces, 0).sum(axis=-1) / counts
+
 
-    corruption_types = model_metrics.keys() - {"clean"}
+def get_metrics_names(metrics_paths):
+    """
+    Name the metrics files by their file name, or by their full path if some file names are the same.
+    """
+    names = [os.path.splitext(os.path.basename(metrics_path))[0] for metrics_path in metrics_paths]
+    if len(set(names)) < len(names):
+        return list(metrics_paths)
+    return names
+
+
+def compute_leaderboard(model_metrics_paths, baseline_metrics_paths):
+    """
+    Calculate the CE, RCE, mCE and relative mCE of every model against every baseline.
+    Args:
+        model_metrics_paths: list of paths to the model metrics json files
+        baseline_metrics_paths: list of paths to the baseline metrics json files
 
-    model_clean_error = model_metrics["clean"]
-    baseline_clean_error = baseline_metrics["clean"]
+    Returns:
+        Tuple of the leaderboard rows (one dict per model and baseline pair) and the corruption types
+    """
+    # Loading the models and the baselines together aligns their corruption types and levels
+    clean_errors, errors, corruption_types, _ = load_metrics(list(model_metrics_paths) + list(baseline_metrics_paths))
+    n_models = len(model_metrics_paths)
+    model_clean_errors, baseline_clean_errors = clean_errors[:n_models], clean_errors[n_models:]
+    model_errors, baseline_errors = errors[:n_models], errors[n_models:]
+
+    ces = corruption_error_matrix(baseline_errors, model_errors)
+    rces = relative_corruption_error_matrix(baseline_errors, baseline_clean_errors, model_errors, model_clean_errors)
+    # The means are taken over the rounded errors, as they are reported
+    ces, rces = np.round(ces, 2), np.round(rces, 2)
+    mces, relative_mces = mean_corruption_error(ces), mean_corruption_error(rces)
+
+    rows = []
+    model_names, baseline_names = get_metrics_names(model_metrics_paths), get_metrics_names(baseline_metrics_paths)
+    for m, model_name in enumerate(model_names):
+        for b, baseline_name in enumerate(baseline_names):
+            row = {
+                "model": model_name,
+                "baseline": baseline_name,
+                "clean_error": model_clean_errors[m],
+                "mCE": mces[m, b],
+                "relative_mCE": relative_mces[m, b],
+            }
+            for c, corruption_type in enumerate(corruption_types):
+                row[f"CE_{corruption_type}"] = ces[m, b, c]
+                row[f"RCE_{corruption_type}"] = rces[m, b, c]
+            rows.append({key: float(value) if isinstance(value, float) else value for key, value in row.items()})
+
+    return rows, corruption_types
+
+
+def save_leaderboard(rows, output_path):
+    """
+    Save the leaderboard as a CSV or JSON file, depending on the extension of the output path.
+    """
+    if output_path.endswith(".json"):
+        # NaN (e.g. a corruption missing from a file) is not valid JSON
+        rows = [{key: None if isinstance(value, float) and np.isnan(value) else value for key, value in row.items()}
+                for row in rows]
+        with open(output_path, "w") as f:
+            json.dump(rows, f, indent=2)
+    else:
+        with open(output_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    print(f"Leaderboard saved to {output_path}")
 
-    ces, rces = {}, {}
-    for corruption_type in corruption_types:
-        model_errors = np.array([model_metrics[corruption_type][key] for key in model_metrics[corruption_type]])
-        baseline_errors = np.array(
-            [baseline_metrics[corruption_type][key] for key in baseline_metrics[corruption_type]])
-        ce = corruption_error(baseline_errors, model_errors)
-        ces[corruption_type] = round(ce, 2)
-        rce = relative_corruption_error(baseline_errors, baseline_clean_error, model_errors, model_clean_error)
-        rces[corruption_type] = round(rce, 2)
 
-    # ces and rces in the same table
-    table = []
-    for corruption_type in corruption_types:
-        table.append([corruption_type, ces[corruption_type], rces[corruption_type]])
+def parse_args():
+    parser = argparse.ArgumentParser(description="Evaluate the model on the test set")
+    parser.add_argument("-i", "--model_metrics", type=str, nargs="+", required=True,
+                        help="Path to the model metrics json file(s) with the error rates")
+    parser.add_argument("-b", "--baseline_metrics", type=str, nargs="+", required=True,
+                        help="Path to the baseline metrics json file(s) with the error rates")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="Path to save the leaderboard of every model against every baseline (.csv or .json)")
+    parser.add_argument("--sort_by", type=str, default="mCE",
+                        help="Column to sort the leaderboard by, in increasing order (e.g. mCE, relative_mCE)")
+    args = parser.parse_args()
+    return args
 
-    print(tabulate.tabulate(table, headers=["Corruption Type", "CE %", "RCE %"]))
 
-    print("---")
-    print(f"Mean Corruption Error (mCE) %: {np.mean(list(ces.values())):.2f}")
-    print(f"Relative mCE %: {np.mean(list(rces.values())):.2f}")
+def main():
+    args = parse_args()
+    rows, corruption_types = compute_leaderboard(args.model_metrics, args.baseline_metrics)
+
+    if len(rows) == 1 and args.output is None:
+        # ces and rces in the same table
+        row = rows[0]
+        table = []
+        for corruption_type in corruption_types:
+            # The corruptions the model does not report (or the baseline lacks) have no CE
+            if np.isnan(row[f"CE_{corruption_type}"]):
+                continue
+            table.append([corruption_type, row[f"CE_{corruption_type}"], row[f"RCE_{corruption_type}"]])
+
+        print(tabulate.tabulate(table, headers=["Corruption Type", "CE %", "RCE %"]))
+
+        print("---")
+        print(f"Mean Corruption Error (mCE) %: {row['mCE']:.2f}")
+        print(f"Relative mCE %: {row['relative_mCE']:.2f}")
+        return
+
+    if args.sort_by not in rows[0]:
+        raise ValueError(f"Cannot sort the leaderboard by '{args.sort_by}', the columns are: {list(rows[0])}")
+    # NaN values (e.g. missing corruptions) are sorted last
+    rows.sort(key=lambda row: (np.isnan(row[args.sort_by]) if isinstance(row[args.sort_by], float) else False,
+                               row[args.sort_by]))
+
+    print(tabulate.tabulate(
+        [[row["model"], row["baseline"], row["clean_error"], row["mCE"], row["relative_mCE"]] for row in rows],
+        headers=["Model", "Baseline", "Clean error %", "mCE %", "Relative mCE %"],
+    ))
+    if args.output is not None:
+        save_leaderboard(rows, args.output)
 
 
 if __name__ == "__main__":
@@ -1,60 +1,36 @@
 import argparse
 import os
 
-from sklearn.metrics import accuracy_score, recall_score
-from sklearn.metrics import confusion_matrix
+from functools import reduce
 
+from robuser.evaluation.accumulator import EvaluationAccumulator, percentile_interval, read_predictions
 from robuser.parsing.get_parser import get_parser_for_dataset
+from robuser.parsing.manifest import DatasetManifest
+from robuser.parsing.subsample import load_subsample
 
 
-def parse_csv(preds_csv):
+def get_targets(data_path, dataset_name, manifest_path=None, subsample_path=None):
     """
-    Parse the predictions CSV file into a dictionary
+    Get the labels of every file of the dataset, without reading any audio file
     Args:
-        preds_csv: Path to the predictions CSV file with the following columns:
-                   file_name (e.g. Ses05F_impro02_M007.wav), emotion
+        data_path: Path to the dataset, which may only contain the annotations (e.g. a labels-only copy)
+        dataset_name: Name of the dataset (e.g. iemocap)
+        manifest_path: Optional path of a manifest of the dataset to read the labels from
+        subsample_path: Optional list of the files of a subsample (see `robuser.parsing.subsample`), to only keep
+                        the labels of these files
     Returns:
-        Dictionary of {file_name: {"emotion": emotion}}
+        Dictionary of {file_name: {"emotion": emotion, ...}}
     """
-    preds = {}
-    with open(preds_csv, "r") as file:
-        for line in file:
-            file_name, emotion = line.strip().split(",")
-            preds[file_name] = {"emotion": emotion}
-
-    return preds
-
-
-def calc_metrics_from_cm(confusion_matrix):
-    metrics = {
-        "recall": [],
-        "weighted_recall": [],
-        "f1_score": [],
-    }
-    TPs = []
-    instances_per_class = []
-    for i in range(len(confusion_matrix)):
-        TP = confusion_matrix[i][i]
-        FN = sum(confusion_matrix[i]) - TP  # Sum the row except for TP to get FN
-        FP = sum(confusion_matrix[j][i] for j in range(len(confusion_matrix)) if j != i)
-
-        precision = TP / (TP + FP) if (TP + FP) != 0 else 0.0
-        recall = TP / (TP + FN) if (TP + FN) != 0 else 0.0
-        # accuracy = TP / sum(confusion_matrix[i]) if sum(confusion_matrix[i]) != 0 else 0.0
-        f1 = (
-            2 * (precision * recall) / (precision + recall)
-            if (precision + recall) != 0
-            else 0.0
-        )
-        TPs.append(TP)
-        instances_per_class.append(sum(confusion_matrix[i]))
-        metrics["recall"].append(recall)
-        metrics["f1_score"].append(f1)
-    metrics["weighted_accuracy"] = sum(TPs) / sum(instances_per_class)
-    metrics["unweighted_accuracy"] = sum(metrics["recall"]) / len(metrics["recall"])
-    metrics["macro_f1_score"] = sum(metrics["f1_score"]) / len(metrics["f1_score"])
-
-    return metrics
+    if manifest_path is not None:
+        targets = DatasetManifest.load(manifest_path, data_path).get_files_dict()
+    else:
+        parser = get_parser_for_dataset(dataset_name)(data_path)
+        targets = parser.run_parser(labels_only=True)
+    targets = {os.path.basename(k): v for k, v in targets.items()}
+    if subsample_path is not None:
+        subsample = load_subsample(subsample_path)
+        targets = {k: v for k, v in targets.items() if k in subsample}
+    return targets
 
 
 def evaluate_iemocap(preds, targets):
@@ -67,59 +43,57 @@ def evaluate_iemocap(preds, targets):
         Dictionary of {fold: [weighted_accuracy, unweighted_accuracy]}
         List of [overal_wa, overall_ua]
     """
+    accumulator, target_indices = EvaluationAccumulator.for_targets(targets)
+    accumulator.update(list(preds), [value["emotion"] for value in preds.values()], target_indices)
+    results, overall_results = accumulator.get_results()
+    return results, overall_results[:2]
 
-    # Only keep the expected classes
-    expected_classes = {"neutral", "happy", "sad", "angry"}
-    preds = {key: value for key, value in preds.items() if value["emotion"] in expected_classes}
-    targets = {key: value for key, value in targets.items() if value["emotion"] in expected_classes}
-
-    # Remove prediction keys that are not in the targets
-    preds = {key: value for key, value in preds.items() if key in targets}
-
-    # Check that the filenames are the same
-    if set(preds.keys()) != set(targets.keys()):
-        raise ValueError("Predictions and targets have different keys")
-
-    # Check that the lengths are the same
-    if len(preds) != len(targets):
-        raise ValueError(f"Predictions and targets have different lengths: {len(preds)} and {len(targets)}")
-
-    # Evaluate with 10-fold cross-validation
-    folds = set([target["speaker_id"] for target in targets.values()])
-
-    results = {}
-    for fold in sorted(folds):
-        fold_filenames = [key for key, value in targets.items() if value["speaker_id"] == fold]
-
-        fold_preds = [preds[key]["emotion"] for key in fold_filenames]
-        fold_targets = [targets[key]["emotion"] for key in fold_filenames]
-
-        # Calculate the WA
-        wa = accuracy_score(fold_targets, fold_preds) * 100
-
-        # Calculate the UA (macro averaged recall)
-        ua = recall_score(fold_targets, fold_preds, average="macro") * 100
-
-        results[fold] = [wa, ua]
 
-    all_filenames = list(targets.keys())
-    all_preds = [preds[key]["emotion"] for key in all_filenames]
-    all_targets = [targets[key]["emotion"] for key in all_filenames]
-
-    cm = confusion_matrix(all_targets, all_preds)
-    overall_metrics = calc_metrics_from_cm(cm)
-    overall_wa = overall_metrics["weighted_accuracy"] * 100
-    overall_ua = overall_metrics["unweighted_accuracy"] * 100
-
-    return results, [overall_wa, overall_ua]
+def accumulate_iemocap(preds_csv, targets, chunk_size=10000):
+    """
+    Score the predictions CSV file on IEMOCAP in chunks, without loading all the predictions in memory
+    Args:
+        preds_csv: Path to the predictions CSV file (see `read_predictions`), e.g. the predictions of an inference shard
+        targets: True labels: dictionary of {file_name: {"emotion": emotion, "fold": fold, "speaker_id": speaker_id}}
+        chunk_size: Number of predictions per chunk
+    Returns:
+        EvaluationAccumulator with the counts of the predictions, that can be merged with the ones of other shards
+    """
+    accumulator, target_indices = EvaluationAccumulator.for_targets(targets)
+    for file_names, emotions in read_predictions(preds_csv, chunk_size):
+        accumulator.update(file_names, emotions, target_indices)
+    return accumulator
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Evaluate the model on the test set")
-    parser.add_argument("-csv", "--predictions", type=str, required=True, help="Path to the predictions CSV file")
-    parser.add_argument("-p", "--data_path", type=str, required=True, help="Path to the dataset")
+    parser.add_argument("-csv", "--predictions", type=str, required=False, help="Path to the predictions CSV file")
+    parser.add_argument("-p", "--data_path", type=str, required=False,
+                        help="Path to the dataset (required with --predictions, names the missing and duplicate "
+                             "predictions with --merge)")
     parser.add_argument("-d", "--dataset", type=str, choices=["iemocap"], required=True, help="Name of the dataset")
+    parser.add_argument("-m", "--manifest", type=str, required=False,
+                        help="Path of a manifest of the dataset to read the labels from, "
+                             "instead of parsing the annotations")
+    parser.add_argument("--chunk_size", type=int, default=10000,
+                        help="Number of predictions read at a time")
+    parser.add_argument("--save_state", type=str, required=False,
+                        help="Save the evaluation state of the predictions (e.g. of an inference shard) to this path, "
+                             "to be merged later with --merge, instead of printing the results")
+    parser.add_argument("--merge", type=str, nargs="+", required=False,
+                        help="Evaluation states saved with --save_state to merge (e.g. one per inference shard)")
+    parser.add_argument("--subsample", type=str, required=False,
+                        help="List of the files of a subsample (robuser_subsample.txt, written by corrupt_dataset "
+                             "--subsample), to only evaluate the predictions of these files")
+    parser.add_argument("--bootstrap", type=int, default=0,
+                        help="Number of bootstrap resamples of the predictions, to print the confidence intervals "
+                             "of the overall results (e.g. 1000 for the predictions of a subsample)")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the intervals")
     args = parser.parse_args()
+    if args.predictions is None and not args.merge:
+        parser.error("either --predictions or --merge is required")
+    if args.predictions is not None and args.data_path is None:
+        parser.error("--data_path is required with --predictions")
     return args
 
 
@@ -127,26 +101,47 @@ def main():
     """Main entry point for the console script"""
     args = parse_args()
 
-    preds = parse_csv(args.predictions)
-    parser_class = get_parser_for_dataset(args.dataset)
-    print(f"Evaluating the predictions {args.predictions} on the {args.dataset} dataset at {args.data_path}")
-    if args.dataset == "iemocap":
-        parser = parser_class(args.data_path)
-        targets = parser.run_parser()
-        targets = {os.path.basename(k): v for k, v in targets.items()}
-        results, overall_results = evaluate_iemocap(preds, targets)
-
-        print("-" * 50)
-        print("Per-fold results:")
-        for fold, (wa, ua) in results.items():
-            print(f"Fold {fold}: WA: {wa:.2f}%, "
-                  f"UA: {ua:.2f}%")
-        print("-" * 50)
-        print(f"Overall results: WA: {overall_results[0]:.2f}%, "
-              f"UA: {overall_results[1]:.2f}%")
-    else:
+    if args.dataset != "iemocap":
         raise ValueError(f"Invalid dataset: {args.dataset}")
 
+    accumulators = []
+    targets = None
+    if args.data_path is not None:
+        # Only the annotations are read, the audio files are neither needed nor decoded
+        targets = get_targets(args.data_path, args.dataset, args.manifest, args.subsample)
+    if args.predictions is not None:
+        print(f"Evaluating the predictions {args.predictions} on the {args.dataset} dataset at {args.data_path}")
+        accumulators.append(accumulate_iemocap(args.predictions, targets, args.chunk_size))
+    if args.merge:
+        print(f"Merging {len(args.merge)} evaluation states")
+        accumulators.extend(EvaluationAccumulator.load(state_path) for state_path in args.merge)
+    accumulator = reduce(EvaluationAccumulator.merge, accumulators)
+    if accumulator.target_names is None and targets is not None:
+        target_names = EvaluationAccumulator.get_target_names(targets, accumulator.classes)
+        # The states of other targets (e.g. of another subsample) cannot be named from these ones
+        if len(target_names) == accumulator.num_targets:
+            accumulator.target_names = target_names
+
+    if args.save_state is not None:
+        accumulator.save(args.save_state)
+        print(f"Evaluation state of {accumulator.num_predictions} predictions saved to {args.save_state}")
+        return
+
+    results, overall_results = accumulator.get_results()
+
+    print("-" * 50)
+    print("Per-fold results:")
+    for fold, (wa, ua) in results.items():
+        print(f"Fold {fold}: WA: {wa:.2f}%, "
+              f"UA: {ua:.2f}%")
+    print("-" * 50)
+    print(f"Overall results: WA: {overall_results[0]:.2f}%, "
+          f"UA: {overall_results[1]:.2f}%")
+    if args.bootstrap:
+        lower, upper = percentile_interval(accumulator.bootstrap(args.bootstrap), args.confidence)
+        print(f"{args.confidence:.0%} confidence intervals of {accumulator.num_predictions} predictions: "
+              f"WA: [{lower[0]:.2f}%, {upper[0]:.2f}%], UA: [{lower[1]:.2f}%, {upper[1]:.2f}%]")
+
 
 if __name__ == "__main__":
     main()
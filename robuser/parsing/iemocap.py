@@ -9,10 +9,7 @@
 import os
 import string
 import argparse
-import librosa
-import soundfile as sf
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
 
 from robuser.parsing.parser import Parser
 from robuser.corruptions.utils import get_supported_audio_extensions
@@ -43,24 +40,43 @@ class ParserForIEMOCAP(Parser):
     
 
     def resample_audio(self, file_path):
-        y, sr = librosa.load(file_path, sr=None)
-        if sr != self.target_sr:
-            y = librosa.resample(y, orig_sr=sr, target_sr=self.target_sr)
-            sf.write(file_path, y, self.target_sr)
+        from robuser.corruptions.resampler import resample_file
+
+        resample_file(file_path, self.target_sr)
 
     def resample_iemocap(self, session):
-        with ThreadPoolExecutor() as executor:
-            files_to_resample = []
-            audio_extensions = get_supported_audio_extensions()
-            for root, _, files in os.walk(self.wav_files_path % session):
-                for file in files:
-                    if file.lower().endswith(audio_extensions):
-                        files_to_resample.append(os.path.join(root, file))
+        from robuser.corruptions.resampler import resample_files
+
+        files_to_resample = []
+        audio_extensions = get_supported_audio_extensions()
+        for root, _, files in os.walk(self.wav_files_path % session):
+            for file in files:
+                if file.lower().endswith(audio_extensions):
+                    files_to_resample.append(os.path.join(root, file))
 
-            list(tqdm(executor.map(self.resample_audio, files_to_resample), total=len(files_to_resample),
-                      desc=f"Resampling IEMOCAP Session {session} to {self.target_sr}Hz"))
+        # The files are resampled by worker processes, the ones already at the target sample rate are not decoded
+        resample_files(files_to_resample, self.target_sr,
+                       desc=f"Resampling IEMOCAP Session {session} to {self.target_sr}Hz")
 
 
+    def get_label_files(self):
+        """!
+        @brief Get the annotation files of all the sessions.
+
+        @returns \b label_files (\a list) Paths of the annotation
+                 files the labels are read from.
+        """
+        label_files = []
+        for session in self.sessions:
+            annotation_path = self.annotation_path % session
+            if not os.path.isdir(annotation_path):
+                continue
+            label_files.extend(
+                os.path.join(annotation_path, annotation_file)
+                for annotation_file in sorted(os.listdir(annotation_path))
+                if annotation_file.endswith(".txt") and not annotation_file.startswith("."))
+        return label_files
+
     def get_utterances_per_dialog(self, session):
         """!
         @brief Get all the utterances for each dialog inside a
@@ -74,14 +90,19 @@ class ParserForIEMOCAP(Parser):
                  dialog to the corresponding utterances.
         """
         dialog_to_utterances = {}
-        for root, dirs, files in os.walk(self.wav_files_path % session):
-            if not dirs:
-                dialog = os.path.basename(root)
-                audio_extensions = get_supported_audio_extensions() + (".npz",)
-                dialog_to_utterances[dialog] = [
-                    os.path.join(root, audiofile)
-                    for audiofile in files if
-                    os.path.splitext(audiofile)[1].lower() in audio_extensions]
+        wav_files_path = os.path.normpath(self.wav_files_path % session)
+        audio_extensions = get_supported_audio_extensions() + (".npz",)
+        for root, dirs, files in os.walk(wav_files_path):
+            # The dialogs are the leaf directories below the wav directory
+            # (not the wav directory itself, e.g. when it is empty)
+            if dirs or os.path.normpath(root) == wav_files_path:
+                continue
+            utterances = [
+                os.path.join(root, audiofile)
+                for audiofile in files if
+                os.path.splitext(audiofile)[1].lower() in audio_extensions]
+            if utterances:
+                dialog_to_utterances[os.path.basename(root)] = utterances
         return dialog_to_utterances
 
     def get_annotation_per_utterance_per_dialog(self,
@@ -128,44 +149,97 @@ class ParserForIEMOCAP(Parser):
                  annotation found. (E.g. {'/path/to/Utterance_1.wav':
                  {'emotion': 'neu', 'valence': 2.500, ...}, ...})
         """
+        annotations = self.parse_annotation_file(annotation_file)
+
         annotation_per_utterance = {}
+        for utterance in utterances:
+            utterance_name = os.path.splitext(os.path.basename(utterance))[0]
+            if utterance_name not in annotations:
+                raise ValueError(f"{utterance_name} is not annotated in {annotation_file}")
+            annotation_per_utterance[utterance] = annotations[utterance_name]
+
+        return annotation_per_utterance
+
+    def parse_annotation_file(self, annotation_file):
+        """!
+        @brief Parse the annotation of every utterance of an
+               annotation file, in a single pass over the file.
+
+        @param annotation_file (\a str) Path of the annotation file.
+
+        @returns \b annotations (\a dict) Dictionary which maps the
+                 name of each annotated utterance to its annotation,
+                 in the order of the file. (E.g. {'Utterance_1':
+                 {'emotion': 'neu', 'valence': '2.5000', ...}, ...})
+        """
+        annotations = {}
 
         with open(annotation_file, "r") as annfile:
-            annfile_list = annfile.read().split()
-
-            for utterance in utterances:
-                annotation = dict(emotion=None, valence=None,
-                                  activation=None, dominance=None)
-                utterance_idx = annfile_list.index(
-                    os.path.splitext(os.path.basename(utterance))[0])
-                emotion_label_idx = utterance_idx + 1
-                val_label_idx = utterance_idx + 2
-                act_label_idx = utterance_idx + 3
-                dom_label_idx = utterance_idx + 4
-                start_time_idx = utterance_idx - 3
-                end_time_idx = utterance_idx - 1
-
-                annotation["emotion"] = annfile_list[emotion_label_idx]
-                annotation["valence"] = annfile_list[val_label_idx] \
-                    .strip(string.punctuation)
-                annotation["activation"] = annfile_list[act_label_idx] \
-                    .strip(string.punctuation)
-                annotation["dominance"] = annfile_list[dom_label_idx] \
-                    .strip(string.punctuation)
-                annotation["start"] = annfile_list[start_time_idx] \
-                    .strip(string.punctuation)
-                annotation["end"] = annfile_list[end_time_idx] \
-                    .strip(string.punctuation)
-                
-                annotation_per_utterance[utterance] = annotation
+            for line in annfile:
+                # Utterance lines: [START_TIME - END_TIME] TURN_NAME EMOTION [V, A, D]
+                if not line.startswith("["):
+                    continue
+                tokens = line.split()
+                utterance_name = tokens[3]
+                if utterance_name in annotations:
+                    continue
+
+                annotations[utterance_name] = dict(
+                    emotion=tokens[4],
+                    valence=tokens[5].strip(string.punctuation),
+                    activation=tokens[6].strip(string.punctuation),
+                    dominance=tokens[7].strip(string.punctuation),
+                    start=tokens[0].strip(string.punctuation),
+                    end=tokens[2].strip(string.punctuation))
 
-        return annotation_per_utterance
+        return annotations
 
-    def get_annotations(self):
+    def get_utterances_per_dialog_from_annotations(self, session):
+        """!
+        @brief Get all the utterances for each dialog inside a
+               specific session from the annotation files, for when
+               the audio files are not available. The dialogs found in
+               the directory listing keep their audio files, the others
+               get the paths where the .wav files would be. Only the
+               dialogs with an annotation file are kept.
+
+        @param session (\a int) Integer from 1 to 5, defining the
+               session we are interested in.
+
+        @returns \b dialog_to_utterances (\a dict) Dictionary which
+                 contains all the dialogs in the session and maps each
+                 dialog to the corresponding utterances.
+        """
+        annotation_path = self.annotation_path % session
+        if not os.path.isdir(annotation_path):
+            return {}
+        # Skip hidden files (e.g. ._Ses01F_impro01.txt)
+        annotated_dialogs = [
+            os.path.splitext(annotation_file)[0]
+            for annotation_file in sorted(os.listdir(annotation_path))
+            if annotation_file.endswith(".txt") and not annotation_file.startswith(".")]
+
+        listed_utterances = self.get_utterances_per_dialog(session)
+        dialog_to_utterances = {}
+        for dialog in annotated_dialogs:
+            if dialog in listed_utterances:
+                dialog_to_utterances[dialog] = listed_utterances[dialog]
+                continue
+            utterance_names = self.parse_annotation_file(os.path.join(annotation_path, dialog + ".txt"))
+            dialog_to_utterances[dialog] = [
+                os.path.join(self.wav_files_path % session, dialog, utterance_name + ".wav")
+                for utterance_name in utterance_names]
+        return dialog_to_utterances
+
+    def get_annotations(self, labels_only=False):
         """!
         @brief Get the annotation for each utterance for each dialog
                inside each session.
 
+        @param labels_only (\a bool) Find the utterances from the
+               annotation files as well, for when the audio files are
+               not available.
+
         @returns \b annotations (\a dict) Dictionary in the following
                  format: {'Session1': {'Dialog_1':
                  {'/path/to/Utterance_1.wav': {'emotion': 'neu',
@@ -175,8 +249,12 @@ class ParserForIEMOCAP(Parser):
         annotations = {}
 
         for session in self.sessions:
-            dialog_to_utterances = \
-                self.get_utterances_per_dialog(session)
+            if labels_only:
+                dialog_to_utterances = \
+                    self.get_utterances_per_dialog_from_annotations(session)
+            else:
+                dialog_to_utterances = \
+                    self.get_utterances_per_dialog(session)
             annotations["Session%d" % session] = \
                 self.get_annotation_per_utterance_per_dialog(
                     dialog_to_utterances, session)
@@ -238,10 +316,20 @@ class ParserForIEMOCAP(Parser):
 
         return speaker_id, gender, channel
 
-    def run_parser(self):
-        for session in tqdm(self.sessions, desc="Processing IEMOCAP Sessions"):
-            self.resample_iemocap(session)
-        annotations = self.get_annotations()
+    def run_parser(self, labels_only=False):
+        """!
+        @brief Find all the utterances and their labels, resampling
+               the audio files to the target sample rate.
+
+        @param labels_only (\a bool) Only read the annotation files
+               and the directory listing, without resampling (i.e.
+               decoding and rewriting) any audio file. This also works
+               on a copy of the dataset without the audio files.
+        """
+        if not labels_only:
+            for session in tqdm(self.sessions, desc="Processing IEMOCAP Sessions"):
+                self.resample_iemocap(session)
+        annotations = self.get_annotations(labels_only)
         annotated_utterances = \
             self.convert_annotations_in_audio_hierarchy(annotations)
 
@@ -0,0 +1,374 @@
+"""
+    Manifest of a dataset, built once and shared by all the corruption configurations,
+    runs and the evaluation. For every audio file it records the relative path, the
+    labels found by the dataset parser and the header information (sample rate,
+    frames, channels), along with the size and mtime used to invalidate it. The
+    label files of the parser (e.g. the annotation files) and its version
+    invalidate it as well.
+
+    Example usage:
+        python -m robuser.parsing.manifest -i /path/to/IEMOCAP/ -d iemocap
+"""
+
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import soundfile as sf
+
+from robuser.corruptions.utils import get_supported_audio_extensions, signal_power
+from robuser.parsing.get_parser import get_parser_for_dataset
+from robuser.parsing.subsample import DEFAULT_STRATA, DEFAULT_SUBSAMPLE_SEED, stratified_subsample
+
+MANIFEST_FILENAME = "robuser_manifest.npz"
+
+# Prefix of the columns with the labels found by the dataset parser
+LABEL_PREFIX = "label_"
+
+
+def list_audio_files(dataset_path):
+    """
+    Lists the audio files of a dataset with their size and modification time.
+
+    Args:
+        dataset_path (str): path to the dataset
+
+    Returns:
+        dict: the relative paths of the audio files mapped to (size, mtime in ns)
+    """
+    audio_files = {}
+    audio_extensions = get_supported_audio_extensions()
+    for root, _, files in os.walk(dataset_path):
+        for file in files:
+            if file.lower().endswith(audio_extensions):
+                file_path = os.path.join(root, file)
+                stat = os.stat(file_path)
+                audio_files[os.path.relpath(file_path, dataset_path)] = (stat.st_size, stat.st_mtime_ns)
+    return audio_files
+
+
+def list_label_files(dataset_path, parser):
+    """
+    Lists the files the dataset parser reads the labels from (e.g. the annotation files) with their size and
+    modification time.
+
+    Args:
+        dataset_path (str): path to the dataset
+        parser (Parser): the parser of the dataset, or None for a directory without labels
+
+    Returns:
+        dict: the relative paths of the label files mapped to (size, mtime in ns)
+    """
+    label_files = {}
+    if parser is not None:
+        for file_path in parser.get_label_files():
+            stat = os.stat(file_path)
+            label_files[os.path.relpath(file_path, dataset_path)] = (stat.st_size, stat.st_mtime_ns)
+    return label_files
+
+
+def get_parser_id(parser):
+    """
+    Returns the name and version of a dataset parser, or an empty string for a directory without labels.
+    """
+    return "" if parser is None else f"{type(parser).__name__}:{parser.version}"
+
+
+def get_listing_signature(audio_files, label_files=None, parser_id=""):
+    """
+    Computes a signature of the files of a dataset, that changes when an audio file or a label file is added,
+    removed or modified, or when the dataset parser changes.
+
+    Args:
+        audio_files (dict): the output of `list_audio_files`
+        label_files (dict): the output of `list_label_files`
+        parser_id (str): the output of `get_parser_id`
+
+    Returns:
+        str: hex digest of the listing
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{parser_id}\n".encode())
+    for kind, files in (("audio", audio_files), ("labels", label_files or {})):
+        for relative_path in sorted(files):
+            size, mtime = files[relative_path]
+            digest.update(f"{kind}\0{relative_path}\0{size}\0{mtime}\n".encode())
+    return digest.hexdigest()
+
+
+def probe_audio_file(file_path):
+    """
+    Reads the sample rate, number of frames and channels of an audio file from its header.
+
+    Args:
+        file_path (str): path to the audio file
+
+    Returns:
+        tuple: (sample rate, frames, channels)
+    """
+    try:
+        info = sf.info(file_path)
+        return info.samplerate, info.frames, info.channels
+    except (RuntimeError, sf.LibsndfileError):
+        # Formats that libsndfile cannot read (e.g. m4a) have to be decoded
+        import librosa
+
+        audio, sample_rate = librosa.load(file_path, sr=None, mono=False)
+        channels = 1 if audio.ndim == 1 else audio.shape[0]
+        return sample_rate, audio.shape[-1], channels
+
+
+def compute_audio_power(file_path):
+    """
+    Computes the power (mean square) of the mono signal of an audio file.
+    """
+    import librosa
+
+    audio, _ = librosa.load(file_path, sr=None)
+    return signal_power(audio)
+
+
+class DatasetManifest:
+    """
+    Columnar manifest of the audio files of a dataset.
+
+    The columns are numpy arrays with one entry per file, sorted by relative path:
+        * relative_path, sample_rate, frames, channels, size, mtime (in ns)
+        * power: the power of the signal (NaN if it was not computed)
+        * label_<name>: the labels found by the dataset parser (e.g. label_emotion)
+    """
+
+    def __init__(self, dataset_path, columns, dataset_name=None, listing_signature=None):
+        """
+        Initialize the DatasetManifest class
+
+        Args:
+            dataset_path (str): path to the dataset
+            columns (dict): the columns of the manifest
+            dataset_name (str): name of the dataset (e.g. iemocap), or None for a directory without labels
+            listing_signature (str): signature of the files of the dataset (see `get_listing_signature`)
+        """
+        self.dataset_path = dataset_path
+        self.columns = columns
+        self.dataset_name = dataset_name
+        self.listing_signature = listing_signature
+
+    def __len__(self):
+        return len(self.columns["relative_path"])
+
+    @property
+    def label_names(self):
+        return [name[len(LABEL_PREFIX):] for name in self.columns if name.startswith(LABEL_PREFIX)]
+
+    @property
+    def file_paths(self):
+        return [os.path.join(self.dataset_path, relative_path) for relative_path in self.columns["relative_path"]]
+
+    @property
+    def durations(self):
+        """
+        Durations of the files in seconds
+        """
+        return self.columns["frames"] / self.columns["sample_rate"]
+
+    def get_files_dict(self):
+        """
+        Returns the files of the manifest in the format of `Parser.run_parser`.
+
+        Returns:
+            dict: the audio file paths mapped to their labels (None if the dataset has no labels)
+        """
+        label_names = self.label_names
+        if not label_names:
+            return {file_path: None for file_path in self.file_paths}
+
+        label_columns = [self.columns[LABEL_PREFIX + name].tolist() for name in label_names]
+        return {
+            file_path: dict(zip(label_names, labels))
+            for file_path, labels in zip(self.file_paths, zip(*label_columns))
+        }
+
+    def subsample(self, size, seed=DEFAULT_SUBSAMPLE_SEED, strata_labels=DEFAULT_STRATA):
+        """
+        Takes a stratified random subsample of the files (see `robuser.parsing.subsample`).
+
+        Args:
+            size (float): number of files of the subsample, or the fraction of the files if below 1
+            seed (int): seed of the subsample
+            strata_labels (tuple): names of the labels to stratify by (e.g. speaker_id and emotion)
+
+        Returns:
+            DatasetManifest: the manifest of the files of the subsample, which is not saved
+        """
+        file_paths = self.file_paths
+        selected = stratified_subsample(self.get_files_dict(), size, seed, strata_labels)
+        rows = np.array([index for index, file_path in enumerate(file_paths) if file_path in selected], dtype=np.int64)
+        columns = {name: column[rows] for name, column in self.columns.items()}
+        return DatasetManifest(self.dataset_path, columns, self.dataset_name)
+
+    def save(self, manifest_path):
+        """
+        Saves the manifest as a compressed .npz file.
+        """
+        np.savez_compressed(
+            manifest_path,
+            dataset_name=np.array("" if self.dataset_name is None else self.dataset_name),
+            listing_signature=np.array(self.listing_signature or ""),
+            **self.columns,
+        )
+
+    @classmethod
+    def load(cls, manifest_path, dataset_path):
+        """
+        Loads a manifest saved with `save`.
+
+        Args:
+            manifest_path (str): path to the manifest file
+            dataset_path (str): path to the dataset the manifest describes
+
+        Returns:
+            DatasetManifest: the loaded manifest
+        """
+        with np.load(manifest_path, allow_pickle=False) as data:
+            columns = {name: data[name] for name in data.files if name not in ("dataset_name", "listing_signature")}
+            dataset_name = str(data["dataset_name"]) or None
+            listing_signature = str(data["listing_signature"]) or None
+        return cls(dataset_path, columns, dataset_name, listing_signature)
+
+
+def to_column(values):
+    """
+    Converts a list of values to a numpy column that can be saved without pickling.
+    """
+    column = np.asarray(values)
+    if column.dtype == object:
+        column = column.astype(str)
+    return column
+
+
+def build_manifest(dataset_path, dataset_name=None, manifest_path=None, compute_power=False):
+    """
+    Builds the manifest of a dataset, reusing the manifest saved by a previous run for the files that have not
+    changed since (same size and mtime). If no audio or label file was added, removed or modified, the saved
+    manifest is returned without running the dataset parser.
+
+    Args:
+        dataset_path (str): path to the dataset
+        dataset_name (str): name of the dataset (e.g. iemocap), or None for a directory without labels
+        manifest_path (str): path of the manifest file, reused and updated across runs, or None to build the
+                             manifest in memory without saving it
+        compute_power (bool): also compute the power of every file, which requires decoding it
+
+    Returns:
+        DatasetManifest: the manifest of the dataset
+    """
+    parser = None if dataset_name is None else get_parser_for_dataset(dataset_name)(dataset_path)
+    label_files, parser_id = list_label_files(dataset_path, parser), get_parser_id(parser)
+
+    previous_manifest = None
+    if manifest_path is not None and os.path.exists(manifest_path):
+        previous_manifest = DatasetManifest.load(manifest_path, dataset_path)
+        if previous_manifest.dataset_name != dataset_name:
+            previous_manifest = None
+
+    audio_files = list_audio_files(dataset_path)
+    if (
+        previous_manifest is not None
+        and previous_manifest.listing_signature == get_listing_signature(audio_files, label_files, parser_id)
+    ):
+        if not compute_power or not np.isnan(previous_manifest.columns["power"]).any():
+            return previous_manifest
+
+    # Find the files of the dataset and their labels
+    if parser is not None:
+        files_dict = parser.run_parser()
+        # The parser may rewrite some files (e.g. resampling), so they are listed again
+        audio_files = list_audio_files(dataset_path)
+    else:
+        files_dict = {os.path.join(dataset_path, relative_path): None for relative_path in audio_files}
+
+    files = sorted(
+        (os.path.relpath(file_path, dataset_path), labels) for file_path, labels in files_dict.items()
+    )
+
+    previous_rows = {}
+    if previous_manifest is not None:
+        previous_columns = previous_manifest.columns
+        for index, relative_path in enumerate(previous_columns["relative_path"].tolist()):
+            previous_rows[relative_path] = index
+
+    rows = []
+    for relative_path, _ in files:
+        file_path = os.path.join(dataset_path, relative_path)
+        size, mtime = audio_files.get(relative_path) or (os.path.getsize(file_path), os.stat(file_path).st_mtime_ns)
+        index = previous_rows.get(relative_path)
+        if (
+            index is not None
+            and previous_columns["size"][index] == size
+            and previous_columns["mtime"][index] == mtime
+            and (not compute_power or not np.isnan(previous_columns["power"][index]))
+        ):
+            rows.append(
+                (
+                    int(previous_columns["sample_rate"][index]),
+                    int(previous_columns["frames"][index]),
+                    int(previous_columns["channels"][index]),
+                    size,
+                    mtime,
+                    float(previous_columns["power"][index]),
+                )
+            )
+            continue
+
+        sample_rate, frames, channels = probe_audio_file(file_path)
+        power = compute_audio_power(file_path) if compute_power else np.nan
+        rows.append((sample_rate, frames, channels, size, mtime, power))
+
+    sample_rates, frames, channels, sizes, mtimes, powers = zip(*rows) if rows else ([],) * 6
+    columns = {
+        "relative_path": to_column([relative_path for relative_path, _ in files]),
+        "sample_rate": np.asarray(sample_rates, dtype=np.int32),
+        "frames": np.asarray(frames, dtype=np.int64),
+        "channels": np.asarray(channels, dtype=np.int16),
+        "size": np.asarray(sizes, dtype=np.int64),
+        "mtime": np.asarray(mtimes, dtype=np.int64),
+        "power": np.asarray(powers, dtype=np.float32),
+    }
+    if files and files[0][1] is not None:
+        for label_name in files[0][1]:
+            columns[LABEL_PREFIX + label_name] = to_column([labels[label_name] for _, labels in files])
+
+    manifest = DatasetManifest(
+        dataset_path, columns, dataset_name, get_listing_signature(audio_files, label_files, parser_id)
+    )
+    if manifest_path is not None:
+        try:
+            manifest.save(manifest_path)
+        except OSError as e:
+            print(f"Could not save the manifest to {manifest_path}: {e}")
+
+    return manifest
+
+
+def parse_arguments():
+    """!
+    @brief Parse Arguments for building the manifest of a dataset.
+    """
+    args_parser = argparse.ArgumentParser(description="Build the manifest of a dataset")
+    args_parser.add_argument("-i", "--input", required=True, help="Path of the dataset")
+    args_parser.add_argument("-d", "--dataset", required=False, help="Name of the dataset (e.g. iemocap)")
+    args_parser.add_argument(
+        "-m", "--manifest", required=False, help=f"Path of the manifest file (default: <input>/{MANIFEST_FILENAME})"
+    )
+    args_parser.add_argument(
+        "--power", action="store_true", help="Also compute the power of every file, which requires decoding it"
+    )
+    return args_parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    manifest_path = args.manifest or os.path.join(args.input, MANIFEST_FILENAME)
+    manifest = build_manifest(args.input, args.dataset, manifest_path, compute_power=args.power)
+    print(f"Manifest with {len(manifest)} files and {manifest.durations.sum() / 3600:.2f} hours of audio")
@@ -2,13 +2,30 @@ from abc import abstractmethod, ABC
 
 
 class Parser(ABC):
+    # Version of the labels found by the parser, to bump when they change for the same files (e.g. a new mapping of
+    # the emotions), so that the saved manifests are rebuilt
+    version = 1
+
     def __init__(self, data_path):
         self.data_path = data_path
 
+    def get_label_files(self):
+        """
+
+        Returns:
+            The paths of the files the labels are read from (e.g. the annotation files), so that the saved manifests
+            are rebuilt when they change
+        """
+        return []
+
     @abstractmethod
-    def run_parser(self):
+    def run_parser(self, labels_only=False):
         """
 
+        Args:
+            labels_only: only read the labels (e.g. from the annotation files and the directory listing),
+                         without decoding or rewriting any audio file, so that it also works without the audio
+
         Returns:
             A dictionary with the following format:
             {
@@ -0,0 +1,166 @@
+"""
+    Stratified subsampling of a dataset, for a fast approximate robustness evaluation: the corruptions, the inference
+    and the evaluation run on a subsample of the utterances with the same proportions of every speaker and emotion.
+
+    The files are ordered once by stratum and a priority derived from the seed and their file name, so that every
+    subsample size takes a prefix of the same order: a larger subsample contains the smaller ones (and reuses their
+    corrupted files, e.g. from the cache), and every stratum gets its share of the subsample, up to one file.
+
+    Example usage:
+        python -m robuser.parsing.subsample -i /path/to/IEMOCAP/ -d iemocap -n 500 -o subsample.txt
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from robuser.corruptions.utils import derive_seed
+
+# Labels the subsample is stratified by, the ones a dataset does not have are ignored
+DEFAULT_STRATA = ("speaker_id", "emotion")
+# Seed of the subsample when none is given
+DEFAULT_SUBSAMPLE_SEED = 42
+SUBSAMPLE_FILENAME = "robuser_subsample.txt"
+
+
+def stratified_order(file_names, strata, seed=DEFAULT_SUBSAMPLE_SEED):
+    """
+    Orders the files of a dataset so that every prefix of the order is a stratified random subsample.
+
+    Within every stratum, the files are ranked by a priority derived from the seed and their file name. A file of rank r
+    in a stratum of m files is placed at (r + 0.5) / m, so the first n files of the order hold n * m / N files of every
+    stratum, up to one file.
+
+    Args:
+        file_names (list): the name of every file, which identifies it in every copy of the dataset (e.g. the
+                           corrupted datasets and the predictions)
+        strata (list): the stratum of every file (any hashable value, e.g. a tuple of labels)
+        seed (int): seed of the subsample
+
+    Returns:
+        np.array: the indices of the files, in the order of the subsamples
+    """
+    priorities = np.array([derive_seed(seed, file_name) for file_name in file_names], dtype=np.int64)
+
+    positions = np.empty(len(file_names), dtype=np.float64)
+    stratum_indices = {}
+    for index, stratum in enumerate(strata):
+        stratum_indices.setdefault(stratum, []).append(index)
+    for indices in stratum_indices.values():
+        indices = np.array(indices)
+        ranked = indices[np.lexsort((np.array(file_names, dtype=object)[indices], priorities[indices]))]
+        positions[ranked] = (np.arange(len(ranked)) + 0.5) / len(ranked)
+
+    # The files at the same position (e.g. of strata of the same size) are ordered by priority
+    return np.lexsort((priorities, positions))
+
+
+def get_strata(files_dict, strata_labels=DEFAULT_STRATA):
+    """
+    Returns the stratum of every file of a dataset, the tuple of its labels to stratify by.
+
+    Args:
+        files_dict (dict): the file paths mapped to their labels, as returned by `Parser.run_parser` (None for the
+                           datasets without labels)
+        strata_labels (tuple): names of the labels to stratify by
+
+    Returns:
+        list: the stratum of every file, in the order of the dict
+    """
+    return [
+        () if labels is None else tuple(labels.get(name) for name in strata_labels)
+        for labels in files_dict.values()
+    ]
+
+
+def get_subsample_size(size, num_files):
+    """
+    Converts a subsample size to a number of files.
+
+    Args:
+        size (float): number of files if at least 1, otherwise the fraction of the files
+        num_files (int): number of files of the dataset
+
+    Returns:
+        int: the number of files of the subsample, at most the number of files of the dataset
+    """
+    if size <= 0:
+        raise ValueError(f"The subsample size must be positive, got {size}")
+    if size < 1:
+        return max(1, round(size * num_files))
+    if size != int(size):
+        raise ValueError(f"The subsample size must be a number of files or a fraction below 1, got {size}")
+    return min(int(size), num_files)
+
+
+def stratified_subsample(files_dict, size, seed=DEFAULT_SUBSAMPLE_SEED, strata_labels=DEFAULT_STRATA):
+    """
+    Takes a stratified random subsample of the files of a dataset (see `stratified_order`).
+
+    Args:
+        files_dict (dict): the file paths mapped to their labels, as returned by `Parser.run_parser`
+        size (float): number of files of the subsample, or the fraction of the files if below 1
+        seed (int): seed of the subsample
+        strata_labels (tuple): names of the labels to stratify by
+
+    Returns:
+        dict: the files of the subsample mapped to their labels, in the order of `files_dict`
+    """
+    file_paths = list(files_dict)
+    order = stratified_order(
+        [os.path.basename(file_path) for file_path in file_paths], get_strata(files_dict, strata_labels), seed
+    )
+    selected = np.sort(order[:get_subsample_size(size, len(file_paths))])
+    return {file_paths[index]: files_dict[file_paths[index]] for index in selected}
+
+
+def save_subsample(subsample_path, file_paths, dataset_path):
+    """
+    Saves the files of a subsample, one path relative to the dataset per line.
+    """
+    with open(subsample_path, "w") as file:
+        for file_path in file_paths:
+            file.write(os.path.relpath(file_path, dataset_path) + "\n")
+
+
+def load_subsample(subsample_path):
+    """
+    Loads the file names of a subsample saved with `save_subsample`.
+
+    Returns:
+        set: the file names (without their directories) of the subsample
+    """
+    with open(subsample_path, "r") as file:
+        return {os.path.basename(line.strip()) for line in file if line.strip()}
+
+
+def parse_arguments():
+    """!
+    @brief Parse Arguments for subsampling a dataset.
+    """
+    args_parser = argparse.ArgumentParser(description="Take a stratified subsample of a dataset")
+    args_parser.add_argument("-i", "--input", required=True, help="Path of the dataset")
+    args_parser.add_argument("-d", "--dataset", required=False, help="Name of the dataset (e.g. iemocap)")
+    args_parser.add_argument(
+        "-m", "--manifest", required=False, help="Path of the manifest of the dataset (default: in the dataset)"
+    )
+    args_parser.add_argument(
+        "-n", "--size", type=float, required=True,
+        help="Number of files of the subsample, or the fraction of the files if below 1",
+    )
+    args_parser.add_argument("--seed", type=int, default=DEFAULT_SUBSAMPLE_SEED, help="Seed of the subsample")
+    args_parser.add_argument(
+        "-o", "--output", default=SUBSAMPLE_FILENAME, help="Path of the list of the files of the subsample"
+    )
+    return args_parser.parse_args()
+
+
+if __name__ == "__main__":
+    from robuser.parsing.manifest import build_manifest
+
+    args = parse_arguments()
+    files_dict = build_manifest(args.input, args.dataset, args.manifest).get_files_dict()
+    subsample = stratified_subsample(files_dict, args.size, args.seed)
+    save_subsample(args.output, subsample, args.input)
+    print(f"Subsample of {len(subsample)} out of {len(files_dict)} files saved to {args.output}")
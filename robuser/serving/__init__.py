@@ -0,0 +1,3 @@
+"""
+Module with a local server that keeps the corruptions warm and corrupts audio on request, and its client
+"""
@@ -0,0 +1,84 @@
+"""
+Client of the corruption server (see `robuser.serving.server`).
+
+Example usage:
+    with CorruptionClient("/tmp/robuser.sock") as client:
+        augmented_audio, applied_noise, details = client.corrupt(audio, 16000, "gaussian", {"snr": 10}, seed=0)
+"""
+
+import socket
+
+from robuser.serving.protocol import receive_message, send_message
+
+
+class CorruptionClient:
+    """
+    Connection to a corruption server. A connection serves one request at a time, so concurrent data loaders should
+    each open their own connection (e.g. one per data loader worker).
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        """
+        Initialize the CorruptionClient class, connecting to the server
+
+        Args:
+            socket_path (str): path of the Unix domain socket of the server
+            timeout (float): timeout in seconds of the requests, or None to wait for the server
+        """
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.settimeout(timeout)
+        self.connection.connect(socket_path)
+
+    def request(self, payload, audio=None):
+        """
+        Sends a request to the server and returns its response.
+
+        Returns:
+            tuple: (the JSON part of the response, the audio part of the response)
+        """
+        send_message(self.connection, payload, audio)
+        response = receive_message(self.connection)
+        if response is None:
+            raise ConnectionError("The corruption server closed the connection")
+        if "error" in response[0]:
+            raise ValueError(f"The corruption server failed: {response[0]['error']}")
+        return response
+
+    def corrupt(self, audio, sample_rate, corruption_type, corruption_config, seed=None):
+        """
+        Corrupts an audio.
+
+        Args:
+            audio (np.array): the audio, sent as float32
+            sample_rate (int): the sample rate of the audio
+            corruption_type (str): type of corruption (e.g. content)
+            corruption_config (dict): configuration of the corruption, as in the corruption CSV files
+            seed (int): seed of the corruption for a reproducible output, or None to continue the random state of
+                        the worker of the server
+
+        Returns:
+            tuple: (corrupted audio as float32, applied noise, details of the output)
+        """
+        payload = {
+            "corruption_type": corruption_type,
+            "corruption_config": corruption_config,
+            "sample_rate": int(sample_rate),
+            "seed": seed,
+        }
+        response, augmented_audio = self.request(payload, audio)
+        return augmented_audio, response["applied_noise"], response["details"]
+
+    def get_stats(self):
+        """
+        Returns the number of requests and the latencies of the server, per corruption type.
+        """
+        return self.request({"op": "stats"})[0]["stats"]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,85 @@
+"""
+Binary protocol of the corruption server.
+
+Every message (request or response) is a header with the lengths in bytes of its two parts, followed by a JSON object
+and the raw audio as little-endian float32 samples (possibly none):
+    <uint32 JSON length><uint32 audio length><JSON><float32 samples>
+"""
+
+import json
+import struct
+
+import numpy as np
+
+from robuser.corruptions.utils import to_json_value
+
+HEADER = struct.Struct("<II")
+AUDIO_DTYPE = np.dtype("<f4")
+# Maximum size of the JSON part of a message, to reject anything that is not a client of the protocol
+MAX_JSON_BYTES = 1024 ** 2
+
+
+def receive_exactly(connection, num_bytes):
+    """
+    Receives a given number of bytes from a socket.
+
+    Args:
+        connection (socket.socket): the connected socket
+        num_bytes (int): number of bytes to receive
+
+    Returns:
+        bytearray: the received bytes, or None if the connection was closed before the first byte
+    """
+    buffer = bytearray(num_bytes)
+    view = memoryview(buffer)
+    received = 0
+    while received < num_bytes:
+        count = connection.recv_into(view[received:])
+        if count == 0:
+            if received == 0:
+                return None
+            raise ConnectionError("The connection was closed in the middle of a message")
+        received += count
+    return buffer
+
+
+def send_message(connection, payload, audio=None):
+    """
+    Sends a message.
+
+    Args:
+        connection (socket.socket): the connected socket
+        payload (dict): the JSON part of the message
+        audio (np.array): the audio part of the message (or None)
+    """
+    payload_bytes = json.dumps(payload, default=to_json_value).encode()
+    if audio is None:
+        audio = np.empty(0, dtype=AUDIO_DTYPE)
+    audio = np.ascontiguousarray(audio, dtype=AUDIO_DTYPE)
+    connection.sendall(HEADER.pack(len(payload_bytes), audio.nbytes) + payload_bytes)
+    if audio.nbytes:
+        connection.sendall(memoryview(audio).cast("B"))
+
+
+def receive_message(connection):
+    """
+    Receives a message.
+
+    Args:
+        connection (socket.socket): the connected socket
+
+    Returns:
+        tuple: (the JSON part of the message, the audio part as a float32 numpy array), or None if the connection was
+               closed
+    """
+    header = receive_exactly(connection, HEADER.size)
+    if header is None:
+        return None
+    payload_length, audio_length = HEADER.unpack(header)
+    if payload_length > MAX_JSON_BYTES or audio_length % AUDIO_DTYPE.itemsize:
+        raise ValueError("Invalid message header")
+
+    payload = json.loads(receive_exactly(connection, payload_length) or b"{}")
+    audio_bytes = receive_exactly(connection, audio_length) if audio_length else bytearray()
+    audio = np.frombuffer(audio_bytes, dtype=AUDIO_DTYPE).astype(np.float32, copy=False)
+    return payload, audio
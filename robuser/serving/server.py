@@ -0,0 +1,359 @@
+"""
+Local corruption server: a long-lived process that corrupts audio sent over a Unix domain socket, e.g. by the data
+loaders of a training job, keeping the corruptions warm between the requests.
+
+The corruptions of a configuration file are created once when the server starts (listing the noise datasets,
+estimating the RT60 of the impulse responses) and sent to a pool of worker processes, with their noise clips and
+impulse responses decoded once into shared memory. The corruptions of other configurations are created on their first
+request and kept by every worker. Every connection is served by its own thread, which hands its requests to the pool.
+
+Example usage:
+    python3 -m robuser.serving.server -s /tmp/robuser.sock -w 4 -c config.yml
+"""
+
+import argparse
+import collections
+import json
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from robuser.corruptions.native_threads import get_thread_budget, init_worker_threads
+from robuser.corruptions.utils import to_audio_dtype
+from robuser.serving.protocol import receive_message, send_message
+
+# Number of latencies kept per corruption type for the statistics
+LATENCY_WINDOW = 10000
+# Interval in seconds at which the accept loop checks whether the server is stopping
+ACCEPT_TIMEOUT = 0.5
+
+
+# Corruption pool of a worker process, set once by `init_worker`
+_worker_state = threading.local()
+
+
+def init_worker(warm_corruptions, max_corruptions):
+    """
+    Initializes a worker process of the server with the corruptions created in advance.
+
+    Args:
+        warm_corruptions (list): (corruption type, normalized metadata, corruption instance) of every corruption
+        max_corruptions (int): maximum number of corruption instances kept by the worker
+    """
+    from robuser.dataset_corruption.corrupt_dataset_per_file import CorruptionPool
+
+    _worker_state.corruption_pool = CorruptionPool(max(max_corruptions, len(warm_corruptions)))
+    for corruption_type, corruption_metadata, corruption in warm_corruptions:
+        _worker_state.corruption_pool.put(corruption_type, corruption_metadata, corruption)
+
+
+def corrupt_in_worker(corruption_type, corruption_metadata, audio, sample_rate, seed):
+    """
+    Corrupts an audio in a worker process initialized by `init_worker`.
+
+    Returns:
+        tuple: (corrupted audio, applied noise, details of the output, time in seconds spent in the corruption)
+    """
+    start = time.perf_counter()
+    corruption = _worker_state.corruption_pool.get(corruption_type, corruption_metadata)
+    if seed is not None:
+        corruption.reseed(seed)
+    augmented_audio, applied_noise = corruption.run(audio, sample_rate)
+    details = corruption.get_details()[0]
+    return (
+        to_audio_dtype(augmented_audio),
+        None if applied_noise is None else str(applied_noise),
+        details,
+        time.perf_counter() - start,
+    )
+
+
+class LatencyStats:
+    """
+    Latencies of the requests served, per corruption type
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_WINDOW))
+        self.corruption_times = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_WINDOW))
+        self.requests = collections.Counter()
+        self.errors = collections.Counter()
+
+    def record(self, corruption_type, latency, corruption_time=None):
+        """
+        Records a request, failed if its corruption time is None.
+        """
+        with self.lock:
+            self.requests[corruption_type] += 1
+            if corruption_time is None:
+                self.errors[corruption_type] += 1
+                return
+            self.latencies[corruption_type].append(latency)
+            self.corruption_times[corruption_type].append(corruption_time)
+
+    def get_summary(self):
+        """
+        Returns the number of requests and errors, and the latency percentiles (in milliseconds) of every corruption
+        type, over its last requests. The corruption time is the part of the latency spent in the corruption itself.
+        """
+        with self.lock:
+            summary = {}
+            for corruption_type, requests in sorted(self.requests.items()):
+                latencies = np.array(self.latencies[corruption_type]) * 1000
+                corruption_times = np.array(self.corruption_times[corruption_type]) * 1000
+                summary[corruption_type] = {"requests": requests, "errors": self.errors[corruption_type]}
+                if len(latencies):
+                    summary[corruption_type].update(
+                        {
+                            "latency_ms_mean": float(np.mean(latencies)),
+                            "latency_ms_p50": float(np.percentile(latencies, 50)),
+                            "latency_ms_p95": float(np.percentile(latencies, 95)),
+                            "latency_ms_max": float(np.max(latencies)),
+                            "corruption_ms_mean": float(np.mean(corruption_times)),
+                        }
+                    )
+            return summary
+
+
+class CorruptionServer:
+    """
+    Serves corruption requests over a Unix domain socket (see `robuser.serving.protocol` and `CorruptionClient`).
+
+    A request is a JSON object with the `corruption_type`, the `corruption_config`, the `sample_rate` of the audio and
+    an optional `seed`, followed by the audio. The response is a JSON object with the `applied_noise`, the `details`
+    of the output (see `CorruptionType.get_details`), the `latency_ms` of the request and the part of it spent in the
+    corruption (`corruption_ms`), followed by the corrupted audio. A failed request gets a response with an `error`
+    and no audio, and the connection stays open. A request with `"op": "stats"` gets the latency statistics.
+
+    Without a seed, a corruption continues the random state of the worker that runs it, so pass a seed (e.g. derived
+    from the utterance and the epoch) for reproducible outputs.
+    """
+
+    def __init__(
+        self, socket_path, workers=1, warm_corruptions=None, max_corruptions=16, share_audio=False, thread_budget=None
+    ):
+        """
+        Initialize the CorruptionServer class, creating the warm corruptions
+
+        Args:
+            socket_path (str): path of the Unix domain socket
+            workers (int): number of worker processes
+            warm_corruptions (list): [corruption type, corruption config] of the corruptions created in advance
+            max_corruptions (int): maximum number of corruption instances kept per worker
+            share_audio (bool): decode the noise clips and impulse responses of the warm corruptions once into
+                                shared memory, instead of in every worker
+            thread_budget (int): number of threads of the server, shared by the workers and their native thread pools
+                                 (BLAS, OpenMP), all the CPUs available if None
+        """
+        from robuser.corruptions.get_corruption import get_corruption
+        from robuser.dataset_corruption.corrupt_dataset_per_file import parse_corruption_metadata
+
+        self.socket_path = socket_path
+        self.workers = workers
+        # Every worker limits its native thread pools to its share of the budget
+        self.threads_per_worker = max(get_thread_budget(thread_budget) // workers, 1)
+        self.stats = LatencyStats()
+        self.stopping = threading.Event()
+        self.banks = []
+
+        self.warm_corruptions = []
+        try:
+            for corruption_type, corruption_config in warm_corruptions or []:
+                corruption_metadata = parse_corruption_metadata(json.dumps(corruption_config))
+                corruption = get_corruption(corruption_type)(corruption_metadata)
+                self.warm_corruptions.append((corruption_type, corruption_metadata, corruption))
+                if share_audio:
+                    self.banks.extend(corruption.share_audio_data())
+        except BaseException:
+            # The banks of the corruptions created so far would be left in shared memory
+            for _, _, corruption in self.warm_corruptions:
+                corruption.unshare_audio_data()
+            raise
+
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_worker_threads,
+            initargs=(self.threads_per_worker, init_worker, (self.warm_corruptions, max_corruptions)),
+        )
+
+    def handle_request(self, payload, audio):
+        """
+        Runs a request in the worker pool.
+
+        Returns:
+            tuple: (the JSON part of the response, the corrupted audio or None)
+        """
+        from robuser.dataset_corruption.corrupt_dataset_per_file import parse_corruption_metadata
+
+        if payload.get("op") == "stats":
+            return {
+                "stats": self.stats.get_summary(),
+                "workers": self.workers,
+                "threads_per_worker": self.threads_per_worker,
+            }, None
+
+        start = time.perf_counter()
+        corruption_type = payload.get("corruption_type")
+        try:
+            corruption_metadata = parse_corruption_metadata(json.dumps(payload.get("corruption_config", {})))
+            future = self.executor.submit(
+                corrupt_in_worker, corruption_type, corruption_metadata, audio, payload["sample_rate"],
+                payload.get("seed"),
+            )
+            augmented_audio, applied_noise, details, corruption_time = future.result()
+        except Exception as e:
+            self.stats.record(corruption_type, time.perf_counter() - start)
+            return {"error": f"{type(e).__name__}: {e}"}, None
+
+        latency = time.perf_counter() - start
+        self.stats.record(corruption_type, latency, corruption_time)
+        response = {
+            "applied_noise": applied_noise,
+            "details": details,
+            "latency_ms": latency * 1000,
+            "corruption_ms": corruption_time * 1000,
+        }
+        return response, augmented_audio
+
+    def handle_connection(self, connection):
+        """
+        Serves the requests of a client until it closes the connection.
+        """
+        with connection:
+            while not self.stopping.is_set():
+                try:
+                    message = receive_message(connection)
+                    if message is None:
+                        return
+                    response, augmented_audio = self.handle_request(*message)
+                    send_message(connection, response, augmented_audio)
+                except (ConnectionError, ValueError) as e:
+                    # The client does not follow the protocol or went away, its connection cannot be recovered
+                    print(f"Closing a connection: {e}")
+                    return
+
+    def serve_forever(self):
+        """
+        Accepts connections until `stop` is called (or the process gets SIGINT or SIGTERM).
+        """
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server_socket.bind(self.socket_path)
+        server_socket.listen()
+        server_socket.settimeout(ACCEPT_TIMEOUT)
+        print(
+            f"Serving {len(self.warm_corruptions)} warm corruptions on {self.socket_path} "
+            f"with {self.workers} worker processes, {self.threads_per_worker} native threads per worker"
+        )
+
+        try:
+            while not self.stopping.is_set():
+                try:
+                    connection, _ = server_socket.accept()
+                except socket.timeout:
+                    continue
+                connection.settimeout(None)
+                threading.Thread(target=self.handle_connection, args=(connection,), daemon=True).start()
+        finally:
+            server_socket.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.close()
+
+    def stop(self):
+        """
+        Stops accepting connections, the server is closed by `serve_forever`.
+        """
+        self.stopping.set()
+
+    def close(self):
+        """
+        Shuts the worker pool down and deletes the shared memory of the warm corruptions.
+        """
+        self.executor.shutdown(cancel_futures=True)
+        for _, _, corruption in self.warm_corruptions:
+            corruption.unshare_audio_data()
+        self.banks = []
+
+
+def parse_arguments():
+    """!
+    @brief Parse Arguments for serving the corruptions.
+    """
+    args_parser = argparse.ArgumentParser(description="Serve the corruptions over a Unix domain socket")
+    args_parser.add_argument("-s", "--socket", required=True, help="Path of the Unix domain socket")
+    args_parser.add_argument("-w", "--workers", type=int, default=1, help="Number of worker processes")
+    args_parser.add_argument(
+        "-c",
+        "--config",
+        type=str,
+        default=None,
+        help="Path to a YAML configuration of the corruptions to create when the server starts (as for "
+        "corrupt_dataset, the chains and severity sweeps are ignored)",
+    )
+    args_parser.add_argument(
+        "--max_corruptions",
+        type=int,
+        default=16,
+        help="Maximum number of corruption instances kept per worker, besides the ones of the configuration",
+    )
+    args_parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Number of threads of the server, shared by the workers and the native thread pools (BLAS, OpenMP) of "
+        "every worker (default: all the CPUs)",
+    )
+    args_parser.add_argument(
+        "--share_audio",
+        action="store_true",
+        help="Decode the noise clips and impulse responses of the configuration once into shared memory, instead of "
+        "in every worker process",
+    )
+    return args_parser.parse_args()
+
+
+def main():
+    """Main entry point for the console script"""
+    args = parse_arguments()
+
+    warm_corruptions = []
+    if args.config is not None:
+        import yaml
+
+        from robuser.dataset_corruption.corrupt_dataset import parse_config
+
+        with open(args.config, "r") as file:
+            config = yaml.safe_load(file)
+        warm_corruptions = [
+            corruption for corruption in parse_config(config) if corruption[0] not in ("chain", "sweep")
+        ]
+
+    server = CorruptionServer(
+        args.socket,
+        workers=args.workers,
+        warm_corruptions=warm_corruptions,
+        max_corruptions=args.max_corruptions,
+        share_audio=args.share_audio,
+        thread_budget=args.threads,
+    )
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    for corruption_type, summary in server.stats.get_summary().items():
+        print(corruption_type, json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+ANNOTATED_EMOTIONS = ("neu", "sad", "ang", "hap", "exc", "fru")
+
+
+def write_iemocap(data_path, sessions=(1, 2), dialogs=("impro01", "script01"), utterances=6, with_audio=True,
+                  sample_rate=16000, seed=0):
+    """
+    Write a small dataset with the structure of IEMOCAP: the annotation file of every dialog and, with audio, a short
+    noise clip per utterance.
+    """
+    import soundfile as sf
+
+    # The labels do not depend on whether the audio is written
+    label_rng, audio_rng = np.random.default_rng(seed), np.random.default_rng(seed + 1)
+    for session in sessions:
+        annotation_path = os.path.join(data_path, f"Session{session}", "dialog", "EmoEvaluation")
+        wav_path = os.path.join(data_path, f"Session{session}", "sentences", "wav")
+        os.makedirs(annotation_path, exist_ok=True)
+        os.makedirs(wav_path, exist_ok=True)
+        for speaker in ("F", "M"):
+            for dialog in dialogs:
+                dialog_name = f"Ses0{session}{speaker}_{dialog}"
+                lines = []
+                for index in range(utterances):
+                    utterance_name = f"{dialog_name}_{'FM'[index % 2]}{index:03d}"
+                    emotion = ANNOTATED_EMOTIONS[label_rng.integers(len(ANNOTATED_EMOTIONS))]
+                    lines.append(f"[{index}.0 - {index + 1}.0]\t{utterance_name}\t{emotion}\t[2.5000, 2.5000, 2.5000]\n")
+                    if with_audio:
+                        os.makedirs(os.path.join(wav_path, dialog_name), exist_ok=True)
+                        duration = audio_rng.uniform(0.3, 0.8)
+                        audio = 0.1 * audio_rng.standard_normal(int(duration * sample_rate)).astype(np.float32)
+                        sf.write(os.path.join(wav_path, dialog_name, utterance_name + ".wav"), audio, sample_rate)
+                with open(os.path.join(annotation_path, dialog_name + ".txt"), "w") as f:
+                    f.writelines(lines)
+    return str(data_path)
+
+
+@pytest.fixture
+def iemocap_path(tmp_path):
+    return write_iemocap(tmp_path / "IEMOCAP")
+
+
+def write_noise_dataset(data_path, num_clips=4, sample_rate=16000, seed=0):
+    """
+    Write a small noise dataset: noise clips of a few seconds, at another sample rate than the utterances.
+    """
+    import soundfile as sf
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(data_path, exist_ok=True)
+    for index in range(num_clips):
+        audio = 0.3 * rng.standard_normal(int(rng.uniform(1.0, 3.0) * sample_rate)).astype(np.float32)
+        sf.write(os.path.join(data_path, f"noise_{index}.wav"), audio, sample_rate)
+    return str(data_path)
+
+
+def write_impulse_responses(data_path, rt60s=(0.2, 0.4, 0.6, 0.8), sample_rate=16000, seed=0):
+    """
+    Write exponentially decaying noise impulse responses, with the given reverberation times.
+    """
+    import soundfile as sf
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(data_path, exist_ok=True)
+    for index, rt60 in enumerate(rt60s):
+        time = np.arange(int(1.2 * rt60 * sample_rate)) / sample_rate
+        # -60 dB of energy after rt60 seconds
+        impulse_response = rng.standard_normal(len(time)) * 10 ** (-3 * time / rt60)
+        impulse_response[0] = 1.0
+        sf.write(os.path.join(data_path, f"ir_{index}.wav"), (impulse_response / 4).astype(np.float32), sample_rate)
+    return str(data_path)
+
+
+@pytest.fixture
+def noise_path(tmp_path):
+    return write_noise_dataset(tmp_path / "noise", sample_rate=22050)
+
+
+@pytest.fixture
+def ir_path(tmp_path):
+    return write_impulse_responses(tmp_path / "irs")
+
+
+def hash_audio_files(corrupted_datasets_path):
+    """
+    Returns the hash of every audio file of the corrupted datasets, by path relative to them.
+    """
+    hashes = {}
+    for root, _, files in os.walk(corrupted_datasets_path):
+        for file in files:
+            if file.endswith(".wav"):
+                file_path = os.path.join(root, file)
+                with open(file_path, "rb") as f:
+                    hashes[os.path.relpath(file_path, corrupted_datasets_path)] = hashlib.sha256(f.read()).hexdigest()
+    return hashes
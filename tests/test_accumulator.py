@@ -0,0 +1,142 @@
+import random
+
+import numpy as np
+import pytest
+from sklearn.metrics import accuracy_score, confusion_matrix, recall_score
+
+from robuser.evaluation.accumulator import EXPECTED_CLASSES, EvaluationAccumulator, calc_metrics_from_cm
+from robuser.evaluation.evaluate import accumulate_iemocap, evaluate_iemocap
+
+EMOTIONS = EXPECTED_CLASSES + ("frustrated", "other")
+
+
+@pytest.fixture
+def targets():
+    rng = random.Random(0)
+    return {
+        f"Ses0{session}{gender}_impro01_{gender}{index:03d}.wav": {
+            "emotion": rng.choice(EMOTIONS), "fold": f"Session{session}", "speaker_id": f"Ses0{session}{gender}"
+        }
+        for session in range(1, 4) for gender in "FM" for index in range(40)
+    }
+
+
+def make_predictions(targets, seed=1):
+    """
+    Predictions of the evaluated classes for every target of the evaluated classes (and some of the other ones)
+    """
+    rng = random.Random(seed)
+    return {
+        file_name: labels["emotion"] if rng.random() < 0.6 else rng.choice(EXPECTED_CLASSES)
+        for file_name, labels in targets.items()
+        if labels["emotion"] in EXPECTED_CLASSES or rng.random() < 0.5
+    }
+
+
+def reference_results(predictions, targets):
+    """
+    The per-fold scikit-learn metrics of the evaluation before the accumulator
+    """
+    targets = {key: value for key, value in targets.items() if value["emotion"] in EXPECTED_CLASSES}
+    results = {}
+    for fold in sorted(set(target["speaker_id"] for target in targets.values())):
+        fold_names = [key for key, value in targets.items() if value["speaker_id"] == fold]
+        fold_targets = [targets[key]["emotion"] for key in fold_names]
+        fold_predictions = [predictions[key] for key in fold_names]
+        results[fold] = [accuracy_score(fold_targets, fold_predictions) * 100,
+                         recall_score(fold_targets, fold_predictions, average="macro") * 100]
+    names = list(targets)
+    metrics = calc_metrics_from_cm(confusion_matrix([targets[key]["emotion"] for key in names],
+                                                    [predictions[key] for key in names]))
+    return results, [metrics["weighted_accuracy"] * 100, metrics["unweighted_accuracy"] * 100]
+
+
+def write_predictions(path, rows):
+    with open(path, "w") as f:
+        f.writelines(f"{file_name},{emotion}\n" for file_name, emotion in rows)
+    return str(path)
+
+
+def test_per_fold_results_match_the_reference(targets):
+    predictions = make_predictions(targets)
+    results, overall_results = evaluate_iemocap({key: {"emotion": value} for key, value in predictions.items()},
+                                                targets)
+    expected_results, expected_overall = reference_results(predictions, targets)
+
+    assert list(results) == list(expected_results)
+    for fold in results:
+        assert results[fold] == pytest.approx(expected_results[fold])
+    assert overall_results == pytest.approx(expected_overall)
+
+
+def test_merged_shards_match_all_the_predictions(targets, tmp_path):
+    rows = list(make_predictions(targets).items())
+    random.Random(2).shuffle(rows)
+    whole = accumulate_iemocap(write_predictions(tmp_path / "all.csv", rows), targets, chunk_size=7)
+    shards = [
+        EvaluationAccumulator.from_bytes(
+            accumulate_iemocap(write_predictions(tmp_path / f"shard_{index}.csv", rows[index::3]), targets).to_bytes()
+        )
+        for index in range(3)
+    ]
+    merged = shards[0].merge(shards[1]).merge(shards[2])
+
+    np.testing.assert_array_equal(merged.confusion_matrices, whole.confusion_matrices)
+    assert merged.get_results() == whole.get_results()
+
+
+def test_missing_prediction_with_a_duplicate_row(targets, tmp_path):
+    rows = list(make_predictions(targets).items())
+    evaluated = [index for index, (file_name, _) in enumerate(rows) if targets[file_name]["emotion"] in
+                 EXPECTED_CLASSES]
+    missing, duplicate = rows[evaluated[0]][0], rows[evaluated[1]]
+    # As many predictions as targets, but one target is predicted twice and another not at all
+    rows = [row for row in rows if row[0] != missing] + [duplicate]
+    accumulator = accumulate_iemocap(write_predictions(tmp_path / "predictions.csv", rows), targets)
+
+    with pytest.raises(ValueError) as error:
+        accumulator.get_results()
+    assert "1 targets have no prediction" in str(error.value) and missing in str(error.value)
+    assert "1 targets have several predictions" in str(error.value) and duplicate[0] in str(error.value)
+
+
+def test_duplicate_across_shards(targets):
+    predictions = make_predictions(targets)
+    file_names, emotions = list(predictions), list(predictions.values())
+    overlap = next(index for index in range(100, len(file_names))
+                   if targets[file_names[index]]["emotion"] in EXPECTED_CLASSES)
+    accumulators = []
+    for shard in (slice(0, overlap + 1), slice(overlap, None)):
+        accumulator, target_indices = EvaluationAccumulator.for_targets(targets)
+        accumulator.update(file_names[shard], emotions[shard], target_indices)
+        accumulators.append(EvaluationAccumulator.from_bytes(accumulator.to_bytes()))
+    merged = accumulators[0].merge(accumulators[1])
+
+    with pytest.raises(ValueError) as error:
+        merged.get_results()
+    assert "1 targets have several predictions" in str(error.value) and "no prediction" not in str(error.value)
+    merged.target_names = EvaluationAccumulator.get_target_names(targets)
+    with pytest.raises(ValueError, match=f"several predictions: {file_names[overlap]}"):
+        merged.get_results()
+
+
+def test_prediction_of_another_class_is_missing(targets):
+    predictions = make_predictions(targets)
+    file_name = next(key for key in predictions if targets[key]["emotion"] in EXPECTED_CLASSES)
+    predictions[file_name] = "frustrated"
+
+    with pytest.raises(ValueError, match=f"no prediction of the evaluated classes: {file_name}"):
+        evaluate_iemocap({key: {"emotion": value} for key, value in predictions.items()}, targets)
+
+
+def test_bootstrap_spread(targets):
+    predictions = make_predictions(targets)
+    accumulator, target_indices = EvaluationAccumulator.for_targets(targets)
+    accumulator.update(list(predictions), list(predictions.values()), target_indices)
+    samples = accumulator.bootstrap(2000, seed=0)
+
+    weighted_accuracy = accumulator.get_results()[1][0] / 100
+    binomial_std = np.sqrt(weighted_accuracy * (1 - weighted_accuracy) / accumulator.num_targets) * 100
+    assert samples[:, 0].mean() == pytest.approx(weighted_accuracy * 100, abs=0.5)
+    # Resampling within the strata removes their share of the variance
+    assert 0.5 * binomial_std < samples[:, 0].std() <= 1.05 * binomial_std
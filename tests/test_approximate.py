@@ -0,0 +1,120 @@
+import json
+import os
+import random
+
+import numpy as np
+import pytest
+
+from robuser.evaluation.approximate import (
+    adaptive_robustness, bootstrap_robustness, is_within_target, next_subsample_size
+)
+from robuser.evaluation.calculate_ce import compute_leaderboard
+from robuser.parsing.subsample import stratified_subsample
+
+BASELINE_METRICS = os.path.join(os.path.dirname(__file__), "..", "results", "iemocap_baseline_metrics.json")
+EMOTIONS = ["angry", "happy", "neutral", "sad"]
+
+
+@pytest.fixture
+def targets():
+    rng = random.Random(0)
+    return {
+        f"Ses0{session}_{index}.wav": {"emotion": rng.choice(EMOTIONS), "speaker_id": f"Ses0{session}F",
+                                       "fold": session}
+        for session in range(1, 5) for index in range(60)
+    }
+
+
+def make_predictions(targets, accuracy, rng):
+    return {
+        file_name: labels["emotion"] if rng.random() < accuracy else rng.choice(EMOTIONS)
+        for file_name, labels in targets.items()
+    }
+
+
+def load_baseline():
+    with open(BASELINE_METRICS, "r") as f:
+        return json.load(f)
+
+
+def test_point_estimates_match_the_leaderboard(targets, tmp_path):
+    rng = random.Random(1)
+    predictions = {"clean": make_predictions(targets, 0.8, rng)}
+    for corruption_type, errors in load_baseline().items():
+        if corruption_type != "clean":
+            predictions[corruption_type] = {level: make_predictions(targets, 0.6, rng) for level in errors}
+    model_metrics, report = bootstrap_robustness(targets, predictions, BASELINE_METRICS, num_samples=100)
+
+    model_metrics_path = tmp_path / "model.json"
+    with open(model_metrics_path, "w") as f:
+        json.dump(model_metrics, f)
+    rows, _ = compute_leaderboard([str(model_metrics_path)], [BASELINE_METRICS])
+    assert report["mCE"]["estimate"] == pytest.approx(rows[0]["mCE"], abs=0.01)
+    assert report["mCE"]["lower"] <= report["mCE"]["estimate"] <= report["mCE"]["upper"]
+
+
+def test_predictions_of_some_corruptions_of_the_baseline(targets):
+    rng = random.Random(2)
+    gaussian_levels = load_baseline()["gaussian"]
+    predictions = {
+        "clean": make_predictions(targets, 0.8, rng),
+        "gaussian": {level: make_predictions(targets, 0.7, rng) for level in gaussian_levels},
+    }
+    _, report = bootstrap_robustness(targets, predictions, BASELINE_METRICS, num_samples=100)
+
+    assert list(report["CE"]) == ["gaussian"]
+    for key in ("estimate", "lower", "upper"):
+        assert np.isfinite(report["mCE"][key])
+        assert report["mCE"][key] == pytest.approx(report["CE"]["gaussian"][key])
+
+
+def test_undefined_width_is_not_within_target():
+    assert is_within_target(1.0, 2.0)
+    assert not is_within_target(3.0, 2.0)
+    assert not is_within_target(float("nan"), 2.0)
+    assert not is_within_target(float("inf"), 2.0)
+    assert next_subsample_size(100, float("nan"), 2.0, 1000) == 150
+
+
+def test_adaptive_robustness_grows_the_subsample(targets):
+    rng = random.Random(3)
+    gaussian_levels = load_baseline()["gaussian"]
+    predictions = {
+        "clean": make_predictions(targets, 0.8, rng),
+        "gaussian": {level: make_predictions(targets, 0.7, rng) for level in gaussian_levels},
+    }
+
+    def evaluate_subsample(size):
+        subsample = stratified_subsample(targets, size, seed=0)
+        return subsample, {
+            "clean": {file_name: predictions["clean"][file_name] for file_name in subsample},
+            "gaussian": {
+                level: {file_name: level_predictions[file_name] for file_name in subsample}
+                for level, level_predictions in predictions["gaussian"].items()
+            },
+        }
+
+    # The target cannot be reached, so the subsample grows to the whole dataset
+    size, _, report = adaptive_robustness(
+        evaluate_subsample, BASELINE_METRICS, 1e-3, 40, len(targets), num_samples=50
+    )
+    assert size == len(targets)
+    assert report["num_utterances"] == len(targets)
+
+
+def test_adaptive_robustness_without_any_corruption_of_the_baseline(targets):
+    rng = random.Random(4)
+    predictions = {"clean": make_predictions(targets, 0.8, rng),
+                   "unknown": {"level_1": make_predictions(targets, 0.7, rng)}}
+    with pytest.raises(ValueError):
+        adaptive_robustness(lambda size: (targets, predictions), BASELINE_METRICS, 2.0, 40, len(targets),
+                            num_samples=50)
+
+
+def test_stratified_subsamples_are_nested_and_balanced(targets):
+    small, large = stratified_subsample(targets, 40, seed=5), stratified_subsample(targets, 120, seed=5)
+    assert len(small) == 40 and len(large) == 120
+    assert set(small) <= set(large)
+    for speaker_id in {labels["speaker_id"] for labels in targets.values()}:
+        count = sum(labels["speaker_id"] == speaker_id for labels in small.values())
+        assert abs(count - 10) <= 1
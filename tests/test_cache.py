@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+
+from robuser.dataset_corruption.cache import CorruptionCache
+
+
+def test_entries_round_trip(tmp_path):
+    cache = CorruptionCache(str(tmp_path / "cache"))
+    audio = np.random.default_rng(0).standard_normal(1000).astype(np.float32)
+    key = cache.make_key("source", "content", {"snr": 5, "content_dataset_path": "noise"}, 7)
+    assert cache.get(key) is None
+
+    cache.put(key, audio, 16000, "noise_0.wav", {"noise_offset": np.int64(12), "snr": np.float64(5.0)})
+    cached_audio, sample_rate, applied_noise, details = cache.get(key)
+    np.testing.assert_array_equal(cached_audio, audio)
+    assert (sample_rate, applied_noise, details) == (16000, "noise_0.wav", {"noise_offset": 12, "snr": 5.0})
+    assert (cache.hits, cache.misses) == (1, 1)
+    # A new cache on the same directory finds the entry
+    assert CorruptionCache(str(tmp_path / "cache")).get(key) is not None
+
+
+def test_keys_depend_on_every_input():
+    key = CorruptionCache.make_key("source", "content", {"snr": 5, "content_dataset_path": "noise"}, 7)
+    # The order of the configuration does not matter
+    assert CorruptionCache.make_key("source", "content", {"content_dataset_path": "noise", "snr": 5}, 7) == key
+    other_keys = [
+        CorruptionCache.make_key("other", "content", {"snr": 5, "content_dataset_path": "noise"}, 7),
+        CorruptionCache.make_key("source", "gaussian", {"snr": 5, "content_dataset_path": "noise"}, 7),
+        CorruptionCache.make_key("source", "content", {"snr": 10, "content_dataset_path": "noise"}, 7),
+        CorruptionCache.make_key("source", "content", {"snr": 5, "content_dataset_path": "noise"}, 8),
+    ]
+    assert len(set(other_keys + [key])) == 5
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    audio = np.zeros(25000, dtype=np.float32)
+    entry_size = 100128
+    # Room for 4 entries
+    cache = CorruptionCache(str(tmp_path / "cache"), max_size_gb=4.5 * entry_size / 1024 ** 3)
+    keys = [cache.make_key(f"source_{index}", "gaussian", {"snr": 10}, 0) for index in range(5)]
+    for index, key in enumerate(keys[:4]):
+        cache.put(key, audio, 16000, None)
+        # Distinct access times, even on file systems with a coarse resolution
+        os.utime(cache.get_entry_paths(key)[0], (index, index))
+    assert os.path.getsize(cache.get_entry_paths(keys[0])[0]) == entry_size
+
+    # The first entry is used again, the second one is now the least recently used
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[4], audio, 16000, None)
+    assert cache.get(keys[1]) is None
+    assert all(cache.get(key) is not None for key in (keys[0], keys[2], keys[3], keys[4]))
+    assert cache.size <= cache.max_size
@@ -0,0 +1,113 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from robuser.evaluation.calculate_ce import (
+    compute_leaderboard, corruption_error, mean_corruption_error, relative_corruption_error
+)
+
+BASELINE_METRICS = os.path.join(os.path.dirname(__file__), "..", "results", "iemocap_baseline_metrics.json")
+
+
+def load_baseline():
+    with open(BASELINE_METRICS, "r") as f:
+        return json.load(f)
+
+
+def make_model_metrics(baseline_metrics):
+    """
+    A model 10% worse than the baseline on every corruption but the impulse responses, on which it is 10% better
+    """
+    model_metrics = {"clean": baseline_metrics["clean"] + 2}
+    for corruption_type, errors in baseline_metrics.items():
+        if corruption_type == "clean":
+            continue
+        factor = 0.9 if corruption_type == "impulse_response" else 1.1
+        model_metrics[corruption_type] = {level: error * factor for level, error in errors.items()}
+    return model_metrics
+
+
+def reference_mces(model_metrics, baseline_metrics):
+    """
+    The mCE and relative mCE of the single model mode, averaged over the corruptions the model reports
+    """
+    ces, rces = [], []
+    for corruption_type in model_metrics.keys() - {"clean"}:
+        model_errors = np.array(list(model_metrics[corruption_type].values()))
+        baseline_errors = np.array(list(baseline_metrics[corruption_type].values()))
+        ces.append(round(corruption_error(baseline_errors, model_errors), 2))
+        rces.append(round(relative_corruption_error(
+            baseline_errors, baseline_metrics["clean"], model_errors, model_metrics["clean"]
+        ), 2))
+    return np.mean(ces), np.mean(rces)
+
+
+def write_metrics(path, metrics):
+    with open(path, "w") as f:
+        json.dump(metrics, f)
+    return str(path)
+
+
+def test_leaderboard_matches_single_model_mode(tmp_path):
+    baseline_metrics = load_baseline()
+    model_metrics = make_model_metrics(baseline_metrics)
+    rows, _ = compute_leaderboard([write_metrics(tmp_path / "model.json", model_metrics)], [BASELINE_METRICS])
+
+    mce, relative_mce = reference_mces(model_metrics, baseline_metrics)
+    assert len(rows) == 1
+    assert rows[0]["mCE"] == pytest.approx(mce)
+    assert rows[0]["relative_mCE"] == pytest.approx(relative_mce)
+
+
+def test_leaderboard_skips_corruptions_missing_from_the_model(tmp_path):
+    baseline_metrics = load_baseline()
+    model_metrics = make_model_metrics(baseline_metrics)
+    del model_metrics["gaussian"]
+    complete_metrics = make_model_metrics(baseline_metrics)
+    rows, _ = compute_leaderboard(
+        [write_metrics(tmp_path / "partial.json", model_metrics),
+         write_metrics(tmp_path / "complete.json", complete_metrics)],
+        [BASELINE_METRICS],
+    )
+
+    partial, complete = rows
+    assert np.isnan(partial["CE_gaussian"])
+    mce, relative_mce = reference_mces(model_metrics, baseline_metrics)
+    assert partial["mCE"] == pytest.approx(mce)
+    assert partial["relative_mCE"] == pytest.approx(relative_mce)
+    # Loading a complete model alongside does not change the mCE of the other one
+    mce, relative_mce = reference_mces(complete_metrics, baseline_metrics)
+    assert complete["mCE"] == pytest.approx(mce)
+    assert complete["relative_mCE"] == pytest.approx(relative_mce)
+
+
+def test_leaderboard_every_model_against_every_baseline(tmp_path):
+    baseline_metrics = load_baseline()
+    better_baseline = {"clean": baseline_metrics["clean"] - 1}
+    for corruption_type, errors in baseline_metrics.items():
+        if corruption_type != "clean":
+            better_baseline[corruption_type] = {level: error * 0.8 for level, error in errors.items()}
+    model_paths = [
+        write_metrics(tmp_path / "model_a.json", make_model_metrics(baseline_metrics)),
+        write_metrics(tmp_path / "model_b.json", baseline_metrics),
+    ]
+    baseline_paths = [BASELINE_METRICS, write_metrics(tmp_path / "better_baseline.json", better_baseline)]
+    rows, corruption_types = compute_leaderboard(model_paths, baseline_paths)
+
+    assert set(corruption_types) == baseline_metrics.keys() - {"clean"}
+    assert [(row["model"], row["baseline"]) for row in rows] == [
+        ("model_a", "iemocap_baseline_metrics"), ("model_a", "better_baseline"),
+        ("model_b", "iemocap_baseline_metrics"), ("model_b", "better_baseline"),
+    ]
+    # The baseline against itself has a CE of 100% on every corruption
+    assert rows[2]["mCE"] == pytest.approx(100)
+    assert rows[2]["relative_mCE"] == pytest.approx(100)
+
+
+def test_mean_corruption_error_without_any_defined_corruption():
+    ces = np.array([[np.nan, np.nan], [50.0, np.nan]])
+    mces = mean_corruption_error(ces)
+    assert np.isnan(mces[0])
+    assert mces[1] == 50.0
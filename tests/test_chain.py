@@ -0,0 +1,84 @@
+import json
+
+import numpy as np
+import pytest
+
+from robuser.corruptions.chain import ChainExecutor
+from robuser.corruptions.get_corruption import get_corruption
+from robuser.corruptions.utils import derive_seed
+from robuser.dataset_corruption.corrupt_dataset import parse_chains_config
+
+GAIN = ["gain_transition", {"min_max_gain_db": [-20.0, -10.0]}]
+
+
+def apply_steps(steps, audio, sample_rate, seed):
+    """
+    Applies the steps of a chain one after the other, reseeding every step as the chains do.
+    """
+    step_path = []
+    for corruption_type, corruption_config in steps:
+        step_path.append([corruption_type, json.dumps(corruption_config, sort_keys=True)])
+        corruption = get_corruption(corruption_type)(corruption_config)
+        corruption.reseed(derive_seed(seed, step_path))
+        audio, _ = corruption.run(audio, sample_rate)
+    return audio
+
+
+@pytest.fixture
+def chains(noise_path):
+    return [
+        [GAIN, ["gaussian", {"snr": 0}]],
+        [GAIN, ["gaussian", {"snr": 20}]],
+        [GAIN],
+        [["content", {"content_dataset_path": noise_path, "snr": 5}], ["gaussian", {"snr": 10}]],
+    ]
+
+
+def test_shared_prefix_matches_sequential_steps(chains):
+    audio = 0.1 * np.random.default_rng(0).standard_normal(16000).astype(np.float32)
+    executor = ChainExecutor(chains)
+    for seed in (3, 4):
+        executor.reseed(seed)
+        outputs = executor.run_all(audio, 16000)
+        assert len(outputs) == len(chains)
+        for steps, (output, _) in zip(chains, outputs):
+            # Every chain gives the same output as on its own, applied step by step
+            np.testing.assert_array_equal(output, apply_steps(steps, audio, 16000, seed))
+            single_executor = ChainExecutor([steps])
+            single_executor.reseed(seed)
+            np.testing.assert_array_equal(output, single_executor.run_all(audio, 16000)[0][0])
+    # The input is not modified by the steps
+    np.testing.assert_array_equal(audio, 0.1 * np.random.default_rng(0).standard_normal(16000).astype(np.float32))
+
+
+def test_shared_prefix_runs_once(chains, monkeypatch):
+    from robuser.corruptions.gain_transition import AddGainTransition
+
+    runs = []
+    run = AddGainTransition.run
+
+    def counting_run(self, audio_data, sample_rate, out=None):
+        runs.append(len(audio_data))
+        return run(self, audio_data, sample_rate, out)
+
+    monkeypatch.setattr(AddGainTransition, "run", counting_run)
+    executor = ChainExecutor(chains)
+    executor.reseed(0)
+    executor.run_all(0.1 * np.random.default_rng(1).standard_normal(4000).astype(np.float32), 16000)
+    # The gain transition shared by three chains runs once
+    assert runs == [4000]
+    assert [len(chain_details["steps"]) for chain_details in executor.get_details()] == [2, 2, 1, 2]
+
+
+def test_chains_config_is_expanded():
+    chains = parse_chains_config(
+        {"rc": [{"gain_transition": {"min_max_gain_db": [[-20.0, -10.0]]}}, {"gaussian": {"snr": [0, 20]}}]}
+    )
+    assert [chain_config["steps"] for _, chain_config in chains] == [
+        [GAIN, ["gaussian", {"snr": 0}]],
+        [GAIN, ["gaussian", {"snr": 20}]],
+    ]
+    with pytest.raises(ValueError):
+        parse_chains_config({"rc": [{"gaussian": {"snr": [0]}, "content": {"snr": [0]}}]})
+    with pytest.raises(ValueError):
+        ChainExecutor([[]])
@@ -0,0 +1,80 @@
+import errno
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from robuser.corruptions import compression
+from robuser.corruptions.compression import Compression, FFmpegPool
+
+
+def python_command(code):
+    return [sys.executable, "-c", code]
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(compression, "FFMPEG_RETRY_DELAY", 0.0)
+
+
+def test_successful_jobs_are_summarized_once():
+    pool = FFmpegPool(max_jobs=2)
+    assert pool.get_summary() is None
+    pool.run(python_command("pass"))
+    pool.run(python_command("pass"))
+
+    summary = pool.get_summary(reset=True)
+    assert summary.startswith("ffmpeg: 2 jobs on up to 2 at once, 0 retries, 0 timeouts, 0 failures")
+    assert pool.get_summary() is None
+
+
+def test_failed_job_is_not_retried():
+    pool = FFmpegPool(attempts=3)
+    with pytest.raises(ValueError, match="unsupported codec"):
+        pool.run(python_command("import sys; sys.stderr.write('unsupported codec\\n'); sys.exit(1)"))
+    assert pool.stats["spawns"] == 1
+    assert pool.stats["retries"] == 0
+    assert pool.stats["failures"] == 1
+
+
+def test_hanging_job_is_retried_after_a_timeout():
+    pool = FFmpegPool(timeout=0.2, attempts=2)
+    with pytest.raises(ValueError, match="after 2 attempts"), pytest.warns(UserWarning, match="Retrying"):
+        pool.run(python_command("import time; time.sleep(10)"))
+    assert pool.stats["timeouts"] == 2
+    assert pool.stats["retries"] == 1
+    assert pool.stats["failures"] == 1
+
+
+def test_spawn_error_is_retried(monkeypatch):
+    popen = subprocess.Popen
+    calls = []
+
+    def flaky_popen(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise OSError(errno.EAGAIN, "Resource temporarily unavailable")
+        return popen(*args, **kwargs)
+
+    monkeypatch.setattr(subprocess, "Popen", flaky_popen)
+    pool = FFmpegPool()
+    with pytest.warns(UserWarning, match="Retrying"):
+        pool.run(python_command("pass"))
+    assert len(calls) == 2
+    assert pool.stats["retries"] == 1
+    assert pool.stats["jobs"] == 1
+
+
+def test_missing_program():
+    with pytest.raises(ValueError, match="not installed"):
+        FFmpegPool().run(["robuser-missing-program"])
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_compression_keeps_the_length():
+    audio = (0.1 * np.random.default_rng(0).standard_normal(8000)).astype(np.float32)
+    compressed, _ = Compression({"bit_rate": 32}).run(audio, 16000, out=np.empty_like(audio))
+    assert compressed.shape == audio.shape
+    assert compression.pop_ffmpeg_summary().startswith("ffmpeg: 2 jobs")
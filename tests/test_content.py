@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from robuser.corruptions import content
+from robuser.corruptions.content import ContentCorruption
+
+from conftest import write_noise_dataset
+
+
+@pytest.mark.parametrize(
+    "noise_sample_rate, quality, reads_segments",
+    [(22050, "poly", True), (22050, "poly_hq", True), (16000, "soxr_hq", True), (22050, "soxr_hq", False)],
+)
+def test_noise_segments_match_the_whole_noise(tmp_path, monkeypatch, noise_sample_rate, quality, reads_segments):
+    noise_path = write_noise_dataset(tmp_path / "noise", num_clips=2, sample_rate=noise_sample_rate)
+    config = {"content_dataset_path": noise_path, "snr": 5, "resampling_quality": quality}
+    partial = ContentCorruption(config)
+    # The noise clips of the shared bank are always resampled in full
+    whole = ContentCorruption(config)
+    whole.share_audio_data()
+
+    segment_reads = []
+    resample_segment = content.resample_segment
+
+    def counting_resample_segment(*args, **kwargs):
+        segment_reads.append(args[0])
+        return resample_segment(*args, **kwargs)
+
+    monkeypatch.setattr(content, "resample_segment", counting_resample_segment)
+    rng = np.random.default_rng(0)
+    try:
+        for seed in range(8):
+            # Shorter and longer than the noise clips, which are then padded
+            audio = 0.1 * rng.standard_normal(int(rng.uniform(0.3, 4.0) * 16000)).astype(np.float32)
+            # As if the resampled noise had been dropped from memory since it was first loaded
+            partial.external_audio_cache.clear()
+            # The draws use the global random state, so every corruption is reseeded right before it runs
+            partial.reseed(seed)
+            partial_output, partial_noise = partial.run(audio, 16000)
+            partial_details = partial.get_details()
+            whole.reseed(seed)
+            whole_output, whole_noise = whole.run(audio, 16000)
+            assert partial_noise == whole_noise
+            assert partial_details == whole.get_details()
+            np.testing.assert_array_equal(partial_output, whole_output)
+    finally:
+        whole.unshare_audio_data()
+    assert bool(segment_reads) == reads_segments
@@ -0,0 +1,213 @@
+import os
+import shutil
+
+import pytest
+
+from robuser.corruptions import audio_bank
+from robuser.corruptions.content import ContentCorruption
+from robuser.corruptions.gaussian import AWGNAugmentation
+from robuser.dataset_corruption.corrupt_dataset import corrupt
+from robuser.dataset_corruption.provenance import PROVENANCE_FILENAME, read_provenance, regenerate, regenerate_file
+
+from conftest import hash_audio_files, write_impulse_responses, write_iemocap, write_noise_dataset
+
+SEED = 7
+
+
+def make_config(noise_path, ir_path):
+    # A new configuration for every run, parsing it consumes its "enabled" and "sweep" flags
+    return {
+        "gaussian": {"enabled": True, "snr": [10]},
+        "content": {"enabled": True, "sweep": True, "content_dataset_path": [noise_path], "snr": [5, 15]},
+        "clipping_distortion": {"enabled": True, "max_percentile_threshold": [20]},
+        "impulse_response": {"enabled": True, "ir_path": [ir_path], "rt60_range": [[0.0, 2.0]]},
+        "chains": {
+            "enabled": True,
+            "rc": [{"gain_transition": {"min_max_gain_db": [[-20.0, -10.0]]}}, {"gaussian": {"snr": [0, 20]}}],
+        },
+    }
+
+
+@pytest.fixture(scope="module")
+def datasets(tmp_path_factory):
+    data_path = tmp_path_factory.mktemp("data")
+    return (
+        write_iemocap(data_path / "IEMOCAP"),
+        write_noise_dataset(data_path / "noise", sample_rate=22050),
+        write_impulse_responses(data_path / "irs"),
+    )
+
+
+@pytest.fixture(scope="module")
+def serial_outputs(datasets, tmp_path_factory):
+    dataset_path, noise_path, ir_path = datasets
+    output_path = str(tmp_path_factory.mktemp("serial"))
+    corrupt("iemocap", dataset_path, output_path, make_config(noise_path, ir_path), seed=SEED)
+    hashes = hash_audio_files(output_path)
+    # Every utterance of the 7 corrupted datasets: gaussian, 2 content SNRs, clipping, impulse response, 2 chains
+    assert len(hashes) == 7 * 48
+    return output_path, hashes
+
+
+def test_cached_outputs_are_identical(datasets, serial_outputs, tmp_path, capsys):
+    dataset_path, noise_path, ir_path = datasets
+    cache_dir = str(tmp_path / "cache")
+
+    first_path = str(tmp_path / "first")
+    corrupt("iemocap", dataset_path, first_path, make_config(noise_path, ir_path), seed=SEED, cache_dir=cache_dir)
+    assert "0 of 48 files found in the cache" in capsys.readouterr().out
+    assert hash_audio_files(first_path) == serial_outputs[1]
+
+    second_path = str(tmp_path / "second")
+    corrupt("iemocap", dataset_path, second_path, make_config(noise_path, ir_path), seed=SEED, cache_dir=cache_dir)
+    output = capsys.readouterr().out
+    assert output.count("48 of 48 files found in the cache") == 5
+    assert "0 of 48" not in output
+    assert hash_audio_files(second_path) == serial_outputs[1]
+
+
+def test_cache_depends_on_the_seed(datasets, serial_outputs, tmp_path, capsys):
+    dataset_path, noise_path, ir_path = datasets
+    cache_dir = str(tmp_path / "cache")
+    corrupt("iemocap", dataset_path, str(tmp_path / "first"), make_config(noise_path, ir_path), seed=SEED,
+            cache_dir=cache_dir)
+    capsys.readouterr()
+
+    other_seed_path = str(tmp_path / "other_seed")
+    corrupt("iemocap", dataset_path, other_seed_path, make_config(noise_path, ir_path), seed=SEED + 1,
+            cache_dir=cache_dir)
+    assert capsys.readouterr().out.count("0 of 48 files found in the cache") == 5
+    hashes = hash_audio_files(other_seed_path)
+    assert hashes.keys() == serial_outputs[1].keys()
+    assert hashes != serial_outputs[1]
+
+
+@pytest.mark.parametrize("share_audio", [False, True])
+def test_process_pool_outputs_are_identical(datasets, serial_outputs, tmp_path, capsys, monkeypatch, share_audio):
+    dataset_path, noise_path, ir_path = datasets
+    bank_dir = tmp_path / "shm"
+    bank_dir.mkdir()
+    monkeypatch.setattr(audio_bank, "SHARED_MEMORY_DIR", str(bank_dir))
+    output_path = str(tmp_path / "parallel")
+    # A budget of two threads, so that the files are spread over two processes even on a single CPU
+    corrupt("iemocap", dataset_path, output_path, make_config(noise_path, ir_path), seed=SEED, workers=2,
+            share_audio=share_audio, thread_budget=2)
+    output = capsys.readouterr().out
+    assert "2 worker processes" in output
+    assert ("Sharing" in output) == share_audio
+    assert hash_audio_files(output_path) == serial_outputs[1]
+    # The banks are deleted at the end of every corruption
+    assert os.listdir(bank_dir) == []
+
+
+def test_regenerated_outputs_are_identical(serial_outputs, tmp_path):
+    output_path, hashes = serial_outputs
+    regenerated_path = tmp_path / "regenerated"
+    corrupted_datasets = [name for name in os.listdir(output_path) if os.path.isdir(os.path.join(output_path, name))]
+    assert len(corrupted_datasets) == 7
+    for name in corrupted_datasets:
+        regenerate(os.path.join(output_path, name, PROVENANCE_FILENAME), str(regenerated_path / name))
+    assert hash_audio_files(regenerated_path) == hashes
+
+
+def test_files_are_regenerated_from_a_moved_dataset(datasets, serial_outputs, tmp_path):
+    output_path, hashes = serial_outputs
+    name = next(name for name in os.listdir(output_path) if "impulse_response" in name)
+    corrupted_path = str(tmp_path / name)
+    shutil.copytree(os.path.join(output_path, name), corrupted_path)
+    moved_dataset_path = shutil.copytree(datasets[0], str(tmp_path / "moved"))
+
+    _, records = read_provenance(corrupted_path)
+    files = sorted(records)[::10]
+    for file in files:
+        os.remove(os.path.join(corrupted_path, file))
+    regenerate(corrupted_path, corrupted_path, files=files, original_dataset_path=moved_dataset_path)
+    with pytest.raises(FileExistsError):
+        regenerate(corrupted_path, corrupted_path, files=files[:1], original_dataset_path=moved_dataset_path)
+    assert {os.path.join(name, path): digest for path, digest in hash_audio_files(corrupted_path).items()} == {
+        path: digest for path, digest in hashes.items() if path.startswith(name + os.sep)
+    }
+
+
+def test_unseeded_datasets_are_not_regenerated(datasets, tmp_path):
+    dataset_path = datasets[0]
+    output_path = str(tmp_path / "unseeded")
+    corrupt("iemocap", dataset_path, output_path, {"gaussian": {"enabled": True, "snr": [10]}})
+    (name,) = [name for name in os.listdir(output_path) if os.path.isdir(os.path.join(output_path, name))]
+    with pytest.raises(ValueError):
+        regenerate(os.path.join(output_path, name), str(tmp_path / "regenerated"))
+
+
+def test_files_are_regenerated_from_their_recorded_noise(datasets, tmp_path):
+    dataset_path = datasets[0]
+    noise_path = shutil.copytree(datasets[1], str(tmp_path / "noise"))
+    ir_path = shutil.copytree(datasets[2], str(tmp_path / "irs"))
+    output_path = str(tmp_path / "corrupted")
+    config = {
+        "content": {"enabled": True, "sweep": True, "content_dataset_path": [noise_path], "snr": [5, 15]},
+        "impulse_response": {"enabled": True, "ir_path": [ir_path], "rt60_range": [[0.0, 2.0]]},
+        "chains": {
+            "enabled": True,
+            "nc": [{"content": {"content_dataset_path": [noise_path], "snr": [10]}}, {"gaussian": {"snr": [20]}}],
+        },
+    }
+    corrupt("iemocap", dataset_path, output_path, config, seed=SEED)
+    hashes = hash_audio_files(output_path)
+    assert len(hashes) == 4 * 48
+
+    # New noise clips and impulse responses change what a new draw would pick, not the recorded ones
+    write_noise_dataset(tmp_path / "new_noise", num_clips=3, sample_rate=22050, seed=1)
+    for name in os.listdir(tmp_path / "new_noise"):
+        shutil.move(str(tmp_path / "new_noise" / name), os.path.join(noise_path, "new_" + name))
+    write_impulse_responses(tmp_path / "new_irs", rt60s=(0.3, 0.5), seed=1)
+    for name in os.listdir(tmp_path / "new_irs"):
+        shutil.move(str(tmp_path / "new_irs" / name), os.path.join(ir_path, "new_" + name))
+
+    regenerated_path = tmp_path / "regenerated"
+    corrupted_datasets = [name for name in os.listdir(output_path) if os.path.isdir(os.path.join(output_path, name))]
+    for name in corrupted_datasets:
+        regenerate(os.path.join(output_path, name), str(regenerated_path / name), skip_copy=True)
+    assert hash_audio_files(regenerated_path) == hashes
+
+    # A recorded noise file that was removed cannot be applied again
+    name = next(name for name in corrupted_datasets if name.endswith("snr_5"))
+    header, records = read_provenance(os.path.join(output_path, name))
+    record = next(iter(records.values()))
+    os.remove(os.path.join(noise_path, record["details"]["noise_file"]))
+    with pytest.raises(ValueError, match="does not exist"):
+        regenerate_file(header, record)
+
+
+def test_regenerated_details_must_match_the_provenance(serial_outputs):
+    output_path, _ = serial_outputs
+    name = next(name for name in os.listdir(output_path) if "gaussian_snr_10" in name and "chain" not in name)
+    header, records = read_provenance(os.path.join(output_path, name))
+    record = next(iter(records.values()))
+    regenerate_file(header, record)
+
+    altered_record = dict(record, details={"snr": record["details"]["snr"] + 1.0})
+    with pytest.raises(ValueError, match="does not match its provenance"):
+        regenerate_file(header, altered_record)
+
+
+def test_only_the_output_of_the_dataset_is_regenerated(serial_outputs, monkeypatch):
+    output_path, _ = serial_outputs
+    runs = []
+    run, run_sweep = AWGNAugmentation.run, ContentCorruption.run_sweep
+
+    def counting_run(self, *args, **kwargs):
+        runs.append("gaussian")
+        return run(self, *args, **kwargs)
+
+    def counting_run_sweep(self, audio_data, sample_rate, severities, *args, **kwargs):
+        runs.append(list(severities))
+        return run_sweep(self, audio_data, sample_rate, severities, *args, **kwargs)
+
+    monkeypatch.setattr(AWGNAugmentation, "run", counting_run)
+    monkeypatch.setattr(ContentCorruption, "run_sweep", counting_run_sweep)
+    for name, expected_runs in (("chain_rc", ["gaussian"]), ("snr_15", [[15]])):
+        name = next(dataset for dataset in os.listdir(output_path) if name in dataset)
+        header, records = read_provenance(os.path.join(output_path, name))
+        runs.clear()
+        regenerate_file(header, next(iter(records.values())))
+        assert runs == expected_runs
@@ -0,0 +1,148 @@
+import csv
+import json
+import os
+import random
+
+import pytest
+
+from robuser.dataset_corruption.corrupt_dataset_per_file import apply_corruption_from_csv
+from robuser.parsing.iemocap import ParserForIEMOCAP
+
+from conftest import hash_audio_files
+
+
+def write_csv(csv_file_path, audio_file_paths, corruptions, output_path, seed=0):
+    """
+    Writes a per-file CSV specification with every corruption for every audio file, the rows of a file scattered over
+    the CSV. The outputs of every corruption go to their own directory, the same corruption may be requested twice.
+    """
+    rows = []
+    for audio_file_path in audio_file_paths:
+        for index, (corruption_type, corruption_config) in enumerate(corruptions):
+            output_file_path = os.path.join(
+                output_path, f"{index}_{corruption_type}", os.path.basename(audio_file_path)
+            )
+            rows.append([audio_file_path, corruption_type, json.dumps(corruption_config), output_file_path])
+    random.Random(seed).shuffle(rows)
+    with open(csv_file_path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["audio_file_path", "corruption_type", "corruption_metadata", "output_file_path"])
+        writer.writerows(rows)
+    return rows
+
+
+@pytest.fixture
+def spec(iemocap_path, noise_path, tmp_path):
+    audio_file_paths = sorted(ParserForIEMOCAP(iemocap_path).run_parser())[:24]
+    corruptions = [
+        ["gaussian", {"snr": 10}],
+        ["content", {"content_dataset_path": noise_path, "snr": 5}],
+        ["clipping_distortion", {"max_percentile_threshold": 20}],
+        # The same corruption again, with other outputs
+        ["gaussian", {"snr": 10}],
+    ]
+
+    def make_spec(name):
+        output_path = str(tmp_path / name)
+        csv_file_path = str(tmp_path / f"{name}.csv")
+        write_csv(csv_file_path, audio_file_paths, corruptions, output_path)
+        return csv_file_path, output_path
+
+    return make_spec, audio_file_paths
+
+
+def relative_noise_paths(applied_noise_paths, output_path):
+    return {os.path.relpath(path, output_path): noise for path, noise in applied_noise_paths.items()}
+
+
+def assert_repeated_rows_differ(output_path):
+    hashes = hash_audio_files(output_path)
+    first_hashes = {path: digest for path, digest in hashes.items() if path.startswith("0_gaussian" + os.sep)}
+    assert len(first_hashes) == 24
+    assert all(hashes[path.replace("0_gaussian", "3_gaussian", 1)] != digest for path, digest in first_hashes.items())
+
+
+def test_parallel_outputs_are_identical(spec, monkeypatch):
+    import librosa
+
+    make_spec, audio_file_paths = spec
+    loads = []
+    load = librosa.load
+
+    def counting_load(path, *args, **kwargs):
+        loads.append(path)
+        return load(path, *args, **kwargs)
+
+    csv_file_path, serial_path = make_spec("serial")
+    monkeypatch.setattr(librosa, "load", counting_load)
+    serial_noise_paths = apply_corruption_from_csv(csv_file_path, seed=3)
+    monkeypatch.undo()
+    # Every input file is decoded once for all its corruptions
+    assert sorted(path for path in loads if path in audio_file_paths) == audio_file_paths
+    assert len(serial_noise_paths) == 4 * 24
+    assert_repeated_rows_differ(serial_path)
+
+    csv_file_path, parallel_path = make_spec("parallel")
+    parallel_noise_paths = apply_corruption_from_csv(csv_file_path, seed=3, workers=2, thread_budget=2)
+    assert_repeated_rows_differ(parallel_path)
+    assert hash_audio_files(parallel_path) == hash_audio_files(serial_path)
+    assert relative_noise_paths(parallel_noise_paths, parallel_path) == relative_noise_paths(
+        serial_noise_paths, serial_path
+    )
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_streamed_outputs_are_identical(spec, capsys, workers):
+    make_spec, _ = spec
+    csv_file_path, in_memory_path = make_spec("in_memory")
+    in_memory_noise_paths = apply_corruption_from_csv(csv_file_path, seed=3)
+
+    csv_file_path, streamed_path = make_spec("streamed")
+    applied_noise_file_path = os.path.join(streamed_path, "applied_noise_paths.csv")
+    os.makedirs(streamed_path)
+    capsys.readouterr()
+    # A budget of a few rows, so that the CSV is spilled to many sorted runs
+    streamed_noise_paths = apply_corruption_from_csv(
+        csv_file_path, seed=3, workers=workers, thread_budget=2, memory_budget_mb=0.002,
+        applied_noise_file_path=applied_noise_file_path,
+    )
+    assert "sorted runs" in capsys.readouterr().out
+    assert streamed_noise_paths == {}
+    assert_repeated_rows_differ(streamed_path)
+    assert hash_audio_files(streamed_path) == hash_audio_files(in_memory_path)
+
+    with open(applied_noise_file_path, "r", newline="") as applied_noise_file:
+        rows = list(csv.reader(applied_noise_file))
+    assert rows[0] == ["audio_file_path", "applied_noise_path"]
+    # The applied noise of the files without noise is written as an empty field
+    streamed_noise_paths = {path: noise or None for path, noise in rows[1:]}
+    assert len(streamed_noise_paths) == len(rows) - 1
+    assert relative_noise_paths(streamed_noise_paths, streamed_path) == relative_noise_paths(
+        in_memory_noise_paths, in_memory_path
+    )
+
+
+def test_repeated_rows_are_corrupted_with_their_own_seeds(spec, tmp_path, capsys):
+    _, audio_file_paths = spec
+    csv_file_path = str(tmp_path / "repeated.csv")
+    rows = [
+        [audio_file_path, "gaussian", json.dumps({"snr": 5}), str(tmp_path / name / os.path.basename(audio_file_path))]
+        for audio_file_path in audio_file_paths[:4]
+        for name in ("first", "second")
+    ]
+    with open(csv_file_path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["audio_file_path", "corruption_type", "corruption_metadata", "output_file_path"])
+        writer.writerows(rows)
+
+    cache_dir = str(tmp_path / "cache")
+    apply_corruption_from_csv(csv_file_path, seed=42, cache_dir=cache_dir)
+    first_hashes, second_hashes = hash_audio_files(tmp_path / "first"), hash_audio_files(tmp_path / "second")
+    assert first_hashes.keys() == second_hashes.keys() and len(first_hashes) == 4
+    assert all(first_hashes[path] != second_hashes[path] for path in first_hashes)
+
+    # The repeated rows are cached apart
+    apply_corruption_from_csv(csv_file_path, force=True, seed=42, cache_dir=cache_dir)
+    assert "8 hits, 0 misses" in capsys.readouterr().out
+    assert hash_audio_files(tmp_path / "first") == first_hashes
+    assert hash_audio_files(tmp_path / "second") == second_hashes
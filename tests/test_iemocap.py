@@ -0,0 +1,35 @@
+import os
+import shutil
+
+from robuser.parsing.iemocap import ParserForIEMOCAP
+
+from conftest import write_iemocap
+
+
+def test_labels_only_matches_the_full_parser(iemocap_path):
+    labels = ParserForIEMOCAP(iemocap_path).run_parser(labels_only=True)
+    assert labels == ParserForIEMOCAP(iemocap_path).run_parser()
+    assert len(labels) == 2 * 2 * 2 * 6
+    assert {labels_["fold"] for labels_ in labels.values()} == {"Session1", "Session2"}
+
+
+def test_labels_only_without_audio(tmp_path):
+    with_audio = write_iemocap(tmp_path / "with_audio")
+    labels_only = write_iemocap(tmp_path / "labels_only", with_audio=False)
+
+    labels = ParserForIEMOCAP(labels_only).run_parser(labels_only=True)
+    expected = ParserForIEMOCAP(with_audio).run_parser(labels_only=True)
+    assert {os.path.relpath(path, labels_only): value for path, value in labels.items()} == \
+           {os.path.relpath(path, with_audio): value for path, value in expected.items()}
+
+
+def test_labels_only_with_some_dialogs_without_audio(iemocap_path):
+    expected = ParserForIEMOCAP(iemocap_path).run_parser(labels_only=True)
+    # An empty dialog directory, and a dialog directory without an annotation file
+    dialog_path = os.path.join(iemocap_path, "Session1", "sentences", "wav", "Ses01F_impro01")
+    for file_name in os.listdir(dialog_path):
+        os.remove(os.path.join(dialog_path, file_name))
+    shutil.copytree(os.path.join(iemocap_path, "Session2", "sentences", "wav", "Ses02M_script01"),
+                    os.path.join(iemocap_path, "Session2", "sentences", "wav", "Ses02M_script02"))
+
+    assert ParserForIEMOCAP(iemocap_path).run_parser(labels_only=True) == expected
@@ -0,0 +1,63 @@
+import os
+import random
+
+import numpy as np
+import pytest
+
+from robuser.corruptions.impulse_response import AddImpulseResponse, calculate_rt60, calculate_rt60s
+
+from conftest import write_impulse_responses
+
+
+def test_batched_rt60_matches_pyroomacoustics(tmp_path):
+    # Impulse responses of different lengths and sample rates in the same batch
+    ir_path = write_impulse_responses(tmp_path / "irs", rt60s=(0.1, 0.3, 0.5, 0.9, 1.4))
+    write_impulse_responses(tmp_path / "irs" / "22k", rt60s=(0.25, 0.7), sample_rate=22050, seed=1)
+    ir_files = sorted(
+        os.path.join(root, file) for root, _, files in os.walk(ir_path) for file in files if file.endswith(".wav")
+    )
+
+    expected = np.array([calculate_rt60(ir_file) for ir_file in ir_files])
+    np.testing.assert_allclose(calculate_rt60s(ir_files, workers=1, batch_size=3), expected, rtol=1e-3)
+    np.testing.assert_allclose(calculate_rt60s(ir_files, workers=1, batch_size=32), expected, rtol=1e-3)
+
+
+@pytest.mark.parametrize("rt60_range", [[0.0, 2.0], [0.3, 0.7], [0.5, 0.5]])
+def test_selected_impulse_responses_match_the_scalar_rt60(ir_path, rt60_range):
+    corruption = AddImpulseResponse({"ir_path": ir_path, "rt60_range": rt60_range})
+    expected = []
+    for root, _, files in os.walk(ir_path):
+        for file in files:
+            rt60 = calculate_rt60(os.path.join(root, file))
+            if rt60_range[0] <= rt60 <= rt60_range[1]:
+                expected.append(os.path.join(root, file))
+    assert corruption.selected_irs == expected
+
+
+@pytest.mark.filterwarnings("ignore:.*had to be resampled")
+@pytest.mark.parametrize("share_audio", [False, True])
+def test_output_matches_audiomentations(tmp_path, share_audio):
+    audiomentations = pytest.importorskip("audiomentations")
+
+    # The impulse responses are resampled to the sample rate of the audio
+    ir_path = write_impulse_responses(tmp_path / "irs", sample_rate=22050)
+    corruption = AddImpulseResponse({"ir_path": ir_path, "rt60_range": [0.0, 2.0]})
+    if share_audio:
+        corruption.share_audio_data()
+    audio = 0.1 * np.random.default_rng(0).standard_normal(8000).astype(np.float32)
+    try:
+        for seed in range(6):
+            corruption.reseed(seed)
+            output, ir_file = corruption.run(audio, 16000)
+
+            # The implementation this corruption replaced
+            random.seed(seed)
+            np.random.seed(seed)
+            expected_ir_file = random.choice(corruption.selected_irs)
+            expected = audiomentations.ApplyImpulseResponse(ir_path=expected_ir_file, p=1.0)(audio, 16000)
+
+            assert ir_file == expected_ir_file
+            assert output.dtype == expected.dtype
+            np.testing.assert_array_equal(output, expected)
+    finally:
+        corruption.unshare_audio_data()
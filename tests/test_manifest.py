@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from robuser.dataset_corruption.corrupt_dataset import corrupt
+from robuser.parsing.iemocap import ParserForIEMOCAP
+from robuser.parsing.manifest import MANIFEST_FILENAME, build_manifest
+
+
+def list_files(path):
+    return sorted(os.path.relpath(os.path.join(root, file), path) for root, _, files in os.walk(path) for file in files)
+
+
+def rewrite_emotion(annotation_file, old_emotion, new_emotion):
+    with open(annotation_file, "r") as f:
+        lines = f.readlines()
+    lines[0] = lines[0].replace(f"\t{old_emotion}\t", f"\t{new_emotion}\t")
+    with open(annotation_file, "w") as f:
+        f.writelines(lines)
+    stat = os.stat(annotation_file)
+    # A later mtime, even on file systems with a coarse resolution
+    os.utime(annotation_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    return lines[0].split()[3]
+
+
+def test_saved_manifest_is_reused(iemocap_path, tmp_path, monkeypatch):
+    manifest_path = str(tmp_path / MANIFEST_FILENAME)
+    manifest = build_manifest(iemocap_path, "iemocap", manifest_path)
+
+    def run_parser(self, labels_only=False):
+        raise AssertionError("The dataset parser should not run for an up to date manifest")
+
+    monkeypatch.setattr(ParserForIEMOCAP, "run_parser", run_parser)
+    assert build_manifest(iemocap_path, "iemocap", manifest_path).get_files_dict() == manifest.get_files_dict()
+
+
+def test_manifest_is_rebuilt_when_the_annotations_change(iemocap_path, tmp_path):
+    manifest_path = str(tmp_path / MANIFEST_FILENAME)
+    build_manifest(iemocap_path, "iemocap", manifest_path)
+
+    annotation_file = os.path.join(iemocap_path, "Session1", "dialog", "EmoEvaluation", "Ses01F_impro01.txt")
+    with open(annotation_file, "r") as f:
+        old_emotion = f.readline().split()[4]
+    new_emotion = "sad" if old_emotion != "sad" else "neu"
+    utterance_name = rewrite_emotion(annotation_file, old_emotion, new_emotion)
+
+    files_dict = build_manifest(iemocap_path, "iemocap", manifest_path).get_files_dict()
+    labels = next(labels for file_path, labels in files_dict.items() if utterance_name in file_path)
+    assert labels["emotion"] == ParserForIEMOCAP(iemocap_path).map_emotion(new_emotion)
+
+
+def test_manifest_is_rebuilt_when_the_parser_version_changes(iemocap_path, tmp_path, monkeypatch):
+    manifest_path = str(tmp_path / MANIFEST_FILENAME)
+    build_manifest(iemocap_path, "iemocap", manifest_path)
+
+    calls = []
+    run_parser = ParserForIEMOCAP.run_parser
+    monkeypatch.setattr(ParserForIEMOCAP, "version", ParserForIEMOCAP.version + 1)
+    monkeypatch.setattr(ParserForIEMOCAP, "run_parser",
+                        lambda self, labels_only=False: calls.append(labels_only) or run_parser(self, labels_only))
+    build_manifest(iemocap_path, "iemocap", manifest_path)
+    assert calls == [False]
+
+
+def test_manifest_without_path_is_not_saved(iemocap_path):
+    files = list_files(iemocap_path)
+    manifest = build_manifest(iemocap_path, "iemocap")
+    assert len(manifest) == 2 * 2 * 2 * 6
+    assert list_files(iemocap_path) == files
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_corrupt_only_reads_the_original_dataset(iemocap_path, tmp_path, workers):
+    files = list_files(iemocap_path)
+    output_path = str(tmp_path / "corrupted")
+    corrupt("iemocap", iemocap_path, output_path, {"gaussian": {"enabled": True, "snr": [10]}}, seed=0,
+            workers=workers)
+
+    assert list_files(iemocap_path) == files
+    assert os.path.isfile(os.path.join(output_path, MANIFEST_FILENAME))
+    corrupted_files = [file for file in list_files(output_path) if file.endswith(".wav")]
+    assert len(corrupted_files) == 2 * 2 * 2 * 6
@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import soundfile as sf
+
+from robuser.dataset_corruption.corrupt_dataset import corrupt
+from robuser.dataset_corruption.qa import find_clipped_samples, run_qa, summarize_report
+
+
+def test_clipped_samples_are_runs_within_a_file():
+    full_scale = np.array([1, 0, 1, 1, 0, 1, 1, 1, 1, 0, 0, 1], dtype=bool)
+    starts = np.array([0, 3, 8])
+    clipped = find_clipped_samples(full_scale, starts)
+    # The run of the second file stops at the start of the third one, whose first sample is alone
+    np.testing.assert_array_equal(clipped, [0, 0, 0, 0, 0, 1, 1, 1, 0, 0, 0, 0])
+
+
+def test_normalized_peak_is_not_clipped(iemocap_path, noise_path, tmp_path):
+    output_path = str(tmp_path / "corrupted")
+    corrupt(
+        None,
+        iemocap_path,
+        output_path,
+        {"content": {"enabled": True, "content_dataset_path": [noise_path], "snr": [5]},
+         "gaussian": {"enabled": True, "snr": [10]}},
+        seed=0,
+    )
+    summaries = {summary["dataset"]: summary for summary in summarize_report(run_qa(iemocap_path, output_path))}
+
+    assert len(summaries) == 2
+    for summary in summaries.values():
+        assert summary["files"] == 2 * 2 * 2 * 6
+        assert summary["missing"] == summary["duration_mismatch"] == summary["snr_off_target"] == 0
+        assert summary["clipped_files"] == 0
+    # The content corruption normalizes its output to full scale
+    content_summary = next(summary for dataset, summary in summaries.items() if "content" in dataset)
+    assert content_summary["peak_max"] > 0.999
+
+
+def test_clipped_file_is_reported(iemocap_path, tmp_path):
+    output_path = str(tmp_path / "corrupted")
+    corrupt(None, iemocap_path, output_path, {"gaussian": {"enabled": True, "snr": [10]}}, seed=0)
+    corrupted_dataset_path = os.path.join(output_path, os.listdir(output_path)[0])
+    for root, _, files in os.walk(corrupted_dataset_path):
+        corrupted_file = next((os.path.join(root, file) for file in files if file.endswith(".wav")), None)
+        if corrupted_file is not None:
+            break
+    audio, sample_rate = sf.read(corrupted_file, dtype="float32")
+    sf.write(corrupted_file, np.clip(audio * 20, -1, 1), sample_rate)
+
+    report = run_qa(iemocap_path, output_path)
+    summary = summarize_report(report)[0]
+    assert summary["clipped_files"] == 1
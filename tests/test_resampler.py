@@ -0,0 +1,78 @@
+import math
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from robuser.corruptions.resampler import (
+    get_resampled_length,
+    resample,
+    resample_batch,
+    resample_segment,
+)
+
+SAMPLE_RATE_PAIRS = [(22050, 16000), (44100, 16000), (8000, 16000), (16000, 48000)]
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("orig_sr, target_sr", SAMPLE_RATE_PAIRS)
+def test_poly_matches_scipy_resample_poly(orig_sr, target_sr, dtype):
+    from scipy.signal import resample_poly
+
+    signal = np.random.default_rng(0).standard_normal(12345).astype(dtype)
+    resampled = resample(signal, orig_sr, target_sr, "poly")
+
+    gcd = math.gcd(orig_sr, target_sr)
+    expected = resample_poly(signal, target_sr // gcd, orig_sr // gcd)
+    assert len(resampled) == get_resampled_length(len(signal), orig_sr, target_sr)
+    assert resampled.dtype == dtype
+    np.testing.assert_array_equal(resampled, expected[:len(resampled)])
+
+
+@pytest.mark.parametrize("orig_sr, target_sr", SAMPLE_RATE_PAIRS)
+def test_default_quality_matches_librosa(orig_sr, target_sr):
+    import librosa
+
+    signal = np.random.default_rng(1).standard_normal(12345).astype(np.float32)
+    np.testing.assert_array_equal(
+        resample(signal, orig_sr, target_sr), librosa.resample(signal, orig_sr=orig_sr, target_sr=target_sr)
+    )
+
+
+@pytest.mark.parametrize("quality", ["poly", "poly_hq"])
+@pytest.mark.parametrize("orig_sr, target_sr", SAMPLE_RATE_PAIRS + [(16000, 16000)])
+def test_segment_is_a_slice_of_the_whole_signal(tmp_path, orig_sr, target_sr, quality):
+    file_path = str(tmp_path / "noise.wav")
+    signal = 0.3 * np.random.default_rng(2).standard_normal(3 * orig_sr).astype(np.float32)
+    sf.write(file_path, signal, orig_sr)
+    # The signal as read back from the file
+    signal, _ = sf.read(file_path, dtype="float32")
+    whole = resample(signal, orig_sr, target_sr, quality)
+
+    num_samples = target_sr // 2
+    for start in (0, 1, 777, len(whole) // 2, len(whole) - num_samples - 3, len(whole) - num_samples):
+        segment = resample_segment(file_path, len(signal), orig_sr, target_sr, start, num_samples, quality)
+        np.testing.assert_array_equal(segment, whole[start:start + num_samples])
+
+
+def test_segment_requires_a_polyphase_quality(tmp_path):
+    file_path = str(tmp_path / "noise.wav")
+    sf.write(file_path, np.zeros(22050, dtype=np.float32), 22050)
+    with pytest.raises(ValueError):
+        resample_segment(file_path, 22050, 22050, 16000, 0, 100, "soxr_hq")
+
+
+@pytest.mark.parametrize("quality", ["poly", "soxr_hq"])
+def test_batch_matches_single_resampling(quality):
+    rng = np.random.default_rng(3)
+    # Signals of the same length and sample rate are filtered together
+    signals = [rng.standard_normal(length).astype(np.float32) for length in (4000, 4000, 5000, 4000, 4000)]
+    orig_srs = [22050, 22050, 22050, 44100, 16000]
+    resampled = resample_batch(signals, orig_srs, 16000, quality)
+    for signal, orig_sr, output in zip(signals, orig_srs, resampled):
+        np.testing.assert_array_equal(output, resample(signal, orig_sr, 16000, quality))
+
+
+def test_unknown_quality_is_rejected():
+    with pytest.raises(ValueError):
+        resample(np.zeros(100, dtype=np.float32), 22050, 16000, "best")
@@ -0,0 +1,186 @@
+import os
+
+import numpy as np
+import pytest
+
+from robuser.corruptions.get_corruption import get_corruption
+from robuser.corruptions.utils import derive_seed
+from robuser.dataset_corruption.scheduling import (
+    FILE_COST_MODEL,
+    Strategy,
+    choose_strategy,
+    describe_strategy,
+    estimate_costs,
+    get_corruption_cost_model,
+    make_locality_batches,
+    order_longest_first,
+    plan_assignments,
+    resolve_workers,
+    run_longest_first,
+)
+from robuser.parsing.iemocap import ParserForIEMOCAP
+
+
+def square(value):
+    return value * value
+
+
+def test_longest_first_order_is_stable():
+    costs = [1.0, 5.0, 3.0, 5.0, 0.5, 3.0]
+    np.testing.assert_array_equal(order_longest_first(costs), [1, 3, 2, 5, 0, 4])
+
+
+def test_costs_add_up_the_corruptions():
+    durations = np.array([1.0, 2.0, 10.0])
+    costs = estimate_costs(durations, [(5.0, 8.0), (0.0, 1.0)], num_outputs=2)
+    np.testing.assert_allclose(costs, FILE_COST_MODEL[0] + 5.0 + durations * (FILE_COST_MODEL[1] * 2 + 9.0))
+    # The steps of a chain add up
+    (ir_fixed, ir_per_second), (gaussian_fixed, gaussian_per_second) = (
+        get_corruption_cost_model("impulse_response"), get_corruption_cost_model("gaussian")
+    )
+    assert get_corruption_cost_model("chain", {"steps": [["impulse_response", {}], ["gaussian", {}]]}) == (
+        ir_fixed + gaussian_fixed, ir_per_second + gaussian_per_second
+    )
+
+
+@pytest.mark.parametrize("batch_size", [1, 3])
+def test_tasks_are_dispatched_longest_first(batch_size):
+    tasks = list(range(10))
+    costs = np.array([3.0, 9.0, 1.0, 7.0, 7.0, 0.0, 2.0, 8.0, 4.0, 6.0])
+    runs = []
+
+    def run_task(task):
+        runs.append(task)
+        return square(task)
+
+    # A single worker thread runs the tasks in the order they are dispatched
+    results = list(run_longest_first(run_task, tasks, costs, workers=1, executor="thread", batch_size=batch_size))
+    order = order_longest_first(costs).tolist()
+    if batch_size == 1:
+        assert runs == order
+    else:
+        # Batches of consecutive tasks in the longest-first order, the most expensive batch first
+        batches = [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+        assert runs[:batch_size] == batches[0]
+        assert sorted(runs[i:i + batch_size] for i in range(0, len(runs), batch_size)) == sorted(batches)
+    assert sorted(results) == sorted(square(task) for task in tasks)
+
+
+def test_process_pool_runs_every_task_once():
+    tasks = list(range(25))
+    costs = np.random.default_rng(0).uniform(size=25)
+    results = list(run_longest_first(square, tasks, costs, workers=2, batch_size=4))
+    assert sorted(results) == [square(task) for task in tasks]
+
+
+
+def get_classes(*corruption_types):
+    return [get_corruption(corruption_type) for corruption_type in corruption_types]
+
+
+def test_strategy_follows_the_capabilities():
+    # A single worker, or a single file, runs serially
+    assert choose_strategy(get_classes("gaussian"), 1, 100, thread_budget=4).executor == "serial"
+    assert choose_strategy(get_classes("gaussian"), 4, 1, thread_budget=4).executor == "serial"
+    # ffmpeg runs in other processes, threads only wait for it
+    assert choose_strategy(get_classes("compression"), 4, 100, thread_budget=4) == Strategy("thread", 1, 4, 1)
+    # Light corruptions are dispatched in batches
+    strategy = choose_strategy(get_classes("gaussian", "clipping_distortion"), 4, 1000, thread_budget=4)
+    assert strategy.executor == "process" and strategy.batch_size > 1
+    # One heavy step (or one that is not stateless) is enough to run every file on its own in a process
+    assert choose_strategy(get_classes("gaussian", "content"), 4, 1000, thread_budget=4) == Strategy(
+        "process", 1, 4, 1
+    )
+    assert choose_strategy(get_classes("compression", "gain_transition"), 4, 100, thread_budget=4).executor == "process"
+
+
+def test_strategy_description():
+    assert describe_strategy(Strategy("serial", 1, 1, 1)) == "a single worker, 1 native thread"
+    assert describe_strategy(Strategy("thread", 1, 4, 1)) == "4 worker threads, 1 native thread per worker"
+    assert describe_strategy(Strategy("process", 8, 2, 3)) == (
+        "2 worker processes, 8 files per task, 3 native threads per worker"
+    )
+
+
+def test_plugin_corruptions_declare_nothing_by_default():
+    from robuser.corruptions.corruption_type import CorruptionType
+
+    class PluginCorruption(CorruptionType):
+        pass
+
+    assert choose_strategy([PluginCorruption], 4, 100, thread_budget=4) == Strategy("process", 1, 4, 1)
+    with pytest.raises(ValueError):
+        get_corruption("not_a_corruption")
+
+
+@pytest.mark.parametrize("corruption_type", ["content", "impulse_response"])
+def test_planned_assignments_are_the_ones_drawn(iemocap_path, noise_path, ir_path, corruption_type):
+    import librosa
+
+    if corruption_type == "content":
+        corruption = get_corruption("content")({"content_dataset_path": noise_path, "snr": 5})
+        external_path = noise_path
+    else:
+        corruption = get_corruption("impulse_response")({"ir_path": ir_path, "rt60_range": [0.0, 2.0]})
+        external_path = ir_path
+    file_paths = sorted(ParserForIEMOCAP(iemocap_path).run_parser())[:16]
+    file_seeds = [derive_seed(7, file_path) for file_path in file_paths]
+    plan = plan_assignments(corruption, file_paths, file_seeds)
+
+    key = corruption.locality_key
+    assert len(plan[key]) == len(file_paths)
+    for index, (file_path, file_seed) in enumerate(zip(file_paths, file_seeds)):
+        audio, sample_rate = librosa.load(file_path, sr=None)
+        corruption.reseed(file_seed)
+        corruption.run(audio, sample_rate)
+        details = corruption.get_details()[0]
+        assert os.path.join(external_path, details[key]) == plan[key][index]
+        for field, values in plan.items():
+            if field != key:
+                assert details[field] == values[index]
+
+
+def test_locality_batches_read_a_single_external_file():
+    rng = np.random.default_rng(0)
+    plan = {
+        "noise_file": rng.choice(["a.wav", "b.wav", "c.wav"], size=200),
+        "noise_offset": rng.integers(1000, size=200),
+    }
+    batches = make_locality_batches(plan, "noise_file", workers=2)
+
+    np.testing.assert_array_equal(np.sort(np.concatenate(batches)), np.arange(200))
+    for batch in batches:
+        assert len(set(plan["noise_file"][batch])) == 1
+        # Front to back within a file
+        assert np.all(np.diff(plan["noise_offset"][batch]) >= 0)
+    # Small enough batches to balance the workers
+    assert len(batches) >= 2 * 8
+
+
+def get_native_threads_variable(_):
+    return os.environ.get("OMP_NUM_THREADS")
+
+
+def test_thread_budget_is_shared_by_the_workers():
+    heavy = get_classes("content")
+    assert choose_strategy(heavy, 2, 100, thread_budget=8) == Strategy("process", 1, 2, 4)
+    # No more workers than threads of the budget or tasks, the rest of the budget goes to the native thread pools
+    assert choose_strategy(heavy, 16, 100, thread_budget=4) == Strategy("process", 1, 4, 1)
+    assert choose_strategy(heavy, 8, 2, thread_budget=8) == Strategy("process", 1, 2, 4)
+    assert choose_strategy(heavy, 1, 100, thread_budget=8) == Strategy("serial", 1, 1, 8)
+    assert resolve_workers("auto", thread_budget=6) == 6
+    assert resolve_workers(3, thread_budget=6) == 3
+    with pytest.raises(ValueError):
+        choose_strategy(heavy, 2, 100, thread_budget=0)
+
+
+def test_workers_limit_their_native_thread_pools(monkeypatch):
+    from robuser.corruptions.native_threads import native_thread_limits
+
+    monkeypatch.delenv("OMP_NUM_THREADS", raising=False)
+    results = list(run_longest_first(get_native_threads_variable, list(range(4)), np.ones(4), workers=2,
+                                     threads_per_worker=3))
+    assert results == ["3"] * 4
+    with native_thread_limits(2):
+        assert os.environ["OMP_NUM_THREADS"] == "2"
+    assert "OMP_NUM_THREADS" not in os.environ
@@ -0,0 +1,101 @@
+import os
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from robuser.corruptions.get_corruption import get_corruption
+from robuser.serving.client import CorruptionClient
+from robuser.serving.protocol import HEADER, receive_message, send_message
+from robuser.serving.server import CorruptionServer
+
+
+def test_messages_round_trip():
+    left, right = socket.socketpair()
+    with left, right:
+        audio = np.random.default_rng(0).standard_normal(1001).astype(np.float32)
+        send_message(left, {"sample_rate": 16000, "seed": None}, audio)
+        payload, received_audio = receive_message(right)
+        assert payload == {"sample_rate": 16000, "seed": None}
+        assert received_audio.dtype == np.float32
+        np.testing.assert_array_equal(received_audio, audio)
+
+        # A message without audio, and numpy values in the JSON part
+        send_message(left, {"snr": np.float64(9.5)})
+        payload, received_audio = receive_message(right)
+        assert payload == {"snr": 9.5} and len(received_audio) == 0
+
+        left.close()
+        assert receive_message(right) is None
+
+
+def test_invalid_messages_are_rejected():
+    left, right = socket.socketpair()
+    with left, right:
+        # The audio is not a whole number of float32 samples
+        left.sendall(HEADER.pack(2, 3) + b"{}abc")
+        with pytest.raises(ValueError):
+            receive_message(right)
+
+    left, right = socket.socketpair()
+    with left, right:
+        left.sendall(struct.pack("<II", 10, 0) + b"{}")
+        left.close()
+        with pytest.raises(ConnectionError):
+            receive_message(right)
+
+
+@pytest.fixture
+def server(noise_path):
+    # The path of a Unix domain socket is limited to about a hundred characters
+    socket_path = os.path.join("/tmp", f"robuser_test_{os.getpid()}.sock")
+    content_config = {"content_dataset_path": noise_path, "snr": 5}
+    server = CorruptionServer(socket_path, workers=1, warm_corruptions=[["content", content_config]],
+                              share_audio=True, thread_budget=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.05)
+    yield server, content_config
+    server.stop()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert not os.path.exists(socket_path)
+    assert server.banks == []
+
+
+def test_served_corruptions_match_the_local_ones(server):
+    server, content_config = server
+    audio = 0.1 * np.random.default_rng(1).standard_normal(16000).astype(np.float32)
+    with CorruptionClient(server.socket_path, timeout=60) as client:
+        for corruption_type, corruption_config in (("content", content_config), ("gaussian", {"snr": 10})):
+            for seed in (0, 1):
+                augmented_audio, applied_noise, details = client.corrupt(
+                    audio, 16000, corruption_type, corruption_config, seed=seed
+                )
+                corruption = get_corruption(corruption_type)(corruption_config)
+                corruption.reseed(seed)
+                expected, expected_noise = corruption.run(audio, 16000)
+                np.testing.assert_array_equal(augmented_audio, expected)
+                assert applied_noise == (None if expected_noise is None else str(expected_noise))
+                assert details == corruption.get_details()[0]
+
+
+def test_failed_requests_keep_the_connection(server):
+    server, _ = server
+    audio = 0.1 * np.random.default_rng(2).standard_normal(4000).astype(np.float32)
+    with CorruptionClient(server.socket_path, timeout=60) as client:
+        with pytest.raises(ValueError, match="Unknown corruption"):
+            client.corrupt(audio, 16000, "not_a_corruption", {}, seed=0)
+        augmented_audio, _, _ = client.corrupt(audio, 16000, "gaussian", {"snr": 10}, seed=0)
+        assert augmented_audio.shape == audio.shape
+
+        stats = client.get_stats()
+        assert stats["not_a_corruption"] == {"requests": 1, "errors": 1}
+        assert stats["gaussian"]["requests"] == 1 and stats["gaussian"]["errors"] == 0
+        assert stats["gaussian"]["latency_ms_max"] >= stats["gaussian"]["corruption_ms_mean"]
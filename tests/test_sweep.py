@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from robuser.corruptions.get_corruption import get_corruption
+from robuser.corruptions.sweep import SeveritySweep
+from robuser.dataset_corruption.corrupt_dataset import parse_config
+
+SNRS = [0, 10, 20]
+
+
+@pytest.fixture(params=["gaussian", "content"])
+def sweep_config(request, noise_path):
+    if request.param == "gaussian":
+        return "gaussian", {}
+    return "content", {"content_dataset_path": noise_path}
+
+
+def test_sweep_shares_a_single_draw(sweep_config):
+    corruption_type, shared_config = sweep_config
+    audio = 0.1 * np.random.default_rng(0).standard_normal(16000).astype(np.float32)
+    sweep = SeveritySweep(corruption_type, [dict(shared_config, snr=snr) for snr in SNRS])
+    sweep.reseed(5)
+    outputs = sweep.run_all(audio, 16000)
+
+    assert len(outputs) == len(SNRS)
+    # The same noise draw for every SNR
+    draws = [{key: value for key, value in details.items() if key != "snr"} for details in sweep.get_details()]
+    assert all(draw == draws[0] for draw in draws)
+    if corruption_type == "gaussian":
+        noises = [output - audio for output, _ in outputs]
+        for snr, noise in zip(SNRS, noises):
+            np.testing.assert_allclose(noise, noises[0] * 10 ** (-snr / 20), rtol=1e-4, atol=1e-6)
+
+    # Every severity is the output of the corruption on its own, with the same seed, up to float32 rounding
+    for snr, (output, applied_noise), details in zip(SNRS, outputs, sweep.get_details()):
+        corruption = get_corruption(corruption_type)(dict(shared_config, snr=snr))
+        corruption.reseed(5)
+        expected, expected_noise = corruption.run(audio, 16000)
+        assert applied_noise == expected_noise
+        np.testing.assert_allclose(output, expected, rtol=0, atol=1e-6)
+        assert details.keys() == corruption.get_details()[0].keys()
+        assert details["snr"] == pytest.approx(corruption.get_details()[0]["snr"], abs=1e-3)
+
+
+def test_sweep_configs_are_grouped(noise_path):
+    corruptions = parse_config(
+        {"content": {"enabled": True, "sweep": True, "content_dataset_path": [noise_path], "snr": SNRS},
+         "gaussian": {"enabled": True, "sweep": True, "snr": SNRS}}
+    )
+    assert [(corruption_type, sweep["corruption_type"], [config["snr"] for config in sweep["configs"]])
+            for corruption_type, sweep in corruptions] == [("sweep", "content", SNRS), ("sweep", "gaussian", SNRS)]
+
+
+def test_sweep_rejects_other_differences(noise_path):
+    with pytest.raises(ValueError):
+        SeveritySweep("content", [{"content_dataset_path": noise_path, "snr": 0},
+                                  {"content_dataset_path": noise_path + "_other", "snr": 10}])
+    with pytest.raises(ValueError):
+        parse_config({"gain_transition": {"enabled": True, "sweep": True, "min_max_gain_db": [[-20.0, -10.0]]}})